@@ -32,7 +32,8 @@ int findseqID(char seqName[],SeqIDMap seqidmap[],int r)
   return -1;
 }
 
-int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int istop)
+int save_interval(IntervalMap *im,IntervalCoord start,IntervalCoord stop,int iseq,
+		  IntervalCoord istart,IntervalCoord istop)
 {
   im->start=start;
   im->end=stop;
@@ -45,10 +46,11 @@ int save_interval(IntervalMap *im,int start,int stop,int iseq,int istart,int ist
 
 
 int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-		  int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+		  IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
 		  long long linecode_count[],int *p_has_continuation)
 {
-  int i,start,seqStart,junk,iseq= -1,max_len=0,seqLength,newline=1,l,extend=0;
+  int i,start,junk,iseq= -1,max_len=0,newline=1,l,extend=0;
+  IntervalCoord seqStart,seqLength;
   unsigned char tmp[32768]; /* MUST USE UNSIGNED ARITHMETIC FOR linecode_count[] INDEXING! */
   char *p,seq[32768],prefix[8],seqName[64],oriFlag[8];
   if (p_has_continuation) /* DEFAULT: NO CONTINUATION */
@@ -57,7 +59,8 @@ int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
     l=strlen(tmp);
     if (newline ) {
       if ('s'==tmp[0] && isspace(tmp[1])) { /* READ SEQUENCE ALIGNMENT LINE */
-	if (7==sscanf(tmp,"%2s %63s %d %d %2s %d %s",prefix,seqName,&seqStart,&junk,
+	if (7==sscanf(tmp,"%2s %63s " COORD_FMT " %d %2s " COORD_FMT " %s",
+		      prefix,seqName,&seqStart,&junk,
 		      oriFlag,&seqLength,seq)) {
 /*printf("%s,%d,%s,%d\n",seqName,seqStart,oriFlag,seqLength);*/ 
 	  iseq=findseqID(seqName,seqidmap,nseq); /* LOOK UP INDEX FOR SEQ */
@@ -127,14 +130,16 @@ int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
                 FILE *ifile, int maxseq, int *isrc, char *src_prefix,
                 char *dest_prefix)
 {
-  int i,srcStart,srcEnd,destStart,destEnd,junk,junk2,idest=-1;
-  int n=0,ivalSrc= -1,ivalDest= -1,lineMax,lineAlloc=0;
-  int srcLength, destLength;
+  int i,junk,junk2,idest=-1;
+  int n=0,lineMax,lineAlloc=0;
+  IntervalCoord srcStart,srcEnd,destStart,destEnd,ivalSrc= -1,ivalDest= -1;
+  IntervalCoord destLength;
   unsigned char tmp[32768];
   char *p, *src_seq=NULL, *dest_seq=NULL, srcName[64], destName[64], oriFlag[8], srcChr[64], destChr[64];
   while ((p=fgets(tmp,32767,ifile))) {
     if (isdigit(tmp[0])) { /* READ SUMMARY LINE */
-      if (9==sscanf(tmp,"%d %63s %d %d %63s %d %d %2s %d",&junk,srcChr,&srcStart,&srcEnd,
+      if (9==sscanf(tmp,"%d %63s " COORD_FMT " " COORD_FMT " %63s " COORD_FMT " "
+		    COORD_FMT " %2s %d",&junk,srcChr,&srcStart,&srcEnd,
 		    destChr,&destStart,&destEnd,oriFlag,&junk2)) {
 	strcpy(srcName, src_prefix);
 	strcpy(destName, dest_prefix);
@@ -145,7 +150,7 @@ int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
 	*isrc=findseqID(srcName,seqidmap,nseq); /* LOOK UP INDEX FOR SEQ */
 	idest=findseqID(destName,seqidmap,nseq); /* LOOK UP INDEX FOR SEQ */
 	destLength = seqidmap[idest].length;
-	lineMax = srcEnd - srcStart + destEnd - destStart +8;
+	lineMax = (int)(srcEnd - srcStart + destEnd - destStart +8);
 	if (!src_seq || lineAlloc<lineMax) { /* EXPAND STORAGE BUFFER AS NEEDED */
 	  if (src_seq) {
 	    free(src_seq);
@@ -6,9 +6,9 @@ typedef struct {
 
 typedef struct {
   char *id;
-  int length;
+  IntervalCoord length;
   int ns_id;
-  int offset;
+  IntervalCoord offset;
   int nlmsa_id;
 } SeqIDMap;
 
@@ -16,7 +16,7 @@ typedef struct {
 
 
 extern int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-			 int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+			 IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
 			 long long linecode_count[],int *p_has_continuation)
      ;
 
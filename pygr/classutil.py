@@ -519,7 +519,8 @@ class RecentValueDictionary(WeakValueDictionary):
                 if i<imin:
                     imin = i
                     vmin = v
-            del self._keepDict[vmin]
+            # another thread may have already dropped it
+            self._keepDict.pop(vmin, None)
     def __setitem__(self, k, v):
         WeakValueDictionary.__setitem__(self, k, v)
         self.keep_this(v)
@@ -12,7 +12,7 @@ cdef extern from "stdlib.h":
   void *realloc(void *,size_t)
   int c_abs "abs" (int)
   void qsort(void *base, size_t nmemb, size_t size,
-             int (*compar)(void *,void *))
+             int (*compar)(void *,void *)) nogil
 
 cdef extern from "stdio.h":
   ctypedef struct FILE:
@@ -23,6 +23,8 @@ cdef extern from "stdio.h":
   int sprintf(char *str,char *fmt,...)
   int fprintf(FILE *ifile,char *fmt,...)
   char *fgets(char *str,int size,FILE *ifile)
+  size_t fread(void *ptr,size_t size,size_t nmemb,FILE *ifile)
+  size_t fwrite(void *ptr,size_t size,size_t nmemb,FILE *ofile)
 
 cdef extern from "string.h":
   int strcmp(char *s1, char *s2)
@@ -31,18 +33,30 @@ cdef extern from "string.h":
   char *strdup(char *)
   char *strcat(char *,char *)
 
+cdef extern from "ctype.h":
+  int toupper(int)
+
+cdef extern from "math.h":
+  double log(double)
+
+cdef extern from "Python.h":
+  object PyString_FromStringAndSize(char *s,int len)
+  FILE *PyFile_AsFile(object f)
+
 cdef extern from "intervaldb.h":
+  ctypedef long IntervalCoord # int, OR long long IF COMPILED WITH PYGR_COORD64
+
   ctypedef struct IntervalMap:
-    int start
-    int end
+    IntervalCoord start
+    IntervalCoord end
     int target_id
-    int target_start
-    int target_end
+    IntervalCoord target_start
+    IntervalCoord target_end
     int sublist
 
   ctypedef struct IntervalIndex:
-    int start
-    int end
+    IntervalCoord start
+    IntervalCoord end
 
   ctypedef struct SublistHeader:
     int start
@@ -61,10 +75,36 @@ cdef extern from "intervaldb.h":
     SublistHeader *subheader
     SubheaderFile subheader_file
     FILE *ifile_idb
+    int is_mapped
 
   ctypedef struct IntervalIterator:
     pass
 
+  ctypedef struct PackedDBFiles:
+    char path[2048]
+    long long offset[6]
+    long long len[6]
+
+  ctypedef struct BatchHits:
+    int n
+    int nalloc
+    IntervalMap *im
+    int *iquery
+
+  ctypedef struct CoverageRun:
+    IntervalCoord start
+    IntervalCoord end
+    int group
+    int depth
+
+  ctypedef struct CoverageRuns:
+    int n
+    int nalloc
+    CoverageRun *run
+
+  ctypedef struct IntervalScan:
+    pass
+
   ctypedef struct FilePtrRecord:
     FILE *ifile
     int left
@@ -83,16 +123,38 @@ cdef extern from "intervaldb.h":
   IntervalIterator *interval_iterator_alloc() except NULL
   int free_interval_iterator(IntervalIterator *it)
   IntervalIterator *reset_interval_iterator(IntervalIterator *it)
-  int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) nogil except -1
   char *write_binary_files(IntervalMap im[],int n,int ntop,int div,SublistHeader *subheader,int nlists,char filestem[])
-  IntervalDBFile *read_binary_files(char filestem[],char err_msg[],int subheader_nblock) except NULL
+  char *build_nested_list_external(char buildfile[],int n,int maxbuf,int div,char filestem[])
+  char *compress_binary_files(char filestem[])
+  void block_cache_resize(size_t max_bytes)
+  void block_cache_clear()
+  void block_cache_get_stats(long long *p_nhit,long long *p_nmiss,long long *p_nbytes,long long *p_max_bytes,int *p_nblock,long long *p_nprefetch,long long *p_nprefetch_hit,int *p_readahead_max)
+  void block_cache_set_readahead(int max_blocks)
+  void file_pool_resize(int max_files)
+  void file_pool_get_stats(int *p_nfiles,int *p_max_files,long long *p_nreopen)
+  IntervalDBFile *read_binary_files(char filestem[],PackedDBFiles *pack,char err_msg[],int subheader_nblock)
   int free_interval_dbfile(IntervalDBFile *db_file)
-  int find_file_intervals(IntervalIterator *it0,int start,int end,IntervalIndex ii[],int nii,SublistHeader subheader[],int nlists,SubheaderFile *subheader_file,int ntop,int div,FILE *ifile,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) except -1
+  IntervalDBFile *mmap_binary_files(char filestem[],PackedDBFiles *pack,char err_msg[])
+  int find_file_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalDBFile *db_file,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return) nogil except -1
+  IntervalScan *interval_scan_alloc(IntervalDBFile *db_file[],int ndb,IntervalCoord start,IntervalCoord end) except NULL
+  int interval_scan_next(IntervalScan *scan,IntervalMap buf[],int nbuf) nogil except -1
+  void free_interval_scan(IntervalScan *scan)
+  int batch_hits_append(BatchHits *hits,IntervalMap im[],int n,int iquery) except -1
+  void free_batch_hits(BatchHits *hits)
+  int sort_batch_hits(BatchHits *hits,int nquery) nogil except -1
+  int coverage_runs(IntervalMap im[],int igroup[],int n,int ngroup,
+                    IntervalCoord start,IntervalCoord end,CoverageRuns *runs)
+  void free_coverage_runs(CoverageRuns *runs)
+  int find_intervals_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],IntervalMap im[],int n,SublistHeader subheader[],int nlists,BatchHits *hits) nogil except -1
+  int find_file_intervals_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],IntervalDBFile *db_file,BatchHits *hits) nogil except -1
   int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
-  int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop)
+  int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop,long long base)
   int save_text_file(char filestem[],char basestem[],char err_msg[],FILE *ofile)
+  int write_interval_records(char filestem[],FILE *ofile,char err_msg[])
   int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   int C_int_max
+  IntervalCoord C_coord_max
 
 
 
@@ -102,13 +164,13 @@ cdef extern from "apps/maf2nclist.h":
     int id
   ctypedef struct SeqIDMap:
     char *id
-    int length
+    IntervalCoord length
     int ns_id
-    int offset
+    IntervalCoord offset
     int nlmsa_id
 
   int readMAFrecord(IntervalMap im[],int n,SeqIDMap seqidmap[],int nseq,
-                    int lpoStart,int *p_block_len,FILE *ifile,int maxseq,
+                    IntervalCoord lpoStart,int *p_block_len,FILE *ifile,int maxseq,
                     long long linecode_count[],int *p_has_continuation)
   int read_axtnet(IntervalMap im[], SeqIDMap seqidmap[], int nseq,
                   FILE *ifile, int maxseq, int *isrc, char *src_prefix,
@@ -126,37 +188,50 @@ cdef class IntervalDB:
   cdef IntervalMap *im
   cdef SublistHeader *subheader
 
+  cdef int adopt_intervals(self,IntervalMap *im,int n) except -1
 
 cdef class IntervalDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap im_buf[1024]
-  cdef int ihit,nhit,start,end
+  cdef int ihit,nhit
+  cdef IntervalCoord start,end
   cdef IntervalDB db
 
   cdef int cnext(self)
 
 cdef class IntervalFileDB:
   cdef IntervalDBFile *db
+  cdef readonly IntervalFileDB delta
 
 cdef class IntervalFileDBIterator:
   cdef IntervalIterator *it,*it_alloc
   cdef IntervalMap *im_buf
-  cdef int ihit,nhit,start,end,nbuf
+  cdef int ihit,nhit,nbuf
+  cdef IntervalCoord start,end
   cdef IntervalFileDB db
   cdef IntervalDB idb
+  cdef int in_delta
 
-  cdef int restart(self,int start,int end,IntervalFileDB db) except -2
+  cdef int restart(self,IntervalCoord start,IntervalCoord end,
+                   IntervalFileDB db) except -2
   cdef int reset(self) except -2
-  cdef int cnext(self,int *pkeep)
+  cdef int cnext(self,int *pkeep) except -2
   cdef int extend(self,int ikeep)
-  cdef int saveInterval(self,int start,int end,int target_id,
-                        int target_start,int target_end)
+  cdef int saveInterval(self,IntervalCoord start,IntervalCoord end,
+                        int target_id,IntervalCoord target_start,
+                        IntervalCoord target_end)
   cdef int nextBlock(self,int *pkeep) except -2
   cdef IntervalMap *getIntervalMap(self)
   cdef int loadAll(self) except -1
   cdef int copy(self,IntervalFileDBIterator src)
 
 
+cdef class IntervalFileDBScan:
+  cdef IntervalScan *scan
+  cdef IntervalMap *im_buf
+  cdef int nbuf
+  cdef IntervalFileDB db
+
 
 cdef class NLMSASequence
 
@@ -169,18 +244,43 @@ cdef class NLMSA:
   cdef int do_build
   cdef readonly object lpoList,maxLPOcoord
   cdef int lpo_id
-  cdef readonly int maxlen,inlmsa,is_bidirectional,pairwiseMode,in_memory_mode
+  cdef readonly IntervalCoord maxlen
+  cdef readonly int inlmsa,is_bidirectional,pairwiseMode,in_memory_mode,is_append
+  cdef readonly int useMmap
+  cdef readonly object sliceCache
+  cdef readonly object packFile
+  cdef readonly object seqTable
   cdef public object _persistent_id,_ignoreShadowAttr,__doc__,_saveLocalBuild
   cdef public object inverseDB
 
+  cdef int find_batch_hits(self,ivals,BatchHits *hits) except -1
+  cdef int find_coverage_runs(self,ival,groups,CoverageRuns *runs) except -1
   cdef void free_seqidmap(self,int nseq0,SeqIDMap *seqidmap)
+  cdef object aligned_seq_info(self,seqDB,seqID,cache)
   cdef void save_nbuild(self,int nbuild[])
+  cdef int save_maf_block(self,IntervalMap im[],int n,int block_len,
+                          SeqIDMap seqidmap[],FILE *build_ifile[],
+                          int nbuild[],int maxint) except -1
+  cdef int mergeMAFshards(self,mafFiles,int nprocs,int nseq0,
+                          SeqIDMap seqidmap[],FILE *build_ifile[],
+                          int nbuild[],int maxint,
+                          long long linecode_count[]) except -1
+  cdef NLMSASequence save_axtnet_block(self,IntervalMap im[],int n,int isrc,
+                                       int is_bidirectional,
+                                       SeqIDMap seqidmap[],
+                                       NLMSASequence ns_src,
+                                       FILE *build_ifile[],int nbuild[])
+  cdef NLMSASequence mergeAxtNetShards(self,jobs,int nprocs,int nseq0,
+                                       SeqIDMap seqidmap[],
+                                       NLMSASequence ns_src,
+                                       FILE *build_ifile[],int nbuild[])
   cdef NLMSASequence add_seqidmap_to_union(self,int j,SeqIDMap seqidmap[],
                                            NLMSASequence ns,FILE *build_ifile[],
                                            int nbuild[])
 
 cdef class NLMSASequence:
-  cdef readonly int id,length,nbuild,is_lpo,is_union
+  cdef readonly int id,nbuild,is_lpo,is_union,is_delta
+  cdef readonly IntervalCoord length
   cdef readonly object offset
   cdef readonly object seq
   cdef readonly object name
@@ -189,13 +289,18 @@ cdef class NLMSASequence:
   cdef FILE *build_ifile
   cdef readonly object filestem
   cdef readonly NLMSA nlmsaLetters
-  cdef readonly object buildList
+  cdef IntervalMap *build_im
+  cdef int build_nalloc
   
   cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,FILE *ifile)
+  cdef int appendInMemory(self,IntervalMap *im) except -1
+  cdef int saveIntervalMap(self,IntervalMap *im) except -1
 
 cdef class NLMSASlice:
-  cdef readonly int start,stop,id
-  cdef int n,nseqBounds,nrealseq,offset
+  cdef readonly IntervalCoord start,stop
+  cdef readonly int id
+  cdef int n,nseqBounds,nrealseq
+  cdef IntervalCoord offset
   cdef IntervalMap *im
   cdef IntervalMap *seqBounds
   cdef readonly NLMSASequence nlmsaSequence
@@ -204,21 +309,23 @@ cdef class NLMSASlice:
   cdef object weakestLink
 
   cdef int findSeqBounds(self,int id,int ori)
-  cdef object get_seq_interval(self, NLMSA nl, int targetID, int start, int stop)
+  cdef object get_seq_interval(self, NLMSA nl, int targetID,
+                               IntervalCoord start, IntervalCoord stop)
 
 cdef class NLMSASliceLetters:
   cdef readonly NLMSASlice nlmsaSlice
 
 
 cdef class NLMSANode:
-  cdef readonly int id,ipos
+  cdef readonly IntervalCoord id,ipos
   cdef int istart,istop,n
   cdef readonly NLMSASlice nlmsaSlice
 
-  cdef int check_edge(self,int iseq,int ipos)
+  cdef int check_edge(self,int iseq,IntervalCoord ipos)
 
 
 cdef class NLMSASliceIterator:
-  cdef int ipos,istart,istop
+  cdef IntervalCoord ipos
+  cdef int istart,istop
   cdef NLMSASlice nlmsaSlice
 
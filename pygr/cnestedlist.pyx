@@ -1,8 +1,160 @@
 import sequence
 import nlmsa_utils
+import array
+
+maxCoord = C_coord_max # LARGEST COORDINATE STORABLE, SEE PYGR_COORD64
+
+# SUFFIXES OF THE FILES OF AN IntervalFileDB, IN THE ORDER OF THE
+# DB_SECTION_ CODES IN intervaldb.h
+_dbSectionSuffixes = ('.size','.index','.subhead','.idb','.idbz','.zindex')
+
+cdef object int_array(int *p,int n):
+  'copy C int array to a python array of typecode i'
+  a=array.array('i')
+  if n>0:
+    a.fromstring(PyString_FromStringAndSize(<char *>p,n*sizeof(int)))
+  return a
+
+cdef object coord_array(IntervalCoord *p,int n):
+  'copy C coordinate array to a python array of matching typecode'
+  if sizeof(IntervalCoord)==sizeof(int):
+    a=array.array('i')
+  else: # 64-BIT COORDINATES, SAME SIZE AS long ON LP64 PLATFORMS
+    a=array.array('l')
+  if n>0:
+    a.fromstring(PyString_FromStringAndSize(<char *>p,
+                                            n*sizeof(IntervalCoord)))
+  return a
+
+cdef object double_array(double *p,int n):
+  'copy C double array to a python array of typecode d'
+  a=array.array('d')
+  if n>0:
+    a.fromstring(PyString_FromStringAndSize(<char *>p,n*sizeof(double)))
+  return a
+
+cdef object interval_map_arrays(IntervalMap *im,int n):
+  '''copy an IntervalMap array to flat column arrays
+  (start,end,target_id,target_start,target_end), with no tuple per interval'''
+  cdef int i
+  cdef int *col
+  cdef IntervalCoord *coord
+  col=<int *>malloc(sizeof(int)*(n+1))
+  coord=<IntervalCoord *>malloc(sizeof(IntervalCoord)*(n+1))
+  try:
+    if col==NULL or coord==NULL:
+      raise MemoryError('out of memory')
+    l=[]
+    for i from 0 <= i < n:
+      coord[i]=im[i].start
+    l.append(coord_array(coord,n))
+    for i from 0 <= i < n:
+      coord[i]=im[i].end
+    l.append(coord_array(coord,n))
+    for i from 0 <= i < n:
+      col[i]=im[i].target_id
+    l.append(int_array(col,n))
+    for i from 0 <= i < n:
+      coord[i]=im[i].target_start
+    l.append(coord_array(coord,n))
+    for i from 0 <= i < n:
+      coord[i]=im[i].target_end
+    l.append(coord_array(coord,n))
+  finally:
+    free(col)
+    free(coord)
+  return tuple(l)
+
+cdef object batch_hits_arrays(BatchHits *hits,int nquery):
+  '''order hits by query index and return them as flat arrays
+  (iquery,start,end,target_id,target_start,target_end)'''
+  with nogil:
+    sort_batch_hits(hits,nquery) # STABLE: KEEPS HIT ORDER WITHIN EACH QUERY
+  return (int_array(hits.iquery,hits.n),)+interval_map_arrays(hits.im,hits.n)
+
+cdef object overlap_batch(IntervalDB idb,IntervalFileDB db,starts,ends):
+  'batch query of either an in-memory (idb) or on-disk (db) database'
+  cdef int i,n,ntop,nlists
+  cdef IntervalCoord *c_starts,*c_ends
+  cdef IntervalMap *im
+  cdef SublistHeader *subheader
+  cdef BatchHits hits
+  n=len(starts)
+  if len(ends)!=n:
+    raise ValueError('starts and ends must have the same length')
+  memset(&hits,0,sizeof(BatchHits))
+  c_starts=<IntervalCoord *>malloc(sizeof(IntervalCoord)*(n+1))
+  c_ends=<IntervalCoord *>malloc(sizeof(IntervalCoord)*(n+1))
+  try:
+    if c_starts==NULL or c_ends==NULL:
+      raise MemoryError('out of memory')
+    for i from 0 <= i < n:
+      c_starts[i]=starts[i]
+      c_ends[i]=ends[i]
+    if db is not None:
+      file_db_find_batch(db,n,c_starts,c_ends,&hits)
+    else:
+      im=idb.im
+      ntop=idb.ntop
+      subheader=idb.subheader
+      nlists=idb.nlists
+      with nogil:
+        find_intervals_batch(n,c_starts,c_ends,im,ntop,subheader,nlists,&hits)
+    return batch_hits_arrays(&hits,n)
+  finally:
+    free(c_starts)
+    free(c_ends)
+    free_batch_hits(&hits)
+
+cdef int file_db_find_batch(IntervalFileDB db,int nquery,IntervalCoord starts[],
+                            IntervalCoord ends[],BatchHits *hits) except -1:
+  'batch query of an on-disk database, and of its delta index if any'
+  cdef IntervalDBFile *db_file
+  db_file=db.db
+  with nogil:
+    find_file_intervals_batch(nquery,starts,ends,db_file,hits)
+  if db.delta is not None:
+    db_file=db.delta.db
+    with nogil:
+      find_file_intervals_batch(nquery,starts,ends,db_file,hits)
+  return 0
+
+cdef int ns_find_batch(NLMSASequence ns,int nquery,IntervalCoord starts[],
+                       IntervalCoord ends[],
+                       BatchHits *hits) except -1:
+  'batch query of the database of ns, in memory or on disk'
+  cdef IntervalDB idb
+  cdef IntervalMap *im
+  cdef SublistHeader *subheader
+  cdef int ntop,nlists
+  if ns.idb is not None:
+    idb=ns.idb
+    im=idb.im
+    ntop=idb.ntop
+    subheader=idb.subheader
+    nlists=idb.nlists
+    with nogil:
+      find_intervals_batch(nquery,starts,ends,im,ntop,subheader,nlists,hits)
+    return 0
+  if ns.db is None:
+    ns.forceLoad()
+  return file_db_find_batch(ns.db,nquery,starts,ends,hits)
+
+cdef int copy_stored_intervals(filestem,FILE *ofile) except -1:
+  'write all intervals stored in database filestem to .build file ofile'
+  cdef int n
+  cdef char err_msg[2048]
+  err_msg[0]=0 # ENSURE STRING IS EMPTY
+  n=write_interval_records(filestem,ofile,err_msg)
+  if n<0:
+    if err_msg[0]==0: # NO MESSAGE MEANS malloc FAILED
+      raise MemoryError('out of memory')
+    raise IOError(err_msg)
+  return n
 
 cdef class IntervalDBIterator:
-  def __new__(self,int start,int end,IntervalDB db not None):
+  def __new__(self,IntervalCoord start,IntervalCoord end,
+              IntervalDB db not None):
     self.it=interval_iterator_alloc()
     self.it_alloc=self.it
     self.start=start
@@ -13,13 +165,19 @@ cdef class IntervalDBIterator:
     return self 
 
   cdef int cnext(self): # C VERSION OF ITERATOR next METHOD RETURNS INDEX
-    cdef int i
+    cdef int i,ntop,nlists
+    cdef IntervalMap *im
+    cdef SublistHeader *subheader
     if self.ihit>=self.nhit: # TRY TO GET ONE MORE BUFFER CHUNK OF HITS
       if self.it==NULL: # ITERATOR IS EXHAUSTED
         return -1
-      find_intervals(self.it,self.start,self.end,self.db.im,self.db.ntop,
-                     self.db.subheader,self.db.nlists,self.im_buf,1024,
-                     &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
+      im=self.db.im
+      ntop=self.db.ntop
+      subheader=self.db.subheader
+      nlists=self.db.nlists
+      with nogil:
+        find_intervals(self.it,self.start,self.end,im,ntop,subheader,nlists,
+                       self.im_buf,1024,&(self.nhit),&(self.it)) # NEXT CHUNK
       self.ihit=0 # START ITERATING FROM START OF BUFFER
     if self.ihit<self.nhit: # RETURN NEXT ITEM FROM BUFFER
       i=self.ihit
@@ -80,6 +238,17 @@ cdef class IntervalDB:
       i=i+1
     self.runBuildMethod(**kwargs)
 
+  cdef int adopt_intervals(self,IntervalMap *im,int n) except -1:
+    'take ownership of malloc-allocated im[0:n], trimming its spare capacity'
+    cdef IntervalMap *im_new
+    self.close() # DUMP OUR EXISTING MEMORY
+    im_new=<IntervalMap *>realloc(im,n*sizeof(IntervalMap))
+    if im_new!=NULL: # IF THE SHRINK FAILS, JUST KEEP THE LARGER BLOCK
+      im=im_new
+    self.im=im
+    self.n=n
+    return n
+
   def runBuildMethod(self,buildInPlace=True):
     'build either in-place or using older build method'
     if buildInPlace:
@@ -99,7 +268,7 @@ cdef class IntervalDB:
     im_new=interval_map_alloc(n)
     if im_new==NULL:
       raise MemoryError('unable to allocate IntervalMap[%d]' % n)
-    i=read_imdiv(ifile,im_new,n,0,n)
+    i=read_imdiv(ifile,im_new,n,0,n,0)
     fclose(ifile)
     if i!=n:
       raise IOError('IntervalMap file corrupted?')
@@ -107,11 +276,11 @@ cdef class IntervalDB:
     self.im=im_new
     self.runBuildMethod(**kwargs)
 
-  def find_overlap(self,int start,int end):
+  def find_overlap(self,IntervalCoord start,IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalDBIterator(start,end,self)
 
-  def find_overlap_list(self,int start,int end):
+  def find_overlap_list(self,IntervalCoord start,IntervalCoord end):
     cdef int i,nhit
     cdef IntervalIterator *it,*it_alloc
     cdef IntervalMap im_buf[1024]
@@ -120,13 +289,33 @@ cdef class IntervalDB:
     it_alloc=it
     l=[] # LIST OF RESULTS TO HAND BACK
     while it:
-      find_intervals(it,start,end,self.im,self.ntop,
-                     self.subheader,self.nlists,im_buf,1024,
-                     &(nhit),&(it)) # GET NEXT BUFFER CHUNK
+      with nogil:
+        find_intervals(it,start,end,self.im,self.ntop,
+                       self.subheader,self.nlists,im_buf,1024,
+                       &(nhit),&(it)) # GET NEXT BUFFER CHUNK
       for i from 0 <= i < nhit:
         l.append((im_buf[i].start,im_buf[i].end,im_buf[i].target_id,im_buf[i].target_start,im_buf[i].target_end))
     free_interval_iterator(it_alloc)
     return l
+
+  def find_overlap_batch(self,starts,ends):
+    '''find the intervals overlapping each query [starts[i]:ends[i]],
+    searching the queries in start order so each resumes the top-level
+    list where the previous one left off.  Returns flat arrays (iquery,
+    start,end,target_id,target_start,target_end) ordered by query index'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return overlap_batch(self,None,starts,ends)
+
+  def find_overlap_arrays(self,IntervalCoord start,IntervalCoord end):
+    '''same hits as find_overlap_list(), but as flat arrays
+    (start,end,target_id,target_start,target_end) instead of tuples'''
+    return self.find_overlap_batch((start,),(end,))[1:]
+
+  def interval_arrays(self):
+    '''return all stored intervals as flat arrays
+    (start,end,target_id,target_start,target_end), in storage order.
+    Intervals are stored in positive source orientation.'''
+    return interval_map_arrays(self.im,self.n)
         
   def check_nonempty(self):
     if self.im:
@@ -135,12 +324,14 @@ cdef class IntervalDB:
       msg='empty IntervalDB, not searchable!'
       raise IndexError(msg)
 
-  def write_binaries(self,filestem,div=256):
+  def write_binaries(self,filestem,div=256,compressBlocks=False):
     cdef char *err_msg
     err_msg=write_binary_files(self.im,self.n,self.ntop,div,
                                self.subheader,self.nlists,filestem)
     if err_msg:
       raise IOError(err_msg)
+    if compressBlocks:
+      compress_nested_list_files(filestem)
 
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
@@ -162,7 +353,8 @@ cdef class IntervalDB:
 
 
 cdef class IntervalFileDBIterator:
-  def __new__(self,int start,int end,IntervalFileDB db=None,
+  def __new__(self,IntervalCoord start,IntervalCoord end,
+              IntervalFileDB db=None,
               NLMSASequence ns=None,
               int nbuffer=1024,rawIvals=None):
     cdef int i
@@ -193,12 +385,14 @@ cdef class IntervalFileDBIterator:
         i=i+1
       self.nhit=i # TOTAL NUMBER OF INTERVALS STORED
 
-  cdef int restart(self,int start,int end,IntervalFileDB db) except -2:
+  cdef int restart(self,IntervalCoord start,IntervalCoord end,
+                   IntervalFileDB db) except -2:
     'reuse this iterator for another search without reallocing memory'
     self.nhit=0 # FLUSH ANY EXISTING DATA
     self.start=start
     self.end=end
     self.db=db
+    self.in_delta=0
     self.it=self.it_alloc # REUSE OUR CURRENT ITERATOR
     reset_interval_iterator(self.it) # RESET IT FOR REUSE
     return 0
@@ -209,14 +403,14 @@ cdef class IntervalFileDBIterator:
     return 0
 
   cdef int extend(self,int ikeep):
-    'expand the buffer if necessary, keeping elements [ikeep:nbuf]'
+    'expand the buffer if necessary, keeping elements [ikeep:nhit]'
     cdef int length,istart
     cdef IntervalMap *new_buf
-    istart=self.nbuf-ikeep
+    istart=self.nhit-ikeep # BUFFER MAY BE PARTLY FULL WHEN WE SWITCH TO delta
     length=sizeof(IntervalMap)*istart # #BYTES WE MUST KEEP
     if ikeep>0 and length>0: # SHIFT [ikeep:] SLICE OF BUFFER TO [0:istart]
       memmove(self.im_buf,self.im_buf+ikeep,length)
-    if ikeep<8: # RUNNING OUT OF ROOM, SO DOUBLE OUR BUFFER
+    if self.nbuf-istart<8: # RUNNING OUT OF ROOM, SO DOUBLE OUR BUFFER
       new_buf=<IntervalMap *>realloc(self.im_buf,
                                      sizeof(IntervalMap)*2*self.nbuf)
       if new_buf==NULL:
@@ -225,8 +419,9 @@ cdef class IntervalFileDBIterator:
       self.nbuf=2*self.nbuf
     return istart # RETURN START OF EMPTY BLOCK WHERE WE CAN ADD NEW DATA
 
-  cdef int saveInterval(self,int start,int end,int target_id,
-                        int target_start,int target_end):
+  cdef int saveInterval(self,IntervalCoord start,IntervalCoord end,
+                        int target_id,IntervalCoord target_start,
+                        IntervalCoord target_end):
     'save an interval, expanding array if necessary'
     cdef int i
     if self.nhit>=self.nbuf: # EXPAND ARRAY IF NECESSARY
@@ -242,32 +437,47 @@ cdef class IntervalFileDBIterator:
 
   cdef int nextBlock(self,int *pkeep) except -2:
     'load one more block of overlapping intervals'
-    cdef int i
+    cdef int i,ntop,nlists
+    cdef IntervalDBFile *db_file
+    cdef IntervalMap *im
+    cdef SublistHeader *subheader
     if self.it==NULL: # ITERATOR IS EXHAUSTED
-      return -1
+      if self.db is None or self.db.delta is None or self.in_delta:
+        return -1
+      self.in_delta=1 # GO ON TO SEARCH THE DELTA INDEX OF THIS DATABASE
+      self.it=self.it_alloc
+      reset_interval_iterator(self.it)
     if pkeep and pkeep[0]>=0 and pkeep[0]<self.nhit: #MUST KEEP [ikeep:] SLICE
       i=self.extend(pkeep[0]) # MOVE SLICE TO THE FRONT
     else: # WE CAN USE THE WHOLE BUFFER
       i=0
-    if self.db is not None: # ON-DISK DATABASE
-      find_file_intervals(self.it,self.start,self.end,
-                          self.db.db[0].ii,self.db.db[0].nii,
-                          self.db.db[0].subheader,self.db.db[0].nlists,
-                          &(self.db.db[0].subheader_file),
-                          self.db.db[0].ntop,self.db.db[0].div,
-                          self.db.db[0].ifile_idb,
-                          self.im_buf+i,self.nbuf-i,
-                          &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
+    if self.db is not None: # ON-DISK DATABASE, OR ITS DELTA INDEX
+      if self.in_delta:
+        db_file=self.db.delta.db
+      else:
+        db_file=self.db.db
+      with nogil: # LET OTHER THREADS RUN WHILE WE SEARCH
+        find_file_intervals(self.it,self.start,self.end,db_file,
+                            self.im_buf+i,self.nbuf-i,
+                            &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
     elif self.idb is not None: # IN-MEMORY DATABASE
-      find_intervals(self.it,self.start,self.end,self.idb.im,self.idb.ntop,
-                     self.idb.subheader,self.idb.nlists,self.im_buf+i,self.nbuf-i,
-                     &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
+      im=self.idb.im
+      ntop=self.idb.ntop
+      subheader=self.idb.subheader
+      nlists=self.idb.nlists
+      with nogil:
+        find_intervals(self.it,self.start,self.end,im,ntop,subheader,nlists,
+                       self.im_buf+i,self.nbuf-i,
+                       &(self.nhit),&(self.it)) # GET NEXT BUFFER CHUNK
     else:
       raise IOError('Iterator has no database!  Please provide a db argument.')
     self.nhit=self.nhit+i # TOTAL #HITS IN THE BUFFER
     self.ihit=i # START ITERATING FROM START OF NEW HITS
     if pkeep and pkeep[0]>=0: # RESET ikeep INDEX TO START OF BUFFER
       pkeep[0]=0
+    if self.nhit==self.ihit and self.it==NULL and not self.in_delta \
+           and self.db is not None and self.db.delta is not None:
+      return self.nextBlock(pkeep) # NO HITS IN MAIN INDEX, SO TRY ITS delta
     return self.nhit-self.ihit # RETURN #NEW HITS IN NEXT BLOCK
 
   cdef IntervalMap *getIntervalMap(self):
@@ -294,7 +504,7 @@ cdef class IntervalFileDBIterator:
       len=self.nextBlock(&ikeep) # LOAD ANOTHER BLOCK OF INTERVALS
     return self.nhit
 
-  cdef int cnext(self,int *pkeep): # C VERSION OF ITERATOR next METHOD
+  cdef int cnext(self,int *pkeep) except -2: # C VERSION OF ITERATOR next METHOD
     'get one more overlapping interval'
     cdef int i
     if self.ihit>=self.nhit: # TRY TO GET ONE MORE BUFFER CHUNK OF HITS
@@ -327,7 +537,8 @@ cdef class IntervalFileDBIterator:
     cdef int i,j,n,id
     if self.nhit<=0: # NOTHING TO MERGE, SO JUST RETURN
       return 0
-    qsort(self.im_buf,self.nhit,sizeof(IntervalMap),target_qsort_cmp) # ORDER BY id,start
+    with nogil:
+      qsort(self.im_buf,self.nhit,sizeof(IntervalMap),target_qsort_cmp) # ORDER BY id,start
     n=0
     id= -1
     for i from 0 <= i < self.nhit:
@@ -371,21 +582,60 @@ cdef class IntervalFileDBIterator:
 
       
 cdef class IntervalFileDB:
-  def __new__(self,filestem=None,mode='r'):
+  def __new__(self,filestem=None,mode='r',useMmap=False,packFile=None):
     if filestem is not None and mode=='r':
-      self.open(filestem)
-
-  def open(self,filestem):
+      self.open(filestem,useMmap,packFile)
+
+  def open(self,filestem,useMmap=False,packFile=None):
+    '''open the database files.  useMmap=True maps them into memory
+    instead, so queries read blocks directly from the mapping.
+    Intervals appended since the database was built are kept in a
+    separate delta database filestem.delta, which is opened too.
+    If packFile is given, the files are read from their sections of
+    that nlmsa_utils.NLMSAPackFile instead.'''
     cdef char err_msg[1024]
-    self.db=read_binary_files(filestem,err_msg,1024)
+    cdef int i
+    cdef long long offset,length
+    cdef PackedDBFiles pack
+    cdef PackedDBFiles *p_pack
+    import os
+    err_msg[0]=0 # ENSURE STRING IS EMPTY
+    p_pack=NULL
+    if packFile is not None: # FIND EACH OF OUR FILES IN THE PACKED FILE
+      if len(packFile.path)>=2048:
+        raise ValueError('path too long: '+packFile.path)
+      strcpy(pack.path,packFile.path)
+      i=0
+      for suffix in _dbSectionSuffixes:
+        try:
+          offset,length=packFile.section(filestem+suffix)
+        except KeyError: # DATABASE DOESN'T HAVE THIS FILE
+          offset=0
+          length= -1
+        pack.offset[i]=offset
+        pack.len[i]=length
+        i=i+1
+      p_pack= &pack
+      hasDelta=filestem+'.delta.size' in packFile
+    else:
+      hasDelta=os.access(filestem+'.delta.size',os.R_OK)
+    if useMmap:
+      self.db=mmap_binary_files(filestem,p_pack,err_msg)
+    else:
+      self.db=read_binary_files(filestem,p_pack,err_msg,1024)
     if self.db==NULL:
+      if err_msg[0]==0: # NO MESSAGE MEANS malloc FAILED
+        raise MemoryError('out of memory')
       raise IOError(err_msg)
+    if hasDelta: # HAS APPENDED INTERVALS
+      self.delta=IntervalFileDB(filestem+'.delta',useMmap=useMmap,
+                                packFile=packFile)
 
-  def find_overlap(self,int start,int end):
+  def find_overlap(self,IntervalCoord start,IntervalCoord end):
     self.check_nonempty() # RAISE EXCEPTION IF NO DATA
     return IntervalFileDBIterator(start,end,self)
 
-  def find_overlap_list(self,int start,int end):
+  def find_overlap_list(self,IntervalCoord start,IntervalCoord end):
     cdef int i,nhit
     cdef IntervalIterator *it,*it_alloc
     cdef IntervalMap im_buf[1024]
@@ -394,18 +644,41 @@ cdef class IntervalFileDB:
     it_alloc=it
     l=[] # LIST OF RESULTS TO HAND BACK
     while it:
-      find_file_intervals(it,start,end,self.db[0].ii,self.db[0].nii,
-                          self.db[0].subheader,self.db[0].nlists,
-                          &(self.db[0].subheader_file),
-                          self.db[0].ntop,self.db[0].div,
-                          self.db[0].ifile_idb,im_buf,1024,
-                          &(nhit),&(it)) # GET NEXT BUFFER CHUNK
+      with nogil:
+        find_file_intervals(it,start,end,self.db,im_buf,1024,
+                            &(nhit),&(it)) # GET NEXT BUFFER CHUNK
       for i from 0 <= i < nhit:
         l.append((im_buf[i].start,im_buf[i].end,im_buf[i].target_id,
                   im_buf[i].target_start,im_buf[i].target_end))
     free_interval_iterator(it_alloc)
+    if self.delta is not None: # ADD HITS FROM OUR DELTA INDEX
+      l.extend(self.delta.find_overlap_list(start,end))
     return l
 
+  def find_overlap_batch(self,starts,ends):
+    '''find the intervals overlapping each query [starts[i]:ends[i]],
+    searching the queries in start order so each resumes the top-level
+    list where the previous one left off.  Returns flat arrays (iquery,
+    start,end,target_id,target_start,target_end) ordered by query index'''
+    self.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    return overlap_batch(None,self,starts,ends)
+
+  def find_overlap_arrays(self,IntervalCoord start,IntervalCoord end):
+    '''same hits as find_overlap_list(), but as flat arrays
+    (start,end,target_id,target_start,target_end) instead of tuples'''
+    return self.find_overlap_batch((start,),(end,))[1:]
+
+  def scan_arrays(self,IntervalCoord start=0,end=None,int chunkSize=4096):
+    '''iterate over all intervals overlapping [start:end) (by default the
+    whole database), including those of our delta database, in start
+    order.  Each nested list is read front to back just once, so this is
+    much cheaper than querying a long region window by window.  Generates
+    chunks of up to chunkSize intervals as flat arrays
+    (start,end,target_id,target_start,target_end).'''
+    if end is None:
+      end=C_coord_max
+    return IntervalFileDBScan(self,start,end,chunkSize)
+
   def check_nonempty(self):
     if self.db==NULL:
       raise IndexError('empty IntervalFileDB, not searchable!')
@@ -414,6 +687,9 @@ cdef class IntervalFileDB:
     if self.db:
       free_interval_dbfile(self.db)
     self.db=NULL
+    if self.delta is not None:
+      self.delta.close()
+      self.delta=None
 
   def __dealloc__(self):
     'remember: dealloc cannot call other methods!'
@@ -422,6 +698,54 @@ cdef class IntervalFileDB:
 
 
 
+cdef class IntervalFileDBScan:
+  '''iterator over the intervals of an IntervalFileDB overlapping
+  [start:end) in start order, see IntervalFileDB.scan_arrays()'''
+  def __new__(self,IntervalFileDB db not None,IntervalCoord start,
+              IntervalCoord end,int chunkSize=4096):
+    cdef IntervalDBFile *db_files[2]
+    cdef int ndb
+    db.check_nonempty() # RAISE EXCEPTION IF NO DATA
+    if start<0 or end<start: # STORED IN POSITIVE ORIENTATION ONLY
+      raise ValueError('scan region must be in positive orientation')
+    if chunkSize<=0:
+      raise ValueError('chunkSize must be positive')
+    self.db=db # KEEP IT OPEN WHILE WE READ IT
+    db_files[0]=db.db
+    ndb=1
+    if db.delta is not None: # MERGE IN ITS APPENDED INTERVALS
+      db_files[1]=db.delta.db
+      ndb=2
+    self.im_buf=<IntervalMap *>malloc(sizeof(IntervalMap)*chunkSize)
+    if self.im_buf==NULL:
+      raise MemoryError('out of memory')
+    self.nbuf=chunkSize
+    self.scan=interval_scan_alloc(db_files,ndb,start,end)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self): # PYREX USES THIS NON-STANDARD NAME INSTEAD OF next()!!!
+    cdef int n
+    if self.scan==NULL:
+      raise StopIteration
+    with nogil:
+      n=interval_scan_next(self.scan,self.im_buf,self.nbuf)
+    if n==0: # DONE: RELEASE ITS CURSORS RIGHT AWAY
+      free_interval_scan(self.scan)
+      self.scan=NULL
+      raise StopIteration
+    return interval_map_arrays(self.im_buf,n)
+
+  def __dealloc__(self):
+    'remember: dealloc cannot call other methods!'
+    if self.scan:
+      free_interval_scan(self.scan)
+    if self.im_buf:
+      free(self.im_buf)
+
+
+
 
 cdef class NLMSASliceLetters:
   'graph interface to letter graph within this region'
@@ -444,9 +768,11 @@ cdef class NLMSASliceLetters:
 
 
 cdef class NLMSASlice:
-  def __new__(self,NLMSASequence ns not None,int start,int stop,
-              int id= -1,int offset=0,seq=None):
-    cdef int i,j,n,start_max,end_min,start2,stop2,nseq,istart,istop,localQuery
+  def __new__(self,NLMSASequence ns not None,IntervalCoord start,
+              IntervalCoord stop,int id= -1,IntervalCoord offset=0,seq=None,
+              NLMSASlice parent=None):
+    cdef int i,j,n,nseq,localQuery
+    cdef IntervalCoord start_max,end_min,start2,stop2,istart,istop
     cdef NLMSASequence ns_lpo
     cdef IntervalFileDBIterator it,it2
     cdef IntervalMap *im,*im2
@@ -460,14 +786,34 @@ cdef class NLMSASlice:
     self.stop=stop
     self.offset=offset # ALWAYS STORE offset IN POSITIVE ORIENTATION
     self.seq=seq
-    try: # USE PYTHON METHOD TO DO QUERY
-      id,ivals=ns.nlmsaLetters.doSlice(seq) # doSlice() RETURNS RAW INTERVALS
-      self.id=id # SAVE OUR SEQUENCE'S nlmsa_id
-      it=IntervalFileDBIterator(start,stop,rawIvals=ivals) # STORE IN BINARY FMT
+    localQuery=0
+    if parent is not None: # CLIP AN ENCLOSING SLICE'S INTERVALS, NO QUERY
+      self.id=parent.id
+      it=IntervalFileDBIterator(start,stop,nbuffer=parent.n)
       it2=IntervalFileDBIterator(start,stop) # HOLDER FOR SUBSEQUENT MERGE
-      localQuery=0 # DO NOT PERFORM LOCAL QUERY CODE BELOW!!
-    except AttributeError:
-      localQuery=1
+      im=parent.im
+      for i from 0 <= i < parent.n:
+        if im[i].end<=start or im[i].start>=stop: # NO OVERLAP WITH [start:stop]
+          continue
+        start2=im[i].target_start
+        stop2=im[i].target_end
+        istart=im[i].start
+        istop=im[i].end
+        if stop<istop: # TRUNCATE TO FIT WITHIN [start:stop]
+          stop2=stop2+stop-istop
+          istop=stop
+        if start>istart:
+          start2=start2+start-istart
+          istart=start
+        it.saveInterval(istart,istop,im[i].target_id,start2,stop2)
+    else:
+      try: # USE PYTHON METHOD TO DO QUERY
+        id,ivals=ns.nlmsaLetters.doSlice(seq) # doSlice() RETURNS RAW INTERVALS
+        self.id=id # SAVE OUR SEQUENCE'S nlmsa_id
+        it=IntervalFileDBIterator(start,stop,rawIvals=ivals) # STORE IN BINARY FMT
+        it2=IntervalFileDBIterator(start,stop) # HOLDER FOR SUBSEQUENT MERGE
+      except AttributeError:
+        localQuery=1
     if localQuery: ################################## PERFORM LOCAL QUERY
       if id<0:
         id=ns.id
@@ -507,6 +853,8 @@ cdef class NLMSASlice:
             it2=IntervalFileDBIterator(it.im_buf[i].target_start,
                                        it.im_buf[i].target_end,ns=ns_lpo)
           else: # JUST REUSE THIS ITERATOR WITHOUT REALLOCING MEMORY
+            if ns_lpo.db is None and ns_lpo.idb is None: # NOT OPENED YET
+              ns_lpo.forceLoad()
             it2.restart(it.im_buf[i].target_start,
                         it.im_buf[i].target_end,ns_lpo.db)
           it2.loadAll() # GET ALL OVERLAPPING INTERVALS
@@ -538,7 +886,8 @@ cdef class NLMSASlice:
 
     self.im=it.getIntervalMap() # RELEASE THIS ARRAY FROM THE ITERATOR
     self.n=it.nhit # TOTAL #INTERVALS SAVED FROM JOIN
-    qsort(self.im,self.n,sizeof(IntervalMap),imstart_qsort_cmp) # ORDER BY start
+    with nogil:
+      qsort(self.im,self.n,sizeof(IntervalMap),imstart_qsort_cmp) # ORDER BY start
 
     n=0
     for i from 0 <= i < self.nseqBounds: # COUNT NON-LPO SEQUENCES
@@ -582,7 +931,7 @@ cdef class NLMSASlice:
       self.seqBounds=NULL
 
   cdef object get_seq_interval(self, NLMSA nl, int targetID,
-                               int start, int stop):
+                               IntervalCoord start, IntervalCoord stop):
     'get seq interval and ensure cache owner keeps it in the cache'
     if start<stop:
       ival = nl.seqInterval(targetID, start, stop)
@@ -733,7 +1082,9 @@ alignment intervals to an NLMSA after calling its build() method.''')
       - pAlignedMin: a fractional minimum alignment threshold e.g. (0.9)
       - pIdentityMin: a fractional minimum identity threshold e.g. (0.9)
       '''
-    cdef int i,j,n,gap,insert,targetStart,targetEnd,start,end,maskStart,maskEnd
+    cdef int i,j,n
+    cdef IntervalCoord gap,insert,targetStart,targetEnd,start,end
+    cdef IntervalCoord maskStart,maskEnd
     cdef NLMSA nl
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     if mergeMost: # BE REASONABLE: DON'T MERGE A WHOLE CHROMOSOME
@@ -912,7 +1263,8 @@ alignment intervals to an NLMSA after calling its build() method.''')
       seqs is a list of sequences in the group.
       Must return a list of (sourceIval,targetIval).  See the docs.
     '''
-    cdef int i,j,start,end,targetStart,targetEnd,ipos,id
+    cdef int i,j,id
+    cdef IntervalCoord start,end,targetStart,targetEnd,ipos,ivalEnd
     cdef float f
     cdef NLMSA nl
     nl=self.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
@@ -972,14 +1324,14 @@ alignment intervals to an NLMSA after calling its build() method.''')
               result.append(sequence.absoluteSlice(self.seq,maskStart,end))
             else: # REPORT TARGET IVALS WITHIN (maskStart,end) REGION
               for seq in seqStart: # CANNOT USE items() BECAUSE THIS IS A QUEUE!
-                (start,i,targetStart,targetEnd,mergeIntervals)=seqStart[seq]
+                (start,ivalEnd,targetStart,targetEnd,mergeIntervals)=seqStart[seq]
                 pleaseClip = False
                 if maskStart>start: # TRUNCATE TARGET IVAL START
                   targetStart=targetStart+maskStart-start
                   start=maskStart
                   pleaseClip = True
-                if end<i: # TRUNCATE TARGET IVAL END
-                  targetEnd=targetEnd+end-i
+                if end<ivalEnd: # TRUNCATE TARGET IVAL END
+                  targetEnd=targetEnd+end-ivalEnd
                   pleaseClip = True
                 if pleaseClip:
                   mergeIntervals = self.clip_interval_list(maskStart,end,mergeIntervals)
@@ -1076,11 +1428,155 @@ alignment intervals to an NLMSA after calling its build() method.''')
                 self.im[i].target_start,self.im[i].target_end))
     return l
 
+  def rawIvalArrays(self):
+    '''return the raw numeric intervals of this slice as flat arrays
+    (start,end,target_id,target_start,target_end), in rawIvals() order'''
+    return interval_map_arrays(self.im,self.n)
+
+  def seqBoundArrays(self):
+    '''return the interval covering each aligned sequence (and LPO)
+    orientation in this slice, as flat arrays
+    (start,end,target_id,target_start,target_end)'''
+    return interval_map_arrays(self.seqBounds,self.nseqBounds)
+
+  def columnArrays(self,letters=False,score=None):
+    '''return the alignment columns of this slice as a compact matrix,
+    without creating an NLMSANode per column: a tuple (ivals,matrix,scores).
+    ivals has one sequence interval per row: our query interval (unless this
+    is an LPO slice), then the interval covering each aligned sequence
+    orientation, in seqBoundArrays() order.  Column icol is position
+    start+icol; its entry for row irow is matrix[icol*len(ivals)+irow].
+    matrix is an int array of offsets within ivals[irow] (-1 for a gap), or
+    with letters=True a string of letters ('-' for a gap), so that each
+    column is a substring.  score='identity' gives each column's fraction of
+    rows carrying its commonest letter, score='entropy' the Shannon entropy
+    (bits) of its letters, as a float array; otherwise scores is None.'''
+    cdef int i,j,irow,nrow,ncol,icol,k,c,nletter,nmax
+    cdef int *boundRow,*rowOf,*offsets
+    cdef int counts[256]
+    cdef char **rowSeq,*buf
+    cdef double *scores
+    cdef double p,h
+    cdef IntervalCoord ipos,base
+    cdef NLMSA nl
+    if score is not None and score!='identity' and score!='entropy':
+      raise ValueError('score must be None, "identity" or "entropy"')
+    nl=self.nlmsa
+    ivals=[]
+    if not self.nlmsaSequence.is_lpo: # OUR QUERY IS ROW 0
+      ivals.append(self.seq)
+    ncol=self.stop-self.start
+    boundRow=NULL
+    rowOf=NULL
+    offsets=NULL
+    rowSeq=NULL
+    buf=NULL
+    scores=NULL
+    try:
+      boundRow=<int *>malloc((self.nseqBounds+1)*sizeof(int))
+      rowOf=<int *>malloc((self.n+1)*sizeof(int))
+      if boundRow==NULL or rowOf==NULL:
+        raise MemoryError('unable to allocate row index')
+      for i from 0 <= i < self.nseqBounds: # ONE ROW PER REAL SEQ ORIENTATION
+        if nl.seqlist.is_lpo(self.seqBounds[i].target_id):
+          boundRow[i]= -1
+        else:
+          boundRow[i]=len(ivals)
+          ivals.append(self.get_seq_interval(nl,self.seqBounds[i].target_id,
+                                             self.seqBounds[i].target_start,
+                                             self.seqBounds[i].target_end))
+      nrow=len(ivals)
+      for i from 0 <= i < self.n: # FIND EACH INTERVAL'S seqBounds ENTRY
+        rowOf[i]= -1
+        for j from 0 <= j < self.nseqBounds:
+          if boundRow[j]>=0 \
+                 and self.seqBounds[j].target_id==self.im[i].target_id \
+                 and (self.seqBounds[j].target_start<0)== \
+                     (self.im[i].target_start<0):
+            rowOf[i]=j
+            break
+      offsets=<int *>malloc((ncol*nrow+1)*sizeof(int))
+      if offsets==NULL:
+        raise MemoryError('unable to allocate column matrix[%d][%d]'
+                          % (ncol,nrow))
+      for k from 0 <= k < ncol*nrow: # START WITH ALL GAPS
+        offsets[k]= -1
+      if nrow>0 and not self.nlmsaSequence.is_lpo:
+        for icol from 0 <= icol < ncol:
+          offsets[icol*nrow]=icol
+      for i from 0 <= i < self.n:
+        j=rowOf[i]
+        if j<0: # LPO OR UNKNOWN TARGET: NOT A ROW
+          continue
+        irow=boundRow[j]
+        base=self.seqBounds[j].target_start
+        for ipos from self.im[i].start <= ipos < self.im[i].end:
+          if ipos<self.start or ipos>=self.stop:
+            continue
+          k=(ipos-self.start)*nrow+irow
+          if offsets[k]<0: # FIRST INTERVAL IN start ORDER WINS
+            offsets[k]=self.im[i].target_start+ipos-self.im[i].start-base
+      if not letters and score is None:
+        return ivals,int_array(offsets,ncol*nrow),None
+      strings=[] # KEEP THE LETTER STRINGS ALIVE WHILE WE READ THEM
+      rowSeq=<char **>malloc((nrow+1)*sizeof(char *))
+      buf=<char *>malloc(ncol*nrow+1)
+      if rowSeq==NULL or buf==NULL:
+        raise MemoryError('unable to allocate letter matrix[%d][%d]'
+                          % (ncol,nrow))
+      for irow from 0 <= irow < nrow:
+        strings.append(str(ivals[irow]))
+        rowSeq[irow]=strings[irow]
+      for k from 0 <= k < ncol*nrow:
+        if offsets[k]<0:
+          buf[k]=c'-'
+        else:
+          buf[k]=rowSeq[k%nrow][offsets[k]]
+      if score is None:
+        return ivals,PyString_FromStringAndSize(buf,ncol*nrow),None
+      scores=<double *>malloc((ncol+1)*sizeof(double))
+      if scores==NULL:
+        raise MemoryError('unable to allocate scores[%d]' % ncol)
+      for icol from 0 <= icol < ncol:
+        memset(counts,0,sizeof(counts))
+        nletter=0
+        nmax=0
+        for k from icol*nrow <= k < (icol+1)*nrow:
+          if buf[k]!=c'-':
+            c=toupper(<unsigned char>buf[k])
+            counts[c]=counts[c]+1
+            nletter=nletter+1
+            if counts[c]>nmax:
+              nmax=counts[c]
+        if nletter==0: # AN EMPTY COLUMN
+          scores[icol]=0.
+        elif score=='identity':
+          scores[icol]=(<double>nmax)/nrow
+        else: # ENTROPY OF THE NON-GAP LETTERS
+          h=0.
+          for c from 0 <= c < 256:
+            if counts[c]>0:
+              p=(<double>counts[c])/nletter
+              h=h-p*log(p)
+          scores[icol]=h/log(2.)
+      if letters:
+        matrix=PyString_FromStringAndSize(buf,ncol*nrow)
+      else:
+        matrix=int_array(offsets,ncol*nrow)
+      return ivals,matrix,double_array(scores,ncol)
+    finally:
+      free(boundRow)
+      free(rowOf)
+      free(offsets)
+      free(rowSeq)
+      free(buf)
+      free(scores)
+
 
 
 
 
-def advanceStartStop(int ipos,NLMSASlice nlmsaSlice not None,
+def advanceStartStop(IntervalCoord ipos,NLMSASlice nlmsaSlice not None,
                      int istart,int istop):
   cdef int i
   if istop>=nlmsaSlice.n:
@@ -1132,7 +1628,7 @@ cdef class NLMSASliceIterator:
 
 cdef class NLMSANode:
   'interface to a node in NLMSA storage of LPO alignment'
-  def __new__(self,int ipos,NLMSASlice nlmsaSlice not None,
+  def __new__(self,IntervalCoord ipos,NLMSASlice nlmsaSlice not None,
               int istart=0,int istop= -1):
     cdef int i,n
     cdef NLMSA nl
@@ -1156,7 +1652,8 @@ cdef class NLMSANode:
   def __len__(self):
     return self.n
   def __iter__(self):
-    cdef int i,j
+    cdef int i
+    cdef IntervalCoord j
     cdef NLMSA nl
     nl=self.nlmsaSlice.nlmsaSequence.nlmsaLetters # GET TOPLEVEL LETTERS OBJECT
     l=[]
@@ -1170,7 +1667,8 @@ cdef class NLMSANode:
 
   def getSeqPos(self,seq):
     'return seqpos for this seq at this node'
-    cdef int i,j,id
+    cdef int i,id
+    cdef IntervalCoord j
     try:
       id=self.nlmsaSlice.nlmsaSequence.nlmsaLetters.seqs.getID(seq)
     except KeyError:
@@ -1207,7 +1705,7 @@ cdef class NLMSANode:
       return -1
 
   ########################################## NODE-TO-NODE EDGE METHODS
-  cdef int check_edge(self,int iseq,int ipos):
+  cdef int check_edge(self,int iseq,IntervalCoord ipos):
     cdef int i
     for i from self.istart <= i < self.istop:
       if self.nlmsaSlice.im[i].start<=self.ipos \
@@ -1267,8 +1765,8 @@ cdef class NLMSANode:
     if has_continuation>=0:
       nodes[self.ipos+1]=has_continuation
     result={}
-    for i in nodes:
-      node=NLMSANode(i,self.nlmsaSlice,self.istart)
+    for ipos in nodes:
+      node=NLMSANode(ipos,self.nlmsaSlice,self.istart)
       result[node]=sequence.LetterEdge(self,node) # EDGE OBJECT
     return result
 
@@ -1292,14 +1790,7 @@ cdef class NLMSASequence:
     if isinstance(seq,types.StringType):
       self.name=seq # ALLOW USER TO BUILD INDEXES WITH A STRING NAME
     elif seq is not None: # REGULAR SEQUENCE
-      seq= seq.pathForward # GET THE WHOLE SEQUENCE, IN FORWARD ORIENTATION
-      try: # MAKE SURE seq HAS A UNIQUE NAME FOR INDEXING IT...
-        self.name=str(seq.path.name)
-      except AttributeError:
-        try:
-          self.name=str(seq.path.id)
-        except AttributeError:
-          raise AttributeError('NLMSASequence: seq must have name or id attribute')
+      self.name=nlmsa_utils.seq_index_name(seq)
     else:
       self.length=0 # LPO AND UNION SEQUENCES EXPAND AUTOMATICALLY
       if not is_union:
@@ -1313,7 +1804,7 @@ cdef class NLMSASequence:
     self.idb=None # DEFAULT: NOT USING IN-MEMORY DATABASE.
     self.db=None # DEFAULT: WAIT TO OPEN DB UNTIL ACTUALLY NEEDED
     if mode=='r': # IMMEDIATELY OPEN DATABASE, UNLIKE onDemand MODE
-      self.db=IntervalFileDB(filestem,mode)
+      self.db=IntervalFileDB(filestem,mode,nl.useMmap,nl.packFile)
     elif mode=='memory': # OPEN IN-MEMORY DATABASE
       self.idb=IntervalDB()
     elif mode=='w': # WRITE .build FILE
@@ -1328,10 +1819,13 @@ cdef class NLMSASequence:
     'remember: dealloc cannot call other methods!'
     if self.build_ifile:
       fclose(self.build_ifile)
+    if self.build_im:
+      free(self.build_im)
 
   def forceLoad(self):
     'force database to be initialized, if not already open'
-    self.db=IntervalFileDB(self.filestem,'r')
+    self.db=IntervalFileDB(self.filestem,'r',self.nlmsaLetters.useMmap,
+                           self.nlmsaLetters.packFile)
 
   def close(self):
     'free memory and close files associated with this sequence index'
@@ -1344,34 +1838,125 @@ cdef class NLMSASequence:
     if self.build_ifile:
       fclose(self.build_ifile)
       self.build_ifile=NULL
+    if self.build_im:
+      free(self.build_im)
+      self.build_im=NULL
+      self.build_nalloc=0
+
+  def openDeltaBuildFile(self):
+    '''start saving new intervals for this already built sequence index
+    to a .build file for its delta index'''
+    filename=self.filestem+'.delta.build'
+    self.build_ifile=fopen(filename,'wb') # binary file
+    if self.build_ifile==NULL:
+      raise IOError('unable to open in write mode: '+filename)
+    self.nbuild=0
+    self.is_delta=1
+
+  def closeBuildFile(self):
+    '''finish writing our .build file, and return its filename.  A delta
+    .build file also gets the intervals of the existing delta index.'''
+    cdef int n
+    if self.build_ifile==NULL:
+      raise IOError('not opened in write mode')
+    if self.is_delta:
+      filestem=self.filestem+'.delta'
+      if self.db is not None: # DON'T READ THE OLD DELTA WHILE WE REPLACE IT
+        self.db.close()
+        self.db=None
+      try:
+        if self.hasDelta(): # KEEP INTERVALS APPENDED EARLIER
+          n=copy_stored_intervals(filestem,self.build_ifile)
+          self.nbuild=self.nbuild+n
+      finally:
+        fclose(self.build_ifile)
+        self.build_ifile=NULL
+    else:
+      filestem=self.filestem
+      fclose(self.build_ifile)
+      self.build_ifile=NULL
+    return filestem+'.build'
 
   def buildFiles(self,**kwargs):
     'build nested list from saved unsorted alignment data'
-    cdef IntervalDB db
-    if self.build_ifile==NULL:
-      raise IOError('not opened in write mode')
-    fclose(self.build_ifile)
-    self.build_ifile=NULL
-    filename=self.filestem+'.build'
-    db=IntervalDB() # CREATE EMPTY NL IN MEMORY
-    if self.nbuild>0:
-      db.buildFromUnsortedFile(filename,self.nbuild,**kwargs) # BUILD FROM .build
-    db.write_binaries(self.filestem) # SAVE AS IntervalDBFile
-    db.close() # DUMP NESTEDLIST FROM MEMORY
-    import os
-    os.remove(filename) # REMOVE OUR .build FILE, NO LONGER NEEDED
-    self.db=IntervalFileDB(self.filestem) # NOW OPEN THE IntervalFileDB
+    filename=self.closeBuildFile()
+    build_nested_list_files(filename[:-6],self.nbuild,**kwargs) # CUT .build
+    self.is_delta=0
+    self.db=IntervalFileDB(self.filestem,'r',self.nlmsaLetters.useMmap) # NOW OPEN IT
     return self.nbuild # return count of intervals
 
-  def buildInMemory(self,verbose=False,**kwargs):
-    try:
-      n = len(self.buildList)
-    except TypeError:
+  def hasDelta(self):
+    'True if intervals have been appended to this index since it was built'
+    import os
+    if self.nlmsaLetters.packFile is not None:
+      return self.filestem+'.delta.size' in self.nlmsaLetters.packFile
+    return os.access(self.filestem+'.delta.size',os.R_OK)
+
+  def compact(self,**kwargs):
+    '''merge our delta index into our main nested list database, so that
+    queries no longer need to search both.  Keeps the main database
+    compressed if it was, unless compressBlocks=False is passed.'''
+    cdef FILE *ifile
+    cdef int n
+    import os
+    if not self.hasDelta():
       return 0
-    else:
-      self.idb.save_tuples(self.buildList,**kwargs)
-      self.buildList = None
-      return n
+    if self.nlmsaLetters.packFile is not None:
+      raise ValueError('''cannot compact a packed NLMSA: unpack it with
+packfile_to_binaries() first''')
+    self.close() # CLOSE BOTH DATABASES WHILE WE REPLACE THEM
+    filename=self.filestem+'.build'
+    ifile=fopen(filename,'wb') # binary file
+    if ifile==NULL:
+      raise IOError('unable to open in write mode: '+filename)
+    try: # COPY ALL INTERVALS OF BOTH DATABASES INTO ONE .build FILE
+      n=copy_stored_intervals(self.filestem,ifile)
+      n=n+copy_stored_intervals(self.filestem+'.delta',ifile)
+    finally:
+      fclose(ifile)
+    if 'compressBlocks' not in kwargs:
+      kwargs['compressBlocks']=os.access(self.filestem+'.idbz',os.R_OK)
+    for suffix in ('.idb','.idbz','.zindex'): # IN CASE THE FORMAT CHANGES
+      if os.access(self.filestem+suffix,os.F_OK):
+        os.remove(self.filestem+suffix)
+    build_nested_list_files(self.filestem,n,**kwargs)
+    for suffix in ('.size','.idb','.idbz','.zindex','.index','.subhead'):
+      if os.access(self.filestem+'.delta'+suffix,os.F_OK):
+        os.remove(self.filestem+'.delta'+suffix)
+    return n
+
+  def buildInMemory(self,verbose=False,nprocs=1,maxBuildMemory=None,
+                    compressBlocks=False,**kwargs):
+    'build in-memory nested list directly from our build buffer, without copying it'
+    cdef int n
+    if self.build_im==NULL:
+      return 0
+    n=self.nbuild
+    self.idb.adopt_intervals(self.build_im,n) # idb NOW OWNS THE BUFFER
+    self.build_im=NULL
+    self.build_nalloc=0
+    self.nbuild=0
+    self.idb.runBuildMethod(**kwargs)
+    return n
+
+  cdef int appendInMemory(self,IntervalMap *im) except -1:
+    'append one interval to our growable in-memory build buffer'
+    cdef int nalloc
+    cdef IntervalMap *im_new
+    if self.nbuild>=self.build_nalloc: # DOUBLE THE BUFFER SIZE
+      nalloc=2*self.build_nalloc
+      if nalloc<1024:
+        nalloc=1024
+      im_new=<IntervalMap *>realloc(self.build_im,nalloc*sizeof(IntervalMap))
+      if im_new==NULL:
+        raise MemoryError('unable to grow build buffer to IntervalMap[%d]'
+                          % nalloc)
+      self.build_im=im_new
+      self.build_nalloc=nalloc
+    self.build_im[self.nbuild]=im[0]
+    self.build_im[self.nbuild].sublist= -1
+    self.nbuild=self.nbuild+1
+    return 0
 
   cdef int saveInterval(self,IntervalMap im[],int n,int expand_self,FILE *ifile):
     cdef int i
@@ -1389,26 +1974,28 @@ cdef class NLMSASequence:
       raise IOError('write_padded_binary failed???')
     return i
     
-  def __setitem__(self,k,t): # SAVE TO .build FILE
-    'save mapping [k.start:k.stop] --> (id,start,stop)'
+  cdef int saveIntervalMap(self,IntervalMap *im) except -1:
+    'save one interval to our .build file or in-memory build buffer'
     cdef int i
-    cdef IntervalMap im_tmp
+    if self.build_ifile==NULL and self.nlmsaLetters.do_build \
+           and not self.nlmsaLetters.in_memory_mode: # ALREADY BUILT: APPENDING
+      self.openDeltaBuildFile()
     if self.build_ifile: # SAVE TO BUILD FILE
-      im_tmp.start,im_tmp.end=(k.start,k.stop)
-      im_tmp.target_id,im_tmp.target_start,im_tmp.target_end=t
-      im_tmp.sublist= -1
-      i=self.saveInterval(&im_tmp,1,self.is_lpo,self.build_ifile)
-  ##     print 'saveInterval:',self.id,im_tmp.start,im_tmp.end,im_tmp.target_id,\
-  ##           im_tmp.target_start,im_tmp.target_end
+      im.sublist= -1
+      i=self.saveInterval(im,1,self.is_lpo,self.build_ifile)
       self.nbuild=self.nbuild+i # INCREMENT COUNTER OF INTERVALS SAVED
-    elif self.nlmsaLetters.in_memory_mode:
-      t=(k.start,k.stop)+t
-      try:
-        self.buildList.append(t)
-      except AttributeError:
-        self.buildList=[t]
+    elif self.nlmsaLetters.in_memory_mode: # NO TUPLE LIST, JUST A C BUFFER
+      self.appendInMemory(im)
     else:
       raise ValueError('not opened in write mode')
+    return 0
+
+  def __setitem__(self,k,t): # SAVE TO .build FILE
+    'save mapping [k.start:k.stop] --> (id,start,stop)'
+    cdef IntervalMap im_tmp
+    im_tmp.start,im_tmp.end=(k.start,k.stop)
+    im_tmp.target_id,im_tmp.target_start,im_tmp.target_end=t
+    self.saveIntervalMap(&im_tmp)
 
   def __getitem__(self,k):
     try:
@@ -1417,6 +2004,30 @@ cdef class NLMSASequence:
     except AttributeError: pass
     raise KeyError('key must be a sequence interval of this sequence')
 
+  def walk(self,seq=None,windowSize=None,chunkSize=4096):
+    '''generate the whole alignment of seq, or of our own sequence if
+    seq is None, in order, see NLMSA.walk()'''
+    if seq is None:
+      if self.is_lpo or self.is_union:
+        raise ValueError('walk() of an LPO or union needs a seq argument')
+      seq=self.seq
+    return self.nlmsaLetters.walk(seq,windowSize,chunkSize)
+
+  def scan_arrays(self,start=0,end=None,int chunkSize=4096):
+    '''iterate over the intervals of our index overlapping [start:end)
+    in start order, as IntervalFileDB.scan_arrays() does'''
+    if self.idb is not None: # IN-MEMORY INDEX: JUST SORT ITS HITS
+      if end is None:
+        end=C_coord_max
+      l=self.idb.find_overlap_list(start,end)
+      if len(l)==0:
+        return iter(())
+      l.sort() # ORDER BY start
+      return iter([zip(*l)]) # ONE CHUNK OF COLUMNS
+    if self.db is None:
+      self.forceLoad()
+    return self.db.scan_arrays(start,end,chunkSize)
+
   def __len__(self):
     'call len(self.seq) if we have a seq.  Otherwise self.length'
     if self.seq is None:
@@ -1456,19 +2067,23 @@ cdef class NLMSA:
                trypath=None,bidirectional=True,pairwiseMode= -1,
                bidirectionalRule=nlmsa_utils.prune_self_mappings,
                use_virtual_lpo=None,maxLPOcoord=None,
-               inverseDB=None, alignedIvals=None, **kwargs):
-    try:
-      import resource # WE MAY NEED TO OPEN A LOT OF FILES...
-      resource.setrlimit(resource.RLIMIT_NOFILE,(maxOpenFiles,-1))
-    except: # BUT THIS IS OPTIONAL...
-      pass
+               inverseDB=None, alignedIvals=None, useMmap=False, nprocs=1,
+               sliceCacheSize=0,**kwargs):
+    set_max_open_files(open_file_budget(maxOpenFiles))
+    self.setSliceCacheSize(sliceCacheSize)
     self.lpoList=[] # EMPTY LIST OF LPO
-    self.seqs=nlmsa_utils.NLMSASeqDict(self,pathstem,mode,**kwargs)
+    if mode=='r' or mode=='a': # MAY BE PACKED IN A SINGLE FILE
+      self.packFile=nlmsa_utils.open_pack_file(pathstem)
+      if self.packFile is not None and mode=='a':
+        raise ValueError('''cannot append to a packed NLMSA: unpack it with
+packfile_to_binaries() first''')
+    self.seqs=nlmsa_utils.NLMSASeqDict(self,pathstem,mode,
+                                       packFile=self.packFile,**kwargs)
     self.seqlist=self.seqs.seqlist
     self.pathstem=pathstem
     self.inverseDB = inverseDB
     if maxlen is None:
-      maxlen=C_int_max-65536 # C_int_max MAXIMUM VALUE REPRESENTABLE BY int
+      maxlen=C_coord_max-65536 # C_coord_max MAXIMUM COORDINATE VALUE
       if axtFiles is not None:
         maxlen = maxlen/2
     self.maxlen=maxlen
@@ -1476,6 +2091,10 @@ cdef class NLMSA:
     self._ignoreShadowAttr={'sourceDB':None,'targetDB':None} # SCHEMA INFO
     self.seqDict=seqDict # SAVE FOR USER TO ACCESS...
     self.in_memory_mode=0
+    if useMmap: # READ IntervalFileDB BLOCKS VIA mmap, NOT fread
+      self.useMmap=1
+    else:
+      self.useMmap=0
     if bidirectional:
       self.is_bidirectional=1
     else:
@@ -1495,20 +2114,23 @@ cdef class NLMSA:
       self.pairwiseMode=0
     else: # DEFAULT: RESTRICT USER TO A SINGLE LPO
       self.maxLPOcoord=self.maxlen
-    if mode=='r': # OPEN FROM DISK FILES
+    if mode=='r' or mode=='a': # OPEN FROM DISK FILES
       if self.seqDict is None:
-        self.seqDict = nlmsa_utils.read_seq_dict(pathstem,trypath)
+        self.seqDict = nlmsa_utils.read_seq_dict(pathstem,trypath,
+                                                 self.packFile)
       self.read_indexes(self.seqDict)
       self.read_attrs()
+      if mode=='a': # ADD MORE ALIGNMENT TO IT, THEN build() AGAIN
+        self.init_append_mode()
     elif mode=='w': # WRITE TO DISK FILES
       self.do_build=1
       self.lpo_id=0
       if mafFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
-        self.readMAFfiles(mafFiles,maxint)
+        self.readMAFfiles(mafFiles,maxint,nprocs)
       elif axtFiles is not None:
         self.newSequence() # CREATE INITIAL LPO
-        self.readAxtNet(axtFiles,bidirectionalRule)
+        self.readAxtNet(axtFiles,bidirectionalRule,nprocs)
       else: # USER WILL ADD INTERVAL MAPPINGS HIMSELF...
         if self.seqDict is None:
           import seqdb
@@ -1517,7 +2139,7 @@ cdef class NLMSA:
         self.newSequence(is_union=1) # SO HE NEEDS AN INITIAL UNION
       if alignedIvals is not None:
         self.add_aligned_intervals(alignedIvals, **kwargs)
-        self.build()
+        self.build(nprocs=nprocs)
     elif mode=='memory': # CONSTRUCT IN-MEMORY
       if self.seqDict is None:
         import seqdb
@@ -1536,7 +2158,9 @@ cdef class NLMSA:
   def close(self):
     'close our shelve index files'
     cdef NLMSASequence ns
-    for ns in self.seqlist: # tell each seq to close its index files
+    if self.sliceCache is not None:
+      self.sliceCache.clear()
+    for ns in self.seqlist.loaded(): # tell each seq to close its index files
       ns.close()
     self.seqs.close()
 
@@ -1552,41 +2176,54 @@ cdef class NLMSA:
     self.__init__(**state) #JUST PASS KWARGS TO CONSTRUCTOR
 
   def read_indexes(self,seqDict):
-    'open all nestedlist indexes in this LPO database for immediate use'
+    '''read the table of nestedlist indexes in this LPO database.  Each
+    NLMSASequence is only created when first used, by loadSequence(),
+    except the LPOs, whose offsets depend on their order'''
+    self.seqTable=nlmsa_utils.read_seq_table(self.pathstem,self.packFile)
+    self.seqlist.extend([None]*len(self.seqTable)) # CREATED ON DEMAND
+    lpo=chr(nlmsa_utils.NLMSASeqTable.LPO)
+    id=self.seqTable.kinds.find(lpo)
+    while id>=0: # AN LPO REFERENCE
+      self.lpo_id=id
+      self.loadSequence(id)
+      id=self.seqTable.kinds.find(lpo,id+1)
+  def loadSequence(self,int id):
+    '''create the NLMSASequence with this id described by our seqTable,
+    the first time it is used'''
     cdef NLMSASequence ns
-    try:
-      ifile=file(self.pathstem+'.NLMSAindex', 'rU') # text file
-    except IOError:
-      ifile=file(self.pathstem+'NLMSAindex', 'rU') # FOR BACKWARDS COMPATIBILITY
-    try:
-      for line in ifile:
-        id,name,is_union,length=line.strip().split('\t')
-        id=int(id)
-        is_union=int(is_union)
-        if id!=len(self.seqlist):
-          raise IOError('corrupted NLMSAIndex???')
-        filestem=self.pathstem+str(id)
-        seq=None # DEFAULT: NO ACTUAL SEQUENCE ASSOCIATED WITH LPO OR UNION
-        if name=='NLMSA_LPO_Internal': # AN LPO REFERENCE
-          self.lpo_id=id
-        elif not is_union: # REGULAR SEQUENCE
-          try:
-            seq=seqDict[name]
-          except KeyError:
-            raise KeyError('unable to find sequence %s in seqDict!' % name)
-        # CREATE THE SEQ INTERFACE, BUT DELAY OPENING THE IntervalDBFile
-        ns=NLMSASequence(self,filestem,seq,'onDemand',is_union) # UNTIL NEEDED
-        ns.length=int(length) # SAVE STORED LENGTH
-        self.addToSeqlist(ns,seq)
-    finally:
-      ifile.close()
+    T=nlmsa_utils.NLMSASeqTable
+    kind=self.seqTable.kind(id)
+    seq=None # DEFAULT: NO ACTUAL SEQUENCE ASSOCIATED WITH LPO OR UNION
+    is_union=0
+    if kind==T.UNION:
+      is_union=1
+    elif kind==T.REGULAR: # REGULAR SEQUENCE
+      name=self.seqTable.names[id]
+      try:
+        seq=self.seqDict[name]
+      except KeyError:
+        raise KeyError('unable to find sequence %s in seqDict!' % name)
+    # CREATE THE SEQ INTERFACE, BUT DELAY OPENING THE IntervalDBFile
+    ns=NLMSASequence(self,self.pathstem+str(id),seq,'onDemand',is_union) # UNTIL NEEDED
+    ns.length=self.seqTable.lengths[id] # SAVE STORED LENGTH
+    ns.id=id
+    if list.__getitem__(self.seqlist,id) is None: # NOT CREATED BY ANOTHER THREAD
+      list.__setitem__(self.seqlist,id,ns)
+      if seq is not None:
+        dict.__setitem__(self.seqs,seq.pathForward,(id,ns,0))
+    return list.__getitem__(self.seqlist,id)
   def read_attrs(self):
     'read pickled attribute dictionary from file and apply to self'
     import pickle
-    try:
-      ifile = file(self.pathstem+'.attrDict', 'rb') # pickle is binary file!
-    except IOError: # BACKWARDS COMPATIBILITY: OLD NLMSA HAS NOT ATTRDICT
-      return
+    if self.packFile is not None:
+      if self.pathstem+'.attrDict' not in self.packFile:
+        return
+      ifile = self.packFile.open(self.pathstem+'.attrDict')
+    else:
+      try:
+        ifile = file(self.pathstem+'.attrDict', 'rb') # pickle is binary file!
+      except IOError: # BACKWARDS COMPATIBILITY: OLD NLMSA HAS NOT ATTRDICT
+        return
     try:
       d = pickle.load(ifile)
       for k,v in d.items():
@@ -1636,6 +2273,22 @@ cdef class NLMSA:
       ns=self.newSequence() # CREATE AN LPO
       ns.offset=offset # FORCE OUR DESIRED OFFSET... EVEN THOUGH ALL LPOs EMPTY
       offset=offset+self.maxlen
+  def init_append_mode(self):
+    '''prepare to save new alignment intervals to an NLMSA already built
+    on disk.  They go to a small delta index per NLMSASequence, which
+    queries search along with its main index until compact() merges them'''
+    cdef NLMSASequence ns
+    for k in self.seqs.IDdict: # DON'T REUSE THE nlmsa_id OF ANY SEQUENCE
+      if int(k)>=self.inlmsa:
+        self.inlmsa=int(k)+1
+    for ns in self.seqlist: # ADD NEW SEQUENCES TO THE LAST UNION
+      if ns.is_union:
+        self.currentUnion=ns
+    if self.currentUnion is None:
+      self.newSequence(is_union=1)
+    self.do_build=1
+    self.is_append=1
+
   def init_pairwise_mode(self,verbose=False):
     'turn on use of virtual LPO mapping (i.e. no actual LPO is present!)'
     if self.pairwiseMode==0:
@@ -1666,10 +2319,27 @@ See the NLMSA documentation for more details.\n''')
       if self.do_build:
         return nlmsa_utils.BuildMSASlice(ns,k.start,k.stop,id,offset,0,k)
       else: # QUERY THE ALIGNMENT
+        cache=self.sliceCache
+        if cache is not None: # TRY TO REUSE AN EARLIER QUERY'S RESULT
+          found,parent=cache.find(id,k.start,k.stop)
+          if found:
+            if parent is None: # KNOWN TO BE UNALIGNED
+              return nlmsa_utils.EmptySlice(k)
+            elif parent.seq is k: # THE VERY SAME QUERY
+              return parent
+            try: # CLIP THE SAME OR AN ENCLOSING SLICE
+              return NLMSASlice(ns,k.start,k.stop,id,offset,k,parent=parent)
+            except nlmsa_utils.EmptySliceError:
+              return nlmsa_utils.EmptySlice(k)
         try:
-          return NLMSASlice(ns,k.start,k.stop,id,offset,k)
+          s=NLMSASlice(ns,k.start,k.stop,id,offset,k)
         except nlmsa_utils.EmptySliceError:
+          s=None
+        if cache is not None:
+          cache.save(id,k.start,k.stop,s)
+        if s is None:
           return nlmsa_utils.EmptySlice(k)
+        return s
     try: # TREAT k AS A PYTHON SLICE OBJECT
       i=k.start
     except AttributeError:
@@ -1683,6 +2353,357 @@ See the NLMSA documentation for more details.\n''')
       for ns,myslice in l: # ONLY RETURN ONE SLICE OBJECT
           return NLMSASlice(ns,myslice.start,myslice.stop)
 
+  def setSliceCacheSize(self,maxSize):
+    '''keep the results of the last maxSize sequence interval queries,
+    so that repeating a query, or querying part of an earlier query,
+    can skip the index lookups.  maxSize=0 turns this cache off.'''
+    if maxSize<=0:
+      self.sliceCache=None
+    elif self.sliceCache is None:
+      self.sliceCache=nlmsa_utils.SliceCache(maxSize)
+    else:
+      self.sliceCache.resize(maxSize)
+
+  def getSliceCacheStats(self):
+    '''return dict of slice cache statistics: hits (same interval),
+    clipHits (enclosing interval) and misses, plus nslice and maxSize'''
+    if self.sliceCache is None:
+      return dict(hits=0,clipHits=0,misses=0,nslice=0,maxSize=0)
+    return self.sliceCache.stats()
+
+  def iterSlices(self,ival,windowSize=100000):
+    '''generate (window,slice) for each successive windowSize-long piece
+    of ival that is aligned, so that a whole chromosome can be scanned
+    holding only one window's alignment in memory'''
+    return nlmsa_utils.iter_slices(self,ival,windowSize)
+
+  def iterAlignedIntervals(self,ival,windowSize=100000):
+    '''generate (ival1,ival2) aligned interval pairs for ival, reading its
+    alignment window by window as iterSlices() does.  Intervals that
+    cross window boundaries are generated unsplit.'''
+    return nlmsa_utils.iter_aligned_intervals(self,ival,windowSize)
+
+  def walk(self,ival,windowSize=None,chunkSize=4096):
+    '''generate (ival1,ival2) for every interval ival2 aligned to ival
+    (typically a whole chromosome), in order of ival1.start.  Unlike
+    iterAlignedIntervals(), this reads each index involved front to back
+    just once, instead of searching it again for each window.  If
+    windowSize is given, generate (window,pairs) instead for each
+    successive windowSize-long piece of ival that is aligned, where pairs
+    is the list of (ival1,ival2) with ival1.start in that window.'''
+    if self.do_build:
+      raise ValueError('you must build the NLMSA before querying it')
+    return nlmsa_utils.walk_alignment(self,ival,windowSize,chunkSize)
+
+  def joinAnnotations(self,annotations,batchSize=10000):
+    '''generate (annotID,ival2) for each interval ival2 aligned to an
+    annotation in annotations (e.g. an AnnotationDB), querying the
+    annotations in sorted batches via query_batch(), instead of one
+    nlmsa[annotation] query each'''
+    return nlmsa_utils.iter_annotation_join(self,annotations,batchSize)
+
+  def query_batch(self,ivals):
+    '''find the alignment of a whole list of sequence intervals in one call,
+    without constructing an NLMSASlice per query.  Returns flat arrays
+    (iquery,start,stop,target_id,target_start,target_stop), ordered by
+    iquery: [start:stop] of ivals[iquery] is aligned to
+    [target_start:target_stop] of the sequence whose nlmsa_id is target_id
+    (see seqInterval()).'''
+    cdef BatchHits hits
+    memset(&hits,0,sizeof(BatchHits))
+    try:
+      self.find_batch_hits(ivals,&hits)
+      return batch_hits_arrays(&hits,len(ivals))
+    finally:
+      free_batch_hits(&hits)
+
+  cdef int find_batch_hits(self,ivals,BatchHits *hits) except -1:
+    '''save to hits the alignment of each of the sequence intervals ivals,
+    tagged by its index in ivals, as query_batch() returns it'''
+    cdef int i,j,m,n,nquery,nbuf,lpo_id
+    cdef IntervalCoord start_max,end_min,istart,istop,start2,stop2,offset
+    cdef IntervalCoord *starts,*ends,*qstart,*qstop
+    cdef int *qmap,*qid
+    cdef char *done
+    cdef IntervalMap *im
+    cdef IntervalMap im1
+    cdef BatchHits ns_hits,lpo_hits
+    cdef NLMSASequence ns,ns_lpo
+    if self.do_build:
+      raise ValueError('you must build the NLMSA before querying it')
+    nquery=len(ivals)
+    memset(&ns_hits,0,sizeof(BatchHits))
+    memset(&lpo_hits,0,sizeof(BatchHits))
+    nbuf=nquery+1
+    starts=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+    ends=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+    qmap=<int *>malloc(sizeof(int)*nbuf)
+    qstart=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+    qstop=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+    qid=<int *>malloc(sizeof(int)*nbuf)
+    done=NULL
+    try:
+      if starts==NULL or ends==NULL or qmap==NULL or qstart==NULL \
+             or qstop==NULL or qid==NULL:
+        raise MemoryError('out of memory')
+      groups={} # GROUP QUERIES BY THEIR NLMSASequence
+      i=0
+      for ival in ivals:
+        id,ns,offset=self.seqs[ival] # GET UNION INFO FOR THIS SEQ
+        qid[i]=id
+        qstart[i]=ival.start
+        qstop[i]=ival.stop
+        if ival.start<0: # NEED TO TRANSLATE OFFSETS TO MINUS ORIENTATION
+          offset= -offset
+        try:
+          groups[ns.id][1].append((i,offset))
+        except KeyError:
+          groups[ns.id]=(ns,[(i,offset)])
+        i=i+1
+
+      for ns,l in groups.values(): ################### SEQ --> LPO JOIN
+        if self.pairwiseMode==1: # TRANSLATE SEQ DIRECTLY TO LPO
+          for i,offset in l:
+            im1.start=qstart[i]
+            im1.end=qstop[i]
+            im1.target_id=ns.id-1
+            im1.target_start=qstart[i]+offset
+            im1.target_end=qstop[i]+offset
+            batch_hits_append(&lpo_hits,&im1,1,i)
+          continue
+        m=0
+        for i,offset in l:
+          qmap[m]=i
+          starts[m]=qstart[i]+offset
+          ends[m]=qstop[i]+offset
+          m=m+1
+        ns_hits.n=0 # REUSE ITS STORAGE
+        ns_find_batch(ns,m,starts,ends,&ns_hits)
+        for j from 0 <= j < ns_hits.n: # CLIP INTERVALS TO FIT [start:stop]
+          i=qmap[ns_hits.iquery[j]]
+          im=ns_hits.im+j
+          offset=starts[ns_hits.iquery[j]]-qstart[i]
+          im.start=im.start-offset # XLATE TO SRC SEQ COORDS
+          im.end=im.end-offset
+          if qstop[i]<im.end: # TRUNCATE TO FIT WITHIN [start:stop]
+            im.target_end=im.target_end+qstop[i]-im.end
+            im.end=qstop[i]
+          if qstart[i]>im.start: # CALCULATE NEW STARTPOINT
+            im.target_start=im.target_start+qstart[i]-im.start
+            im.start=qstart[i]
+          batch_hits_append(&lpo_hits,im,1,i)
+
+      if lpo_hits.n>=nbuf: ######################### LPO --> SEQ JOIN
+        free(starts)
+        free(ends)
+        free(qmap)
+        nbuf=lpo_hits.n+1
+        starts=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+        ends=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nbuf)
+        qmap=<int *>malloc(sizeof(int)*nbuf)
+        if starts==NULL or ends==NULL or qmap==NULL:
+          raise MemoryError('out of memory')
+      done=<char *>calloc(lpo_hits.n+1,sizeof(char))
+      if done==NULL:
+        raise MemoryError('out of memory')
+      for n from 0 <= n < lpo_hits.n: # ONE BATCH PER TARGET LPO
+        if done[n]:
+          continue
+        lpo_id=lpo_hits.im[n].target_id
+        ns_lpo=self.seqlist[lpo_id]
+        if not ns_lpo.is_lpo:
+          raise ValueError('sequence mapped to non-LPO target??')
+        m=0
+        for j from n <= j < lpo_hits.n:
+          if not done[j] and lpo_hits.im[j].target_id==lpo_id:
+            qmap[m]=j
+            starts[m]=lpo_hits.im[j].target_start
+            ends[m]=lpo_hits.im[j].target_end
+            done[j]=1
+            m=m+1
+        ns_hits.n=0 # REUSE ITS STORAGE
+        ns_find_batch(ns_lpo,m,starts,ends,&ns_hits)
+        for j from 0 <= j < ns_hits.n: # MAP EACH INTERVAL BACK TO ITS QUERY
+          im=lpo_hits.im+qmap[ns_hits.iquery[j]]
+          i=lpo_hits.iquery[qmap[ns_hits.iquery[j]]]
+          if im.target_start>ns_hits.im[j].start: # GET INTERSECTION INTERVAL
+            start_max=im.target_start
+          else:
+            start_max=ns_hits.im[j].start
+          if im.target_end<ns_hits.im[j].end:
+            end_min=im.target_end
+          else:
+            end_min=ns_hits.im[j].end
+          istart=im.start+start_max-im.target_start # SRC COORDS
+          istop=im.start+end_min-im.target_start
+          start2=ns_hits.im[j].target_start+start_max-ns_hits.im[j].start
+          stop2=ns_hits.im[j].target_start+end_min-ns_hits.im[j].start
+          if ns_hits.im[j].target_id!=qid[i] or istart!=start2: # NOT SELF
+            im1.start=istart
+            im1.end=istop
+            im1.target_id=ns_hits.im[j].target_id
+            im1.target_start=start2
+            im1.target_end=stop2
+            batch_hits_append(hits,&im1,1,i) # SAVE IT!
+    finally:
+      free(starts)
+      free(ends)
+      free(qmap)
+      free(qstart)
+      free(qstop)
+      free(qid)
+      free(done)
+      free_batch_hits(&ns_hits)
+      free_batch_hits(&lpo_hits)
+    return 0
+
+  cdef int find_coverage_runs(self,ival,groups,CoverageRuns *runs) except -1:
+    '''append to runs the runs of constant alignment depth tiling ival,
+    for each group of aligned sequences of groups (a CoverageGroups)'''
+    cdef int i
+    cdef int *igroup
+    cdef BatchHits hits
+    memset(&hits,0,sizeof(BatchHits))
+    igroup=NULL
+    try:
+      self.find_batch_hits((ival,),&hits)
+      igroup=<int *>malloc(sizeof(int)*(hits.n+1))
+      if igroup==NULL:
+        raise MemoryError('out of memory')
+      for i from 0 <= i < hits.n: # GROUP INDEX OF EACH ALIGNED SEQUENCE
+        igroup[i]=groups[hits.im[i].target_id]
+      if coverage_runs(hits.im,igroup,hits.n,len(groups.keys),
+                       ival.start,ival.stop,runs)<0:
+        raise MemoryError('out of memory')
+    finally:
+      free(igroup)
+      free_batch_hits(&hits)
+    return 0
+
+  def coverage(self,ival,by=None):
+    '''return the alignment depth of ival as a list of runs
+    (start,stop,depth) tiling [ival.start:ival.stop], where depth is the
+    number of aligned intervals covering [start:stop].  by='species'
+    instead returns a dict of such lists, one per sequence database
+    prefix of the seqDict; by='seq' one per aligned sequence ID; and a
+    function f one per f(seqID).  Computed in C from the query_batch()
+    hits, without constructing an NLMSASlice.'''
+    cdef int i
+    cdef CoverageRuns runs
+    groups=nlmsa_utils.CoverageGroups(self,by)
+    memset(&runs,0,sizeof(CoverageRuns))
+    try:
+      self.find_coverage_runs(ival,groups,&runs)
+      l=[]
+      for i from 0 <= i < len(groups.keys):
+        l.append([])
+      for i from 0 <= i < runs.n:
+        l[runs.run[i].group].append((runs.run[i].start,runs.run[i].end,
+                                     runs.run[i].depth))
+    finally:
+      free_coverage_runs(&runs)
+    return groups.results(l)
+
+  def coverageHistogram(self,ival,by=None):
+    '''return a dict {depth:number of positions of ival aligned at that
+    depth}, or with the by option of coverage(), a dict of them'''
+    cdef int i
+    cdef CoverageRuns runs
+    groups=nlmsa_utils.CoverageGroups(self,by)
+    memset(&runs,0,sizeof(CoverageRuns))
+    try:
+      self.find_coverage_runs(ival,groups,&runs)
+      l=[]
+      for i from 0 <= i < len(groups.keys):
+        l.append({})
+      for i from 0 <= i < runs.n:
+        d=l[runs.run[i].group]
+        d[runs.run[i].depth]=d.get(runs.run[i].depth,0) \
+                              +runs.run[i].end-runs.run[i].start
+    finally:
+      free_coverage_runs(&runs)
+    return groups.results(l)
+
+  def coverageTrack(self,ival,binSize,by=None,windowSize=100000):
+    '''return the binned alignment coverage of ival, in one sweep, as
+    arrays (start,covered,depth): the start of each binSize-long bin of
+    ival, its number of aligned positions, and its mean alignment depth.
+    ival is queried windowSize at a time (rounded up to whole bins), so
+    only one window's alignment is held in memory.  With the by option of
+    coverage(), returns a dict of (start,covered,depth) per group.'''
+    cdef int i,g,ibin,nbin,nwbin,ngroup
+    cdef IntervalCoord c_binSize,wlen,wstart,length,pos,end,binEnd
+    cdef IntervalCoord *binStarts,*covered
+    cdef double *depth
+    cdef CoverageRuns runs
+    if binSize<=0 or windowSize<=0:
+      raise ValueError('binSize and windowSize must be positive')
+    groups=nlmsa_utils.CoverageGroups(self,by)
+    c_binSize=binSize
+    nwbin=(windowSize+binSize-1)/binSize # WHOLE BINS PER WINDOW
+    wlen=nwbin*c_binSize
+    length=len(ival)
+    memset(&runs,0,sizeof(CoverageRuns))
+    binStarts=<IntervalCoord *>malloc(sizeof(IntervalCoord)*nwbin)
+    covered=NULL
+    depth=NULL
+    starts=coord_array(NULL,0)
+    tracks=[] # (covered,depth) ARRAYS OF EACH GROUP
+    try:
+      if binStarts==NULL:
+        raise MemoryError('out of memory')
+      wstart=0
+      while wstart<length:
+        window=ival[wstart:min(wstart+wlen,length)]
+        nbin=(len(window)+c_binSize-1)/c_binSize
+        runs.n=0 # REUSE ITS STORAGE
+        self.find_coverage_runs(window,groups,&runs)
+        ngroup=len(groups.keys)
+        free(covered)
+        free(depth)
+        covered=<IntervalCoord *>calloc(ngroup*nwbin+1,sizeof(IntervalCoord))
+        depth=<double *>calloc(ngroup*nwbin+1,sizeof(double))
+        if covered==NULL or depth==NULL:
+          raise MemoryError('out of memory')
+        for i from 0 <= i < runs.n: # ADD EACH ALIGNED RUN TO ITS BINS
+          if runs.run[i].depth==0:
+            continue
+          g=runs.run[i].group*nwbin
+          pos=runs.run[i].start-window.start
+          end=runs.run[i].end-window.start
+          while pos<end:
+            ibin=pos/c_binSize
+            binEnd=(ibin+1)*c_binSize
+            if binEnd>end:
+              binEnd=end
+            covered[g+ibin]=covered[g+ibin]+binEnd-pos
+            depth[g+ibin]=depth[g+ibin]+(binEnd-pos)*runs.run[i].depth
+            pos=binEnd
+        for ibin from 0 <= ibin < nbin: # CONVERT DEPTH SUMS TO MEANS
+          binStarts[ibin]=window.start+ibin*c_binSize
+          binEnd=(ibin+1)*c_binSize
+          if binEnd>len(window):
+            binEnd=len(window)
+          for g from 0 <= g < ngroup:
+            depth[g*nwbin+ibin]=depth[g*nwbin+ibin]/(binEnd-ibin*c_binSize)
+        for g from len(tracks) <= g < ngroup: # NEW GROUP: NO COVERAGE BEFORE
+          tracks.append((array.array(starts.typecode,[0])*len(starts),
+                         array.array('d',[0.])*len(starts)))
+        starts.extend(coord_array(binStarts,nbin))
+        for g from 0 <= g < ngroup:
+          tracks[g][0].extend(coord_array(covered+g*nwbin,nbin))
+          tracks[g][1].extend(double_array(depth+g*nwbin,nbin))
+        wstart=wstart+wlen
+    finally:
+      free(binStarts)
+      free(covered)
+      free(depth)
+      free_coverage_runs(&runs)
+    l=[]
+    for t in tracks:
+      l.append((array.array(starts.typecode,starts),t[0],t[1]))
+    return groups.results(l)
+
   def __iadd__(self,seq):
     'add seq to our union'
     self.seqs.saveSeq(seq)
@@ -1696,6 +2717,100 @@ See the NLMSA documentation for more details.\n''')
     'add ID/coords in alignedIvals to this alignment'
     nlmsa_utils.add_aligned_intervals(self, alignedIvals, *args, **kwargs)
 
+  cdef object aligned_seq_info(self,seqDB,seqID,cache):
+    '''(nlmsaID,virtual LPO,union offset,length) for seqDB[seqID],
+    adding it to our union the first time we see it'''
+    try:
+      return cache[seqID]
+    except KeyError:
+      pass
+    seq=seqDB[seqID]
+    self.seqs.saveSeq(seq) # NO-OP IF ALREADY IN OUR UNION
+    id,ns,offset=self.seqs[seq]
+    t=(id,self.seqlist[ns.id-1],offset,len(seq))
+    cache[seqID]=t
+    return t
+
+  def add_aligned_arrays(self,srcIDs,srcStarts,srcStops,destIDs,destStarts,
+                         destStops,srcOris=None,destOris=None,srcDB=None,
+                         destDB=None):
+    '''bulk form of add_aligned_intervals() for a pairwise alignment:
+    save the alignment of srcDB[srcIDs[i]][srcStarts[i]:srcStops[i]] to
+    destDB[destIDs[i]][destStarts[i]:destStops[i]] for every i.  The
+    optional srcOris, destOris give -1 for intervals on the minus strand.
+    Each distinct sequence ID is looked up only once, and the intervals
+    go straight to the build buffers.  Returns the number of pairs saved.'''
+    cdef int i,n,src_id,dest_id
+    cdef IntervalCoord start,stop,src_start,src_stop,dest_start,dest_stop
+    cdef IntervalCoord src_offset,dest_offset,length
+    cdef IntervalMap im_tmp
+    cdef NLMSASequence ns_src,ns_dest
+    if self.do_build==0:
+      raise ValueError('not opened in write mode')
+    n=len(srcIDs)
+    for a in (srcStarts,srcStops,destIDs,destStarts,destStops,
+              srcOris,destOris):
+      if a is not None and len(a)!=n:
+        raise ValueError('all arrays must have the same length')
+    if srcDB is None: # GET ALL SEQS FROM THE EXISTING seqDict
+      srcDB=self.seqDict
+    if destDB is None: # USE SAME INPUT SET AS SOURCE
+      destDB=srcDB
+    srcCache={}
+    if destDB is srcDB:
+      destCache=srcCache
+    else:
+      destCache={}
+    if n>0:
+      self.init_pairwise_mode()
+    for i from 0 <= i < n:
+      src_id,ns_src,src_offset,length= \
+          self.aligned_seq_info(srcDB,srcIDs[i],srcCache)
+      start=srcStarts[i]
+      stop=srcStops[i]
+      if start<0 or stop>length or start>=stop:
+        raise IndexError('bad interval %s[%d:%d]' % (srcIDs[i],start,stop))
+      if srcOris is not None and srcOris[i]<0: # MINUS STRAND
+        src_start= -stop
+        src_stop= -start
+      else:
+        src_start=start
+        src_stop=stop
+      dest_id,ns_dest,dest_offset,length= \
+          self.aligned_seq_info(destDB,destIDs[i],destCache)
+      start=destStarts[i]
+      stop=destStops[i]
+      if start<0 or stop>length or start>=stop:
+        raise IndexError('bad interval %s[%d:%d]' % (destIDs[i],start,stop))
+      if destOris is not None and destOris[i]<0: # MINUS STRAND
+        dest_start= -stop
+        dest_stop= -start
+      else:
+        dest_start=start
+        dest_stop=stop
+      if src_start<0: # SRC UNION COORDS --> DEST
+        im_tmp.start=src_start-src_offset
+        im_tmp.end=src_stop-src_offset
+      else:
+        im_tmp.start=src_start+src_offset
+        im_tmp.end=src_stop+src_offset
+      im_tmp.target_id=dest_id
+      im_tmp.target_start=dest_start
+      im_tmp.target_end=dest_stop
+      ns_src.saveIntervalMap(&im_tmp)
+      if self.is_bidirectional: # DEST UNION COORDS --> SRC
+        if dest_start<0:
+          im_tmp.start=dest_start-dest_offset
+          im_tmp.end=dest_stop-dest_offset
+        else:
+          im_tmp.start=dest_start+dest_offset
+          im_tmp.end=dest_stop+dest_offset
+        im_tmp.target_id=src_id
+        im_tmp.target_start=src_start
+        im_tmp.target_end=src_stop
+        ns_dest.saveIntervalMap(&im_tmp)
+    return n
+
   cdef void free_seqidmap(self,int nseq0,SeqIDMap *seqidmap):
     cdef int i
     for i from 0 <= i <nseq0: # DUMP STRING STORAGE FOR SEQUENCE IDENTIFIERS
@@ -1710,19 +2825,18 @@ See the NLMSA documentation for more details.\n''')
 ##       print 'nbuild[%d]' % i,ns.nbuild
   
 
-  def readMAFfiles(self,mafFiles,maxint):
-    'read alignment from a set of MAF files'
-    cdef int i,j,nseq0,nseq1,n,nseq,block_len
+  def readMAFfiles(self,mafFiles,maxint,nprocs=1):
+    '''read alignment from a set of MAF files.  With nprocs>1 the files
+    are parsed in a pool of processes, then merged in order'''
+    cdef int i,nseq0,n,block_len
     cdef SeqIDMap *seqidmap
     cdef char tmp[32768],*p,a_header[4]
     cdef FILE *ifile
-    cdef IntervalMap im[4096],im_tmp
-    cdef NLMSASequence ns_lpo,ns # ns IS OUR CURRENT UNION
+    cdef IntervalMap im[4096]
     cdef FILE *build_ifile[4096]
     cdef int nbuild[4096],has_continuation
     cdef long long linecode_count[256]
 
-    ns_lpo=self.seqlist[self.lpo_id] # OUR INITIAL LPO
     self.pairwiseMode=0 # WE ARE USING A REAL LPO!
     memset(<void *>linecode_count,0,sizeof(linecode_count))
     has_continuation=0
@@ -1735,14 +2849,21 @@ See the NLMSA documentation for more details.\n''')
       try:
         seqidmap[i].length = seqInfo.length
       except OverflowError:
-        raise OverflowError('''Sequence too long for 32 bit int: %s, %d
+        raise OverflowError('''Sequence too long for %d bit coordinates: %s, %d
 Something is probably wrong with creation / reading of this sequence.
-Check the input!''' % (pythonStr, seqInfo.length))
+Check the input!''' % (8*sizeof(IntervalCoord), pythonStr, seqInfo.length))
       i=i+1
     qsort(seqidmap,nseq0,sizeof(SeqIDMap),seqidmap_qsort_cmp) # SORT BY id
-    ns=None
 
-    im_tmp.sublist= -1 # DEFAULT
+    if nprocs>1 and len(mafFiles)>1: # PARSE THE FILES IN PARALLEL
+      try:
+        self.mergeMAFshards(mafFiles,nprocs,nseq0,seqidmap,build_ifile,
+                            nbuild,maxint,linecode_count)
+      except:
+        self.free_seqidmap(nseq0,seqidmap)
+        self.save_nbuild(nbuild)
+        raise
+      mafFiles=() # ALREADY READ
     strcpy(a_header,"a ") # MAKE C STRING 
     for filename in mafFiles:
       print 'Processing MAF file:',filename
@@ -1758,7 +2879,7 @@ Check the input!''' % (pythonStr, seqInfo.length))
       p=fgets(tmp,32767,ifile) # READ 1ST DATA LINE OF THE MAF FILE
       while p: # GOT ANOTHER LINE TO PROCESS
         if has_continuation or 0==strncmp(tmp,a_header,2): # ALIGNMENT HEADER: READ ALIGNMENT
-          n=readMAFrecord(im,0,seqidmap,nseq0,ns_lpo.length, # READ ONE MAF BLOCK
+          n=readMAFrecord(im,0,seqidmap,nseq0,0, # READ ONE MAF BLOCK
                           &block_len,ifile,4096,linecode_count,&has_continuation)
           if n<0: # UNRECOVERABLE ERROR OCCURRED...
             self.free_seqidmap(nseq0,seqidmap)
@@ -1766,52 +2887,10 @@ Check the input!''' % (pythonStr, seqInfo.length))
             raise ValueError('MAF block too long!  Increase max size')
           elif n==0:
             continue
-
-          if self.maxlen-ns_lpo.length<=block_len \
-                 or ns_lpo.nbuild>maxint: # TOO BIG! MUST CREATE A NEW LPO
-            j=ns_lpo.length # RECORD THE OLD OFFSET
-            ns_lpo=self.newSequence() # CREATE A NEW LPO SEQUENCE
-            for i from 0<= i < n: # TRANSLATE THESE INTERVALS BACK TO ZERO OFFSET
-              if im[i].start>=0: # FORWARD INTERVAL
-                im[i].start = im[i].start - j
-                im[i].end = im[i].end - j
-              else: # REVERSE INTERVAL
-                im[i].start = im[i].start + j
-                im[i].end = im[i].end + j
-
-          for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
-            j=im[i].target_id
-            if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
-              if ns is None or self.maxlen-ns.length<=seqidmap[j].length:
-                ns=self.newSequence(None,is_union=1) # CREATE NEW UNION TO HOLD IT
-                build_ifile[ns.id]=ns.build_ifile # KEEP PTR SO WE CAN WRITE DIRECTLY!
-                nbuild[ns.id]=0
-              seqidmap[j].ns_id=ns.id # SET IDs TO ADD THIS SEQ TO THE UNION
-              seqidmap[j].nlmsa_id=self.inlmsa
-              seqidmap[j].offset=ns.length
-              self.inlmsa=self.inlmsa+1 # ADVANCE SEQUENCE ID COUNTER
-              ns.length=ns.length+seqidmap[j].length # EXPAND UNION SIZE
-              
-            im[i].target_id=seqidmap[j].nlmsa_id # USE THE CORRECT ID
-            if im[i].target_start<0: # OFFSET REVERSE ORI
-              im_tmp.start= -seqidmap[j].offset+im[i].target_start
-              im_tmp.end=   -seqidmap[j].offset+im[i].target_end
-            else: # OFFSET FORWARD ORI
-              im_tmp.start= seqidmap[j].offset+im[i].target_start
-              im_tmp.end=   seqidmap[j].offset+im[i].target_end
-            im_tmp.target_id=ns_lpo.id
-            im_tmp.target_start=im[i].start
-            im_tmp.target_end=im[i].end
-            j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
-            ns_lpo.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE SEQ -> LPO
-            nbuild[j]=nbuild[j]+1
-
-          ns_lpo.saveInterval(im,n,1,ns_lpo.build_ifile) # SAVE LPO -> SEQ
-          ns_lpo.nbuild=ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
+          self.save_maf_block(im,n,block_len,seqidmap,build_ifile,nbuild,maxint)
         if not has_continuation:
           p=fgets(tmp,32767,ifile) # TRY TO READ ANOTHER LINE...
       fclose(ifile) # CLOSE THIS MAF FILE
-##     print 'nbuild[0]',ns_lpo.nbuild
     for i from 0 <= i <256: # PRINT WARNINGS ABOUT NON-ALIGNMENT LINES
       if linecode_count[i]>0:
         print "warning: non-alignment text lines ignored: prefix %s, count %d" \
@@ -1822,7 +2901,119 @@ Check the input!''' % (pythonStr, seqInfo.length))
                           seqidmap[i].nlmsa_id)
     self.free_seqidmap(nseq0,seqidmap)
     self.save_nbuild(nbuild)
-    self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
+    self.build(nprocs=nprocs) # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
+
+  cdef int save_maf_block(self,IntervalMap im[],int n,int block_len,
+                          SeqIDMap seqidmap[],FILE *build_ifile[],
+                          int nbuild[],int maxint) except -1:
+    '''save one MAF block read by readMAFrecord(), whose LPO coordinates
+    start at zero, at the end of our last LPO (or a new LPO, if it is full),
+    adding any new sequences to our current union'''
+    cdef int i,j
+    cdef IntervalCoord lpoOffset
+    cdef IntervalMap im_tmp
+    cdef NLMSASequence ns_lpo,ns # ns IS OUR CURRENT UNION
+    ns_lpo=self.lpoList[-1]
+    if self.maxlen-ns_lpo.length<=block_len \
+           or ns_lpo.nbuild>maxint: # TOO BIG! MUST CREATE A NEW LPO
+      ns_lpo=self.newSequence() # CREATE A NEW LPO SEQUENCE
+    lpoOffset=ns_lpo.length # APPEND THIS BLOCK TO THE LPO
+    for i from 0<= i < n: # TRANSLATE THESE INTERVALS TO LPO COORDS
+      if im[i].start>=0: # FORWARD INTERVAL
+        im[i].start = im[i].start + lpoOffset
+        im[i].end = im[i].end + lpoOffset
+      else: # REVERSE INTERVAL
+        im[i].start = im[i].start - lpoOffset
+        im[i].end = im[i].end - lpoOffset
+
+    ns=self.currentUnion
+    im_tmp.sublist= -1 # DEFAULT
+    for i from 0 <= i < n: # SAVE EACH INTERVAL IN UNION -> LPO MAP
+      j=im[i].target_id
+      if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
+        if ns is None or self.maxlen-ns.length<=seqidmap[j].length:
+          ns=self.newSequence(None,is_union=1) # CREATE NEW UNION TO HOLD IT
+          build_ifile[ns.id]=ns.build_ifile # KEEP PTR SO WE CAN WRITE DIRECTLY!
+          nbuild[ns.id]=0
+        seqidmap[j].ns_id=ns.id # SET IDs TO ADD THIS SEQ TO THE UNION
+        seqidmap[j].nlmsa_id=self.inlmsa
+        seqidmap[j].offset=ns.length
+        self.inlmsa=self.inlmsa+1 # ADVANCE SEQUENCE ID COUNTER
+        ns.length=ns.length+seqidmap[j].length # EXPAND UNION SIZE
+
+      im[i].target_id=seqidmap[j].nlmsa_id # USE THE CORRECT ID
+      if im[i].target_start<0: # OFFSET REVERSE ORI
+        im_tmp.start= -seqidmap[j].offset+im[i].target_start
+        im_tmp.end=   -seqidmap[j].offset+im[i].target_end
+      else: # OFFSET FORWARD ORI
+        im_tmp.start= seqidmap[j].offset+im[i].target_start
+        im_tmp.end=   seqidmap[j].offset+im[i].target_end
+      im_tmp.target_id=ns_lpo.id
+      im_tmp.target_start=im[i].start
+      im_tmp.target_end=im[i].end
+      j=seqidmap[j].ns_id # USE NLMSA ID OF THE UNION
+      ns_lpo.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE SEQ -> LPO
+      nbuild[j]=nbuild[j]+1
+
+    ns_lpo.saveInterval(im,n,1,ns_lpo.build_ifile) # SAVE LPO -> SEQ
+    ns_lpo.nbuild=ns_lpo.nbuild+n # INCREMENT COUNT OF SAVED INTERVALS
+    return 0
+
+  cdef int mergeMAFshards(self,mafFiles,int nprocs,int nseq0,
+                          SeqIDMap seqidmap[],FILE *build_ifile[],
+                          int nbuild[],int maxint,
+                          long long linecode_count[]) except -1:
+    '''parse each MAF file into a shard file by read_maf_shard(), in a pool
+    of nprocs worker processes, then save their blocks in mafFiles order,
+    exactly as if the files were read one by one'''
+    cdef int i,n,block_len
+    cdef FILE *ifile
+    cdef IntervalMap im[4096]
+    try:
+      import multiprocessing
+    except ImportError:
+      raise ValueError('nprocs>1 requires the multiprocessing module (Python 2.6+)')
+    import os
+    seqIDs=[] # SORTED, SO WORKERS GIVE EACH SEQUENCE THE SAME INDEX
+    for i from 0 <= i <nseq0:
+      seqIDs.append(seqidmap[i].id)
+    shards=[]
+    for filename in mafFiles:
+      shards.append('%s.mafshard%d' % (self.pathstem,len(shards)))
+    pool=multiprocessing.Pool(nprocs)
+    try:
+      results=[]
+      for i from 0 <= i <len(shards):
+        print 'Processing MAF file:',mafFiles[i]
+        results.append(pool.apply_async(read_maf_shard,
+                                        (mafFiles[i],seqIDs,shards[i])))
+      for r in results: # WAIT FOR ALL WORKERS, RAISING ANY OF THEIR ERRORS
+        counts=r.get()
+        for i from 0 <= i <256:
+          linecode_count[i]=linecode_count[i]+counts[i]
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+    try:
+      for filename in shards:
+        ifile=fopen(filename,'rb') # binary file
+        if ifile==NULL:
+          raise IOError('unable to open file %s' % filename)
+        try:
+          while fread(&n,sizeof(int),1,ifile)==1: # READ EACH SAVED BLOCK
+            if fread(&block_len,sizeof(int),1,ifile)!=1 or n<0 or n>4096 \
+                   or fread(im,sizeof(IntervalMap),n,ifile)!=n:
+              raise IOError('truncated MAF shard file %s' % filename)
+            self.save_maf_block(im,n,block_len,seqidmap,build_ifile,nbuild,
+                                maxint)
+        finally:
+          fclose(ifile)
+    finally:
+      for filename in shards:
+        if os.access(filename,os.F_OK):
+          os.remove(filename)
+    return 0
 
   cdef NLMSASequence add_seqidmap_to_union(self,int j,SeqIDMap seqidmap[],
                                            NLMSASequence ns,FILE *build_ifile[],
@@ -1843,16 +3034,18 @@ Check the input!''' % (pythonStr, seqInfo.length))
     ns.length = ns.length+seqidmap[j].length # EXPAND UNION SIZE
     return ns
 
-  def readAxtNet(self,axtFiles,bidirectionalRule):
-    'read alignment from a set of axtnet files'
-    cdef int i,j,nseq0,n,isrc,is_bidirectional
+  def readAxtNet(self,axtFiles,bidirectionalRule,nprocs=1):
+    '''read alignment from a set of axtnet files, which may be gzipped.
+    With nprocs>1 the files are parsed in a pool of processes, then
+    merged in order'''
+    cdef int i,nseq0,n,isrc,is_bidirectional
     cdef SeqIDMap *seqidmap
-    cdef char tmp[32768],*p,comment[4],src_prefix[64],dest_prefix[64]
+    cdef char src_prefix[64],dest_prefix[64]
     cdef FILE *ifile
-    cdef IntervalMap im[4096],im_tmp
+    cdef IntervalMap im[4096]
     cdef NLMSASequence ns_src # SOURCE UNION VS DEST UNION
     cdef FILE *build_ifile[4096]
-    cdef int nbuild[4096],has_continuation
+    cdef int nbuild[4096]
 
     self.pairwiseMode = 1 # WE ARE USING pairwiseMode
 
@@ -1866,78 +3059,45 @@ Check the input!''' % (pythonStr, seqInfo.length))
     qsort(seqidmap,nseq0,sizeof(SeqIDMap),seqidmap_qsort_cmp) # SORT BY id
     ns_src = None
 
-    im_tmp.sublist= -1 # DEFAULT
-    strcpy(comment,"#") # MAKE C STRING 
-    import string
-    import os.path
-    for filename in axtFiles:
+    try: # APPLY bidirectionalRule TO EACH (SOURCE,TARGET) PAIR JUST ONCE
+      jobs=nlmsa_utils.axtnet_jobs(axtFiles,bidirectionalRule,
+                                   self.is_bidirectional)
+      if nprocs>1 and len(jobs)>1: # PARSE THE FILES IN PARALLEL
+        ns_src=self.mergeAxtNetShards(jobs,nprocs,nseq0,seqidmap,ns_src,
+                                      build_ifile,nbuild)
+        jobs=() # ALREADY READ
+    except:
+      self.free_seqidmap(nseq0,seqidmap)
+      self.save_nbuild(nbuild)
+      raise
+    for filename,src,dest,is_bidirectional in jobs:
       print 'Processing axtnet file:',filename
+      strcpy(src_prefix,src) # KEEP THEM IN STATIC C STRINGS FOR SPEED
+      strcpy(dest_prefix,dest)
       try:
-        if filename[-8:] == '.net.axt':
-          t = string.split(os.path.basename(filename)[:-8], '.')[-2:]
-        elif filename[-4:] == '.axt':
-          t = string.split(os.path.basename(filename)[:-4], '.')[-2:]
+        stream=nlmsa_utils.AlignmentFileStream(filename)
       except:
-        raise IOError('%s is not correct axtNet file name. Correct name is (chrid.)source.target.net.axt.' % filename)
-      #t = prefix_fun(filename) # CALL PYTHON FUNCTION TO OBTAIN PREFIXES
-      if bidirectionalRule is None: # DETERMINE IF UNI- VS. BI-DIRECTIONAL
-        is_bidirectional = self.is_bidirectional # JUST USE GLOBAL SETTING
-      else: # GET SETTING FROM USER-SUPPLIED FUNCTION
-        is_bidirectional = bidirectionalRule(t[0],t[1],self.is_bidirectional)
-      strcpy(src_prefix,t[0]) # KEEP THEM IN STATIC C STRINGS FOR SPEED
-      strcpy(dest_prefix,t[1])
-      ifile=fopen(filename,'r') # text file
-      if ifile==NULL:
         self.free_seqidmap(nseq0,seqidmap)
         self.save_nbuild(nbuild)
-        raise IOError('unable to open file %s' % filename)
+        raise
+      ifile=PyFile_AsFile(stream.ifile)
       while True:
         n = read_axtnet(im,seqidmap,nseq0,ifile,4096,&isrc,src_prefix,dest_prefix)
         if n<0: # UNRECOVERABLE ERROR OCCURRED...
+          stream.abort()
           self.free_seqidmap(nseq0,seqidmap)
           self.save_nbuild(nbuild)
           raise ValueError('axtNet block too long!  Increase max size')
         elif n==0: # NO MORE DATA TO READ
           break
-
-        if seqidmap[isrc].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
-          ns_src = self.add_seqidmap_to_union(isrc,seqidmap,ns_src,build_ifile,nbuild)
-
-        for i from 0 <= i < n: # SAVE EACH INTERVAL IN SRC -> DEST MAP
-          j=im[i].target_id
-          #print 'A',im[i].start,im[i].end,im[i].target_id,im[i].target_start, im[i].target_end, im_tmp.sublist
-          #print 'B',seqidmap[isrc].nlmsa_id,i,j,seqidmap[j].id,seqidmap[j].ns_id,seqidmap[j].offset,seqidmap[j].nlmsa_id
-          if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
-            ns_src = self.add_seqidmap_to_union(j,seqidmap,ns_src,build_ifile,nbuild)
-          im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
-          if is_bidirectional: # SAVE DEST -> SRC ALIGNMENT MAPPING
-            if im[i].target_start<0: # OFFSET REVERSE ORI
-              im_tmp.start = -seqidmap[j].offset+im[i].target_start
-              im_tmp.end = -seqidmap[j].offset+im[i].target_end
-            else: # OFFSET FORWARD ORI
-              im_tmp.start = seqidmap[j].offset+im[i].target_start
-              im_tmp.end = seqidmap[j].offset+im[i].target_end
-            im_tmp.target_id = seqidmap[isrc].nlmsa_id
-            im_tmp.target_start = im[i].start
-            im_tmp.target_end = im[i].end
-            #print 'C', im_tmp.target_id, im_tmp.target_start, im_tmp.target_end, seqidmap[j].ns_id, j
-            j=seqidmap[j].ns_id-1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
-            ns_src.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE DEST -> SRC
-            nbuild[j]=nbuild[j]+1
-          if im[i].start < 0: # OFFSET FORWARD ORI
-            im[i].start = -seqidmap[isrc].offset + im[i].start
-            im[i].end = -seqidmap[isrc].offset + im[i].end
-          else: # OFFSET FORWARD ORI
-            im[i].start = seqidmap[isrc].offset + im[i].start
-            im[i].end = seqidmap[isrc].offset + im[i].end
-          #print 'D', im_tmp.start, im_tmp.end, im_tmp.target_id, im_tmp.target_start, im_tmp.target_end, im_tmp.sublist
-
-        # SAVE THE RECORD. read_axtnet FUNCTION READS SRC/DEST AT THE SAME TIME
-        j = seqidmap[isrc].ns_id-1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
-        ns_src.saveInterval(im,n,0,build_ifile[j]) # SAVE SRC -> DEST
-        nbuild[j]=nbuild[j]+n # INCREMENT COUNT OF SAVED INTERVALS
-
-      fclose(ifile) # CLOSE THIS AXTNET FILE
+        ns_src=self.save_axtnet_block(im,n,isrc,is_bidirectional,seqidmap,
+                                      ns_src,build_ifile,nbuild)
+      try:
+        stream.close() # CLOSE THIS AXTNET FILE
+      except:
+        self.free_seqidmap(nseq0,seqidmap)
+        self.save_nbuild(nbuild)
+        raise
 
     for i from 0 <= i <nseq0: # INDEX SEQUENCES THAT WERE ALIGNED
       if seqidmap[i].nlmsa_id>0: # ALIGNED, SO RECORD IT
@@ -1945,27 +3105,128 @@ Check the input!''' % (pythonStr, seqInfo.length))
                           seqidmap[i].nlmsa_id)
     self.free_seqidmap(nseq0,seqidmap)
     self.save_nbuild(nbuild)
-    self.build() # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
-
+    self.build(nprocs=nprocs) # WILL TAKE CARE OF CLOSING ALL build_ifile STREAMS
+
+  cdef NLMSASequence save_axtnet_block(self,IntervalMap im[],int n,int isrc,
+                                       int is_bidirectional,
+                                       SeqIDMap seqidmap[],
+                                       NLMSASequence ns_src,
+                                       FILE *build_ifile[],int nbuild[]):
+    '''save one axtNet block read by read_axtnet(), whose target_id are
+    seqidmap indexes, adding any new sequences to the union ns_src.
+    Returns the union to add the next new sequence to'''
+    cdef int i,j
+    cdef IntervalMap im_tmp
+    im_tmp.sublist= -1 # DEFAULT
+    if seqidmap[isrc].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
+      ns_src = self.add_seqidmap_to_union(isrc,seqidmap,ns_src,build_ifile,nbuild)
+
+    for i from 0 <= i < n: # SAVE EACH INTERVAL IN SRC -> DEST MAP
+      j=im[i].target_id
+      if seqidmap[j].nlmsa_id<=0: # NEW SEQUENCE, NEED TO ADD TO UNION
+        ns_src = self.add_seqidmap_to_union(j,seqidmap,ns_src,build_ifile,nbuild)
+      im[i].target_id = seqidmap[j].nlmsa_id # USE THE CORRECT ID
+      if is_bidirectional: # SAVE DEST -> SRC ALIGNMENT MAPPING
+        if im[i].target_start<0: # OFFSET REVERSE ORI
+          im_tmp.start = -seqidmap[j].offset+im[i].target_start
+          im_tmp.end = -seqidmap[j].offset+im[i].target_end
+        else: # OFFSET FORWARD ORI
+          im_tmp.start = seqidmap[j].offset+im[i].target_start
+          im_tmp.end = seqidmap[j].offset+im[i].target_end
+        im_tmp.target_id = seqidmap[isrc].nlmsa_id
+        im_tmp.target_start = im[i].start
+        im_tmp.target_end = im[i].end
+        j=seqidmap[j].ns_id-1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
+        ns_src.saveInterval(&im_tmp,1,0,build_ifile[j]) # SAVE DEST -> SRC
+        nbuild[j]=nbuild[j]+1
+      if im[i].start < 0: # OFFSET FORWARD ORI
+        im[i].start = -seqidmap[isrc].offset + im[i].start
+        im[i].end = -seqidmap[isrc].offset + im[i].end
+      else: # OFFSET FORWARD ORI
+        im[i].start = seqidmap[isrc].offset + im[i].start
+        im[i].end = seqidmap[isrc].offset + im[i].end
+
+    # SAVE THE RECORD. read_axtnet FUNCTION READS SRC/DEST AT THE SAME TIME
+    j = seqidmap[isrc].ns_id-1 # SAVE ALL ALIGNMENTS TO THE VIRTUAL LPO
+    ns_src.saveInterval(im,n,0,build_ifile[j]) # SAVE SRC -> DEST
+    nbuild[j]=nbuild[j]+n # INCREMENT COUNT OF SAVED INTERVALS
+    return ns_src
+
+  cdef NLMSASequence mergeAxtNetShards(self,jobs,int nprocs,int nseq0,
+                                       SeqIDMap seqidmap[],
+                                       NLMSASequence ns_src,
+                                       FILE *build_ifile[],int nbuild[]):
+    '''parse each axtNet file into a shard file by read_axtnet_shard(), in
+    a pool of nprocs worker processes, then save their blocks in jobs
+    order, exactly as if the files were read one by one.  Returns the
+    union to add the next new sequence to'''
+    cdef int i,n,isrc,is_bidirectional
+    cdef FILE *ifile
+    cdef IntervalMap im[4096]
+    try:
+      import multiprocessing
+    except ImportError:
+      raise ValueError('nprocs>1 requires the multiprocessing module (Python 2.6+)')
+    import os
+    seqIDs=[] # SORTED, SO WORKERS GIVE EACH SEQUENCE THE SAME INDEX
+    seqLengths=[]
+    for i from 0 <= i <nseq0:
+      seqIDs.append(seqidmap[i].id)
+      seqLengths.append(seqidmap[i].length)
+    shards=[]
+    for job in jobs:
+      shards.append('%s.axtshard%d' % (self.pathstem,len(shards)))
+    pool=multiprocessing.Pool(nprocs)
+    try:
+      results=[]
+      for i from 0 <= i <len(shards):
+        filename,src,dest,is_bidirectional=jobs[i]
+        print 'Processing axtnet file:',filename
+        results.append(pool.apply_async(read_axtnet_shard,
+                                        (filename,src,dest,seqIDs,
+                                         seqLengths,shards[i])))
+      for r in results: # WAIT FOR ALL WORKERS, RAISING ANY OF THEIR ERRORS
+        r.get()
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+    try:
+      for i from 0 <= i <len(shards):
+        is_bidirectional=jobs[i][3]
+        ifile=fopen(shards[i],'rb') # binary file
+        if ifile==NULL:
+          raise IOError('unable to open file %s' % shards[i])
+        try:
+          while fread(&isrc,sizeof(int),1,ifile)==1: # READ EACH SAVED BLOCK
+            if fread(&n,sizeof(int),1,ifile)!=1 or n<=0 or n>4096 \
+                   or isrc<0 or isrc>=nseq0 \
+                   or fread(im,sizeof(IntervalMap),n,ifile)!=n:
+              raise IOError('truncated axtNet shard file %s' % shards[i])
+            ns_src=self.save_axtnet_block(im,n,isrc,is_bidirectional,
+                                          seqidmap,ns_src,build_ifile,nbuild)
+        finally:
+          fclose(ifile)
+    finally:
+      for filename in shards:
+        if os.access(filename,os.F_OK):
+          os.remove(filename)
+    return ns_src
     
-  def buildFiles(self,saveSeqDict=False,verbose=True,**kwargs):
+  def buildFiles(self,saveSeqDict=False,verbose=True,nprocs=1,**kwargs):
     'build nestedlist databases on-disk, and .seqDict index if desired'
     cdef NLMSASequence ns
     self.seqs.reopenReadOnly() # SAVE INDEXES AND OPEN READ-ONLY
-    ntotal = 0
-    ifile=file(self.pathstem+'.NLMSAindex','w') # text file
-    try:
+    if nprocs>1: # BUILD THE IntervalFileDBs IN A POOL OF PROCESSES
+      ntotal = self.buildFilesParallel(nprocs,**kwargs)
+    else:
+      ntotal = 0
       for ns in self.seqlist: # BUILD EACH IntervalFileDB ONE BY ONE
-        ntotal = ntotal + ns.buildFiles(**kwargs)
-        if ns.is_lpo:
-          ifile.write('%d\t%s\t%d\t%d\n' %(ns.id,'NLMSA_LPO_Internal',0,ns.length))
-        elif ns.is_union:
-          ifile.write('%d\t%s\t%d\t%d\n' %(ns.id,'NLMSA_UNION_Internal',1,ns.length))
-        else:
-          ifile.write('%d\t%s\t%d\t%d\n' %(ns.id,ns.name,0,ns.length))
-    finally:
-      ifile.close()
-    if ntotal==0:
+        if ns.build_ifile: # NOT ALREADY BUILT, OR APPENDED TO
+          ntotal = ntotal + ns.buildFiles(**kwargs)
+    seqTable=nlmsa_utils.seq_table_from_seqlist(self.seqlist)
+    seqTable.write(self.pathstem) # .NLMSAindex AND .NLMSAseqTable
+    if ntotal==0 and not self.is_append:
       raise nlmsa_utils.EmptyAlignmentError('empty alignment!')
     import sys,pickle
     ifile = file(self.pathstem+'.attrDict','wb') # pickle is binary file!
@@ -1987,6 +3248,39 @@ or in the future pass the saveSeqDict=True option to NLMSA.build().
 To turn off this message, use the verbose=False option
 ''')
 
+  def buildFilesParallel(self,int nprocs,**kwargs):
+    '''build the nested list database of each NLMSASequence in a pool of
+    nprocs worker processes; return the total count of intervals'''
+    cdef NLMSASequence ns
+    try:
+      import multiprocessing
+    except ImportError:
+      raise ValueError('nprocs>1 requires the multiprocessing module (Python 2.6+)')
+    l=[]
+    for ns in self.seqlist:
+      if ns.build_ifile: # NOT ALREADY BUILT, OR APPENDED TO
+        filename=ns.closeBuildFile() # THIS MAY INCREASE ns.nbuild
+        l.append((ns.nbuild,filename,ns))
+    l.sort() # START THE BIGGEST BUILDS FIRST, TO BALANCE THE LOAD
+    l.reverse()
+    pool=multiprocessing.Pool(nprocs)
+    try:
+      results=[]
+      for nbuild,filename,ns in l: # CUT .build TO GET EACH filestem
+        results.append(pool.apply_async(build_nested_list_files,
+                                        (filename[:-6],nbuild),kwargs))
+      ntotal=0
+      for r in results: # WAIT FOR ALL WORKERS, RAISING ANY OF THEIR ERRORS
+        ntotal=ntotal+r.get()
+      pool.close()
+    finally:
+      pool.terminate()
+      pool.join()
+    for nbuild,filename,ns in l: # NOW OPEN THEM
+      ns.is_delta=0
+      ns.db=IntervalFileDB(ns.filestem,'r',self.useMmap)
+    return ntotal
+
   def save_seq_dict(self):
     'save seqDict to a worldbase-aware pickle file'
     nlmsa_utils.save_seq_dict(self.pathstem,self.seqDict)
@@ -2008,8 +3302,24 @@ To turn off this message, use the verbose=False option
     else:
       self.buildFiles(**kwargs)
     self.do_build=0
+    if self.sliceCache is not None: # ITS RESULTS MAY NOW BE INCOMPLETE
+      self.sliceCache.clear()
 
-  def seqInterval(self,int iseq,int istart,int istop):
+  def compact(self,**kwargs):
+    '''merge the delta index of each NLMSASequence that has been appended
+    to (see mode='a') into its main index.  Only those indexes are
+    rebuilt.  Returns the number of indexes compacted.'''
+    cdef NLMSASequence ns
+    if self.do_build:
+      raise ValueError('you must build() before you can compact()')
+    n=0
+    for ns in self.seqlist:
+      if ns.hasDelta():
+        ns.compact(**kwargs)
+        n=n+1
+    return n
+
+  def seqInterval(self,int iseq,IntervalCoord istart,IntervalCoord istop):
     'get specified interval in the target sequence'
     seq=self.seqlist.getSeq(iseq) # JUST THE SEQ OBJECT
     return sequence.relativeSlice(seq,istart,istop)
@@ -2024,9 +3334,116 @@ To turn off this message, use the verbose=False option
 
 
 
+def build_nested_list_files(filestem,int nbuild,maxBuildMemory=None,
+                            compressBlocks=False,**kwargs):
+  '''build nested list database files for filestem from its .build file of
+  nbuild unsorted intervals, then remove the .build file.  If the intervals
+  would take more than maxBuildMemory bytes, build them out of core
+  instead, sorting them in temporary run files of that size.
+  If compressBlocks is true, store the .idb file compressed.'''
+  cdef IntervalDB db
+  cdef char *err_msg
+  filename=filestem+'.build'
+  if maxBuildMemory is not None and \
+         nbuild*sizeof(IntervalMap)>maxBuildMemory: # TOO BIG TO SORT IN RAM
+    err_msg=build_nested_list_external(filename,nbuild,
+                                       maxBuildMemory/sizeof(IntervalMap),
+                                       256,filestem)
+    if err_msg:
+      raise IOError(err_msg)
+  else:
+    db=IntervalDB() # CREATE EMPTY NL IN MEMORY
+    if nbuild>0:
+      db.buildFromUnsortedFile(filename,nbuild,**kwargs) # BUILD FROM .build
+    db.write_binaries(filestem) # SAVE AS IntervalDBFile
+    db.close() # DUMP NESTEDLIST FROM MEMORY
+  if compressBlocks:
+    compress_nested_list_files(filestem)
+  import os
+  os.remove(filename) # REMOVE OUR .build FILE, NO LONGER NEEDED
+  return nbuild # return count of intervals
+
+def compress_nested_list_files(filestem):
+  '''replace the .idb file of nested list database filestem by a compressed
+  .idbz file plus .zindex block offsets.  Each block of div intervals is
+  delta encoded separately, so a query only decodes the blocks it reads.'''
+  cdef char *err_msg
+  err_msg=compress_binary_files(filestem)
+  if err_msg:
+    raise IOError(err_msg)
+
+def set_block_cache_size(long long maxBytes):
+  '''set the byte budget of the block cache shared by all open
+  IntervalFileDB in this process, evicting blocks as needed to fit.
+  0 disables the cache.'''
+  if maxBytes<0:
+    raise ValueError('maxBytes must be >= 0')
+  block_cache_resize(maxBytes)
+
+def clear_block_cache():
+  'empty the shared block cache and reset its hit / miss counts'
+  block_cache_clear()
+
+def set_block_readahead(int maxBlocks):
+  '''set the most blocks read ahead into the shared block cache at once,
+  when queries of a database miss the cache on ascending blocks.
+  0 disables readahead.'''
+  if maxBlocks<0:
+    raise ValueError('maxBlocks must be >= 0')
+  block_cache_set_readahead(maxBlocks)
+
+def get_block_cache_stats():
+  '''return a dict of the shared block cache's hits, misses,
+  nbytes (bytes in use), maxBytes (its budget), nblock (blocks held),
+  prefetched (blocks read ahead), prefetchHits (of those, blocks
+  later asked for) and maxReadahead (see set_block_readahead())'''
+  cdef long long nhit,nmiss,nbytes,maxBytes,nprefetch,nprefetchHit
+  cdef int nblock,maxReadahead
+  block_cache_get_stats(&nhit,&nmiss,&nbytes,&maxBytes,&nblock,
+                        &nprefetch,&nprefetchHit,&maxReadahead)
+  return dict(hits=nhit,misses=nmiss,nbytes=nbytes,maxBytes=maxBytes,
+              nblock=nblock,prefetched=nprefetch,prefetchHits=nprefetchHit,
+              maxReadahead=maxReadahead)
+
+def open_file_budget(maxOpenFiles):
+  '''raise our open file limit towards maxOpenFiles if allowed, and return
+  how many files nested list databases may hold open within it'''
+  try:
+    import resource # WE MAY NEED TO OPEN A LOT OF FILES...
+    soft,hard=resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard!=resource.RLIM_INFINITY and hard<maxOpenFiles:
+      maxOpenFiles=hard # CAN'T GO ABOVE THE HARD LIMIT WITHOUT PRIVILEGES
+    if soft!=resource.RLIM_INFINITY and soft<maxOpenFiles:
+      try:
+        resource.setrlimit(resource.RLIMIT_NOFILE,(maxOpenFiles,hard))
+      except (ValueError,resource.error):
+        maxOpenFiles=soft
+  except ImportError: # NO resource MODULE, E.G. ON WINDOWS
+    pass
+  if maxOpenFiles<2:
+    return 1
+  return maxOpenFiles/2 # LEAVE THE REST FOR SEQUENCE DATABASES ETC.
+
+def set_max_open_files(int maxFiles):
+  '''limit how many files all open IntervalFileDB in this process may hold
+  open at once.  Beyond this, the least recently used databases' files are
+  closed, and reopened automatically when next queried.'''
+  if maxFiles<1:
+    raise ValueError('maxFiles must be >= 1')
+  file_pool_resize(maxFiles)
+
+def get_file_pool_stats():
+  '''return a dict of the shared file pool's nfiles (files now open),
+  maxFiles (its limit) and reopens (times a database reopened its files)'''
+  cdef int nfiles,maxFiles
+  cdef long long nreopen
+  file_pool_get_stats(&nfiles,&maxFiles,&nreopen)
+  return dict(nfiles=nfiles,maxFiles=maxFiles,reopens=nreopen)
+
 def dump_textfile(pathstem,outfilename=None,verbose=True):
   'dump NLMSA binary files to a text file'
-  cdef int n,nlmsaID,nsID,offset,is_bidirectional,pairwiseMode,nprefix
+  cdef int n,nlmsaID,nsID,is_bidirectional,pairwiseMode,nprefix
+  cdef long long offset # WIDE ENOUGH FOR EITHER COORDINATE SIZE
   cdef FILE *outfile
   cdef char err_msg[2048],tmp[2048],seqDictID[256]
   err_msg[0] = 0 # ENSURE STRING IS EMPTY
@@ -2094,7 +3511,7 @@ to textfile_to_binaries() on the destination machine.''')
       nlmsaID=t[0]
       nsID=t[1]
       offset=t[2]
-      if fprintf(outfile,"SEQID\t%s\t%d\t%d\t%d\n",tmp,
+      if fprintf(outfile,"SEQID\t%s\t%d\t%d\t%lld\n",tmp,
                  nlmsaID,nsID,offset)<0:
         raise IOError('error writing to file %s' %outfilename)
     try:
@@ -2107,10 +3524,13 @@ to textfile_to_binaries() on the destination machine.''')
   try:
     for line in ifile:  # NOW SAVE THE NLMSA DATA
       id,name,is_union,length=line.strip().split('\t')
+      mypath=pathstem+id
+      if os.path.exists(mypath+'.delta.size'):
+        raise ValueError('%s has appended intervals: call compact() first'
+                         % mypath)
       strcpy(tmp,line) # COPY TO C STRING SO WE CAN fprintf
       if fprintf(outfile,"NLMSASequence\t%s",tmp)<0:
         raise IOError('error writing file %s'%outfilename)
-      mypath=pathstem+id
       mybase=basestem+id
       if save_text_file(mypath,mybase,err_msg,outfile)!=0:
         raise IOError(err_msg)
@@ -2121,7 +3541,8 @@ to textfile_to_binaries() on the destination machine.''')
 
 def textfile_to_binaries(filename,seqDict=None,prefixDict=None,buildpath=''):
   'convert pathstem.txt textfile to NLMSA binary files'
-  cdef int i,n,nlmsaID,nsID,offset,is_bidirectional,pairwiseMode,nprefix
+  cdef int i,n,nlmsaID,nsID,is_bidirectional,pairwiseMode,nprefix
+  cdef long long offset # WIDE ENOUGH FOR EITHER COORDINATE SIZE
   cdef FILE *infile
   cdef char err_msg[2048],line[32768],tmp[2048],basestem[2048],seqDictID[2048]
   if seqDict is not None:
@@ -2194,13 +3615,14 @@ dictionary argument: %s''' % missing)
     for i from 0 <= i <n: # seqIDDict READING
       if fgets(line,32767,infile)==NULL:
         raise IOError('error or EOF reading %s'%filename)
-      if 4!=sscanf(line,"SEQID\t%s\t%d %d %d",tmp,
+      if 4!=sscanf(line,"SEQID\t%s\t%d %d %lld",tmp,
                    &nlmsaID,&nsID,&offset):
         raise IOError('bad format in %s'%filename)
       seqIDdict[tmp]=(nlmsaID,nsID,offset) # SAVE THIS ENTRY
       IDdict[str(nlmsaID)]=(tmp,nsID)
     seqIDdict.close() # DONE WRITING THE seqIDdict
     IDdict.close() # DONE WRITING THE seqIDdict
+    nlmsa_utils.save_id_map(buildpath1) # COMPACT COPY FOR READING
 
     NLMSAindexText = ''
     if buildpath!='': # USER-SPECIFIED PATH FOR BINARIES
@@ -2218,9 +3640,226 @@ dictionary argument: %s''' % missing)
       sys.stderr.write('Saving NLMSA binary index: '+s[14:]+'...\n')
       if text_file_to_binaries(infile,basestem,err_msg)<0:
         raise IOError(err_msg)
-    ifile = file(buildpath1+'.NLMSAindex',"w") # text file
-    ifile.write(NLMSAindexText) # LAST, WRITE TOP INDEX FILE
-    ifile.close()
+    seqTable=nlmsa_utils.seq_table_fromtext(NLMSAindexText)
+    seqTable.write(buildpath1) # LAST, WRITE TOP INDEX FILES
   finally:
     fclose(infile)
   return buildpath1 # ACTUAL PATH TO NLMSA INDEX FILESET
+
+
+def read_maf_shard(mafFile,seqIDs,shardpath):
+  '''parse the MAF file mafFile into the binary shard file shardpath, for
+  NLMSA.readMAFfiles(nprocs>1) to merge.  seqIDs is the sorted list of
+  sequence IDs whose indexes the shard uses as target_id.  Each alignment
+  block is saved as its interval count, its length, then its IntervalMap
+  records, in LPO coordinates starting at zero.  Returns the count of
+  non-alignment lines ignored, for each first character.'''
+  cdef int i,n,nseq0,block_len,has_continuation
+  cdef SeqIDMap *seqidmap
+  cdef char tmp[32768],*p,a_header[4]
+  cdef FILE *ifile,*ofile
+  cdef IntervalMap im[4096]
+  cdef long long linecode_count[256]
+  memset(<void *>linecode_count,0,sizeof(linecode_count))
+  has_continuation=0
+  nseq0=len(seqIDs)
+  seqidmap=<SeqIDMap *>calloc(nseq0,sizeof(SeqIDMap)) # ALLOCATE ARRAY
+  if nseq0>0 and seqidmap==NULL:
+    raise MemoryError('unable to allocate seqidmap for %d sequences' % nseq0)
+  ifile=NULL
+  ofile=NULL
+  try:
+    for i from 0 <= i <nseq0: # seqIDs KEEPS THESE STRINGS ALIVE
+      seqidmap[i].id=seqIDs[i]
+    ifile=fopen(mafFile,'r') # text file
+    if ifile==NULL:
+      raise IOError('unable to open file %s' % mafFile)
+    if fgets(tmp,32767,ifile)==NULL or strncmp(tmp,"##maf",4): # HEADER LINE
+      raise IOError('%s: not a MAF file? Bad format.' % mafFile)
+    ofile=fopen(shardpath,'wb') # binary file
+    if ofile==NULL:
+      raise IOError('unable to open in write mode: %s' % shardpath)
+    strcpy(a_header,"a ") # MAKE C STRING 
+    p=fgets(tmp,32767,ifile) # READ 1ST DATA LINE OF THE MAF FILE
+    while p: # GOT ANOTHER LINE TO PROCESS
+      if has_continuation or 0==strncmp(tmp,a_header,2): # ALIGNMENT HEADER: READ ALIGNMENT
+        n=readMAFrecord(im,0,seqidmap,nseq0,0, # READ ONE MAF BLOCK
+                        &block_len,ifile,4096,linecode_count,&has_continuation)
+        if n<0: # UNRECOVERABLE ERROR OCCURRED...
+          raise ValueError('MAF block too long!  Increase max size')
+        elif n==0:
+          continue
+        if fwrite(&n,sizeof(int),1,ofile)!=1 \
+               or fwrite(&block_len,sizeof(int),1,ofile)!=1 \
+               or fwrite(im,sizeof(IntervalMap),n,ofile)!=n:
+          raise IOError('error writing %s' % shardpath)
+      if not has_continuation:
+        p=fgets(tmp,32767,ifile) # TRY TO READ ANOTHER LINE...
+  finally:
+    free(seqidmap) # ITS STRINGS BELONG TO seqIDs
+    if ifile!=NULL:
+      fclose(ifile)
+    if ofile!=NULL:
+      if fclose(ofile)!=0:
+        raise IOError('error writing %s' % shardpath)
+  counts=[]
+  for i from 0 <= i <256:
+    counts.append(linecode_count[i])
+  return counts
+
+
+def read_axtnet_shard(axtFile,src_prefix,dest_prefix,seqIDs,seqLengths,
+                      shardpath):
+  '''parse the axtNet file axtFile (which may be gzipped) into the binary
+  shard file shardpath, for NLMSA.readAxtNet(nprocs>1) to merge.  seqIDs
+  is the sorted list of sequence IDs whose indexes the shard uses as
+  target_id, and seqLengths their lengths.  Each alignment block is saved
+  as the index of its source sequence, its interval count, then its
+  IntervalMap records, in sequence coordinates.'''
+  cdef int i,n,nseq0,isrc
+  cdef SeqIDMap *seqidmap
+  cdef char c_src_prefix[64],c_dest_prefix[64]
+  cdef FILE *ifile,*ofile
+  cdef IntervalMap im[4096]
+  nseq0=len(seqIDs)
+  seqidmap=<SeqIDMap *>calloc(nseq0,sizeof(SeqIDMap)) # ALLOCATE ARRAY
+  if nseq0>0 and seqidmap==NULL:
+    raise MemoryError('unable to allocate seqidmap for %d sequences' % nseq0)
+  strcpy(c_src_prefix,src_prefix) # KEEP THEM IN STATIC C STRINGS FOR SPEED
+  strcpy(c_dest_prefix,dest_prefix)
+  stream=None
+  ofile=NULL
+  try:
+    for i from 0 <= i <nseq0: # seqIDs KEEPS THESE STRINGS ALIVE
+      seqidmap[i].id=seqIDs[i]
+      seqidmap[i].length=seqLengths[i]
+    stream=nlmsa_utils.AlignmentFileStream(axtFile)
+    ifile=PyFile_AsFile(stream.ifile)
+    ofile=fopen(shardpath,'wb') # binary file
+    if ofile==NULL:
+      raise IOError('unable to open in write mode: %s' % shardpath)
+    while True:
+      n=read_axtnet(im,seqidmap,nseq0,ifile,4096,&isrc,c_src_prefix,
+                    c_dest_prefix)
+      if n<0: # UNRECOVERABLE ERROR OCCURRED...
+        raise ValueError('axtNet block too long!  Increase max size')
+      elif n==0: # NO MORE DATA TO READ
+        break
+      if fwrite(&isrc,sizeof(int),1,ofile)!=1 \
+             or fwrite(&n,sizeof(int),1,ofile)!=1 \
+             or fwrite(im,sizeof(IntervalMap),n,ofile)!=n:
+        raise IOError('error writing %s' % shardpath)
+    stream.close() # RAISES IOError IF gzip FAILED
+    stream=None
+  finally:
+    free(seqidmap) # ITS STRINGS BELONG TO seqIDs
+    if stream is not None:
+      stream.abort()
+    if ofile!=NULL:
+      if fclose(ofile)!=0:
+        raise IOError('error writing %s' % shardpath)
+
+
+def binaries_to_packfile(pathstem,packstem=None):
+  '''pack all the files of the NLMSA pathstem into the single file
+  packstem.NLMSApack (by default, pathstem.NLMSApack), which NLMSA(packstem)
+  then reads directly.  Its seqIDdict and idDict shelves are saved as an
+  NLMSAIDMap.  Returns the path of the packed file.'''
+  import shutil,struct,os,classutil
+  P=nlmsa_utils.NLMSAPackFile
+  if packstem is None:
+    packstem=pathstem
+  try:
+    ifile=file(pathstem+'.NLMSAindex', 'rU') # text file
+  except IOError:
+    ifile=file(pathstem+'NLMSAindex', 'rU') # FOR BACKWARDS COMPATIBILITY
+  try:
+    NLMSAindexText=ifile.read()
+  finally:
+    ifile.close()
+  members=[('.NLMSAindex',None,NLMSAindexText)] # (NAME,FILE TO COPY,DATA)
+  for suffix in ('.attrDict','.seqDictP',nlmsa_utils.NLMSASeqTable.suffix):
+    if os.access(pathstem+suffix,os.R_OK):
+      members.append((suffix,pathstem+suffix,None))
+  suffix=nlmsa_utils.NLMSAIDMap.suffix
+  if os.access(pathstem+suffix,os.R_OK):
+    members.append((suffix,pathstem+suffix,None))
+  else: # BUILT BY AN OLDER VERSION OF PYGR, SO CONVERT ITS SHELVES
+    d=classutil.open_shelve(pathstem+'.seqIDdict','r')
+    try:
+      members.append((suffix,None,nlmsa_utils.id_map_tostring(d.iteritems())))
+    finally:
+      d.close()
+  for line in NLMSAindexText.splitlines():
+    id=line.split('\t')[0]
+    for stem in (id,id+'.delta'): # AN IntervalFileDB, AND ITS DELTA IF ANY
+      for suffix in _dbSectionSuffixes:
+        if os.access(pathstem+stem+suffix,os.R_OK):
+          members.append((stem+suffix,pathstem+stem+suffix,None))
+  packpath=packstem+P.suffix
+  ofile=file(packpath,'wb') # binary file
+  try:
+    ofile.write(struct.pack(P.headerFormat,P.magic,P.version,0,0))
+    directory=[]
+    for name,path,data in members:
+      ofile.write('\0'*(-ofile.tell()%16)) # ALIGN FOR mmap OF ITS RECORDS
+      offset=ofile.tell()
+      if path is not None:
+        ifile=file(path,'rb') # binary file
+        try:
+          shutil.copyfileobj(ifile,ofile)
+        finally:
+          ifile.close()
+      else:
+        ofile.write(data)
+      directory.append('%s\t%d\t%d\n' % (name,offset,ofile.tell()-offset))
+    directory=''.join(directory)
+    offset=ofile.tell()
+    ofile.write(directory) # DIRECTORY GOES LAST, SO WE CAN COPY IN ONE PASS
+    ofile.seek(0)
+    ofile.write(struct.pack(P.headerFormat,P.magic,P.version,offset,
+                            len(directory)))
+    ofile.close()
+  except:
+    ofile.close()
+    os.remove(packpath) # DON'T LEAVE A TRUNCATED PACKED FILE BEHIND
+    raise
+  return packpath
+
+
+def packfile_to_binaries(packstem,pathstem=None):
+  '''unpack packstem.NLMSApack, written by binaries_to_packfile(), back into
+  the separate files of the NLMSA pathstem (by default, packstem),
+  e.g. so that it can be appended to.  Returns pathstem.'''
+  import classutil
+  if pathstem is None:
+    pathstem=packstem
+  packFile=nlmsa_utils.NLMSAPackFile(packstem)
+  for name in packFile.sections:
+    if name=='.seqIDdict' or name=='.idDict': # RECREATE THE SHELVE
+      d=classutil.open_shelve(pathstem+name,'n')
+      try:
+        for k,v in packFile.read_dict(packstem+name).iteritems():
+          d[k]=v
+      finally:
+        d.close()
+    else:
+      ofile=file(pathstem+name,'wb') # binary file
+      try:
+        packFile.copy(packstem+name,ofile)
+      finally:
+        ofile.close()
+  if nlmsa_utils.NLMSAIDMap.suffix in packFile.sections: # RECREATE SHELVES
+    seqs=nlmsa_utils.NLMSASeqDict(None,pathstem,'r') # FROM THE NLMSAIDMap
+    seqIDdict=classutil.open_shelve(pathstem+'.seqIDdict','n')
+    IDdict=classutil.open_shelve(pathstem+'.idDict','n')
+    try:
+      for k,v in seqs.seqIDdict.iteritems():
+        seqIDdict[k]=v
+      for k,v in seqs.IDdict.iteritems():
+        IDdict[k]=v
+    finally:
+      seqIDdict.close()
+      IDdict.close()
+      seqs.close()
+  return pathstem
@@ -10,10 +10,13 @@
    back to regular fseek version.  On other platforms use POSIX fseeko */
 #ifdef __MSVCRT__
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko64(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello64(IFILE)
 #elif defined(_WIN32)
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseek(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftell(IFILE)
 #else
 #define PYGR_FSEEK(IFILE,OFFSET,WHENCE) fseeko(IFILE,OFFSET,WHENCE)
+#define PYGR_FTELL(IFILE) ftello(IFILE)
 #endif
 
 #ifdef BUILD_C_LIBRARY
@@ -48,6 +51,14 @@
    ALLOCATE THE DESIRED RESOURCE...  */
 #define MALLOC_FAILURE_ACTION goto handle_malloc_failure
 
+/* SET A PYTHON EXCEPTION.  SAFE EVEN IN C CODE THAT PYREX CALLS WITH THE
+   GIL RELEASED (with nogil:), SINCE IT TAKES THE GIL WHILE IT DOES SO */
+#define PYGR_SET_ERROR(EXC,MSG) {\
+    PyGILState_STATE pygr_gil_state=PyGILState_Ensure(); \
+    PyErr_SetString(EXC,MSG); \
+    PyGILState_Release(pygr_gil_state); \
+  }
+
 /* USE OF THIS MACRO WILL HANDLE MALLOC FAILURES BY
    RAISING THE APPROPRIATE PYTHON EXCEPTIONS
    INSTEAD OF CRASHING PYTHON OR FORCING THE PROCESS TO ABORT... */
@@ -56,14 +67,14 @@
     char errstr[1024]; \
     sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
               __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_ValueError,errstr); \
+    PYGR_SET_ERROR(PyExc_ValueError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }\
   else if (NULL == ((memptr)=(ATYPE *)calloc((size_t)(N),sizeof(ATYPE))))  { \
     char errstr[1024]; \
     sprintf(errstr,"%s, line %d: memory request failed: %s[%d].\n",\
               __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_MemoryError,errstr); \
+    PYGR_SET_ERROR(PyExc_MemoryError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }
 
@@ -73,7 +84,7 @@
     char errstr[1024]; \
     sprintf(errstr,"%s, line %d: *** invalid memory request: %s[%d].\n",\
               __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-    PyErr_SetString(PyExc_ValueError,errstr); \
+    PYGR_SET_ERROR(PyExc_ValueError,errstr); \
     MALLOC_FAILURE_ACTION;\
   }\
   else {\
@@ -82,7 +93,7 @@
       char errstr[1024]; \
       sprintf(errstr,"%s, line %d: memory request failed: %s[%d].\n",\
                 __FILE__,__LINE__,STRINGIFY(memptr),(N));   \
-      PyErr_SetString(PyExc_MemoryError,errstr); \
+      PYGR_SET_ERROR(PyExc_MemoryError,errstr); \
       MALLOC_FAILURE_ACTION;\
     } \
     else \
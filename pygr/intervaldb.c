@@ -1,14 +1,26 @@
 
 #include "intervaldb.h"
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <errno.h>
+#include <pthread.h>
+#endif
 
 int C_int_max=INT_MAX; /* KLUDGE TO LET PYREX CODE ACCESS VALUE OF INT_MAX MACRO */
+IntervalCoord C_coord_max=INTERVAL_COORD_MAX; /* LARGEST LEGAL COORDINATE */
 
 IntervalMap *read_intervals(int n,FILE *ifile)
 {
   int i=0;
   IntervalMap *im=NULL;
   CALLOC(im,n,IntervalMap); /* ALLOCATE THE WHOLE ARRAY */
-  while (i<n && fscanf(ifile," %d %d %d %d %d",&im[i].start,&im[i].end,
+  while (i<n && fscanf(ifile," " COORD_FMT " " COORD_FMT " %d " COORD_FMT " " COORD_FMT,
+		       &im[i].start,&im[i].end,
 		       &im[i].target_id,&im[i].target_start,
 		       &im[i].target_end)==5) {
     im[i].sublist= -1; /* DEFAULT: NO SUBLIST */
@@ -38,6 +50,12 @@ int imstart_qsort_cmp(const void *void_a,const void *void_b)
     return -1;
   else if (a->end<b->end) /* CONTAINED INTERVAL SHOULD FOLLOW LARGER INTERVAL*/
     return 1;
+  else if (a->target_id!=b->target_id) /* BREAK REMAINING TIES BY TARGET, SO */
+    return (a->target_id<b->target_id) ? -1 : 1; /* ORDER IS REPRODUCIBLE */
+  else if (a->target_start!=b->target_start)
+    return (a->target_start<b->target_start) ? -1 : 1;
+  else if (a->target_end!=b->target_end)
+    return (a->target_end<b->target_end) ? -1 : 1;
   else
     return 0;
 }
@@ -48,7 +66,7 @@ int imstart_qsort_cmp(const void *void_a,const void *void_b)
 #ifdef MERGE_INTERVAL_ORIENTATIONS
 int im_qsort_cmp(const void *void_a,const void *void_b)
 { /* MERGE FORWARD AND REVERSE INTERVALS AS IF THEY WERE ALL IN FORWARD ORI */
-  int a_start,a_end,b_start,b_end;
+  IntervalCoord a_start,a_end,b_start,b_end;
   IntervalMap *a=(IntervalMap *)void_a,*b=(IntervalMap *)void_b;
   SET_INTERVAL_POSITIVE(*a,a_start,a_end);
   SET_INTERVAL_POSITIVE(*b,b_start,b_end);
@@ -316,7 +334,7 @@ IntervalMap *interval_map_alloc(int n)
 
 
 
-int find_overlap_start(int start,int end,IntervalMap im[],int n)
+int find_overlap_start(IntervalCoord start,IntervalCoord end,IntervalMap im[],int n)
 {
   int l=0,mid,r;
 
@@ -337,7 +355,7 @@ int find_overlap_start(int start,int end,IntervalMap im[],int n)
 
 
 
-int find_index_start(int start,int end,IntervalIndex im[],int n)
+int find_index_start(IntervalCoord start,IntervalCoord end,IntervalIndex im[],int n)
 {
   int l=0,mid,r;
 
@@ -354,7 +372,7 @@ int find_index_start(int start,int end,IntervalIndex im[],int n)
 
 
 
-int find_suboverlap_start(int start,int end,int isub,IntervalMap im[],
+int find_suboverlap_start(IntervalCoord start,IntervalCoord end,int isub,IntervalMap im[],
 			  SublistHeader subheader[],int nlists)
 {
   int i;
@@ -397,7 +415,8 @@ IntervalIterator *reset_interval_iterator(IntervalIterator *it)
 
 void reorient_intervals(int n,IntervalMap im[],int ori_sign)
 {
-  int i,tmp;
+  int i;
+  IntervalCoord tmp;
   for (i=0;i<n;i++) {
     if ((im[i].start>=0 ? 1:-1)!=ori_sign) { /* ORIENTATION MISMATCH */
       tmp=im[i].start; /* SO REVERSE THIS INTERVAL MAPPING */
@@ -410,7 +429,7 @@ void reorient_intervals(int n,IntervalMap im[],int ori_sign)
   }
 }
 
-int find_intervals(IntervalIterator *it0,int start,int end,
+int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,
 		   IntervalMap im[],int n,
 		   SublistHeader subheader[],int nlists,
 		   IntervalMap buf[],int nbuf,
@@ -418,6 +437,7 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 {
   IntervalIterator *it=NULL,*it2=NULL;
   int ibuf=0,j,k,ori_sign=1;
+  IntervalCoord tmp;
   if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
     CALLOC(it,1,IntervalIterator);
   }
@@ -426,9 +446,9 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 #if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
   if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
-    j=start;
+    tmp=start;
     start= -end;
-    end= -j;
+    end= -tmp;
     ori_sign = -1;
   }
 #endif
@@ -471,6 +491,599 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 
 
+/****************************************************************
+ *
+ *   LOCKING: PYREX RUNS OUR SEARCHES WITH THE GIL RELEASED, SO SEVERAL
+ *   THREADS MAY QUERY AT ONCE.  THE BLOCK CACHE AND FILE POOL BELOW ARE
+ *   SHARED BY ALL OPEN DATABASES, SO ONE PROCESS-WIDE LOCK GUARDS THEM (AND
+ *   EACH DATABASE'S SUBLIST HEADER BLOCK).  IT IS HELD ONLY FOR BOOKKEEPING:
+ *   READS USE read_file_at(), WHICH NEEDS NO SHARED FILE POSITION
+ */
+
+#ifdef _WIN32
+static SRWLOCK db_file_lock=SRWLOCK_INIT;
+#define DB_FILE_LOCK() AcquireSRWLockExclusive(&db_file_lock)
+#define DB_FILE_UNLOCK() ReleaseSRWLockExclusive(&db_file_lock)
+#else
+static pthread_mutex_t db_file_lock=PTHREAD_MUTEX_INITIALIZER;
+#define DB_FILE_LOCK() pthread_mutex_lock(&db_file_lock)
+#define DB_FILE_UNLOCK() pthread_mutex_unlock(&db_file_lock)
+#endif
+
+
+/* READ n ITEMS OF size BYTES FROM BYTE offset OF ifile, LIKE fseek() +
+   fread() BUT WITHOUT USING ITS FILE POSITION, SO THAT THREADS CAN READ
+   THE SAME FILE AT ONCE.  RETURNS #ITEMS READ.  MUST NOT HOLD THE LOCK */
+size_t read_file_at(FILE *ifile,void *buf,size_t size,size_t n,
+		    PYGR_OFF_T offset)
+{
+#ifdef _WIN32 /* NO pread(), SO TAKE TURNS USING THE FILE POSITION */
+  DB_FILE_LOCK();
+  PYGR_FSEEK(ifile,offset,SEEK_SET);
+  n=fread(buf,size,n,ifile);
+  DB_FILE_UNLOCK();
+  return n;
+#else
+  size_t nread=0;
+  ssize_t nbyte;
+  while (nread<size*n) { /* pread() MAY RETURN FEWER BYTES THAN ASKED */
+    nbyte=pread(fileno(ifile),(char *)buf+nread,size*n-nread,
+		offset+(PYGR_OFF_T)nread);
+    if (nbyte<0 && errno==EINTR) /* INTERRUPTED BY A SIGNAL: TRY AGAIN */
+      continue;
+    if (nbyte<=0) /* ERROR OR END OF FILE */
+      break;
+    nread+=nbyte;
+  }
+  return nread/size;
+#endif
+}
+
+
+
+
+
+/****************************************************************
+ *
+ *   BLOCK CACHE: A PROCESS-WIDE LRU CACHE OF div-RECORD BLOCKS READ FROM
+ *   DATABASE FILES, SHARED BY EVERY OPEN IntervalDBFile AND KEYED BY
+ *   (file_id, iblock).  ITS MEMORY IS OPTIONAL, SO IT USES PLAIN calloc()
+ *   RATHER THAN CALLOC(): FAILING TO CACHE A BLOCK IS NOT AN ERROR.
+ *   ITS FUNCTIONS EXPECT THE CALLER TO HOLD THE LOCK, EXCEPT WHERE NOTED
+ */
+
+static BlockCache block_cache={BLOCK_CACHE_DEFAULT_BYTES,0,0,0,0,
+			       NULL,NULL,NULL,0,0,READAHEAD_DEFAULT_MAX};
+static int next_file_id=1; /* FOR TAGGING EACH IntervalDBFile WE OPEN */
+
+#define BLOCK_CACHE_HASH(file_id,iblock) \
+  ((((unsigned)(file_id)*2654435761U) ^ (unsigned)(iblock)) % BLOCK_CACHE_NHASH)
+#define BLOCK_CACHE_ENTRY_BYTES(e) \
+  (sizeof(BlockCacheEntry)+(e)->n*sizeof(IntervalMap))
+
+
+/* REMOVE AN ENTRY FROM THE LRU LIST AND ITS HASH CHAIN, AND FREE IT */
+void block_cache_drop(BlockCacheEntry *e)
+{
+  BlockCacheEntry **p_e;
+  p_e=block_cache.hash+BLOCK_CACHE_HASH(e->file_id,e->iblock);
+  while (*p_e!=e)
+    p_e= &((*p_e)->hash_next);
+  *p_e=e->hash_next;
+  if (e->prev)
+    e->prev->next=e->next;
+  else
+    block_cache.first=e->next;
+  if (e->next)
+    e->next->prev=e->prev;
+  else
+    block_cache.last=e->prev;
+  block_cache.nbytes-=BLOCK_CACHE_ENTRY_BYTES(e);
+  block_cache.nblock--;
+  free(e->im);
+  free(e);
+}
+
+
+/* EVICT LEAST RECENTLY USED BLOCKS UNTIL WE FIT IN max_bytes */
+void block_cache_trim(size_t max_bytes)
+{
+  while (block_cache.last && block_cache.nbytes>max_bytes)
+    block_cache_drop(block_cache.last);
+}
+
+
+/* FIND A CACHED BLOCK, MAKING IT THE MOST RECENTLY USED */
+BlockCacheEntry *block_cache_find(int file_id,int iblock)
+{
+  BlockCacheEntry *e;
+  if (!block_cache.hash)
+    return NULL;
+  for (e=block_cache.hash[BLOCK_CACHE_HASH(file_id,iblock)];e;e=e->hash_next)
+    if (e->file_id==file_id && e->iblock==iblock) {
+      if (e->prev) { /* MOVE TO FRONT OF THE LRU LIST */
+	e->prev->next=e->next;
+	if (e->next)
+	  e->next->prev=e->prev;
+	else
+	  block_cache.last=e->prev;
+	e->prev=NULL;
+	e->next=block_cache.first;
+	block_cache.first->prev=e;
+	block_cache.first=e;
+      }
+      return e;
+    }
+  return NULL;
+}
+
+
+/* SAVE A COPY OF n RECORDS AS BLOCK iblock OF file_id, MARKED AS READ
+   AHEAD IF is_prefetched */
+void block_cache_add(int file_id,int iblock,IntervalMap im[],int n,
+		     int is_prefetched)
+{
+  int ihash;
+  BlockCacheEntry *e;
+  if (sizeof(BlockCacheEntry)+n*sizeof(IntervalMap)>block_cache.max_bytes)
+    return; /* TOO BIG FOR OUR BUDGET */
+  if (block_cache_find(file_id,iblock)) /* ANOTHER THREAD READ IT TOO */
+    return;
+  if (!block_cache.hash
+      && !(block_cache.hash=(BlockCacheEntry **)
+	   calloc(BLOCK_CACHE_NHASH,sizeof(BlockCacheEntry *))))
+    return;
+  if (!(e=(BlockCacheEntry *)calloc(1,sizeof(BlockCacheEntry))))
+    return;
+  if (!(e->im=(IntervalMap *)malloc(n*sizeof(IntervalMap)))) {
+    free(e);
+    return;
+  }
+  memcpy(e->im,im,n*sizeof(IntervalMap));
+  if (is_prefetched) {
+    e->is_prefetched=1;
+    block_cache.nprefetch++;
+  }
+  e->file_id=file_id;
+  e->iblock=iblock;
+  e->n=n;
+  block_cache_trim(block_cache.max_bytes-BLOCK_CACHE_ENTRY_BYTES(e));
+  ihash=BLOCK_CACHE_HASH(file_id,iblock);
+  e->hash_next=block_cache.hash[ihash];
+  block_cache.hash[ihash]=e;
+  e->next=block_cache.first; /* ADD AT FRONT OF THE LRU LIST */
+  if (block_cache.first)
+    block_cache.first->prev=e;
+  else
+    block_cache.last=e;
+  block_cache.first=e;
+  block_cache.nbytes+=BLOCK_CACHE_ENTRY_BYTES(e);
+  block_cache.nblock++;
+}
+
+
+/* CHANGE THE BYTE BUDGET, EVICTING BLOCKS AS NEEDED.  0 DISABLES CACHING.
+   TAKES THE LOCK ITSELF */
+void block_cache_resize(size_t max_bytes)
+{
+  DB_FILE_LOCK();
+  block_cache.max_bytes=max_bytes;
+  block_cache_trim(max_bytes);
+  DB_FILE_UNLOCK();
+}
+
+
+/* EMPTY THE CACHE AND RESET ITS HIT / MISS COUNTS.  TAKES THE LOCK ITSELF */
+void block_cache_clear(void)
+{
+  DB_FILE_LOCK();
+  block_cache_trim(0);
+  block_cache.nhit=block_cache.nmiss=0;
+  block_cache.nprefetch=block_cache.nprefetch_hit=0;
+  DB_FILE_UNLOCK();
+}
+
+
+/* DROP ALL BLOCKS OF A FILE THAT IS BEING CLOSED */
+void block_cache_forget(int file_id)
+{
+  BlockCacheEntry *e,*e_next;
+  if (block_cache.nblock==0) /* NOTHING TO SCAN */
+    return;
+  for (e=block_cache.first;e;e=e_next) {
+    e_next=e->next;
+    if (e->file_id==file_id)
+      block_cache_drop(e);
+  }
+}
+
+
+void block_cache_get_stats(long long *p_nhit,long long *p_nmiss,
+			   long long *p_nbytes,long long *p_max_bytes,
+			   int *p_nblock,long long *p_nprefetch,
+			   long long *p_nprefetch_hit,int *p_readahead_max)
+{
+  DB_FILE_LOCK();
+  *p_nhit=block_cache.nhit;
+  *p_nmiss=block_cache.nmiss;
+  *p_nbytes=(long long)block_cache.nbytes;
+  *p_max_bytes=(long long)block_cache.max_bytes;
+  *p_nblock=block_cache.nblock;
+  *p_nprefetch=block_cache.nprefetch;
+  *p_nprefetch_hit=block_cache.nprefetch_hit;
+  *p_readahead_max=block_cache.readahead_max;
+  DB_FILE_UNLOCK();
+}
+
+
+/* CHANGE THE MOST BLOCKS READ AHEAD AT ONCE.  0 DISABLES READAHEAD.
+   TAKES THE LOCK ITSELF */
+void block_cache_set_readahead(int max_blocks)
+{
+  DB_FILE_LOCK();
+  block_cache.readahead_max=max_blocks;
+  DB_FILE_UNLOCK();
+}
+
+
+/* ON A CACHE MISS OF BLOCK iblock OF db_file, RETURN HOW MANY OF THE
+   BLOCKS AFTER IT TO READ ALONG WITH IT.  TILED OR SORTED QUERIES MISS ON
+   ASCENDING BLOCKS, SO EACH DATABASE TRACKS A FEW SUCH RUNS (E.G. ITS
+   TOP-LEVEL LIST, AND THE BIG SUBLISTS THE SAME QUERIES DESCEND INTO).
+   A MISS THAT CONTINUES A RUN DOUBLES ITS WINDOW, UP TO readahead_max;
+   ANY OTHER MISS STARTS A NEW RUN IN PLACE OF THE LEAST RECENTLY USED ONE,
+   READING NOTHING AHEAD.  CALLER MUST HOLD THE LOCK */
+int readahead_window(IntervalDBFile *db_file,int iblock)
+{
+  int i;
+  ReadaheadStream *s,*s_old=NULL;
+  if (block_cache.readahead_max<=0 || block_cache.max_bytes==0
+      || db_file->is_mapped) /* MAPPED FILES ARE READ AHEAD BY THE OS */
+    return 0;
+  db_file->ra_clock++;
+  for (i=0;i<READAHEAD_NSTREAM;i++) {
+    s=db_file->ra_stream+i;
+    if (s->last_use>0 && s->next_block==iblock) { /* CONTINUES THIS RUN */
+      s->window= s->window>0 ? 2*s->window : 1;
+      if (s->window>block_cache.readahead_max)
+	s->window=block_cache.readahead_max;
+      if (db_file->is_compressed && iblock+s->window>=db_file->nblock)
+	s->window=db_file->nblock-iblock-1; /* DON'T READ PAST THE END */
+      if (s->window<0)
+	s->window=0;
+      s->next_block=iblock+s->window+1;
+      s->last_use=db_file->ra_clock;
+      return s->window;
+    }
+    if (!s_old || s->last_use<s_old->last_use)
+      s_old=s;
+  }
+  s_old->next_block=iblock+1; /* START A NEW RUN */
+  s_old->window=0;
+  s_old->last_use=db_file->ra_clock;
+  return 0;
+}
+
+
+/* TRUE IF n IS THE RIGHT #RECORDS FOR BLOCK iblock OF db_file: div, OR
+   FEWER ONLY FOR THE LAST BLOCK OF THE FILE.  A SHORT READ (E.G. A SHORT
+   pread() ON A NETWORK FILESYSTEM) FAILS THIS TEST */
+int is_whole_block(IntervalDBFile *db_file,int iblock,int n)
+{
+  long long nleft;
+  if (n<=0)
+    return 0;
+  if (db_file->is_compressed) /* LAST BLOCK'S SIZE IS CHECKED BY DECODING */
+    return n==db_file->div || iblock==db_file->nblock-1;
+  nleft=(long long)db_file->nrecord-(long long)iblock*db_file->div;
+  return n==db_file->div || (long long)n==nleft;
+}
+
+
+/* READ BLOCK iblock OF db_file INTO im, AND THE nahead BLOCKS AFTER IT
+   INTO THE CACHE, ALL IN ONE READ.  RETURNS #RECORDS IN BLOCK iblock, OR
+   -1 IF THE READ FAILED OR THERE IS NO MEMORY FOR IT, SO THAT THE CALLER
+   CAN READ JUST BLOCK iblock INSTEAD.  TAKES THE LOCK ITSELF, BUT NOT
+   WHILE READING THE FILE */
+int read_blocks_ahead(IntervalDBFile *db_file,int iblock,int nahead,
+		      IntervalMap im[])
+{
+  int i,n= -1,nrec,div=db_file->div;
+  size_t nread,nbyte;
+  long long *zoffset=db_file->zoffset;
+  IntervalMap *buf=NULL;
+  unsigned char *zbuf=NULL;
+  if (db_file->is_compressed) {
+    nbyte=(size_t)(zoffset[iblock+nahead+1]-zoffset[iblock]);
+    if (!(zbuf=(unsigned char *)malloc(nbyte))
+	|| !(buf=(IntervalMap *)malloc(div*sizeof(IntervalMap)))
+	|| read_file_at(db_file->ifile_idb,zbuf,1,nbyte,db_file->idb_offset
+			+(PYGR_OFF_T)zoffset[iblock])!=nbyte)
+      goto finally_return_result;
+    n=decode_interval_block(zbuf,(int)(zoffset[iblock+1]-zoffset[iblock]),
+			    im,div);
+    if (!is_whole_block(db_file,iblock,n)) {
+      n= -1;
+      goto finally_return_result;
+    }
+    for (i=1;i<=nahead;i++) {
+      nrec=decode_interval_block(zbuf+(zoffset[iblock+i]-zoffset[iblock]),
+				 (int)(zoffset[iblock+i+1]-zoffset[iblock+i]),
+				 buf,div);
+      if (is_whole_block(db_file,iblock+i,nrec)) {
+	DB_FILE_LOCK();
+	block_cache_add(db_file->file_id,iblock+i,buf,nrec,1);
+	DB_FILE_UNLOCK();
+      }
+    }
+  }
+  else {
+    if (!(buf=(IntervalMap *)malloc((nahead+1)*div*sizeof(IntervalMap))))
+      goto finally_return_result;
+    nread=read_file_at(db_file->ifile_idb,buf,sizeof(IntervalMap),
+		       (nahead+1)*div,db_file->idb_offset
+		       +(PYGR_OFF_T)iblock*div*sizeof(IntervalMap));
+    n= nread<(size_t)div ? (int)nread : div;
+    if (!is_whole_block(db_file,iblock,n)) { /* ERROR, EOF OR SHORT READ */
+      n= -1;
+      goto finally_return_result;
+    }
+    memcpy(im,buf,n*sizeof(IntervalMap));
+    DB_FILE_LOCK();
+    for (i=1;i<=nahead && (size_t)i*div<nread;i++) { /* LAST MAY BE PARTIAL */
+      nrec=(int)(nread-i*div);
+      if (nrec>div)
+	nrec=div;
+      if (is_whole_block(db_file,iblock+i,nrec)) /* NEVER CACHE A SHORT READ */
+	block_cache_add(db_file->file_id,iblock+i,buf+i*div,nrec,1);
+    }
+    DB_FILE_UNLOCK();
+  }
+ finally_return_result:
+  FREE(buf);
+  FREE(zbuf);
+  return n;
+}
+
+
+/* GET BLOCK iblock (RECORDS iblock*div ... iblock*div+div-1) OF db_file
+   INTO im, WHICH MUST HOLD div RECORDS, FROM THE CACHE IF POSSIBLE.
+   zbuf MUST HOLD db_file->zbuf_size BYTES IF db_file IS COMPRESSED.
+   RETURNS #RECORDS (FEWER AT THE END OF THE FILE), OR -1 IF THE BLOCK IS
+   CORRUPT OR COULD NOT BE READ WHOLE.  A PARTIAL BLOCK IS NEVER CACHED.
+   TAKES THE LOCK ITSELF, BUT NOT WHILE READING THE FILE */
+int read_cached_block(IntervalDBFile *db_file,int iblock,IntervalMap im[],
+		      unsigned char zbuf[])
+{
+  int n= -1,nahead=0;
+  BlockCacheEntry *e;
+  DB_FILE_LOCK();
+  if ((e=block_cache_find(db_file->file_id,iblock))) {
+    block_cache.nhit++;
+    if (e->is_prefetched) { /* OUR READAHEAD PAID OFF */
+      block_cache.nprefetch_hit++;
+      e->is_prefetched=0;
+    }
+    n=e->n;
+    memcpy(im,e->im,n*sizeof(IntervalMap));
+  }
+  else {
+    block_cache.nmiss++;
+    nahead=readahead_window(db_file,iblock);
+  }
+  DB_FILE_UNLOCK();
+  if (n>=0) /* FOUND IN THE CACHE */
+    return n;
+  if (nahead>0 && (n=read_blocks_ahead(db_file,iblock,nahead,im))>=0)
+    return n;
+  if (db_file->is_compressed)
+    n=read_compressed_block(db_file,iblock,im,zbuf);
+  else
+    n=(int)read_file_at(db_file->ifile_idb,im,sizeof(IntervalMap),
+			db_file->div,db_file->idb_offset
+			+(PYGR_OFF_T)iblock*db_file->div*sizeof(IntervalMap));
+  if (!is_whole_block(db_file,iblock,n))
+    return -1;
+  DB_FILE_LOCK();
+  if (block_cache.max_bytes>0)
+    block_cache_add(db_file->file_id,iblock,im,n,0);
+  DB_FILE_UNLOCK();
+  return n;
+}
+
+
+
+/****************************************************************
+ *
+ *   FILE POOL: BOUNDS THE #FILES HELD OPEN BY ALL IntervalDBFile THAT READ
+ *   VIA fread(), SO THAT AN NLMSA WITH 100,000 SEQUENCES CAN RUN UNDER A
+ *   SMALL RLIMIT_NOFILE.  WHEN OVER BUDGET, THE FILES OF THE LEAST RECENTLY
+ *   USED DATABASE ARE CLOSED; file_pool_use() REOPENS THEM TRANSPARENTLY
+ *   THE NEXT TIME THAT DATABASE IS QUERIED.  A DATABASE THAT A SEARCH IS
+ *   READING (BETWEEN file_pool_use() AND file_pool_release()) IS NEVER
+ *   CLOSED.  ITS FUNCTIONS EXPECT THE CALLER TO HOLD THE LOCK, EXCEPT
+ *   WHERE NOTED
+ */
+
+static FilePool file_pool={FILE_POOL_DEFAULT_MAX,0,0,NULL,NULL};
+
+/* #FILES A DATABASE READ VIA fread() KEEPS OPEN */
+#ifdef ON_DEMAND_SUBLIST_HEADER
+#define DBFILE_NFILES(db_file) ((db_file)->nlists>0 ? 2 : 1)
+#else
+#define DBFILE_NFILES(db_file) 1
+#endif
+
+
+/* TAKE A DATABASE OFF THE POOL'S LRU LIST */
+void file_pool_unlink(IntervalDBFile *db_file)
+{
+  if (db_file->pool_prev)
+    db_file->pool_prev->pool_next=db_file->pool_next;
+  else
+    file_pool.first=db_file->pool_next;
+  if (db_file->pool_next)
+    db_file->pool_next->pool_prev=db_file->pool_prev;
+  else
+    file_pool.last=db_file->pool_prev;
+  db_file->pool_prev=db_file->pool_next=NULL;
+  file_pool.nfiles-=db_file->nfile_open;
+  db_file->nfile_open=0;
+}
+
+
+/* ADD A DATABASE HOLDING nfile OPEN FILES AT THE FRONT OF THE LRU LIST */
+void file_pool_link(IntervalDBFile *db_file,int nfile)
+{
+  db_file->pool_prev=NULL;
+  db_file->pool_next=file_pool.first;
+  if (file_pool.first)
+    file_pool.first->pool_prev=db_file;
+  else
+    file_pool.last=db_file;
+  file_pool.first=db_file;
+  db_file->nfile_open=nfile;
+  file_pool.nfiles+=nfile;
+}
+
+
+/* CLOSE A DATABASE'S FILES, LEAVING THE REST OF IT IN MEMORY */
+void file_pool_close(IntervalDBFile *db_file)
+{
+  if (db_file->ifile_idb) {
+    fclose(db_file->ifile_idb);
+    db_file->ifile_idb=NULL;
+  }
+#ifdef ON_DEMAND_SUBLIST_HEADER
+  if (db_file->subheader_file.ifile) {
+    fclose(db_file->subheader_file.ifile);
+    db_file->subheader_file.ifile=NULL;
+  }
+#endif
+  if (db_file->nfile_open>0)
+    file_pool_unlink(db_file);
+}
+
+
+/* CLOSE LEAST RECENTLY USED DATABASES UNTIL nfile MORE FILES FIT, SKIPPING
+   ANY THAT ARE BEING READ.  SO IF ALL ARE BUSY, WE MAY GO OVER BUDGET */
+void file_pool_trim(int nfile)
+{
+  IntervalDBFile *db_file,*db_prev;
+  for (db_file=file_pool.last;
+       db_file && file_pool.nfiles+nfile>file_pool.max_files;
+       db_file=db_prev) {
+    db_prev=db_file->pool_prev;
+    if (db_file->nreader==0)
+      file_pool_close(db_file);
+  }
+}
+
+
+/* OPEN THE FILES OF A DATABASE READ VIA fread(), MAKING ROOM FOR THEM IN
+   THE POOL.  RETURNS 0 ON SUCCESS, OR -1 WITH err_msg SET */
+int file_pool_open(IntervalDBFile *db_file,char err_msg[])
+{
+  char path[2048];
+  PYGR_OFF_T len;
+  file_pool_trim(DBFILE_NFILES(db_file));
+  db_file->ifile_idb=open_db_section(db_file->filestem,db_file->pack,
+				     db_file->is_compressed ? DB_SECTION_IDBZ
+				     : DB_SECTION_IDB,path,
+				     &(db_file->idb_offset),&len);
+  if (!db_file->ifile_idb)
+    goto unable_to_open_file;
+#ifdef ON_DEMAND_SUBLIST_HEADER
+  if (db_file->nlists>0) { /* SUBHEADER BLOCKS ARE READ AS NEEDED */
+    db_file->subheader_file.ifile=
+      open_db_section(db_file->filestem,db_file->pack,DB_SECTION_SUBHEAD,path,
+		      &(db_file->subheader_file.offset),&len);
+    if (!db_file->subheader_file.ifile) {
+      fclose(db_file->ifile_idb);
+      db_file->ifile_idb=NULL;
+      goto unable_to_open_file;
+    }
+  }
+#endif
+  file_pool_link(db_file,DBFILE_NFILES(db_file));
+  return 0;
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  return -1;
+}
+
+
+/* MAKE SURE A DATABASE'S FILES ARE OPEN BEFORE READING IT, MARK IT AS
+   MOST RECENTLY USED, AND KEEP THEM OPEN UNTIL file_pool_release().
+   RETURNS 0 ON SUCCESS, OR -1 (WITH A PYTHON IOError SET) IF ITS FILES
+   COULD NOT BE REOPENED.  TAKES THE LOCK ITSELF */
+int file_pool_use(IntervalDBFile *db_file)
+{
+  int nfile,status=0;
+  char err_msg[2048];
+  if (db_file->is_mapped) /* HOLDS NO FILES OPEN */
+    return 0;
+  DB_FILE_LOCK();
+  if (db_file->nfile_open>0) {
+    if (db_file->pool_prev) { /* MOVE TO FRONT OF THE LRU LIST */
+      nfile=db_file->nfile_open;
+      file_pool_unlink(db_file);
+      file_pool_link(db_file,nfile);
+    }
+  }
+  else {
+    file_pool.nreopen++;
+    status=file_pool_open(db_file,err_msg);
+  }
+  if (status==0)
+    db_file->nreader++;
+  DB_FILE_UNLOCK();
+  if (status==0)
+    return 0;
+#ifdef BUILD_C_LIBRARY
+  fprintf(stderr,"%s\n",err_msg);
+#else
+  PYGR_SET_ERROR(PyExc_IOError,err_msg);
+#endif
+  return -1;
+}
+
+
+/* LET THE POOL CLOSE A DATABASE'S FILES AGAIN, AFTER file_pool_use().
+   TAKES THE LOCK ITSELF */
+void file_pool_release(IntervalDBFile *db_file)
+{
+  if (db_file->is_mapped)
+    return;
+  DB_FILE_LOCK();
+  db_file->nreader--;
+  DB_FILE_UNLOCK();
+}
+
+
+/* CHANGE THE #FILES DATABASES MAY HOLD OPEN, CLOSING FILES AS NEEDED.
+   TAKES THE LOCK ITSELF */
+void file_pool_resize(int max_files)
+{
+  DB_FILE_LOCK();
+  file_pool.max_files=max_files;
+  file_pool_trim(0);
+  DB_FILE_UNLOCK();
+}
+
+
+void file_pool_get_stats(int *p_nfiles,int *p_max_files,long long *p_nreopen)
+{
+  DB_FILE_LOCK();
+  *p_nfiles=file_pool.nfiles;
+  *p_max_files=file_pool.max_files;
+  *p_nreopen=file_pool.nreopen;
+  DB_FILE_UNLOCK();
+}
+
+
+
 /****************************************************************
  *
  *   FILE-BASED SEARCH FUNCTIONS
@@ -478,7 +1091,8 @@ int find_intervals(IntervalIterator *it0,int start,int end,
 
 
 /* READ A BLOCK FROM THE DATABASE FILE */
-int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop)
+int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop,
+	       PYGR_OFF_T base)
 {
   int block;
   PYGR_OFF_T ipos;
@@ -488,15 +1102,14 @@ int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop)
   else /* JUST READ PARTIAL BLOCK AT END */
     block=ntop%div;
   ipos *= sizeof(IntervalMap); /* CALCULATE FILE POSITION IN BYTES */
-  PYGR_FSEEK(ifile,ipos,SEEK_SET);
-  fread(imdiv,sizeof(IntervalMap),block,ifile);
-  return block;
+  return (int)read_file_at(ifile,imdiv,sizeof(IntervalMap),block,base+ipos);
 }
 
 
-/* READ A SUBLIST FROM DATABASE FILE */
+/* READ A SUBLIST FROM DATABASE FILE.  RETURNS NULL IF OUT OF MEMORY OR
+   THE SUBLIST COULD NOT BE READ WHOLE */
 IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,
-			  IntervalMap *im)
+			  IntervalMap *im,PYGR_OFF_T base)
 {
   PYGR_OFF_T ipos;
   if (im==NULL) {
@@ -504,17 +1117,19 @@ IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,
   }
   ipos=subheader->start; /* CALCULATE POSITION IN RECORDS */
   ipos*=sizeof(IntervalMap);  /* CALCULATE FILE POSITION IN BYTES */
-  PYGR_FSEEK(ifile,ipos,SEEK_SET);
-  fread(im,sizeof(IntervalMap),subheader->len,ifile);
+  if (read_file_at(ifile,im,sizeof(IntervalMap),subheader->len,base+ipos)
+      !=(size_t)subheader->len)
+    return NULL;
   return im;
  handle_malloc_failure:
   return NULL;
 }
 
 
-/* READ A BLOCK OF THE SUBLIST HEADER FILE */
+/* READ A BLOCK OF THE SUBLIST HEADER FILE.  CALLER MUST HOLD THE LOCK,
+   SINCE THE BLOCK BUFFER AND FILE POSITION ARE SHARED */
 int read_subheader_block(SublistHeader subheader[],int isub,int nblock,
-			 int nsubheader,FILE *ifile)
+			 int nsubheader,FILE *ifile,PYGR_OFF_T base)
 {
   PYGR_OFF_T ipos;
   long start;
@@ -523,35 +1138,175 @@ int read_subheader_block(SublistHeader subheader[],int isub,int nblock,
     nblock=nsubheader-start; /* TRUNCATE TO FIT MAX FILE LENGTH */
   ipos=start; /* CONVERT TO off_t TYPE */
   ipos *= sizeof(SublistHeader); /* CALCULATE ACTUAL BYTE OFFSET */
-  PYGR_FSEEK(ifile,ipos,SEEK_SET);
-  fread(subheader,sizeof(SublistHeader),nblock,ifile);
+  read_file_at(ifile,subheader,sizeof(SublistHeader),nblock,base+ipos);
   return start;
 }
 
 
 
 
-int find_file_start(IntervalIterator *it,int start,int end,int isub,
-		    IntervalIndex ii[],int nii,
-		    SublistHeader *subheader,int nlists,
-                    SubheaderFile *subheader_file,
-		    int ntop,int div,FILE *ifile)
+/* MAKE SURE THE ITERATOR HAS ITS OWN BUFFER OF AT LEAST n RECORDS.
+   ITERATORS ARE REUSED ACROSS DATABASES, SO THE OLD ONE MAY BE TOO SMALL */
+int alloc_iterator_buffer(IntervalIterator *it,int n)
+{
+  if (it->im && !it->im_is_mapped) {
+    if (it->im_nalloc>=n) /* ALREADY BIG ENOUGH */
+      return 0;
+    free(it->im);
+  }
+  it->im_is_mapped=0;
+  it->im_nalloc=0;
+  CALLOC(it->im,n,IntervalMap);
+  it->im_nalloc=n;
+  return 0;
+ handle_malloc_failure:
+  it->im=NULL;
+  return FIND_FILE_MALLOC_ERR;
+}
+
+
+/* GIVE THE ITERATOR ITS OWN BUFFER FOR READING COMPRESSED BLOCKS OF
+   db_file, SO THAT THREADS SEARCHING THE SAME DATABASE DON'T SHARE ONE */
+int alloc_iterator_zbuf(IntervalIterator *it,IntervalDBFile *db_file)
+{
+  if (it->zbuf_nalloc>=db_file->zbuf_size) /* ALREADY BIG ENOUGH */
+    return 0;
+  FREE(it->zbuf);
+  it->zbuf_nalloc=0;
+  CALLOC(it->zbuf,db_file->zbuf_size,unsigned char);
+  it->zbuf_nalloc=db_file->zbuf_size;
+  return 0;
+ handle_malloc_failure:
+  return FIND_FILE_MALLOC_ERR;
+}
+
+
+/* COMPRESSED FILES MUST BE READ BY WHOLE BLOCKS; OTHER FILES THAT AREN'T
+   MAPPED ARE READ BY WHOLE BLOCKS ONLY TO SHARE THEM VIA THE BLOCK CACHE */
+#define USE_BLOCK_CACHE(db_file) ((db_file)->is_compressed \
+  || (!(db_file)->is_mapped && block_cache.max_bytes>0))
+
+/* SET A PYTHON IOError FOR A BLOCK OF db_file THAT COULD NOT BE READ */
+int block_read_error(IntervalDBFile *db_file,int iblock)
+{
+  char err_msg[1024];
+  sprintf(err_msg,"unable to read block %d of %s: file truncated or corrupted?",
+	  iblock,db_file->filestem ? db_file->filestem : "interval database");
+  PYGR_SET_ERROR(PyExc_IOError,err_msg);
+  return FIND_FILE_READ_ERR;
+}
+
+
+/* LOAD A BLOCK FOR THE ITERATOR, EITHER BY POINTING INTO THE FILE MAPPING
+   OR BY READING IT INTO THE ITERATOR'S OWN BUFFER.  RETURNS ITS #RECORDS,
+   FIND_FILE_MALLOC_ERR, OR FIND_FILE_READ_ERR WITH A PYTHON IOError SET */
+int load_imdiv(IntervalIterator *it,IntervalDBFile *db_file,int i_div,int ntop)
+{
+  int div=db_file->div,nblock;
+  it->i_div_loaded= -1; /* UNTIL WE HAVE LOADED IT SUCCESSFULLY */
+  if ((i_div+1)*div<=ntop) /* A WHOLE BLOCK */
+    nblock=div;
+  else /* JUST A PARTIAL BLOCK AT END */
+    nblock=ntop%div;
+  if (USE_BLOCK_CACHE(db_file)) { /* GET JUST THIS ONE BLOCK */
+    if (alloc_iterator_buffer(it,2*div) /* load_sublist NEEDS 2*div */
+	|| alloc_iterator_zbuf(it,db_file))
+      return FIND_FILE_MALLOC_ERR;
+    if (read_cached_block(db_file,i_div,it->im,it->zbuf)<nblock)
+      return block_read_error(db_file,i_div);
+    it->i_div_loaded=i_div;
+    return nblock;
+  }
+  if (db_file->is_mapped) {
+    if (it->im && !it->im_is_mapped) /* DUMP BUFFER FROM A PREVIOUS FILE READ */
+      free(it->im);
+    it->im=db_file->im_map + (PYGR_OFF_T)div*i_div; /* NO COPY! */
+    it->im_is_mapped=1;
+    it->i_div_loaded=i_div;
+    return nblock;
+  }
+  if (alloc_iterator_buffer(it,div)) /* ALWAYS ALLOCATE div BUFFERSIZE */
+    return FIND_FILE_MALLOC_ERR;
+  if (read_imdiv(db_file->ifile_idb,it->im,div,i_div,ntop,
+		 db_file->idb_offset)!=nblock)
+    return block_read_error(db_file,i_div);
+  it->i_div_loaded=i_div;
+  return nblock;
+}
+
+
+/* LOAD A SMALL (<=div) SUBLIST FOR THE ITERATOR.  RETURNS AS load_imdiv() */
+int load_sublist(IntervalIterator *it,IntervalDBFile *db_file,
+		 SublistHeader *subheader)
+{
+  int div=db_file->div,i_div,offset,n,n2;
+  it->i_div_loaded= -1; /* NOT A WHOLE BLOCK */
+  if (USE_BLOCK_CACHE(db_file)) { /* GET THE ONE OR TWO BLOCKS HOLDING IT */
+    if (alloc_iterator_buffer(it,2*div) || alloc_iterator_zbuf(it,db_file))
+      return FIND_FILE_MALLOC_ERR;
+    i_div=subheader->start/div;
+    offset=subheader->start%div;
+    n=read_cached_block(db_file,i_div,it->im,it->zbuf);
+    if (n<0)
+      return block_read_error(db_file,i_div);
+    if (n==div && offset+subheader->len>div) { /* RUNS INTO THE NEXT BLOCK */
+      if ((n2=read_cached_block(db_file,i_div+1,it->im+div,it->zbuf))<0)
+	return block_read_error(db_file,i_div+1);
+      n+=n2;
+    }
+    if (n<offset+subheader->len) /* BLOCK TOO SHORT FOR THIS SUBLIST */
+      return block_read_error(db_file,i_div);
+    if (offset>0) /* SHIFT THE SUBLIST TO THE START OF OUR BUFFER */
+      memmove(it->im,it->im+offset,subheader->len*sizeof(IntervalMap));
+    return subheader->len;
+  }
+  if (db_file->is_mapped) {
+    if (it->im && !it->im_is_mapped) /* DUMP BUFFER FROM A PREVIOUS FILE READ */
+      free(it->im);
+    it->im=db_file->im_map + subheader->start; /* NO COPY! */
+    it->im_is_mapped=1;
+    return subheader->len;
+  }
+  if (alloc_iterator_buffer(it,div)) /* ALWAYS ALLOCATE div BUFFERSIZE */
+    return FIND_FILE_MALLOC_ERR;
+  if (!read_sublist(db_file->ifile_idb,subheader,it->im, /* <=div ITEMS */
+		    db_file->idb_offset))
+    return block_read_error(db_file,subheader->start/div);
+  return subheader->len;
+}
+
+
+int find_file_start(IntervalIterator *it,IntervalCoord start,IntervalCoord end,int isub,
+		    IntervalDBFile *db_file)
 {
-  int i_div= -1,offset=0,offset_div=0;
+  int i_div= -1,offset=0,offset_div=0,ntop,nii,div;
+  IntervalIndex *ii;
+  SublistHeader *subheader=NULL,subheader_copy;
+  SubheaderFile *subheader_file;
+  ii=db_file->ii;
+  nii=db_file->nii;
+  ntop=db_file->ntop;
+  div=db_file->div;
   if (isub<0)  /* TOP-LEVEL SEARCH: USE THE INDEX */
     i_div=find_index_start(start,end,ii,nii);
   else { /* GET PTR TO subheader[isub] */
+    subheader_file= &(db_file->subheader_file);
 #ifdef ON_DEMAND_SUBLIST_HEADER
-    if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
-	|| isub>=subheader_file->start+subheader_file->nblock)
-      subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
-	read_subheader_block(subheader_file->subheader,isub,
-			     subheader_file->nblock,nlists,
-			     subheader_file->ifile);
-    subheader=subheader_file->subheader + (isub-subheader_file->start);
-#else
-    subheader += isub; /* POINT TO OUR SUBHEADER */
+    if (subheader_file->ifile) { /* READ SUBHEADER BLOCKS FROM DISK */
+      DB_FILE_LOCK(); /* ANOTHER THREAD MAY BE LOADING A DIFFERENT BLOCK */
+      if (isub<subheader_file->start /* isub OUTSIDE OUR CURRENT BLOCK */
+	  || isub>=subheader_file->start+subheader_file->nblock)
+	subheader_file->start=  /* LOAD NEW BLOCK FROM DISK */
+	  read_subheader_block(subheader_file->subheader,isub,
+			       subheader_file->nblock,db_file->nlists,
+			       subheader_file->ifile,subheader_file->offset);
+      subheader_copy=subheader_file->subheader[isub-subheader_file->start];
+      DB_FILE_UNLOCK();
+      subheader= &subheader_copy; /* OUR OWN COPY, SAFE FROM OTHER THREADS */
+    }
+    else /* WHOLE SUBHEADER IS ALREADY IN MEMORY, E.G. MAPPED */
 #endif
+      subheader=db_file->subheader + isub; /* POINT TO OUR SUBHEADER */
     if (subheader->len>div) { /* BIG SUBLIST, SO USE THE INDEX */
       offset=subheader->start;
       offset_div=offset/div;/* offset GUARANTEED TO BE MULTIPLE OF div */
@@ -563,39 +1318,35 @@ int find_file_start(IntervalIterator *it,int start,int end,int isub,
     }
   }
 
-  if (!it->im) { /* NO ALLOCATION? ALLOCATE OUR BLOCK SIZE div */
-    CALLOC(it->im,div,IntervalMap); /* ALWAYS ALLOCATE div BUFFERSIZE */
-  }
   if (i_div>=0) { /* READ A SPECIFIC BLOCK OF SIZE div */
-    it->n=read_imdiv(ifile,it->im,div,i_div+offset_div,ntop+offset);
+    it->n=load_imdiv(it,db_file,i_div+offset_div,ntop+offset);
     it->ntop=ntop+offset; /* END OF THIS LIST IN THE BINARY FILE */
     it->nii=nii+offset_div; /* SAVE INFORMATION FOR READING SUBSEQUENT BLOCKS */
     it->i_div=i_div+offset_div; /* INDEX OF THIS BLOCK IN THE BINARY FILE */
   }
   else { /* A SMALL SUBLIST: READ THE WHOLE LIST INTO MEMORY */
-    read_sublist(ifile,subheader,it->im); /* GUARANTEED TO BE <=div ITEMS */
-    it->n=subheader->len;
+    it->n=load_sublist(it,db_file,subheader);
     it->nii=1;
     it->i_div=0; /* INDICATE THAT THERE ARE NO ADDITIONAL BLOCKS TO READ*/
   }
+  if (FIND_FILE_ERR(it->n))
+    return it->n; /* SIGNAL THAT A MEMORY OR READ ERROR OCCURRED */
 
   it->i=find_overlap_start(start,end,it->im,it->n);
   return it->i;
- handle_malloc_failure:
-  return -2; /* SIGNAL THAT MEMORY ERROR OCCURRED */
 }
 
 
-int find_file_intervals(IntervalIterator *it0,int start,int end,
-			IntervalIndex ii[],int nii,
-			SublistHeader subheader[],int nlists,
-			SubheaderFile *subheader_file,
-			int ntop,int div,FILE *ifile,
+int find_file_intervals(IntervalIterator *it0,IntervalCoord start,
+			IntervalCoord end,IntervalDBFile *db_file,
 			IntervalMap buf[],int nbuf,
 			int *p_nreturn,IntervalIterator **it_return)
 {
   IntervalIterator *it=NULL,*it2=NULL;
   int k,ibuf=0,ori_sign=1,ov=0;
+  IntervalCoord tmp;
+  if (file_pool_use(db_file)) /* (RE)OPEN ITS FILES, AND KEEP THEM OPEN */
+    return -1;
   if (!it0) { /* ALLOCATE AN ITERATOR IF NOT SUPPLIED*/
     CALLOC(it,1,IntervalIterator);
   }
@@ -604,17 +1355,18 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 
 #if defined(ALL_POSITIVE_ORIENTATION) || defined(MERGE_INTERVAL_ORIENTATIONS)
   if (start<0) { /* NEED TO CONVERT TO POSITIVE ORIENTATION */
-    k=start;
+    tmp=start;
     start= -end;
-    end= -k;
+    end= -tmp;
     ori_sign = -1;
   }
 #endif
 
-  if (it->n == 0)  /* DEFAULT: SEARCH THE TOP NESTED LIST */
-    if (find_file_start(it,start,end,-1,ii,nii,subheader,nlists,
-			subheader_file,ntop,div,ifile) == FIND_FILE_MALLOC_ERR)
+  if (it->n == 0) { /* DEFAULT: SEARCH THE TOP NESTED LIST */
+    ov=find_file_start(it,start,end,-1,db_file);
+    if (FIND_FILE_ERR(ov))
       goto handle_malloc_failure;
+  }
   
   do { /* ITERATOR STACK LOOP */
     while (it->i_div < it->nii) { /* BLOCK ITERATION LOOP */
@@ -625,10 +1377,9 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 	k=it->im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
 	it->i++; /* ADVANCE TO NEXT INTERVAL */
 	PUSH_ITERATOR_STACK(it,it2,IntervalIterator); /* RECURSE TO SUBLIST */
-	if (k>=0 && (ov=find_file_start(it2,start,end,k,ii,nii,subheader,nlists,
-					subheader_file,ntop,div,ifile))>=0)
+	if (k>=0 && (ov=find_file_start(it2,start,end,k,db_file))>=0)
 	  it=it2; /* PUSH THE ITERATOR STACK */
-	if (FIND_FILE_MALLOC_ERR == ov)
+	if (FIND_FILE_ERR(ov))
 	  goto handle_malloc_failure;
 	
 	if (ibuf>=nbuf)  /* FILLED THE BUFFER, RETURN THE RESULTS SO FAR */
@@ -637,7 +1388,9 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
       it->i_div++; /* TRY GOING TO NEXT BLOCK */
       if (it->i == it->n  /* USED WHOLE BLOCK, SO THERE MIGHT BE MORE */
 	  && it->i_div < it->nii) { /* CONTINUE TO NEXT BLOCK */
-	it->n=read_imdiv(ifile,it->im,div,it->i_div,it->ntop); /*READ NEXT BLOCK*/
+	it->n=load_imdiv(it,db_file,it->i_div,it->ntop); /*READ NEXT BLOCK*/
+	if (FIND_FILE_ERR(it->n))
+	  goto handle_malloc_failure;
 	it->i=0; /* PROCESS IT FROM ITS START */
       }
     }
@@ -652,8 +1405,10 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 #endif
   *p_nreturn=ibuf; /* #INTERVALS FOUND IN THIS PASS */
   *it_return=it; /* HAND BACK ITERATOR FOR CONTINUING THE SEARCH, IF ANY */
+  file_pool_release(db_file);
   return 0; /* SIGNAL THAT NO ERROR OCCURRED */
  handle_malloc_failure:
+  file_pool_release(db_file);
   return -1;
 }
 
@@ -662,36 +1417,580 @@ int find_file_intervals(IntervalIterator *it0,int start,int end,
 
 
 
-/* FUNCTIONS FOR READING AND WRITING OF THE BINARY DATABASE FILES */
+/****************************************************************
+ *
+ *   ORDERED SCAN: READ ALL INTERVALS OF A DATABASE OVERLAPPING A LARGE
+ *   REGION, E.G. A WHOLE SEQUENCE, IN start ORDER.  EACH NESTED LIST IS
+ *   READ FRONT TO BACK BY ITS OWN CURSOR, WITH ONE INDEX SEARCH PER LIST
+ *   INSTEAD OF ONE PER QUERY WINDOW, AND A SUBLIST IS STARTED WHEN ITS
+ *   PARENT INTERVAL IS REACHED.  SINCE EVERY LIST IS SORTED, A HEAP OF THE
+ *   CURSORS MERGES THEM INTO ONE start-ORDERED STREAM
+ */
 
-int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
+
+/* TELL THE OS WE ARE ABOUT TO READ db_file FRONT TO BACK, SO THAT IT
+   READS AHEAD AGGRESSIVELY, OR (is_sequential=0) THAT WE ARE DONE */
+void advise_sequential_read(IntervalDBFile *db_file,int is_sequential)
 {
-  int i,npad;
-  fwrite(im,sizeof(IntervalMap),n,ifile); /* SAVE THE ACTUAL DATA */
-  npad=n%div;
-  if (npad) {
-    npad=div-npad; /* #ITEMS NEEDED TO PAD TO AN EXACT MULTIPLE OF div */
-    for (i=0;i<npad;i++) /* GUARANTEED im HAS AT LEAST ONE RECORD */
-      fwrite(im,sizeof(IntervalMap),1,ifile); /*THIS IS JUST PADDING */
+#ifndef _WIN32
+  if (db_file->is_mapped) {
+    if (db_file->map_idb.map_p)
+      madvise(db_file->map_idb.map_p,db_file->map_idb.map_len,
+	      is_sequential ? MADV_SEQUENTIAL : MADV_NORMAL);
   }
-  return n+npad; /* #RECORDS SAVED */
+#ifdef POSIX_FADV_SEQUENTIAL
+  else if (db_file->ifile_idb)
+    posix_fadvise(fileno(db_file->ifile_idb),0,0,
+		  is_sequential ? POSIX_FADV_SEQUENTIAL : POSIX_FADV_NORMAL);
+#endif
+#endif
 }
 
 
-int repack_subheaders(IntervalMap im[],int n,int div,
-		      SublistHeader *subheader,int nlists)
+/* SCAN [start:end) OF THE ndb DATABASES db_file, E.G. A DATABASE AND ITS
+   DELTA DATABASE.  ALL INTERVALS ARE STORED IN POSITIVE ORIENTATION, SO
+   start,end MUST BE TOO.  NOTHING IS READ UNTIL interval_scan_next() */
+IntervalScan *interval_scan_alloc(IntervalDBFile *db_file[],int ndb,
+				  IntervalCoord start,IntervalCoord end)
 {
-  int i,j,*sub_map=NULL;
-  SublistHeader *sub_pack=NULL;
-
-  CALLOC(sub_map,nlists,int);
-  CALLOC(sub_pack,nlists,SublistHeader);
-  for (i=j=0;i<nlists;i++) { /* PLACE SUBLISTS W/ len>div AT FRONT */
-    if (subheader[i].len>div) {
-      memcpy(sub_pack+j,subheader+i,sizeof(SublistHeader));
-      sub_map[i]=j;
-      j++;
-    }
+  IntervalScan *scan=NULL;
+  CALLOC(scan,1,IntervalScan);
+  scan->start=start;
+  scan->end=end;
+  if (ndb>0) {
+    CALLOC(scan->db_file,ndb,IntervalDBFile *);
+    memcpy(scan->db_file,db_file,ndb*sizeof(IntervalDBFile *));
+  }
+  scan->ndb=ndb;
+  return scan;
+ handle_malloc_failure:
+  free_interval_scan(scan);
+  return NULL;
+}
+
+
+void free_interval_scan(IntervalScan *scan)
+{
+  int i;
+  if (!scan)
+    return;
+  for (i=0;i<scan->ncursor;i++)
+    free_interval_iterator(scan->cursor[i]);
+  FREE(scan->cursor);
+  FREE(scan->cursor_db);
+  FREE(scan->heap);
+  FREE(scan->idle);
+  FREE(scan->db_file);
+  free(scan);
+}
+
+
+/* THE CURRENT INTERVAL OF CURSOR j */
+#define SCAN_HEAD(scan,j) ((scan)->cursor[j]->im+(scan)->cursor[j]->i)
+#define SCAN_LESS(scan,j,k) (imstart_qsort_cmp(SCAN_HEAD(scan,j),\
+					       SCAN_HEAD(scan,k))<0)
+
+/* RESTORE HEAP ORDER BELOW POSITION i OF THE HEAP OF CURSORS */
+void interval_scan_sift_down(IntervalScan *scan,int i)
+{
+  int child,tmp;
+  while ((child=2*i+1)<scan->nheap) {
+    if (child+1<scan->nheap
+	&& SCAN_LESS(scan,scan->heap[child+1],scan->heap[child]))
+      child++; /* PICK THE SMALLER CHILD */
+    if (!SCAN_LESS(scan,scan->heap[child],scan->heap[i]))
+      break;
+    tmp=scan->heap[i];
+    scan->heap[i]=scan->heap[child];
+    scan->heap[child]=tmp;
+    i=child;
+  }
+}
+
+
+/* RESTORE HEAP ORDER ABOVE POSITION i OF THE HEAP OF CURSORS */
+void interval_scan_sift_up(IntervalScan *scan,int i)
+{
+  int parent,tmp;
+  while (i>0) {
+    parent=(i-1)/2;
+    if (!SCAN_LESS(scan,scan->heap[i],scan->heap[parent]))
+      break;
+    tmp=scan->heap[i];
+    scan->heap[i]=scan->heap[parent];
+    scan->heap[parent]=tmp;
+    i=parent;
+  }
+}
+
+
+/* START READING LIST isub (-1 FOR THE TOP-LEVEL LIST) OF db_file AT ITS
+   FIRST INTERVAL OVERLAPPING [start:end), AND ADD ITS CURSOR TO THE HEAP
+   IF THERE IS ONE.  RETURNS 0, OR -1 IF OUT OF MEMORY */
+int interval_scan_push(IntervalScan *scan,IntervalDBFile *db_file,int isub)
+{
+  int i,j,n;
+  if (scan->nidle==0) { /* ALL CURSORS BUSY, SO ADD SOME MORE */
+    n=2*scan->ncursor+4;
+    REALLOC(scan->cursor,n,IntervalIterator *);
+    REALLOC(scan->cursor_db,n,IntervalDBFile *);
+    REALLOC(scan->heap,n,int);
+    REALLOC(scan->idle,n,int);
+    for (j=n-1;j>=scan->ncursor;j--) {
+      scan->cursor[j]=NULL; /* ITS ITERATOR IS ALLOCATED WHEN FIRST USED */
+      scan->idle[scan->nidle++]=j;
+    }
+    scan->ncursor=n;
+  }
+  j=scan->idle[scan->nidle-1];
+  if (!scan->cursor[j]) {
+    CALLOC(scan->cursor[j],1,IntervalIterator);
+  }
+  scan->cursor_db[j]=db_file;
+  i=find_file_start(scan->cursor[j],scan->start,scan->end,isub,db_file);
+  if (FIND_FILE_ERR(i))
+    return -1;
+  if (i>=0) { /* HAS AN OVERLAPPING INTERVAL, SO ADD TO THE HEAP */
+    scan->nidle--;
+    scan->heap[scan->nheap]=j;
+    interval_scan_sift_up(scan,scan->nheap++);
+  }
+  return 0;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+/* MOVE CURSOR j TO THE NEXT INTERVAL OF ITS LIST, READING THE NEXT BLOCK
+   IF NEEDED.  RETURNS 1 IF THAT INTERVAL OVERLAPS [start:end), 0 IF THE
+   LIST HAS NO MORE THAT DO, OR -1 IF OUT OF MEMORY OR A BLOCK COULD NOT BE READ */
+int interval_scan_advance(IntervalScan *scan,int j)
+{
+  IntervalIterator *it=scan->cursor[j];
+  it->i++;
+  if (it->i==it->n && it->i_div+1<it->nii) { /* USED WHOLE BLOCK: READ NEXT */
+    it->i_div++;
+    it->n=load_imdiv(it,scan->cursor_db[j],it->i_div,it->ntop);
+    if (FIND_FILE_ERR(it->n))
+      return -1;
+    it->i=0;
+  }
+  /* A LIST HAS NO CONTAINED INTERVALS, SO ITS ends ARE SORTED TOO: ONLY
+     start CAN TAKE US PAST THE END OF THE REGION */
+  return it->i<it->n && START_POSITIVE(it->im[it->i])<scan->end;
+}
+
+
+/* COPY UP TO nbuf MORE INTERVALS TO buf, IN start ORDER (LONGER INTERVALS
+   FIRST, AS imstart_qsort_cmp() SORTS THEM).  RETURNS THEIR NUMBER, 0
+   WHEN THE SCAN IS DONE, OR -1 WITH A PYTHON EXCEPTION SET IF OUT OF
+   MEMORY OR A DATABASE'S FILES COULD NOT BE REOPENED */
+int interval_scan_next(IntervalScan *scan,IntervalMap buf[],int nbuf)
+{
+  int i,j,k,n=0,status=0;
+  IntervalIterator *it;
+  IntervalDBFile *db_file;
+  for (i=0;i<scan->ndb;i++) /* (RE)OPEN THEIR FILES, AND KEEP THEM OPEN */
+    if (file_pool_use(scan->db_file[i])) {
+      while (--i>=0)
+	file_pool_release(scan->db_file[i]);
+      return -1;
+    }
+  if (!scan->is_started) { /* START WITH THE TOP-LEVEL LISTS */
+    scan->is_started=1;
+    for (i=0;i<scan->ndb;i++) {
+      advise_sequential_read(scan->db_file[i],1);
+      if ((status=interval_scan_push(scan,scan->db_file[i],-1)))
+	goto finally_return_result;
+    }
+  }
+  while (n<nbuf && scan->nheap>0) {
+    j=scan->heap[0]; /* CURSOR WITH THE SMALLEST CURRENT INTERVAL */
+    it=scan->cursor[j];
+    db_file=scan->cursor_db[j];
+    memcpy(buf+n,it->im+it->i,sizeof(IntervalMap)); /* SAVE THIS HIT */
+    n++;
+    k=it->im[it->i].sublist; /* GET SUBLIST OF i IF ANY */
+    if ((status=interval_scan_advance(scan,j))<0)
+      goto finally_return_result;
+    if (status==0) { /* THIS LIST IS DONE */
+      scan->heap[0]=scan->heap[--scan->nheap];
+      scan->idle[scan->nidle++]=j;
+    }
+    interval_scan_sift_down(scan,0);
+    /* ITS SUBLIST STARTS NO EARLIER THAN IT, SO CAN JOIN THE MERGE NOW */
+    if (k>=0 && (status=interval_scan_push(scan,db_file,k)))
+      goto finally_return_result;
+    status=0;
+  }
+  if (scan->nheap==0) /* SCAN IS DONE */
+    for (i=0;i<scan->ndb;i++)
+      advise_sequential_read(scan->db_file[i],0);
+ finally_return_result:
+  for (i=0;i<scan->ndb;i++)
+    file_pool_release(scan->db_file[i]);
+  return status<0 ? -1 : n;
+}
+
+
+
+
+/****************************************************************
+ *
+ *   BATCH SEARCH FUNCTIONS: MANY QUERY INTERVALS AT ONCE
+ */
+
+typedef struct { /* ONE QUERY OF A BATCH, AND ITS POSITION IN THE BATCH */
+  IntervalCoord start;
+  IntervalCoord end;
+  int iquery;
+} BatchQuery;
+
+/* POSITIVE-ORIENTATION COORDINATES OF A QUERY, SINCE find_intervals()
+   SEARCHES A MINUS-ORIENTATION QUERY AS ITS POSITIVE EQUIVALENT */
+#define QUERY_START_POSITIVE(Q) (((Q).start>=0) ? ((Q).start) : -((Q).end))
+#define QUERY_END_POSITIVE(Q) (((Q).start>=0) ? ((Q).end) : -((Q).start))
+
+int batchquery_qsort_cmp(const void *void_a,const void *void_b)
+{ /* ORDER BY POSITIVE start, LONGER INTERVALS FIRST */
+  const BatchQuery *a=(const BatchQuery *)void_a,*b=(const BatchQuery *)void_b;
+  if (QUERY_START_POSITIVE(*a)<QUERY_START_POSITIVE(*b))
+    return -1;
+  else if (QUERY_START_POSITIVE(*a)>QUERY_START_POSITIVE(*b))
+    return 1;
+  else if (QUERY_END_POSITIVE(*a)>QUERY_END_POSITIVE(*b))
+    return -1;
+  else if (QUERY_END_POSITIVE(*a)<QUERY_END_POSITIVE(*b))
+    return 1;
+  else
+    return 0;
+}
+
+
+/* RETURN THE QUERIES SORTED BY POSITIVE-ORIENTATION start, SO THAT
+   SUCCESSIVE SEARCHES VISIT THE NESTED LIST IN ORDER */
+BatchQuery *sort_batch_queries(int nquery,IntervalCoord starts[],
+				IntervalCoord ends[])
+{
+  int i;
+  BatchQuery *bq=NULL;
+  CALLOC(bq,nquery,BatchQuery);
+  for (i=0;i<nquery;i++) {
+    bq[i].start=starts[i];
+    bq[i].end=ends[i];
+    bq[i].iquery=i;
+  }
+  qsort(bq,nquery,sizeof(BatchQuery),batchquery_qsort_cmp);
+  return bq;
+ handle_malloc_failure:
+  return NULL;
+}
+
+
+int batch_hits_append(BatchHits *hits,IntervalMap im[],int n,int iquery)
+{
+  int i,nalloc;
+  if (hits->n+n>hits->nalloc) { /* EXPAND BY DOUBLING */
+    nalloc=hits->nalloc>0 ? hits->nalloc : 1024;
+    while (nalloc<hits->n+n)
+      nalloc*=2;
+    REALLOC(hits->im,nalloc,IntervalMap);
+    REALLOC(hits->iquery,nalloc,int);
+    hits->nalloc=nalloc;
+  }
+  memcpy(hits->im+hits->n,im,n*sizeof(IntervalMap));
+  for (i=0;i<n;i++)
+    hits->iquery[hits->n+i]=iquery;
+  hits->n+=n;
+  return hits->n;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+void free_batch_hits(BatchHits *hits)
+{
+  FREE(hits->im);
+  FREE(hits->iquery);
+  hits->n=hits->nalloc=0;
+}
+
+
+/* STABLE COUNTING SORT OF hits BY iquery, WHICH MUST BE IN [0,nquery) */
+int sort_batch_hits(BatchHits *hits,int nquery)
+{
+  int i,j,*count=NULL,*iquery=NULL;
+  IntervalMap *im=NULL;
+  if (hits->n<=0)
+    return 0;
+  CALLOC(count,nquery+1,int);
+  CALLOC(im,hits->n,IntervalMap);
+  CALLOC(iquery,hits->n,int);
+  for (i=0;i<hits->n;i++) /* HISTOGRAM OF HITS PER QUERY */
+    count[hits->iquery[i]+1]++;
+  for (i=0;i<nquery;i++) /* CONVERT TO STARTING OFFSET OF EACH QUERY */
+    count[i+1]+=count[i];
+  for (i=0;i<hits->n;i++) {
+    j=count[hits->iquery[i]]++;
+    memcpy(im+j,hits->im+i,sizeof(IntervalMap));
+    iquery[j]=hits->iquery[i];
+  }
+  free(count);
+  free(hits->im);
+  free(hits->iquery);
+  hits->im=im;
+  hits->iquery=iquery;
+  hits->nalloc=hits->n;
+  return hits->n;
+ handle_malloc_failure:
+  FREE(count);
+  FREE(im);
+  FREE(iquery);
+  return -1;
+}
+
+
+/* ORDER DEPTH EVENTS BY GROUP, THEN POSITION */
+static int depth_event_qsort_cmp(const void *void_a,const void *void_b)
+{
+  const DepthEvent *a=void_a,*b=void_b;
+  if (a->group<b->group)
+    return -1;
+  else if (a->group>b->group)
+    return 1;
+  else if (a->pos<b->pos)
+    return -1;
+  else if (a->pos>b->pos)
+    return 1;
+  return 0;
+}
+
+
+/* APPEND [start:end) AT depth TO runs, EXTENDING THE LAST RUN IF IT IS
+   THE SAME GROUP AND DEPTH, AND ENDS WHERE THIS ONE STARTS */
+static int coverage_runs_append(CoverageRuns *runs,IntervalCoord start,
+				IntervalCoord end,int group,int depth)
+{
+  int nalloc;
+  CoverageRun *last;
+  if (runs->n>0) {
+    last=runs->run+runs->n-1;
+    if (last->group==group && last->depth==depth && last->end==start) {
+      last->end=end;
+      return runs->n;
+    }
+  }
+  if (runs->n>=runs->nalloc) { /* EXPAND BY DOUBLING */
+    nalloc=runs->nalloc>0 ? 2*runs->nalloc : 1024;
+    REALLOC(runs->run,nalloc,CoverageRun);
+    runs->nalloc=nalloc;
+  }
+  runs->run[runs->n].start=start;
+  runs->run[runs->n].end=end;
+  runs->run[runs->n].group=group;
+  runs->run[runs->n].depth=depth;
+  return ++runs->n;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+/* SWEEP THE n HITS im[] (E.G. FROM find_batch()), ALREADY CLIPPED TO
+   [start:end), APPENDING TO runs THE RUNS OF CONSTANT DEPTH (NUMBER OF
+   OVERLAPPING HITS) THAT TILE [start:end), SEPARATELY FOR EACH GROUP
+   0..ngroup-1 IN TURN.  igroup[i] GIVES THE GROUP OF im[i]; HITS WITH A
+   NEGATIVE GROUP ARE SKIPPED.  RETURNS runs->n, OR -1 ON ERROR */
+int coverage_runs(IntervalMap im[],int igroup[],int n,int ngroup,
+		  IntervalCoord start,IntervalCoord end,CoverageRuns *runs)
+{
+  int i,j,g,nev=0,depth;
+  IntervalCoord pos;
+  DepthEvent *ev=NULL;
+  if (n>0) {
+    CALLOC(ev,2*n,DepthEvent);
+  }
+  for (i=0;i<n;i++) { /* ONE EVENT WHERE EACH HIT STARTS, ONE WHERE IT ENDS */
+    if (igroup[i]<0 || igroup[i]>=ngroup)
+      continue;
+    ev[nev].group=ev[nev+1].group=igroup[i];
+    ev[nev].pos= im[i].start>start ? im[i].start : start;
+    ev[nev].delta=1;
+    ev[nev+1].pos= im[i].end<end ? im[i].end : end;
+    ev[nev+1].delta= -1;
+    if (ev[nev].pos<ev[nev+1].pos) /* SKIP EMPTY INTERVALS */
+      nev+=2;
+  }
+  if (nev>0)
+    qsort(ev,nev,sizeof(DepthEvent),depth_event_qsort_cmp);
+  for (g=j=0;g<ngroup;g++) {
+    pos=start;
+    depth=0;
+    for (;j<nev && ev[j].group==g;j++) {
+      if (ev[j].pos>pos) { /* DEPTH WAS CONSTANT OVER [pos:ev[j].pos) */
+	if (coverage_runs_append(runs,pos,ev[j].pos,g,depth)<0)
+	  goto handle_malloc_failure;
+	pos=ev[j].pos;
+      }
+      depth+=ev[j].delta;
+    }
+    if (pos<end && coverage_runs_append(runs,pos,end,g,0)<0)
+      goto handle_malloc_failure;
+  }
+  FREE(ev);
+  return runs->n;
+ handle_malloc_failure:
+  FREE(ev);
+  return -1;
+}
+
+
+void free_coverage_runs(CoverageRuns *runs)
+{
+  FREE(runs->run);
+  runs->n=runs->nalloc=0;
+}
+
+
+/* FIRST INTERVAL OF THE TOP-LEVEL LIST im[i:n] THAT ENDS AFTER start,
+   OR n IF NONE.  GALLOPS FORWARD FROM i, SO SUCCESSIVE SORTED QUERIES
+   ADVANCE THROUGH THE LIST INSTEAD OF BINARY SEARCHING ALL OF IT */
+int resume_overlap_start(IntervalCoord start,IntervalMap im[],int i,int n)
+{
+  int l=i,mid,r,step=1;
+  if (l>=n || END_POSITIVE(im[l])>start)
+    return l;
+  while (l+step<n && END_POSITIVE(im[l+step])<=start) { /* im[l] ENDS BEFORE */
+    l+=step;
+    step*=2;
+  }
+  r=(l+step<n) ? l+step : n; /* im[r] ENDS AFTER start, OR r==n */
+  l++;
+  while (l<r) {
+    mid=(l+r)/2;
+    if (END_POSITIVE(im[mid])<=start)
+      l=mid+1;
+    else
+      r=mid;
+  }
+  return l;
+}
+
+
+/* SEARCH EITHER AN IN-MEMORY NESTED LIST (db_file==NULL) OR A FILE DB,
+   SAVING EVERY HIT TO hits TAGGED BY ITS QUERY INDEX.  THE QUERIES ARE
+   PROCESSED IN START ORDER USING A SINGLE REUSED ITERATOR, EACH RESUMING
+   THE TOP-LEVEL LIST WHERE THE PREVIOUS ONE LEFT OFF: IN MEMORY FROM THE
+   PREVIOUS QUERY'S FIRST HIT, AND ON DISK FROM THE TOP-LEVEL BLOCK STILL
+   LOADED IF THE QUERY STARTS INSIDE IT.  ONLY A QUERY STARTING BEYOND THAT
+   BLOCK SEARCHES THE FILE INDEX AGAIN.  SUBLISTS ARE STILL SEARCHED AFRESH
+   FOR EACH QUERY THAT OVERLAPS THEIR PARENT. */
+int find_batch(int nquery,IntervalCoord starts[],IntervalCoord ends[],
+	       IntervalMap im[],int n,SublistHeader subheader[],int nlists,
+	       IntervalDBFile *db_file,BatchHits *hits)
+{
+  int i,nhit,status,itop=0,nblock,i_div;
+  IntervalCoord start;
+  IntervalIterator *it=NULL,*it_alloc=NULL;
+  BatchQuery *bq=NULL;
+  IntervalMap buf[1024];
+  if (nquery<=0)
+    return 0;
+  bq=sort_batch_queries(nquery,starts,ends);
+  if (!bq)
+    return -1;
+  it_alloc=interval_iterator_alloc();
+  if (!it_alloc)
+    goto handle_malloc_failure;
+  for (i=0;i<nquery;i++) {
+    start=QUERY_START_POSITIVE(bq[i]);
+    nblock=it_alloc->n; /* SIZE OF THE TOP-LEVEL BLOCK LEFT LOADED, IF ANY */
+    it=reset_interval_iterator(it_alloc); /* REUSE THE SAME ITERATOR */
+    if (!db_file) { /* NO HIT CAN PRECEDE THE PREVIOUS QUERY'S FIRST HIT */
+      itop=resume_overlap_start(start,im,itop,n);
+      it->n=n;
+      it->i=itop;
+    }
+    else if (nblock>0 && it->i_div_loaded>=0) { /* LAST BLOCK LOADED */
+      i_div=it->i_div_loaded; /* it->i_div HAS ALREADY MOVED PAST IT */
+      if (END_POSITIVE(db_file->ii[i_div])>start /* FIRST HIT IS IN IT */
+	  && (i_div==0 || END_POSITIVE(db_file->ii[i_div-1])<=start)) {
+	it->n=nblock; /* SO RESUME IN THIS BLOCK, WITHOUT RELOADING IT */
+	it->i_div=i_div;
+	it->i=resume_overlap_start(start,it->im,0,nblock);
+      }
+    }
+    while (it) { /* GET ALL HITS FOR THIS QUERY, A BUFFER CHUNK AT A TIME */
+      if (db_file)
+	status=find_file_intervals(it,bq[i].start,bq[i].end,db_file,
+				   buf,1024,&nhit,&it);
+      else
+	status=find_intervals(it,bq[i].start,bq[i].end,im,n,subheader,nlists,
+			      buf,1024,&nhit,&it);
+      if (status<0 || batch_hits_append(hits,buf,nhit,bq[i].iquery)<0)
+	goto handle_malloc_failure;
+    }
+  }
+  free_interval_iterator(it_alloc);
+  free(bq);
+  return hits->n;
+ handle_malloc_failure:
+  free_interval_iterator(it_alloc);
+  FREE(bq);
+  return -1;
+}
+
+
+int find_intervals_batch(int nquery,IntervalCoord starts[],
+			 IntervalCoord ends[],
+			 IntervalMap im[],int n,
+			 SublistHeader subheader[],int nlists,
+			 BatchHits *hits)
+{
+  return find_batch(nquery,starts,ends,im,n,subheader,nlists,NULL,hits);
+}
+
+
+int find_file_intervals_batch(int nquery,IntervalCoord starts[],
+			      IntervalCoord ends[],
+			      IntervalDBFile *db_file,BatchHits *hits)
+{
+  return find_batch(nquery,starts,ends,NULL,0,NULL,0,db_file,hits);
+}
+
+
+
+
+
+/* FUNCTIONS FOR READING AND WRITING OF THE BINARY DATABASE FILES */
+
+int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile)
+{
+  int i,npad;
+  fwrite(im,sizeof(IntervalMap),n,ifile); /* SAVE THE ACTUAL DATA */
+  npad=n%div;
+  if (npad) {
+    npad=div-npad; /* #ITEMS NEEDED TO PAD TO AN EXACT MULTIPLE OF div */
+    for (i=0;i<npad;i++) /* GUARANTEED im HAS AT LEAST ONE RECORD */
+      fwrite(im,sizeof(IntervalMap),1,ifile); /*THIS IS JUST PADDING */
+  }
+  return n+npad; /* #RECORDS SAVED */
+}
+
+
+int repack_subheaders(IntervalMap im[],int n,int div,
+		      SublistHeader *subheader,int nlists)
+{
+  int i,j,*sub_map=NULL;
+  SublistHeader *sub_pack=NULL;
+
+  CALLOC(sub_map,nlists,int);
+  CALLOC(sub_pack,nlists,SublistHeader);
+  for (i=j=0;i<nlists;i++) { /* PLACE SUBLISTS W/ len>div AT FRONT */
+    if (subheader[i].len>div) {
+      memcpy(sub_pack+j,subheader+i,sizeof(SublistHeader));
+      sub_map[i]=j;
+      j++;
+    }
   }
   for (i=0;i<nlists;i++) { /* PLACE SUBLISTS W/ len<=div AFTERWARDS */
     if (subheader[i].len<=div) {
@@ -708,164 +2007,1008 @@ int repack_subheaders(IntervalMap im[],int n,int div,
   FREE(sub_map);
   FREE(sub_pack);
   return 0;
- handle_malloc_failure:
-  return -1;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
+{
+  int i,j,nsave=0;
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+  IntervalCoord coord;
+#endif
+  for (i=0;i<n;i+=div) {
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+    if (im[i].start>=0) /* FORWARD ORI */
+#endif
+      fwrite(&(im[i].start),sizeof(IntervalCoord),1,ifile);  /*SAVE start */
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+    else { /* REVERSE ORI */
+      coord= - im[i].end;
+      fwrite(&coord,sizeof(IntervalCoord),1,ifile);  /*SAVE start */
+    }
+#endif
+    j=i+div-1;
+    if (j>=n)
+      j=n-1;
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+    if (im[j].start>=0)  /* FORWARD ORI */
+#endif
+      fwrite(&(im[j].end),sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+#ifdef MERGE_INTERVAL_ORIENTATIONS
+    else { /* REVERSE ORI */
+      coord= - im[j].start;
+      fwrite(&coord,sizeof(IntervalCoord),1,ifile);  /*SAVE end */
+    }
+#endif
+    nsave++;
+  }
+  return nsave;
+}
+
+
+
+char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
+			 SublistHeader *subheader,int nlists,char filestem[])
+{
+  int i,npad=0,nii;
+  char path[2048];
+  FILE *ifile=NULL,*ifile_subheader=NULL;
+  SublistHeader sh_tmp;
+  static char err_msg[1024];
+
+  if (nlists>0  /* REPACK SMALL SUBLISTS TO END */
+      && repack_subheaders(im,n,div,subheader,nlists)
+      == FIND_FILE_MALLOC_ERR) {
+    sprintf(err_msg,"unable to malloc %d subheaders",nlists);
+    return err_msg;
+  }
+  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
+  ifile_subheader=fopen(path,"wb"); /* binary file */
+  if (!ifile_subheader) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  sprintf(path,"%s.idb",filestem); /* SAVE THE DATABASE */
+  ifile=fopen(path,"wb"); /* binary file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  npad=write_padded_binary(im,ntop,div,ifile); /* WRITE THE TOP LEVEL LIST */
+  for (i=0;i<nlists;i++) {
+    sh_tmp.start=npad; /* FILE LOCATION WHERE THIS SUBLIST STORED */
+    sh_tmp.len=subheader[i].len; /* SAVE THE TRUE SUBLIST LENGTH, UNPADDED */
+    fwrite(&sh_tmp,sizeof(SublistHeader),1,ifile_subheader);
+    if (subheader[i].len>div) /* BIG LIST: PAD TO EXACT MULTIPLE OF div */
+      npad+=write_padded_binary(im+subheader[i].start,subheader[i].len,div,ifile);
+    else { /* SMALL LIST: SAVE W/O PADDING */
+      fwrite(im+subheader[i].start,sizeof(IntervalMap),subheader[i].len,ifile);
+      npad+=subheader[i].len;
+    }
+  }
+  fclose(ifile);
+  fclose(ifile_subheader);
+
+  sprintf(path,"%s.index",filestem); /* SAVE THE COMPACTED INDEX */
+  ifile=fopen(path,"wb"); /* binary file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  nii=write_binary_index(im,ntop,div,ifile);
+  for (i=0;i<nlists;i++) /* ALSO STORE INDEX DATA FOR BIG SUBLISTS */
+    if (subheader[i].len>div)
+      nii+=write_binary_index(im+subheader[i].start,subheader[i].len,div,ifile);
+  fclose(ifile);
+
+  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
+  ifile=fopen(path,"w"); /* text file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  fprintf(ifile,SIZE_FILE_FMT,n,ntop,div,nlists,nii);
+  fclose(ifile);
+
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+}
+
+
+
+/****************************************************************
+ *
+ *   COMPRESSED .idb FORMAT: THE .idb IS CUT INTO BLOCKS OF div RECORDS
+ *   (THE SAME BLOCKS THE IntervalIndex DESCRIBES), AND EACH BLOCK IS
+ *   DELTA + VARINT ENCODED ON ITS OWN INTO filestem.idbz, SO A QUERY
+ *   ONLY DECODES THE BLOCKS IT TOUCHES.  filestem.zindex STORES THE
+ *   BYTE OFFSET OF EACH BLOCK AS long long, PLUS ONE FINAL OFFSET
+ *   GIVING THE END OF THE .idbz FILE.
+ */
+
+/* ALL DELTAS ARE COMPUTED IN unsigned long long, SO THEY WRAP AROUND
+   INSTEAD OF OVERFLOWING; ZIGZAG MAPS SMALL NEGATIVE DELTAS TO SMALL
+   VARINTS */
+#define ZIGZAG_ENCODE(U) (((U)<<1) ^ (0-((U)>>63)))
+#define ZIGZAG_DECODE(Z) (((Z)>>1) ^ (0-((Z)&1)))
+
+int write_varint(unsigned char buf[],unsigned long long v)
+{
+  int n=0;
+  while (v>=0x80) { /* 7 BITS PER BYTE, HIGH BIT MEANS MORE TO COME */
+    buf[n++]=(unsigned char)(v|0x80);
+    v>>=7;
+  }
+  buf[n++]=(unsigned char)v;
+  return n;
+}
+
+/* RETURNS POINTER PAST THE VARINT, OR NULL IF IT RUNS PAST end */
+unsigned char *read_varint(unsigned char *p,unsigned char *end,
+			   unsigned long long *p_v)
+{
+  int shift=0;
+  unsigned long long v=0;
+  while (p<end && shift<64) {
+    v|= (unsigned long long)(*p & 0x7f) << shift;
+    if (!(*p++ & 0x80)) {
+      *p_v=v;
+      return p;
+    }
+    shift+=7;
+  }
+  return NULL;
+}
+
+
+/* ENCODE n RECORDS INTO buf, WHICH MUST HOLD COMPRESSED_BLOCK_MAX(n)
+   BYTES.  RECORDS ARE SORTED BY start, AND target_start USUALLY TRACKS
+   start, SO EACH FIELD IS STORED AS A DIFFERENCE FROM THE PREVIOUS
+   RECORD OR FROM ANOTHER FIELD.  RETURNS #BYTES USED */
+int encode_interval_block(IntervalMap im[],int n,unsigned char buf[])
+{
+  int i,nbyte;
+  unsigned long long start=0,target_id=0,target_offset=0,sublist=0,len,u;
+  nbyte=write_varint(buf,(unsigned long long)n);
+  for (i=0;i<n;i++) {
+    len=(unsigned long long)im[i].end-(unsigned long long)im[i].start;
+    u=(unsigned long long)im[i].start-start;
+    nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(u));
+    nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(len));
+    u=(unsigned long long)im[i].target_id-target_id;
+    nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(u));
+    u=(unsigned long long)im[i].target_start-(unsigned long long)im[i].start
+      -target_offset;
+    nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(u));
+    u=(unsigned long long)im[i].target_end
+      -(unsigned long long)im[i].target_start-len;
+    nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(u));
+    if (im[i].sublist<0) /* 0 MEANS NO SUBLIST */
+      nbyte+=write_varint(buf+nbyte,0);
+    else { /* SUBLISTS ARE NUMBERED IN ORDER, SO STORE THE STEP */
+      u=(unsigned long long)im[i].sublist-sublist;
+      nbyte+=write_varint(buf+nbyte,ZIGZAG_ENCODE(u)+1);
+      sublist=(unsigned long long)im[i].sublist;
+    }
+    start=(unsigned long long)im[i].start;
+    target_id=(unsigned long long)im[i].target_id;
+    target_offset=(unsigned long long)im[i].target_start-start;
+  }
+  return nbyte;
+}
+
+
+/* DECODE A BLOCK WRITTEN BY encode_interval_block() INTO im.
+   RETURNS #RECORDS, OR -1 IF THE BLOCK IS CORRUPT OR HOLDS MORE THAN nmax */
+int decode_interval_block(unsigned char buf[],int nbyte,
+			  IntervalMap im[],int nmax)
+{
+  int i;
+  unsigned long long n,start=0,target_id=0,target_offset=0,sublist=0,len,u;
+  unsigned char *p=buf,*end=buf+nbyte;
+  if (!(p=read_varint(p,end,&n)) || n>(unsigned long long)nmax)
+    return -1;
+  for (i=0;i<(int)n;i++) {
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    start+=ZIGZAG_DECODE(u);
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    len=ZIGZAG_DECODE(u);
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    target_id+=ZIGZAG_DECODE(u);
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    target_offset+=ZIGZAG_DECODE(u);
+    im[i].start=(IntervalCoord)start;
+    im[i].end=(IntervalCoord)(start+len);
+    im[i].target_id=(int)target_id;
+    im[i].target_start=(IntervalCoord)(start+target_offset);
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    im[i].target_end=(IntervalCoord)(start+target_offset+len
+				     +ZIGZAG_DECODE(u));
+    if (!(p=read_varint(p,end,&u)))
+      return -1;
+    if (u==0) /* NO SUBLIST */
+      im[i].sublist= -1;
+    else {
+      sublist+=ZIGZAG_DECODE(u-1);
+      im[i].sublist=(int)sublist;
+    }
+  }
+  return (int)n;
+}
+
+
+/* DECODE COMPRESSED BLOCK iblock OF db_file INTO im, WHICH MUST HOLD div
+   RECORDS, READING IT VIA zbuf, WHICH MUST HOLD db_file->zbuf_size BYTES
+   (UNUSED IF db_file IS MAPPED).
+   RETURNS #RECORDS, 0 PAST THE LAST BLOCK, OR -1 IF CORRUPT */
+int read_compressed_block(IntervalDBFile *db_file,int iblock,IntervalMap im[],
+			  unsigned char zbuf[])
+{
+  int nbyte;
+  unsigned char *buf;
+  if (iblock<0 || iblock>=db_file->nblock)
+    return 0;
+  nbyte=(int)(db_file->zoffset[iblock+1]-db_file->zoffset[iblock]);
+  if (db_file->is_mapped) /* DECODE STRAIGHT FROM THE MAPPING */
+    buf=(unsigned char *)db_file->map_idb.p+db_file->zoffset[iblock];
+  else {
+    buf=zbuf;
+    if (read_file_at(db_file->ifile_idb,buf,1,nbyte,db_file->idb_offset
+		     +(PYGR_OFF_T)db_file->zoffset[iblock])!=(size_t)nbyte)
+      return -1;
+  }
+  return decode_interval_block(buf,nbyte,im,db_file->div);
+}
+
+
+/* REPLACE filestem.idb BY ITS COMPRESSED FORM filestem.idbz + .zindex.
+   THE .size, .index AND .subhead FILES ARE UNCHANGED */
+char *compress_binary_files(char filestem[])
+{
+  int n,ntop,div,nlists,nii,nrec,nbyte;
+  long long offset=0;
+  char path[2048];
+  IntervalMap *im=NULL;
+  unsigned char *buf=NULL;
+  FILE *ifile=NULL,*ofile=NULL,*ofile_zindex=NULL;
+  static char err_msg[1024];
+
+  if (read_size_file(filestem,NULL,&n,&ntop,&div,&nlists,&nii,err_msg))
+    return err_msg;
+  CALLOC(im,div,IntervalMap);
+  CALLOC(buf,COMPRESSED_BLOCK_MAX(div),unsigned char);
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %s",path);
+    goto cleanup;
+  }
+  sprintf(path,"%s.idbz",filestem);
+  ofile=fopen(path,"wb"); /* binary file */
+  if (!ofile)
+    goto unable_to_write;
+  sprintf(path,"%s.zindex",filestem);
+  ofile_zindex=fopen(path,"wb"); /* binary file */
+  if (!ofile_zindex)
+    goto unable_to_write;
+  while ((nrec=fread(im,sizeof(IntervalMap),div,ifile))>0) {
+    nbyte=encode_interval_block(im,nrec,buf);
+    if (fwrite(&offset,sizeof(long long),1,ofile_zindex)!=1
+	|| fwrite(buf,1,nbyte,ofile)!=(size_t)nbyte)
+      goto write_error_occurred;
+    offset+=nbyte;
+  }
+  if (fwrite(&offset,sizeof(long long),1,ofile_zindex)!=1) /* END OF FILE */
+    goto write_error_occurred;
+  fclose(ifile);
+  ifile=NULL;
+  if (fclose(ofile) || fclose(ofile_zindex)) {
+    ofile=ofile_zindex=NULL;
+    goto write_error_occurred;
+  }
+  ofile=ofile_zindex=NULL;
+  sprintf(path,"%s.idb",filestem); /* THE .idbz REPLACES IT */
+  remove(path);
+  free(im);
+  free(buf);
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+ unable_to_write:
+  sprintf(err_msg,"unable to open file %s for writing",path);
+  goto cleanup;
+ write_error_occurred:
+  sprintf(err_msg,"error writing output file! out of disk space?");
+  goto cleanup;
+ handle_malloc_failure:
+  sprintf(err_msg,"unable to malloc %d records",div);
+ cleanup:
+  if (ifile)
+    fclose(ifile);
+  if (ofile)
+    fclose(ofile);
+  if (ofile_zindex)
+    fclose(ofile_zindex);
+  FREE(im);
+  FREE(buf);
+  return err_msg;
+}
+
+
+
+/****************************************************************
+ *
+ *   EXTERNAL-MEMORY NESTED LIST CONSTRUCTION, FOR .build FILES
+ *   TOO BIG TO SORT IN RAM
+ */
+
+int run_sorter_init(RunSorter *rs,size_t recsize,int maxbuf,
+		    int (*cmp)(const void *,const void *),char stem[])
+{
+  memset(rs,0,sizeof(RunSorter));
+  rs->recsize=recsize;
+  rs->cmp=cmp;
+  if (maxbuf>INT_MAX/(int)recsize) /* KEEP BUFFER SIZE WITHIN int RANGE */
+    maxbuf=INT_MAX/(int)recsize;
+  rs->maxbuf=maxbuf;
+  strncpy(rs->stem,stem,sizeof(rs->stem)-16);
+  CALLOC(rs->buf,maxbuf*(int)recsize,char);
+  return 0;
+ handle_malloc_failure:
+  return -1;
+}
+
+
+/* SORT THE BUFFERED RECORDS AND SAVE THEM AS A NEW RUN FILE */
+int run_sorter_flush(RunSorter *rs)
+{
+  char path[2048];
+  FILE *ifile;
+  if (rs->nbuf<=0)
+    return 0;
+  qsort(rs->buf,rs->nbuf,rs->recsize,rs->cmp);
+  sprintf(path,"%s.%d",rs->stem,rs->nrun);
+  ifile=fopen(path,"wb"); /* binary file */
+  if (!ifile)
+    return -1;
+  if (fwrite(rs->buf,rs->recsize,rs->nbuf,ifile)!=(size_t)rs->nbuf) {
+    fclose(ifile);
+    return -1;
+  }
+  fclose(ifile);
+  rs->nrun++;
+  rs->nbuf=0;
+  return 0;
+}
+
+
+int run_sorter_add(RunSorter *rs,void *rec)
+{
+  memcpy(rs->buf+rs->nbuf*rs->recsize,rec,rs->recsize);
+  rs->nbuf++;
+  if (rs->nbuf>=rs->maxbuf) /* BUFFER FULL, SO SAVE IT AS A RUN */
+    return run_sorter_flush(rs);
+  return 0;
+}
+
+
+/* FREE THE BUFFER AND DELETE ALL RUN FILES */
+void run_sorter_free(RunSorter *rs)
+{
+  int i;
+  char path[2048];
+  FREE(rs->buf);
+  for (i=0;i<rs->nrun;i++) {
+    sprintf(path,"%s.%d",rs->stem,i);
+    remove(path);
+  }
+  rs->nrun=0;
+}
+
+
+#define RUN_HEAD(rm,i) ((rm)->head+(i)*(rm)->rs->recsize)
+#define RUN_LESS(rm,i,j) ((rm)->rs->cmp(RUN_HEAD(rm,i),RUN_HEAD(rm,j))<0)
+
+/* RESTORE HEAP ORDER BELOW POSITION i OF THE HEAP OF RUN INDEXES */
+void run_merger_sift(RunMerger *rm,int i)
+{
+  int child,tmp;
+  while ((child=2*i+1)<rm->nheap) {
+    if (child+1<rm->nheap && RUN_LESS(rm,rm->heap[child+1],rm->heap[child]))
+      child++; /* PICK THE SMALLER CHILD */
+    if (!RUN_LESS(rm,rm->heap[child],rm->heap[i]))
+      break;
+    tmp=rm->heap[i];
+    rm->heap[i]=rm->heap[child];
+    rm->heap[child]=tmp;
+    i=child;
+  }
+}
+
+
+/* OPEN ALL THE RUNS OF rs FOR A K-WAY MERGE.  CAN BE CALLED REPEATEDLY.
+   RETURNS -1 IF A RUN FILE CAN'T BE OPENED, FIND_FILE_MALLOC_ERR IF OUT
+   OF MEMORY; EITHER WAY THE CALLER MUST STILL run_merger_close() */
+int run_merger_open(RunMerger *rm,RunSorter *rs)
+{
+  int i;
+  char path[2048];
+  memset(rm,0,sizeof(RunMerger));
+  rm->rs=rs;
+  if (rs->nrun<=0)
+    return 0;
+  CALLOC(rm->ifile,rs->nrun,FILE *);
+  CALLOC(rm->head,rs->nrun*rs->recsize,char);
+  CALLOC(rm->heap,rs->nrun,int);
+  for (i=0;i<rs->nrun;i++) {
+    sprintf(path,"%s.%d",rs->stem,i);
+    rm->ifile[i]=fopen(path,"rb"); /* binary file */
+    if (!rm->ifile[i])
+      return -1;
+    if (fread(RUN_HEAD(rm,i),rs->recsize,1,rm->ifile[i])==1) /* RUNS NEVER EMPTY */
+      rm->heap[rm->nheap++]=i;
+  }
+  for (i=rm->nheap/2-1;i>=0;i--) /* HEAPIFY */
+    run_merger_sift(rm,i);
+  return 0;
+ handle_malloc_failure:
+  return FIND_FILE_MALLOC_ERR;
+}
+
+
+/* COPY THE NEXT RECORD IN SORTED ORDER TO rec. RETURN 0 WHEN EXHAUSTED */
+int run_merger_next(RunMerger *rm,void *rec)
+{
+  int i;
+  if (rm->nheap<=0)
+    return 0;
+  i=rm->heap[0]; /* RUN WITH THE SMALLEST HEAD */
+  memcpy(rec,RUN_HEAD(rm,i),rm->rs->recsize);
+  if (fread(RUN_HEAD(rm,i),rm->rs->recsize,1,rm->ifile[i])!=1) /* RUN DONE */
+    rm->heap[0]=rm->heap[--rm->nheap];
+  run_merger_sift(rm,0);
+  return 1;
+}
+
+
+void run_merger_close(RunMerger *rm)
+{
+  int i;
+  if (rm->ifile) {
+    for (i=0;i<rm->rs->nrun;i++)
+      if (rm->ifile[i])
+	fclose(rm->ifile[i]);
+  }
+  FREE(rm->ifile);
+  FREE(rm->head);
+  FREE(rm->heap);
+  rm->nheap=0;
+}
+
+
+
+typedef struct { /* AN INTERVAL TAGGED WITH ITS NESTED LIST, AND ITS ORDER THERE */
+  int list;
+  int ipos;
+  IntervalMap im;
+} NestedListRecord;
+
+int nested_list_record_cmp(const void *void_a,const void *void_b)
+{ /* SORT IN LIST ORDER, THEN IN ORIGINAL ORDER WITHIN EACH LIST */
+  NestedListRecord *a=(NestedListRecord *)void_a,*b=(NestedListRecord *)void_b;
+  if (a->list<b->list)
+    return -1;
+  else if (a->list>b->list)
+    return 1;
+  else if (a->ipos<b->ipos)
+    return -1;
+  else if (a->ipos>b->ipos)
+    return 1;
+  else
+    return 0;
+}
+
+
+/* READ THE MERGED INTERVALS IN start ORDER, AND ASSIGN EACH ONE TO ITS
+   NESTED LIST USING A STACK OF CONTAINING INTERVALS, EXACTLY AS
+   build_nested_list_inplace() DOES.  LIST 0 IS THE TOP LEVEL LIST. */
+int assign_nested_lists(RunMerger *rm,RunSorter *out,
+			int **p_lens,int *p_nlists)
+{
+  int nstack=0,sp=0,nlens=0,nlists=1,has_prev=0;
+  int *lens=NULL;
+  IntervalIndex *stack=NULL; /* start,end OF EACH OPEN PARENT */
+  int *child=NULL; /* ITS SUBLIST, OR -1 */
+  IntervalMap im;
+  NestedListRecord prev;
+
+  nlens=1024;
+  CALLOC(lens,nlens,int);
+  while (run_merger_next(rm,&im)) {
+    while (sp>0 && (END_POSITIVE(im)>stack[sp-1].end /* im NOT CONTAINED */
+		    || (END_POSITIVE(im)==stack[sp-1].end /* SAME INTERVAL! */
+			&& START_POSITIVE(im)==stack[sp-1].start)))
+      sp--; /* POP PARENTS THAT DON'T CONTAIN im */
+    if (sp>0 && child[sp-1]<0) { /* FIRST CHILD OF stack[sp-1]: NEW SUBLIST */
+      child[sp-1]=nlists++;
+      if (nlists>nlens) {
+	REALLOC(lens,2*nlens,int);
+	memset(lens+nlens,0,nlens*sizeof(int));
+	nlens*=2;
+      }
+      /* A FIRST CHILD ALWAYS IMMEDIATELY FOLLOWS ITS PARENT IN start ORDER,
+	 SO THE PARENT IS STILL WAITING IN prev */
+      prev.im.sublist=child[sp-1];
+    }
+    if (has_prev && run_sorter_add(out,&prev)<0) /* prev IS NOW COMPLETE */
+      goto handle_io_failure;
+    prev.list= (sp>0) ? child[sp-1] : 0;
+    prev.ipos=lens[prev.list]++;
+    memcpy(&prev.im,&im,sizeof(IntervalMap));
+    prev.im.sublist= -1;
+    has_prev=1;
+    if (sp>=nstack) { /* PUSH im ON THE STACK */
+      nstack= nstack>0 ? 2*nstack : 1024;
+      REALLOC(stack,nstack,IntervalIndex);
+      REALLOC(child,nstack,int);
+    }
+    stack[sp].start=START_POSITIVE(im);
+    stack[sp].end=END_POSITIVE(im);
+    child[sp]= -1;
+    sp++;
+  }
+  if (has_prev && run_sorter_add(out,&prev)<0)
+    goto handle_io_failure;
+  FREE(stack);
+  FREE(child);
+  *p_lens=lens;
+  *p_nlists=nlists;
+  return 0;
+ handle_io_failure:
+  FREE(stack);
+  FREE(child);
+  FREE(lens);
+  return -1;
+ handle_malloc_failure:
+  FREE(stack);
+  FREE(child);
+  FREE(lens);
+  return FIND_FILE_MALLOC_ERR;
+}
+
+
+typedef struct { /* STREAMING WRITER FOR THE .idb, .index AND .subhead FILES */
+  FILE *ifile_idb;
+  FILE *ifile_index;
+  FILE *ifile_subhead;
+  int div;
+  int list; /* LIST NOW BEING WRITTEN, OR -1 */
+  int len; /* ITS LENGTH */
+  int ipos; /* #RECORDS OF IT WRITTEN SO FAR */
+  int is_padded; /* TOP LIST OR BIG SUBLIST: PAD & INDEX IT */
+  IntervalMap first; /* ITS FIRST RECORD, FOR PADDING */
+  IntervalIndex block; /* INDEX ENTRY FOR THE CURRENT BLOCK */
+  int npad; /* #RECORDS WRITTEN TO .idb */
+  int nii; /* #ENTRIES WRITTEN TO .index */
+} NestedListWriter;
+
+
+void nested_list_writer_end_list(NestedListWriter *w)
+{
+  int npad;
+  if (w->list>=0 && w->is_padded && (npad=w->len%w->div)) {
+    for (npad=w->div-npad;npad>0;npad--) /* SAME PADDING AS write_padded_binary */
+      fwrite(&(w->first),sizeof(IntervalMap),1,w->ifile_idb);
+    w->npad+=w->div - w->len%w->div;
+  }
+  w->list= -1;
+}
+
+
+/* APPEND rec TO THE FILES, ASSUMING LISTS ARRIVE CONTIGUOUSLY IN FILE ORDER */
+void nested_list_writer_add(NestedListWriter *w,NestedListRecord *rec,
+			    int lens[],int sub_map[])
+{
+  SublistHeader sh;
+  IntervalMap im;
+  if (rec->list!=w->list) { /* START A NEW LIST */
+    nested_list_writer_end_list(w);
+    w->list=rec->list;
+    w->len=lens[rec->list];
+    w->ipos=0;
+    w->is_padded= (rec->list==0 || w->len>w->div);
+    if (rec->list>0) { /* SAVE ITS SUBHEADER: FILE LOCATION AND TRUE LENGTH */
+      sh.start=w->npad;
+      sh.len=w->len;
+      fwrite(&sh,sizeof(SublistHeader),1,w->ifile_subhead);
+    }
+  }
+  memcpy(&im,&(rec->im),sizeof(IntervalMap));
+  if (im.sublist>=0) /* TRANSLATE TO FINAL SUBLIST NUMBER */
+    im.sublist=sub_map[im.sublist];
+  if (w->ipos==0)
+    memcpy(&(w->first),&im,sizeof(IntervalMap));
+  if (w->is_padded && w->ipos%w->div==0)
+    w->block.start=START_POSITIVE(im);
+  fwrite(&im,sizeof(IntervalMap),1,w->ifile_idb);
+  w->npad++;
+  w->ipos++;
+  if (w->is_padded && (w->ipos%w->div==0 || w->ipos==w->len)) { /* BLOCK DONE */
+    w->block.end=END_POSITIVE(im);
+    fwrite(&(w->block),sizeof(IntervalIndex),1,w->ifile_index);
+    w->nii++;
+  }
+}
+
+
+/* BUILD THE NESTED LIST FOR THE n UNSORTED INTERVALS IN buildfile, AND
+   SAVE IT AS THE SAME BINARY FILES AS write_binary_files(), HOLDING AT MOST
+   maxbuf INTERVALS IN MEMORY: SORTED RUN FILES ARE MERGED TO ASSIGN EACH
+   INTERVAL TO ITS SUBLIST, THEN MERGED AGAIN IN SUBLIST ORDER TO WRITE THEM */
+char *build_nested_list_external(char buildfile[],int n,int maxbuf,int div,
+				 char filestem[])
+{
+  int i,nlists=0,ntop=0,pass,*lens=NULL,*sub_map=NULL;
+  char path[2048];
+  FILE *ifile=NULL;
+  IntervalMap im;
+  NestedListRecord rec;
+  RunSorter sort_im,sort_nl;
+  RunMerger merger;
+  NestedListWriter w;
+  static char err_msg[1024];
+
+  memset(&sort_im,0,sizeof(RunSorter));
+  memset(&sort_nl,0,sizeof(RunSorter));
+  memset(&merger,0,sizeof(RunMerger));
+  memset(&w,0,sizeof(NestedListWriter));
+  if (maxbuf<div)
+    maxbuf=div;
+  sprintf(path,"%s.sortrun",filestem);
+  if (run_sorter_init(&sort_im,sizeof(IntervalMap),maxbuf,
+		      imstart_qsort_cmp,path)<0)
+    goto handle_malloc_failure;
+
+  ifile=fopen(buildfile,"rb"); /* SAVE SORTED RUNS OF THE .build FILE */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open %s",buildfile);
+    goto handle_error;
+  }
+  for (i=0;i<n;i++) {
+    if (fread(&im,sizeof(IntervalMap),1,ifile)!=1) {
+      sprintf(err_msg,"IntervalMap file %s corrupted?",buildfile);
+      goto handle_error;
+    }
+#ifdef ALL_POSITIVE_ORIENTATION
+    reorient_intervals(1,&im,1); /* FORCE ALL INTERVALS INTO POSITIVE ORI */
+#endif
+    im.sublist= -1;
+    if (run_sorter_add(&sort_im,&im)<0)
+      goto handle_io_failure;
+  }
+  fclose(ifile);
+  ifile=NULL;
+  if (run_sorter_flush(&sort_im)<0)
+    goto handle_io_failure;
+  FREE(sort_im.buf); /* ONLY ONE SORT BUFFER AT A TIME */
+
+  sprintf(path,"%s.nestrun",filestem); /* ASSIGN INTERVALS TO SUBLISTS */
+  if (run_sorter_init(&sort_nl,sizeof(NestedListRecord),
+		      maxbuf*sizeof(IntervalMap)/sizeof(NestedListRecord),
+		      nested_list_record_cmp,path)<0)
+    goto handle_malloc_failure;
+  if ((i=run_merger_open(&merger,&sort_im))<0)
+    goto handle_merger_failure;
+  i=assign_nested_lists(&merger,&sort_nl,&lens,&nlists);
+  run_merger_close(&merger);
+  run_sorter_free(&sort_im);
+  if (i==FIND_FILE_MALLOC_ERR)
+    goto handle_malloc_failure;
+  else if (i<0 || run_sorter_flush(&sort_nl)<0)
+    goto handle_io_failure;
+  FREE(sort_nl.buf);
+  ntop=lens[0];
+
+  CALLOC(sub_map,nlists,int); /* NUMBER SUBLISTS W/ len>div FIRST, AS */
+  for (i=1,pass=0;i<nlists;i++) /* repack_subheaders() DOES */
+    if (lens[i]>div)
+      sub_map[i]=pass++;
+  for (i=1;i<nlists;i++)
+    if (lens[i]<=div)
+      sub_map[i]=pass++;
+
+  sprintf(path,"%s.subhead",filestem);
+  w.ifile_subhead=fopen(path,"wb"); /* binary file */
+  sprintf(path,"%s.idb",filestem);
+  w.ifile_idb=fopen(path,"wb"); /* binary file */
+  sprintf(path,"%s.index",filestem);
+  w.ifile_index=fopen(path,"wb"); /* binary file */
+  if (!w.ifile_subhead || !w.ifile_idb || !w.ifile_index) {
+    sprintf(err_msg,"unable to open files %s.* for writing",filestem);
+    goto handle_error;
+  }
+  w.div=div;
+  w.list= -1;
+  for (pass=0;pass<2;pass++) { /* TOP & BIG LISTS, THEN SMALL SUBLISTS */
+    if ((i=run_merger_open(&merger,&sort_nl))<0)
+      goto handle_merger_failure;
+    while (run_merger_next(&merger,&rec))
+      if ((rec.list==0 || lens[rec.list]>div) == (pass==0))
+	nested_list_writer_add(&w,&rec,lens,sub_map);
+    run_merger_close(&merger);
+  }
+  nested_list_writer_end_list(&w);
+  run_sorter_free(&sort_nl);
+  fclose(w.ifile_subhead);
+  fclose(w.ifile_idb);
+  fclose(w.ifile_index);
+  FREE(lens);
+  FREE(sub_map);
+
+  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
+  ifile=fopen(path,"w"); /* text file */
+  if (!ifile) {
+    sprintf(err_msg,"unable to open file %s for writing",path);
+    return err_msg;
+  }
+  fprintf(ifile,SIZE_FILE_FMT,n,ntop,div,nlists-1,w.nii);
+  fclose(ifile);
+  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+
+ handle_merger_failure:
+  run_merger_close(&merger);
+  if (i==FIND_FILE_MALLOC_ERR)
+    goto handle_malloc_failure;
+ handle_io_failure:
+  sprintf(err_msg,"unable to write or read sort runs for %s",filestem);
+  goto handle_error;
+ handle_malloc_failure:
+  sprintf(err_msg,"out of memory building %s",filestem);
+ handle_error:
+  if (ifile)
+    fclose(ifile);
+  if (w.ifile_subhead)
+    fclose(w.ifile_subhead);
+  if (w.ifile_idb)
+    fclose(w.ifile_idb);
+  if (w.ifile_index)
+    fclose(w.ifile_index);
+  run_sorter_free(&sort_im);
+  run_sorter_free(&sort_nl);
+  FREE(lens);
+  FREE(sub_map);
+  return err_msg;
+}
+
+
+
+/* SUFFIX OF EACH FILE OF A DATABASE, INDEXED BY ITS DB_SECTION_ NUMBER */
+static char *db_section_suffix[N_DB_SECTION]={".size",".index",".subhead",
+					       ".idb",".idbz",".zindex"};
+
+/* OPEN ONE FILE OF A DATABASE: filestem+SUFFIX, OR ITS SECTION OF THE PACKED
+   FILE pack IF THAT IS NOT NULL.  SETS *p_offset AND *p_len TO WHERE ITS
+   DATA LIES IN THE RETURNED FILE, AND path TO ITS NAME FOR ERROR MESSAGES.
+   RETURNS NULL IF THE DATABASE HAS NO SUCH FILE */
+FILE *open_db_section(char filestem[],PackedDBFiles *pack,int isection,
+		      char path[],PYGR_OFF_T *p_offset,PYGR_OFF_T *p_len)
+{
+  FILE *ifile;
+  sprintf(path,"%s%s",filestem,db_section_suffix[isection]);
+  if (pack) {
+    if (pack->len[isection]<0) /* NOT IN THE PACKED FILE */
+      return NULL;
+    *p_offset=(PYGR_OFF_T)pack->offset[isection];
+    *p_len=(PYGR_OFF_T)pack->len[isection];
+    return fopen(pack->path,"rb"); /* binary file */
+  }
+  ifile=fopen(path,"rb"); /* binary file */
+  if (ifile) {
+    PYGR_FSEEK(ifile,0,SEEK_END);
+    *p_len=PYGR_FTELL(ifile);
+    *p_offset=0;
+  }
+  return ifile;
+}
+
+
+
+/* READ THE BASIC SIZE INFO FROM filestem.size.  AN OPTIONAL SIXTH FIELD
+   GIVES THE COORDINATE SIZE IN BITS (DEFAULT 32); A DATABASE BUILT WITH A
+   DIFFERENT COORDINATE SIZE THAN THIS MODULE CANNOT BE READ */
+int read_size_file(char filestem[],PackedDBFiles *pack,int *p_n,int *p_ntop,
+		   int *p_div,int *p_nlists,int *p_nii,char err_msg[])
+{
+  int nfield,coord_bits=32;
+  char path[2048],buf[256];
+  PYGR_OFF_T offset,len;
+  FILE *ifile=NULL;
+
+  ifile=open_db_section(filestem,pack,DB_SECTION_SIZE,path,&offset,&len);
+  if (!ifile) {
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s",path);
+    return -1;
+  }
+  if (len>=(PYGR_OFF_T)sizeof(buf)) /* A FEW NUMBERS OF TEXT */
+    len=sizeof(buf)-1;
+  len=(PYGR_OFF_T)read_file_at(ifile,buf,1,(size_t)len,offset);
+  fclose(ifile);
+  buf[len]='\0'; /* A PACKED SECTION IS NOT FOLLOWED BY EOF */
+  nfield=sscanf(buf,"%d %d %d %d %d %d",p_n,p_ntop,p_div,p_nlists,p_nii,
+		&coord_bits);
+  if (nfield<5) {
+    if (err_msg)
+      sprintf(err_msg,"error or EOF reading file %s",path);
+    return -1;
+  }
+  if (coord_bits!=COORD_BITS) {
+    if (err_msg)
+      sprintf(err_msg,"%s was built with %d-bit coordinates, but this pygr was compiled for %d-bit coordinates",
+	      path,coord_bits,COORD_BITS);
+    return -1;
+  }
+  return 0;
 }
 
 
-int write_binary_index(IntervalMap im[],int n,int div,FILE *ifile)
+
+/* MAP ONE FILE OF A DATABASE, OR ITS SECTION OF THE PACKED FILE pack.
+   RETURNS 0 ON SUCCESS, OR -1 ON ERROR OR IF THE DATABASE HAS NO SUCH FILE */
+int map_db_section(char filestem[],PackedDBFiles *pack,int isection,
+		   char path[],MappedFile *mf)
 {
-  int i,j,nsave=0;
-  for (i=0;i<n;i+=div) {
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    if (im[i].start>=0) /* FORWARD ORI */
-#endif
-      fwrite(&(im[i].start),sizeof(int),1,ifile);  /*SAVE start */
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    else { /* REVERSE ORI */
-      j= - im[i].end;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE start */
-    }
-#endif
-    j=i+div-1;
-    if (j>=n)
-      j=n-1;
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    if (im[j].start>=0)  /* FORWARD ORI */
-#endif
-      fwrite(&(im[j].end),sizeof(int),1,ifile);  /*SAVE end */
-#ifdef MERGE_INTERVAL_ORIENTATIONS
-    else { /* REVERSE ORI */
-      j= - im[j].start;
-      fwrite(&j,sizeof(int),1,ifile);  /*SAVE end */
-    }
-#endif
-    nsave++;
-  }
-  return nsave;
+  sprintf(path,"%s%s",filestem,db_section_suffix[isection]);
+  if (!pack)
+    return map_file_section(path,0,-1,mf);
+  if (pack->len[isection]<0) /* NOT IN THE PACKED FILE */
+    return -1;
+  return map_file_section(pack->path,(PYGR_OFF_T)pack->offset[isection],
+			  (PYGR_OFF_T)pack->len[isection],mf);
 }
 
 
 
-char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
-			 SublistHeader *subheader,int nlists,char filestem[])
+/* IF filestem.idb IS ABSENT, THE DATABASE MAY BE COMPRESSED (SEE
+   compress_binary_files()): LOAD OR MAP ITS BLOCK OFFSETS FROM
+   filestem.zindex.  RETURNS 1 IF COMPRESSED, 0 IF NOT, -1 ON ERROR */
+int open_compressed_index(IntervalDBFile *idb_file,char filestem[],
+			  char err_msg[])
 {
-  int i,npad=0,nii;
+  int i;
+  long long nbyte,nmax=0;
   char path[2048];
-  FILE *ifile=NULL,*ifile_subheader=NULL;
-  SublistHeader sh_tmp;
-  static char err_msg[1024];
+  PYGR_OFF_T offset,len;
+  FILE *ifile=NULL;
 
-  if (nlists>0  /* REPACK SMALL SUBLISTS TO END */
-      && repack_subheaders(im,n,div,subheader,nlists)
-      == FIND_FILE_MALLOC_ERR) {
-    sprintf(err_msg,"unable to malloc %d subheaders",nlists);
-    return err_msg;
+  ifile=open_db_section(filestem,idb_file->pack,DB_SECTION_IDB,path,
+			&offset,&len);
+  if (ifile) { /* AN ORDINARY, UNCOMPRESSED DATABASE */
+    fclose(ifile);
+    idb_file->nrecord=(int)(len/sizeof(IntervalMap));
+    return 0;
   }
-  sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
-  ifile_subheader=fopen(path,"wb"); /* binary file */
-  if (!ifile_subheader) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
+  ifile=open_db_section(filestem,idb_file->pack,DB_SECTION_IDBZ,path,
+			&offset,&len);
+  if (!ifile) { /* NEITHER FORMAT: REPORT THE USUAL MISSING FILE */
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s.idb",filestem);
+    return -1;
   }
-  sprintf(path,"%s.idb",filestem); /* SAVE THE DATABASE */
-  ifile=fopen(path,"wb"); /* binary file */
-  if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
+  fclose(ifile);
+  if (idb_file->is_mapped) { /* OFFSETS OF THE COMPRESSED BLOCKS */
+    if (map_db_section(filestem,idb_file->pack,DB_SECTION_ZINDEX,path,
+		       &(idb_file->map_zindex))
+	|| idb_file->map_zindex.len<sizeof(long long))
+      goto unable_to_open_file;
+    idb_file->zoffset=(long long *)idb_file->map_zindex.p;
+    idb_file->nblock=idb_file->map_zindex.len/sizeof(long long)-1;
   }
-  npad=write_padded_binary(im,ntop,div,ifile); /* WRITE THE TOP LEVEL LIST */
-  for (i=0;i<nlists;i++) {
-    sh_tmp.start=npad; /* FILE LOCATION WHERE THIS SUBLIST STORED */
-    sh_tmp.len=subheader[i].len; /* SAVE THE TRUE SUBLIST LENGTH, UNPADDED */
-    fwrite(&sh_tmp,sizeof(SublistHeader),1,ifile_subheader);
-    if (subheader[i].len>div) /* BIG LIST: PAD TO EXACT MULTIPLE OF div */
-      npad+=write_padded_binary(im+subheader[i].start,subheader[i].len,div,ifile);
-    else { /* SMALL LIST: SAVE W/O PADDING */
-      fwrite(im+subheader[i].start,sizeof(IntervalMap),subheader[i].len,ifile);
-      npad+=subheader[i].len;
+  else {
+    ifile=open_db_section(filestem,idb_file->pack,DB_SECTION_ZINDEX,path,
+			  &offset,&len);
+    if (!ifile)
+      goto unable_to_open_file;
+    idb_file->nblock=len/sizeof(long long)-1;
+    if (idb_file->nblock<0)
+      goto fread_error_occurred;
+    CALLOC(idb_file->zoffset,idb_file->nblock+1,long long);
+    if (read_file_at(ifile,idb_file->zoffset,sizeof(long long),
+		     idb_file->nblock+1,offset)
+	!=(size_t)idb_file->nblock+1)
+      goto fread_error_occurred;
+    fclose(ifile);
+    ifile=NULL;
+    for (i=0;i<idb_file->nblock;i++) { /* SIZE OUR READ BUFFER */
+      nbyte=idb_file->zoffset[i+1]-idb_file->zoffset[i];
+      if (nbyte>nmax)
+	nmax=nbyte;
     }
+    idb_file->zbuf_size=(int)nmax+1;
+    CALLOC(idb_file->zbuf,idb_file->zbuf_size,unsigned char);
   }
+  idb_file->is_compressed=1;
+  return 1;
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  return -1;
+ fread_error_occurred:
   fclose(ifile);
-  fclose(ifile_subheader);
+  if (err_msg)
+    sprintf(err_msg,"error or EOF reading file %s",path);
+  return -1;
+ handle_malloc_failure:
+  if (ifile)
+    fclose(ifile);
+  return -1;
+}
 
-  sprintf(path,"%s.index",filestem); /* SAVE THE COMPACTED INDEX */
-  ifile=fopen(path,"wb"); /* binary file */
-  if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
-  }
-  nii=write_binary_index(im,ntop,div,ifile);
-  for (i=0;i<nlists;i++) /* ALSO STORE INDEX DATA FOR BIG SUBLISTS */
-    if (subheader[i].len>div)
-      nii+=write_binary_index(im+subheader[i].start,subheader[i].len,div,ifile);
-  fclose(ifile);
 
-  sprintf(path,"%s.size",filestem); /* SAVE BASIC SIZE INFO*/
-  ifile=fopen(path,"w"); /* text file */
-  if (!ifile) {
-    sprintf(err_msg,"unable to open file %s for writing",path);
-    return err_msg;
-  }
-  fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii);
-  fclose(ifile);
 
-  return NULL; /* RETURN CODE SIGNALS SUCCESS!! */
+/* KEEP OUR OWN COPY OF THE PACKED FILE LAYOUT, IF ANY, FOR REOPENING FILES */
+int copy_packed_db_files(IntervalDBFile *idb_file,PackedDBFiles *pack)
+{
+  if (pack) {
+    CALLOC(idb_file->pack,1,PackedDBFiles);
+    memcpy(idb_file->pack,pack,sizeof(PackedDBFiles));
+  }
+  return 0;
+ handle_malloc_failure:
+  return -1;
 }
 
 
 
-IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
-				  int subheader_nblock)
+/* OPEN A DATABASE, READING ITS .index AND (SOME OF) ITS .subhead INTO
+   MEMORY.  pack GIVES ITS LAYOUT IN A PACKED FILE, OR IS NULL IF IT IS
+   STORED AS SEPARATE FILES filestem.size, filestem.index ETC. */
+IntervalDBFile *read_binary_files(char filestem[],PackedDBFiles *pack,
+				  char err_msg[],int subheader_nblock)
 {
-  int n,ntop,div,nlists,nii;
+  int i,n,ntop,div,nlists,nii;
   char path[2048];
+  PYGR_OFF_T offset,len;
   IntervalIndex *ii=NULL;
   SublistHeader *subheader=NULL;
   IntervalDBFile *idb_file=NULL;
   FILE *ifile=NULL;
 
-  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
-  ifile=fopen(path,"r"); /* text file */
-  if (!ifile) {
-    if (err_msg)
-      sprintf(err_msg,"unable to open file %s",path);
+  if (read_size_file(filestem,pack,&n,&ntop,&div,&nlists,&nii,err_msg))
     return NULL;
-  }
-  fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii);
-  fclose(ifile);
 
   CALLOC(ii,nii+1,IntervalIndex);
-  if (nii>0) {
-    sprintf(path,"%s.index",filestem); /* READ THE COMPACTED INDEX */
-    ifile=fopen(path,"rb"); /* binary file */
+  if (nii>0) { /* READ THE COMPACTED INDEX */
+    ifile=open_db_section(filestem,pack,DB_SECTION_INDEX,path,&offset,&len);
     if (!ifile) {
       if (err_msg)
 	sprintf(err_msg,"unable to open file %s",path);
       return NULL;
     }
-    fread(ii,sizeof(IntervalIndex),nii,ifile);
+    read_file_at(ifile,ii,sizeof(IntervalIndex),nii,offset);
     fclose(ifile);
   }
 
   CALLOC(idb_file,1,IntervalDBFile);
   if(nlists>0){
-    sprintf(path,"%s.subhead",filestem); /* SAVE THE SUBHEADER LIST */
-    ifile=fopen(path,"rb"); /* binary file */
+#ifdef ON_DEMAND_SUBLIST_HEADER /* file_pool_open() OPENS THE .subhead */
+    CALLOC(subheader,subheader_nblock,SublistHeader);
+    idb_file->subheader_file.subheader=subheader;
+    idb_file->subheader_file.nblock=subheader_nblock;
+    idb_file->subheader_file.start = -subheader_nblock; /* NO BLOCK LOADED */
+#else /* SAVE THE SUBHEADER LIST */
+    ifile=open_db_section(filestem,pack,DB_SECTION_SUBHEAD,path,&offset,&len);
     if (!ifile) {
       if (err_msg)
 	sprintf(err_msg,"unable to open file %s",path);
       return NULL;
     }
-#ifdef ON_DEMAND_SUBLIST_HEADER
-    CALLOC(subheader,subheader_nblock,SublistHeader);
-    idb_file->subheader_file.subheader=subheader;
-    idb_file->subheader_file.nblock=subheader_nblock;
-    idb_file->subheader_file.start = -subheader_nblock; /* NO BLOCK LOADED */
-    idb_file->subheader_file.ifile=ifile;
-#else
     CALLOC(subheader,nlists,SublistHeader); /* LOAD THE ENTIRE SUBHEADER */
-    fread(subheader,sizeof(SublistHeader),nlists,ifile);  /*SAVE LIST */
+    read_file_at(ifile,subheader,sizeof(SublistHeader),nlists,offset);
     fclose(ifile);
 #endif
   }
@@ -879,12 +3022,19 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
     idb_file->nii++; /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
   idb_file->ii=ii;
   idb_file->subheader=subheader;
-  sprintf(path,"%s.idb",filestem); /* OPEN THE DATABASE */
-  idb_file->ifile_idb=fopen(path,"rb"); /* binary file */
-  if (!idb_file->ifile_idb) {
-    if (err_msg)
-      sprintf(err_msg,"unable to open file %s",path);
-    free(idb_file);
+  CALLOC(idb_file->filestem,strlen(filestem)+1,char); /* FOR REOPENING */
+  strcpy(idb_file->filestem,filestem);
+  if (copy_packed_db_files(idb_file,pack)
+      || open_compressed_index(idb_file,filestem,err_msg)<0) {
+    free_interval_dbfile(idb_file);
+    return NULL;
+  }
+  DB_FILE_LOCK();
+  idb_file->file_id=next_file_id++;
+  i=file_pool_open(idb_file,err_msg); /* OPEN THE DATABASE */
+  DB_FILE_UNLOCK();
+  if (i) {
+    free_interval_dbfile(idb_file);
     return NULL;
   }
   return idb_file;
@@ -897,16 +3047,165 @@ IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
 
 
 
-int free_interval_dbfile(IntervalDBFile *db_file)
+#ifdef _WIN32
+int map_file_section(char path[],PYGR_OFF_T offset,PYGR_OFF_T len,
+		     MappedFile *mf)
 {
-  if (db_file->ifile_idb)
-    fclose(db_file->ifile_idb);
-#ifdef ON_DEMAND_SUBLIST_HEADER
-  if (db_file->subheader_file.ifile)
-    fclose(db_file->subheader_file.ifile);
+  return -1; /* MMAP NOT SUPPORTED ON THIS PLATFORM */
+}
+
+void unmap_file_section(MappedFile *mf)
+{
+}
+#else
+/* MAP len BYTES OF A FILE STARTING AT offset READ-ONLY, OR ALL OF IT FROM
+   offset ON IF len<0.  RETURNS 0 ON SUCCESS, -1 ON ERROR.  AN EMPTY
+   SECTION GIVES A NULL MAPPING OF len 0, WHICH IS NOT AN ERROR */
+int map_file_section(char path[],PYGR_OFF_T offset,PYGR_OFF_T len,
+		     MappedFile *mf)
+{
+  int fd;
+  struct stat st;
+  PYGR_OFF_T start;
+  mf->p=mf->map_p=NULL;
+  mf->len=mf->map_len=0;
+  fd=open(path,O_RDONLY);
+  if (fd<0)
+    return -1;
+  if (fstat(fd,&st)) {
+    close(fd);
+    return -1;
+  }
+  if (len<0)
+    len=st.st_size-offset;
+  if (offset<0 || len<0 || offset+len>st.st_size) { /* NOT IN THIS FILE */
+    close(fd);
+    return -1;
+  }
+  if (len>0) {
+    start=offset-offset%sysconf(_SC_PAGESIZE); /* MUST START ON A PAGE */
+    mf->map_len=(size_t)(offset-start+len);
+    mf->map_p=mmap(NULL,mf->map_len,PROT_READ,MAP_SHARED,fd,start);
+    if (mf->map_p==MAP_FAILED) {
+      mf->map_p=NULL;
+      mf->map_len=0;
+      close(fd);
+      return -1;
+    }
+    mf->p=(char *)mf->map_p+(offset-start);
+    mf->len=(size_t)len;
+  }
+  close(fd); /* THE MAPPING STAYS VALID WITHOUT THE DESCRIPTOR */
+  return 0;
+}
+
+void unmap_file_section(MappedFile *mf)
+{
+  if (mf->map_p)
+    munmap(mf->map_p,mf->map_len);
+  mf->p=mf->map_p=NULL;
+  mf->len=mf->map_len=0;
+}
 #endif
+
+
+
+/* OPEN A DATABASE BY MAPPING ITS .idb, .index AND .subhead FILES (OR THEIR
+   SECTIONS OF THE PACKED FILE pack) INTO MEMORY.  QUERIES THEN READ
+   DIRECTLY FROM THE MAPPINGS, WITH NO fread() OR COPYING */
+IntervalDBFile *mmap_binary_files(char filestem[],PackedDBFiles *pack,
+				  char err_msg[])
+{
+  int i,n,ntop,div,nlists,nii;
+  char path[2048];
+  IntervalDBFile *idb_file=NULL;
+
+  if (read_size_file(filestem,pack,&n,&ntop,&div,&nlists,&nii,err_msg))
+    return NULL;
+
+  CALLOC(idb_file,1,IntervalDBFile);
+  idb_file->is_mapped=1;
+  DB_FILE_LOCK();
+  idb_file->file_id=next_file_id++;
+  DB_FILE_UNLOCK();
+  if (copy_packed_db_files(idb_file,pack)) {
+    free_interval_dbfile(idb_file);
+    return NULL;
+  }
+  if (nii>0) { /* MAP THE COMPACTED INDEX */
+    if (map_db_section(filestem,pack,DB_SECTION_INDEX,path,
+		       &(idb_file->map_index))
+	|| idb_file->map_index.len<nii*sizeof(IntervalIndex))
+      goto unable_to_map_file;
+    idb_file->ii=(IntervalIndex *)idb_file->map_index.p;
+  }
+  if (nlists>0) { /* MAP THE WHOLE SUBHEADER LIST */
+    if (map_db_section(filestem,pack,DB_SECTION_SUBHEAD,path,
+		       &(idb_file->map_subhead))
+	|| idb_file->map_subhead.len<nlists*sizeof(SublistHeader))
+      goto unable_to_map_file;
+    idb_file->subheader=(SublistHeader *)idb_file->map_subhead.p;
+  }
+  switch (open_compressed_index(idb_file,filestem,err_msg)) {
+  case 0: /* MAP THE DATABASE */
+    i=DB_SECTION_IDB;
+    break;
+  case 1: /* BLOCKS ARE DECODED STRAIGHT FROM THE MAPPING */
+    i=DB_SECTION_IDBZ;
+    break;
+  default:
+    free_interval_dbfile(idb_file);
+    return NULL;
+  }
+  if (map_db_section(filestem,pack,i,path,&(idb_file->map_idb)))
+    goto unable_to_map_file;
+  if (idb_file->is_compressed) {
+    if ((long long)idb_file->map_idb.len<idb_file->zoffset[idb_file->nblock])
+      goto unable_to_map_file;
+  }
+  else
+    idb_file->im_map=(IntervalMap *)idb_file->map_idb.p;
+
+  idb_file->n=n;
+  idb_file->ntop=ntop;
+  idb_file->nlists=nlists;
+  idb_file->div=div;
+  idb_file->nii=ntop/div;
+  if (ntop%div) /* INDEX IS PADDED TO EXACT MULTIPLE OF div */
+    idb_file->nii++; /* ONE EXTRA ENTRY FOR PARTIAL BLOCK */
+  return idb_file;
+ unable_to_map_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to mmap file %s",path);
+  free_interval_dbfile(idb_file);
+  return NULL;
+ handle_malloc_failure:
+  return NULL;
+}
+
+int free_interval_dbfile(IntervalDBFile *db_file)
+{
+  DB_FILE_LOCK();
+  if (db_file->file_id)
+    block_cache_forget(db_file->file_id);
+  if (!db_file->is_mapped)
+    file_pool_close(db_file); /* CLOSE ITS FILES, IF STILL OPEN */
+  DB_FILE_UNLOCK();
+  if (db_file->is_mapped) { /* MAPPINGS ARE NOT OURS TO free() */
+    unmap_file_section(&(db_file->map_idb));
+    unmap_file_section(&(db_file->map_index));
+    unmap_file_section(&(db_file->map_subhead));
+    unmap_file_section(&(db_file->map_zindex));
+    FREE(db_file->pack);
+    free(db_file);
+    return 0;
+  }
+  FREE(db_file->filestem);
+  FREE(db_file->pack);
   FREE(db_file->ii);
   FREE(db_file->subheader);
+  FREE(db_file->zoffset);
+  FREE(db_file->zbuf);
   free(db_file);
   return 0;
 }
@@ -914,6 +3213,62 @@ int free_interval_dbfile(IntervalDBFile *db_file)
 
 
 
+/* WRITE ONE DATABASE RECORD AS AN M LINE OF THE TEXT FORMAT */
+int write_text_interval(FILE *ofile,IntervalMap *im)
+{
+  if (fprintf(ofile,"M " COORD_FMT " " COORD_FMT " %d " COORD_FMT " "
+	      COORD_FMT " %d\n",im->start,im->end,
+	      im->target_id,im->target_start,
+	      im->target_end,im->sublist)<0)
+    return -1;
+  return 0;
+}
+
+
+/* WRITE THE npad RECORDS OF A COMPRESSED DATABASE AS M LINES,
+   DECODING ONE BLOCK AT A TIME */
+int save_compressed_text(char filestem[],int npad,char err_msg[],FILE *ofile)
+{
+  int i=0,j,n,iblock;
+  IntervalMap *im=NULL;
+  IntervalDBFile *db_file=NULL;
+
+  db_file=read_binary_files(filestem,NULL,err_msg,1024);
+  if (!db_file)
+    return -1;
+  CALLOC(im,db_file->div,IntervalMap);
+  if (file_pool_use(db_file)) { /* KEEP ITS FILE OPEN WHILE WE READ IT */
+    if (err_msg)
+      sprintf(err_msg,"unable to open file %s.idbz",filestem);
+    goto error_occurred;
+  }
+  for (iblock=0;i<npad;iblock++) {
+    n=read_compressed_block(db_file,iblock,im,db_file->zbuf);
+    if (n<=0) {
+      if (err_msg)
+	sprintf(err_msg,"error or EOF reading file %s.idbz",filestem);
+      goto error_occurred;
+    }
+    for (j=0;j<n && i<npad;j++,i++)
+      if (write_text_interval(ofile,im+j)) {
+	if (err_msg)
+	  sprintf(err_msg,"error writing output file! out of disk space?");
+	goto error_occurred;
+      }
+  }
+  free(im);
+  free_interval_dbfile(db_file);
+  return 0;
+ error_occurred:
+  FREE(im);
+  free_interval_dbfile(db_file);
+  return -1;
+ handle_malloc_failure:
+  free_interval_dbfile(db_file);
+  return -1;
+}
+
+
 int save_text_file(char filestem[],char basestem[],
 		   char err_msg[],FILE *ofile)
 {
@@ -924,13 +3279,8 @@ int save_text_file(char filestem[],char basestem[],
   SublistHeader subheader;
   FILE *ifile=NULL;
 
-  sprintf(path,"%s.size",filestem); /* READ BASIC SIZE INFO*/
-  ifile=fopen(path,"r"); /* text file */
-  if (!ifile) 
-    goto unable_to_open_file;
-  if (5!=fscanf(ifile,"%d %d %d %d %d",&n,&ntop,&div,&nlists,&nii))
-    goto fread_error_occurred;
-  fclose(ifile);
+  if (read_size_file(filestem,NULL,&n,&ntop,&div,&nlists,&nii,err_msg))
+    return -1;
   npad=ntop%div;
   if (npad>0) /* PAD TO AN EXACT MULTIPLE OF div */
     npad=ntop+(div-npad);
@@ -949,7 +3299,7 @@ int save_text_file(char filestem[],char basestem[],
     for (i=0;i<nii;i++) {
       if (1!=fread(&ii,sizeof(IntervalIndex),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"I %d %d\n",ii.start,ii.end)<0)
+      if (fprintf(ofile,"I " COORD_FMT " " COORD_FMT "\n",ii.start,ii.end)<0)
 	goto write_error_occurred;
     }
     fclose(ifile);
@@ -973,14 +3323,12 @@ int save_text_file(char filestem[],char basestem[],
   if (npad>0) {
     sprintf(path,"%s.idb",filestem); /* READ THE DATABASE */
     ifile=fopen(path,"rb"); /* binary file */
-    if (!ifile) 
-      goto unable_to_open_file;
+    if (!ifile) /* MAY BE COMPRESSED, SEE compress_binary_files() */
+      return save_compressed_text(filestem,npad,err_msg,ofile);
     for (i=0;i<npad;i++) {
       if (1!=fread(&im,sizeof(IntervalMap),1,ifile))
 	goto fread_error_occurred;
-      if (fprintf(ofile,"M %d %d %d %d %d %d\n",im.start,im.end,
-		  im.target_id,im.target_start,
-		  im.target_end,im.sublist)<0)
+      if (write_text_interval(ofile,&im))
 	goto write_error_occurred;
     }
     fclose(ifile);
@@ -1002,6 +3350,98 @@ int save_text_file(char filestem[],char basestem[],
 
 
 
+/* APPEND EVERY INTERVAL STORED IN DATABASE filestem, SKIPPING THE PADDING,
+   TO ofile IN .build FORMAT, SO IT CAN BE REBUILT TOGETHER WITH NEW
+   INTERVALS.  RETURNS THE NUMBER OF INTERVALS WRITTEN, OR -1 ON ERROR */
+int write_interval_records(char filestem[],FILE *ofile,char err_msg[])
+{
+  int i,j,k,n,ntop,div,nlists,nii,nrec,nout=0,iblock;
+  char path[2048];
+  SublistHeader *lists=NULL;
+  IntervalMap *im=NULL;
+  IntervalDBFile *db_file=NULL;
+  FILE *ifile=NULL;
+
+  if (read_size_file(filestem,NULL,&n,&ntop,&div,&nlists,&nii,err_msg))
+    return -1;
+  CALLOC(lists,nlists+1,SublistHeader); /* THE TOP LIST, THEN EACH SUBLIST */
+  lists[0].start=0;
+  lists[0].len=ntop;
+  if (nlists>0) {
+    sprintf(path,"%s.subhead",filestem);
+    ifile=fopen(path,"rb"); /* binary file */
+    if (!ifile)
+      goto unable_to_open_file;
+    if (nlists!=fread(lists+1,sizeof(SublistHeader),nlists,ifile))
+      goto fread_error_occurred;
+    fclose(ifile);
+  }
+  nrec=lists[nlists].start+lists[nlists].len; /* LAST LIST ENDS THE FILE */
+  sprintf(path,"%s.idb",filestem);
+  ifile=fopen(path,"rb"); /* binary file */
+  if (!ifile && nrec>0) { /* MAY BE COMPRESSED, SEE compress_binary_files() */
+    db_file=read_binary_files(filestem,NULL,err_msg,1024);
+    if (!db_file)
+      goto error_occurred;
+    sprintf(path,"%s.idbz",filestem);
+    if (file_pool_use(db_file)) /* KEEP ITS FILE OPEN WHILE WE READ IT */
+      goto unable_to_open_file;
+  }
+  CALLOC(im,div,IntervalMap);
+  for (i=k=iblock=0;i<nrec;iblock++) { /* READ ONE BLOCK AT A TIME */
+    if (ifile)
+      n=fread(im,sizeof(IntervalMap),div,ifile);
+    else
+      n=read_compressed_block(db_file,iblock,im,db_file->zbuf);
+    if (n<=0)
+      goto fread_error_occurred;
+    for (j=0;j<n && i<nrec;j++,i++) {
+      while (i>=lists[k].start+lists[k].len) /* PAST THE END OF THIS LIST */
+	k++;
+      if (i<lists[k].start) /* PADDING BETWEEN LISTS */
+	continue;
+      im[j].sublist= -1; /* LET THE BUILD ASSIGN SUBLISTS AFRESH */
+      if (1!=fwrite(im+j,sizeof(IntervalMap),1,ofile)) {
+	if (err_msg)
+	  sprintf(err_msg,"error writing output file! out of disk space?");
+	goto error_occurred;
+      }
+      nout++;
+    }
+  }
+  if (ifile)
+    fclose(ifile);
+  if (db_file)
+    free_interval_dbfile(db_file);
+  free(im);
+  free(lists);
+  return nout;
+ unable_to_open_file:
+  if (err_msg)
+    sprintf(err_msg,"unable to open file %s",path);
+  goto error_occurred;
+ fread_error_occurred:
+  if (err_msg)
+    sprintf(err_msg,"error or EOF reading file %s",path);
+ error_occurred:
+  if (ifile)
+    fclose(ifile);
+  if (db_file)
+    free_interval_dbfile(db_file);
+  FREE(im);
+  FREE(lists);
+  return -1;
+ handle_malloc_failure:
+  if (ifile)
+    fclose(ifile);
+  if (db_file)
+    free_interval_dbfile(db_file);
+  FREE(lists);
+  return -1;
+}
+
+
+
 int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
 {
   int i,n,ntop,div,nlists,nii,npad;
@@ -1020,7 +3460,7 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   ifile=fopen(path,"w"); /* text file */
   if (!ifile) 
     goto unable_to_open_file;
-  if (fprintf(ifile,"%d %d %d %d %d\n",n,ntop,div,nlists,nii)<0)
+  if (fprintf(ifile,SIZE_FILE_FMT,n,ntop,div,nlists,nii)<0)
     goto write_error_occurred;
   fclose(ifile);
   npad=ntop%div;
@@ -1037,7 +3477,7 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
     for (i=0;i<nii;i++) {
       if (NULL==fgets(line,32767,infile))
 	goto fread_error_occurred;
-      if (2!=sscanf(line,"I %d %d",&(ii.start),&(ii.end)))
+      if (2!=sscanf(line,"I " COORD_FMT " " COORD_FMT,&(ii.start),&(ii.end)))
 	goto fread_error_occurred;
       if (1!=fwrite(&ii,sizeof(IntervalIndex),1,ifile))
 	goto write_error_occurred;
@@ -1069,7 +3509,8 @@ int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[])
   for (i=0;i<npad;i++) {
     if (NULL==fgets(line,32767,infile))
       goto fread_error_occurred;
-    if (6!=sscanf(line,"M %d %d %d %d %d %d",&(im.start),&(im.end),
+    if (6!=sscanf(line,"M " COORD_FMT " " COORD_FMT " %d " COORD_FMT " "
+		  COORD_FMT " %d",&(im.start),&(im.end),
 		  &(im.target_id),&(im.target_start),
 		  &(im.target_end),&(im.sublist)))
       goto fread_error_occurred;
@@ -4,21 +4,36 @@
 #include "default.h"
 #include <limits.h>
 
+#ifdef PYGR_COORD64
+/* OPT-IN 64-BIT COORDINATES, E.G. python setup.py build_ext -DPYGR_COORD64
+   CHANGES THE BINARY FILE FORMAT: .size FILES RECORD THE COORDINATE SIZE */
+typedef long long IntervalCoord;
+#define INTERVAL_COORD_MAX LLONG_MAX
+#define COORD_FMT "%lld"
+#define COORD_BITS 64
+#else
+typedef int IntervalCoord;
+#define INTERVAL_COORD_MAX INT_MAX
+#define COORD_FMT "%d"
+#define COORD_BITS 32
+#endif
+
 extern int C_int_max;
+extern IntervalCoord C_coord_max;
 
 typedef struct {
-  int start;
-  int end;
+  IntervalCoord start;
+  IntervalCoord end;
   int target_id;
-  int target_start;
-  int target_end;
+  IntervalCoord target_start;
+  IntervalCoord target_end;
   int sublist;
 } IntervalMap;
 
 
 typedef struct {
-  int start;
-  int end;
+  IntervalCoord start;
+  IntervalCoord end;
 } IntervalIndex;
 
 typedef struct {
@@ -39,9 +54,43 @@ typedef struct { /* FOR REAL-TIME DISK ACCESS TO SUBLIST HEADER FILE*/
   int nblock;
   int start;
   FILE *ifile;
+  PYGR_OFF_T offset; /* WHERE THE SUBHEADER DATA STARTS IN ifile */
 } SubheaderFile;
 
-typedef struct {
+typedef struct { /* READ-ONLY MEMORY MAPPING OF A FILE, OR A SECTION OF ONE */
+  void *p;
+  size_t len;
+  void *map_p; /* THE WHOLE MAPPING, WHICH STARTS AT A PAGE BOUNDARY */
+  size_t map_len;
+} MappedFile;
+
+/* THE FILES OF A DATABASE: filestem.size, filestem.index ETC.  THEY MAY BE
+   STORED AS SECTIONS OF ONE PACKED FILE INSTEAD, SEE PackedDBFiles */
+#define DB_SECTION_SIZE 0
+#define DB_SECTION_INDEX 1
+#define DB_SECTION_SUBHEAD 2
+#define DB_SECTION_IDB 3
+#define DB_SECTION_IDBZ 4
+#define DB_SECTION_ZINDEX 5
+#define N_DB_SECTION 6
+
+typedef struct { /* WHERE EACH FILE OF A DATABASE LIES IN THE PACKED FILE */
+  char path[2048];
+  long long offset[N_DB_SECTION];
+  long long len[N_DB_SECTION]; /* NEGATIVE IF THE DATABASE LACKS THAT FILE */
+} PackedDBFiles;
+
+typedef struct { /* AN ASCENDING RUN OF BLOCK READS, SEE readahead_window() */
+  int next_block; /* THE CACHE MISS THAT WOULD CONTINUE IT */
+  int window; /* #BLOCKS READ AHEAD THE LAST TIME IT CONTINUED */
+  long long last_use; /* FOR REPLACING THE LEAST RECENTLY USED RUN */
+} ReadaheadStream;
+
+/* #ASCENDING RUNS TRACKED PER DATABASE, E.G. ITS TOP-LEVEL LIST PLUS A
+   FEW BIG SUBLISTS BEING READ IN TURN */
+#define READAHEAD_NSTREAM 4
+
+typedef struct IntervalDBFile_S {
   int n;
   int ntop;
   int nlists;
@@ -51,20 +100,142 @@ typedef struct {
   SublistHeader *subheader;
   SubheaderFile subheader_file;
   FILE *ifile_idb;
+  int nrecord; /* #RECORDS IN AN UNCOMPRESSED .idb, FOR CHECKING BLOCK READS */
+  int is_mapped; /* IF TRUE, READ FROM THE MAPPINGS BELOW, NOT FROM FILES */
+  IntervalMap *im_map; /* POINTS INTO map_idb */
+  MappedFile map_idb;
+  MappedFile map_index;
+  MappedFile map_subhead;
+  int is_compressed; /* IF TRUE, ifile_idb / map_idb IS THE .idbz FILE */
+  int nblock; /* #COMPRESSED BLOCKS */
+  long long *zoffset; /* BYTE OFFSET OF EACH BLOCK, PLUS END OF FILE */
+  int zbuf_size; /* BIG ENOUGH TO READ ANY ONE COMPRESSED BLOCK */
+  unsigned char *zbuf; /* FOR WHOLE-FILE READS; ITERATORS HAVE THEIR OWN */
+  MappedFile map_zindex;
+  int file_id; /* UNIQUE KEY OF THIS OPEN FILE IN THE BLOCK CACHE */
+  char *filestem; /* FOR REOPENING FILES CLOSED BY THE FILE POOL */
+  PackedDBFiles *pack; /* IF NOT NULL, OUR FILES ARE SECTIONS OF pack->path */
+  PYGR_OFF_T idb_offset; /* WHERE THE .idb OR .idbz DATA STARTS IN ifile_idb */
+  int nfile_open; /* #FILES WE HOLD OPEN, COUNTED BY THE FILE POOL */
+  int nreader; /* #SEARCHES READING OUR FILES, WHICH THE POOL MUST NOT CLOSE */
+  struct IntervalDBFile_S *pool_prev; /* MORE RECENTLY USED */
+  struct IntervalDBFile_S *pool_next; /* LESS RECENTLY USED */
+  ReadaheadStream ra_stream[READAHEAD_NSTREAM];
+  long long ra_clock; /* COUNTS CACHE MISSES, TO DATE ra_stream[].last_use */
 } IntervalDBFile;
 
+typedef struct BlockCacheEntry_S {
+  int file_id;
+  int iblock;
+  int n; /* #RECORDS IN THIS BLOCK */
+  int is_prefetched; /* READ AHEAD, AND NOT YET ASKED FOR */
+  IntervalMap *im;
+  struct BlockCacheEntry_S *prev; /* MORE RECENTLY USED */
+  struct BlockCacheEntry_S *next; /* LESS RECENTLY USED */
+  struct BlockCacheEntry_S *hash_next;
+} BlockCacheEntry;
+
+typedef struct {
+  size_t max_bytes; /* BYTE BUDGET; 0 DISABLES THE CACHE */
+  size_t nbytes; /* BYTES CURRENTLY IN USE */
+  long long nhit;
+  long long nmiss;
+  int nblock;
+  BlockCacheEntry **hash;
+  BlockCacheEntry *first; /* MOST RECENTLY USED */
+  BlockCacheEntry *last; /* LEAST RECENTLY USED, NEXT TO BE EVICTED */
+  long long nprefetch; /* #BLOCKS READ AHEAD INTO THE CACHE */
+  long long nprefetch_hit; /* #OF THOSE LATER ASKED FOR */
+  int readahead_max; /* MOST BLOCKS TO READ AHEAD AT ONCE; 0 DISABLES */
+} BlockCache;
+
+typedef struct {
+  int max_files; /* MOST FILES ALL IntervalDBFile MAY HOLD OPEN AT ONCE */
+  int nfiles; /* #FILES CURRENTLY OPEN */
+  long long nreopen; /* #TIMES A DATABASE HAD TO REOPEN ITS FILES */
+  IntervalDBFile *first; /* MOST RECENTLY USED */
+  IntervalDBFile *last; /* LEAST RECENTLY USED, NEXT TO BE CLOSED */
+} FilePool;
+
 typedef struct IntervalIterator_S {
   int i;
   int n;
   int nii;
   int ntop;
   int i_div;
+  int i_div_loaded; /* BLOCK OF THE FILE NOW HELD IN im, OR -1 FOR A SUBLIST */
   IntervalMap *im;
+  int im_is_mapped; /* im POINTS INTO A FILE MAPPING: DON'T free() IT */
+  int im_nalloc; /* SIZE OF im, IF WE ALLOCATED IT */
+  unsigned char *zbuf; /* FOR READING COMPRESSED BLOCKS, SEE read_cached_block */
+  int zbuf_nalloc;
   struct IntervalIterator_S *up;
   struct IntervalIterator_S *down;
 } IntervalIterator;
 
 
+typedef struct { /* READS THE INTERVALS OF ONE OR MORE DATABASES OVERLAPPING
+		    [start:end) IN start ORDER, READING EACH BLOCK JUST ONCE */
+  IntervalCoord start;
+  IntervalCoord end;
+  int ndb;
+  IntervalDBFile **db_file;
+  int is_started; /* TOP-LEVEL LISTS OF THE DATABASES ARE IN THE HEAP */
+  IntervalIterator **cursor; /* ONE PER NESTED LIST BEING READ */
+  IntervalDBFile **cursor_db; /* THE DATABASE EACH CURSOR READS */
+  int ncursor; /* #CURSORS ALLOCATED */
+  int *heap; /* ACTIVE CURSORS, HEAP-ORDERED BY THEIR CURRENT INTERVAL */
+  int nheap;
+  int *idle; /* CURSORS FREE FOR REUSE */
+  int nidle;
+} IntervalScan;
+
+typedef struct { /* GROWABLE LIST OF HITS, EACH TAGGED BY ITS QUERY INDEX */
+  int n;
+  int nalloc;
+  IntervalMap *im;
+  int *iquery;
+} BatchHits;
+
+typedef struct { /* RUN OF CONSTANT ALIGNMENT DEPTH OVER [start:end) */
+  IntervalCoord start;
+  IntervalCoord end;
+  int group;
+  int depth;
+} CoverageRun;
+
+typedef struct { /* GROWABLE LIST OF CoverageRun */
+  int n;
+  int nalloc;
+  CoverageRun *run;
+} CoverageRuns;
+
+typedef struct { /* A HIT STARTS (delta=1) OR ENDS (delta= -1) AT pos */
+  IntervalCoord pos;
+  int group;
+  int delta;
+} DepthEvent;
+
+
+typedef struct { /* SORTS FIXED-SIZE RECORDS IN BOUNDED MEMORY, AS RUN FILES */
+  size_t recsize;
+  int (*cmp)(const void *,const void *);
+  char *buf;
+  int nbuf;
+  int maxbuf;
+  int nrun;
+  char stem[2048]; /* RUN FILE i IS stem.i */
+} RunSorter;
+
+typedef struct { /* K-WAY MERGE OF THE RUN FILES OF A RunSorter */
+  RunSorter *rs;
+  FILE **ifile;
+  char *head; /* CURRENT RECORD OF EACH RUN */
+  int *heap; /* RUN INDEXES, HEAP-ORDERED BY THEIR head RECORD */
+  int nheap;
+} RunMerger;
+
+
 typedef struct {
   FILE *ifile;
   int left;
@@ -85,42 +256,130 @@ extern IntervalDB *build_interval_db(IntervalMap im[],int n);
 extern IntervalIterator *interval_iterator_alloc(void);
 extern int free_interval_iterator(IntervalIterator *it);
 extern IntervalIterator *reset_interval_iterator(IntervalIterator *it);
-extern int find_intervals(IntervalIterator *it0,int start,int end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
-extern int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop);
-extern IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,IntervalMap *im);
-extern int find_file_intervals(IntervalIterator *it0,int start,int end,
-			       IntervalIndex ii[],int nii,
-			       SublistHeader subheader[],int nlists,
-			       SubheaderFile *subheader_file,
-			       int ntop,int div,FILE *ifile,
+extern int find_intervals(IntervalIterator *it0,IntervalCoord start,IntervalCoord end,IntervalMap im[],int n,SublistHeader subheader[],int nlists,IntervalMap buf[],int nbuf,int *p_nreturn,IntervalIterator **it_return);
+extern int read_imdiv(FILE *ifile,IntervalMap imdiv[],int div,int i_div,int ntop,
+		      PYGR_OFF_T base);
+extern IntervalMap *read_sublist(FILE *ifile,SublistHeader *subheader,IntervalMap *im,
+				 PYGR_OFF_T base);
+extern int find_file_intervals(IntervalIterator *it0,IntervalCoord start,
+			       IntervalCoord end,
+			       IntervalDBFile *db_file,
 			       IntervalMap buf[],int nbuf,
 			       int *p_nreturn,IntervalIterator **it_return);
+extern IntervalScan *interval_scan_alloc(IntervalDBFile *db_file[],int ndb,
+					IntervalCoord start,IntervalCoord end);
+extern int interval_scan_next(IntervalScan *scan,IntervalMap buf[],int nbuf);
+extern void free_interval_scan(IntervalScan *scan);
+extern int batch_hits_append(BatchHits *hits,IntervalMap im[],int n,int iquery);
+extern void free_batch_hits(BatchHits *hits);
+extern int sort_batch_hits(BatchHits *hits,int nquery);
+extern int coverage_runs(IntervalMap im[],int igroup[],int n,int ngroup,
+			 IntervalCoord start,IntervalCoord end,
+			 CoverageRuns *runs);
+extern void free_coverage_runs(CoverageRuns *runs);
+extern int find_intervals_batch(int nquery,IntervalCoord starts[],
+				IntervalCoord ends[],
+				IntervalMap im[],int n,
+				SublistHeader subheader[],int nlists,
+				BatchHits *hits);
+extern int find_file_intervals_batch(int nquery,IntervalCoord starts[],
+				     IntervalCoord ends[],
+				     IntervalDBFile *db_file,BatchHits *hits);
 extern int write_padded_binary(IntervalMap im[],int n,int div,FILE *ifile);
+extern int encode_interval_block(IntervalMap im[],int n,unsigned char buf[]);
+extern int decode_interval_block(unsigned char buf[],int nbyte,
+				 IntervalMap im[],int nmax);
+extern size_t read_file_at(FILE *ifile,void *buf,size_t size,size_t n,
+			   PYGR_OFF_T offset);
+extern int read_compressed_block(IntervalDBFile *db_file,int iblock,
+				 IntervalMap im[],unsigned char zbuf[]);
+extern int read_cached_block(IntervalDBFile *db_file,int iblock,
+			     IntervalMap im[],unsigned char zbuf[]);
+extern void block_cache_resize(size_t max_bytes);
+extern void block_cache_clear(void);
+extern void block_cache_forget(int file_id);
+extern void block_cache_get_stats(long long *p_nhit,long long *p_nmiss,
+				  long long *p_nbytes,long long *p_max_bytes,
+				  int *p_nblock,long long *p_nprefetch,
+				  long long *p_nprefetch_hit,
+				  int *p_readahead_max);
+extern void block_cache_set_readahead(int max_blocks);
+extern int file_pool_use(IntervalDBFile *db_file);
+extern void file_pool_release(IntervalDBFile *db_file);
+extern void file_pool_resize(int max_files);
+extern void file_pool_get_stats(int *p_nfiles,int *p_max_files,
+				long long *p_nreopen);
+extern char *compress_binary_files(char filestem[]);
 extern char *write_binary_files(IntervalMap im[],int n,int ntop,int div,
 				SublistHeader *subheader,int nlists,char filestem[]);
-extern IntervalDBFile *read_binary_files(char filestem[],char err_msg[],
-					 int subheader_nblock);
+extern int run_sorter_init(RunSorter *rs,size_t recsize,int maxbuf,
+			   int (*cmp)(const void *,const void *),char stem[]);
+extern int run_sorter_add(RunSorter *rs,void *rec);
+extern int run_sorter_flush(RunSorter *rs);
+extern void run_sorter_free(RunSorter *rs);
+extern int run_merger_open(RunMerger *rm,RunSorter *rs);
+extern int run_merger_next(RunMerger *rm,void *rec);
+extern void run_merger_close(RunMerger *rm);
+extern char *build_nested_list_external(char buildfile[],int n,int maxbuf,
+					int div,char filestem[]);
+extern FILE *open_db_section(char filestem[],PackedDBFiles *pack,int isection,
+			     char path[],PYGR_OFF_T *p_offset,PYGR_OFF_T *p_len);
+extern IntervalDBFile *read_binary_files(char filestem[],PackedDBFiles *pack,
+					 char err_msg[],int subheader_nblock);
+extern IntervalDBFile *mmap_binary_files(char filestem[],PackedDBFiles *pack,
+					 char err_msg[]);
+extern int map_file_section(char path[],PYGR_OFF_T offset,PYGR_OFF_T len,
+			    MappedFile *mf);
+extern void unmap_file_section(MappedFile *mf);
 extern int free_interval_dbfile(IntervalDBFile *db_file);
 
 extern int save_text_file(char filestem[],char err_msg[],
 			  char basestem[],FILE *ofile);
 extern int text_file_to_binaries(FILE *infile,char buildpath[],char err_msg[]);
+extern int write_interval_records(char filestem[],FILE *ofile,char err_msg[]);
 extern void reorient_intervals(int n,IntervalMap im[],int ori_sign);
 
 #define FIND_FILE_MALLOC_ERR -2
+#define FIND_FILE_READ_ERR -3 /* A BLOCK COULD NOT BE READ OR DECODED */
+#define FIND_FILE_ERR(i) ((i)==FIND_FILE_MALLOC_ERR || (i)==FIND_FILE_READ_ERR)
+
+/* DEFAULT BYTE BUDGET OF THE SHARED BLOCK CACHE, AND ITS #HASH BUCKETS */
+#define BLOCK_CACHE_DEFAULT_BYTES (32*1024*1024)
+#define BLOCK_CACHE_NHASH 4096
+/* DEFAULT MOST BLOCKS TO READ AHEAD AT ONCE, SEE readahead_window() */
+#define READAHEAD_DEFAULT_MAX 16
+
+/* DEFAULT #FILES THE FILE POOL LETS DATABASES HOLD OPEN */
+#define FILE_POOL_DEFAULT_MAX 512
+
+/* MOST BYTES encode_interval_block() CAN USE FOR div RECORDS:
+   SIX VARINTS OF AT MOST 10 BYTES EACH PER RECORD, PLUS THE COUNT */
+#define COMPRESSED_BLOCK_MAX(div) (60*(div)+10)
+
+/* .size FILES OF 64-BIT DATABASES END WITH AN EXTRA FIELD: 64 */
+#ifdef PYGR_COORD64
+#define SIZE_FILE_FMT "%d %d %d %d %d 64\n"
+#else
+#define SIZE_FILE_FMT "%d %d %d %d %d\n"
+#endif
+extern int read_size_file(char filestem[],PackedDBFiles *pack,int *p_n,
+			  int *p_ntop,int *p_div,int *p_nlists,int *p_nii,
+			  char err_msg[]);
 
 #define ITERATOR_STACK_TOP(it) while (it->up) it=it->up;
 #define FREE_ITERATOR_STACK(it,it2,it_next) \
   for (it2=it->down;it2;it2=it_next) { \
     it_next=it2->down; \
-    if (it2->im) \
+    if (it2->im && !it2->im_is_mapped) \
       free(it2->im); \
+    FREE(it2->zbuf); \
     free(it2); \
   } \
   for (it2=it;it2;it2=it_next) { \
     it_next=it2->up; \
-    if (it2->im) \
+    if (it2->im && !it2->im_is_mapped) \
       free(it2->im); \
+    FREE(it2->zbuf); \
     free(it2); \
   }
 
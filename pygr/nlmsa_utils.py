@@ -1,17 +1,33 @@
 import classutil, logger
-import os, types
+import bisect, os, struct, types, zlib
 
 class NLMSASeqList(list):
+  '''list of the NLMSASequences of an NLMSA, indexed by their id.  An NLMSA
+  opened from disk holds None for each NLMSASequence not yet used, which
+  NLMSA.loadSequence() creates the first time it is accessed'''
   def __init__(self,nlmsaSeqDict):
     list.__init__(self)
     self.nlmsaSeqDict=nlmsaSeqDict
   def __getitem__(self,nlmsaID):
     'return NLMSASequence for a given nlmsa_id'
     try:
-      return list.__getitem__(self,nlmsaID)
+      ns=list.__getitem__(self,nlmsaID)
     except IndexError:
       seqID,nsID=self.nlmsaSeqDict.IDdict[str(nlmsaID)]
-      return list.__getitem__(self,nsID)
+      ns=list.__getitem__(self,nsID)
+      nlmsaID=nsID
+    if ns is None: # NOT CREATED YET
+      if nlmsaID<0:
+        nlmsaID=nlmsaID+len(self)
+      ns=self.nlmsaSeqDict.nlmsa.loadSequence(nlmsaID)
+    return ns
+  def __iter__(self):
+    'iterate over all our NLMSASequences, creating any not yet used'
+    for i in range(len(self)):
+      yield self[i]
+  def loaded(self):
+    'list of the NLMSASequences created so far'
+    return [ns for ns in list.__iter__(self) if ns is not None]
   def getSeq(self,nlmsaID):
     'return seq for a given nlmsa_id'
     seqID,nsID=self.nlmsaSeqDict.IDdict[str(nlmsaID)]
@@ -31,6 +47,158 @@ class NLMSASeqList(list):
   def nextID(self):
       return len(self)
 
+
+def seq_index_name(seq):
+  'return the name under which an NLMSA saves the NLMSASequence of seq'
+  seq= seq.pathForward # GET THE WHOLE SEQUENCE, IN FORWARD ORIENTATION
+  try: # MAKE SURE seq HAS A UNIQUE NAME FOR INDEXING IT...
+    return str(seq.path.name)
+  except AttributeError:
+    try:
+      return str(seq.path.id)
+    except AttributeError:
+      raise AttributeError('NLMSASequence: seq must have name or id attribute')
+
+
+class NLMSASeqTable(object):
+  '''the kind (REGULAR, UNION or LPO) and length of each NLMSASequence of an
+  NLMSA, indexed by its id, and the name of each REGULAR one.  It is saved
+  both as the text PATHSTEM.NLMSAindex and as the binary
+  PATHSTEM.NLMSAseqTable, which NLMSA reads in a single pass on opening,
+  without creating any NLMSASequence objects.'''
+  suffix='.NLMSAseqTable'
+  magic='NLMSASQT'
+  version=1
+  headerFormat='<8sQQ' # MAGIC, VERSION, NUMBER OF NLMSASequences
+  REGULAR,UNION,LPO=0,1,2
+  def __init__(self,kinds='',lengths=(),names=None):
+    self.kinds=kinds # ONE BYTE PER NLMSASequence
+    self.lengths=lengths
+    if names is None:
+      names={}
+    self.names=names # id -> name OF EACH REGULAR NLMSASequence
+    self.ids={}
+    for id,name in names.items():
+      self.ids[name]=id
+  def __len__(self):
+    return len(self.kinds)
+  def kind(self,id):
+    return ord(self.kinds[id])
+  def tostring(self):
+    'binary representation saved as PATHSTEM.NLMSAseqTable'
+    n=len(self.kinds)
+    l=[struct.pack(self.headerFormat,self.magic,self.version,n),
+       struct.pack('<%dq' % n,*self.lengths),self.kinds]
+    ids=self.names.keys()
+    ids.sort()
+    for id in ids:
+      l.append('%d\t%s\n' % (id,self.names[id]))
+    return ''.join(l)
+  def totext(self):
+    'text representation saved as PATHSTEM.NLMSAindex'
+    l=[]
+    for id in range(len(self.kinds)):
+      kind=self.kind(id)
+      if kind==self.LPO:
+        name,is_union='NLMSA_LPO_Internal',0
+      elif kind==self.UNION:
+        name,is_union='NLMSA_UNION_Internal',1
+      else:
+        name,is_union=self.names[id],0
+      l.append('%d\t%s\t%d\t%d\n' % (id,name,is_union,self.lengths[id]))
+    return ''.join(l)
+  def write(self,pathstem):
+    'save as both PATHSTEM.NLMSAindex and PATHSTEM.NLMSAseqTable'
+    ifile=file(pathstem+'.NLMSAindex','w') # text file
+    try:
+      ifile.write(self.totext())
+    finally:
+      ifile.close()
+    ifile=file(pathstem+self.suffix,'wb') # binary file
+    try:
+      ifile.write(self.tostring())
+    finally:
+      ifile.close()
+
+def seq_table_fromstring(data):
+  'read an NLMSASeqTable from its binary representation'
+  T=NLMSASeqTable
+  hsize=struct.calcsize(T.headerFormat)
+  try:
+    magic,version,n=struct.unpack(T.headerFormat,data[:hsize])
+  except struct.error:
+    raise IOError('corrupted NLMSAseqTable???')
+  if magic!=T.magic or version!=T.version or len(data)<hsize+9*n:
+    raise IOError('corrupted NLMSAseqTable???')
+  lengths=struct.unpack('<%dq' % n,data[hsize:hsize+8*n])
+  kinds=data[hsize+8*n:hsize+9*n]
+  names={}
+  for line in data[hsize+9*n:].splitlines():
+    id,name=line.split('\t')
+    names[int(id)]=name
+  return NLMSASeqTable(kinds,lengths,names)
+
+def seq_table_fromtext(text):
+  'read an NLMSASeqTable from the text of an .NLMSAindex file'
+  T=NLMSASeqTable
+  kinds=[]
+  lengths=[]
+  names={}
+  for line in text.splitlines():
+    id,name,is_union,length=line.strip().split('\t')
+    id=int(id)
+    if id!=len(kinds):
+      raise IOError('corrupted NLMSAIndex???')
+    if name=='NLMSA_LPO_Internal': # AN LPO REFERENCE
+      kinds.append(chr(T.LPO))
+    elif int(is_union):
+      kinds.append(chr(T.UNION))
+    else: # REGULAR SEQUENCE
+      kinds.append(chr(T.REGULAR))
+      names[id]=name
+    lengths.append(int(length))
+  return NLMSASeqTable(''.join(kinds),lengths,names)
+
+def seq_table_from_seqlist(seqlist):
+  'get the NLMSASeqTable describing the NLMSASequences in seqlist'
+  T=NLMSASeqTable
+  kinds=[]
+  lengths=[]
+  names={}
+  for ns in seqlist:
+    if ns.is_lpo:
+      kinds.append(chr(T.LPO))
+    elif ns.is_union:
+      kinds.append(chr(T.UNION))
+    else:
+      kinds.append(chr(T.REGULAR))
+      names[ns.id]=ns.name
+    lengths.append(ns.length)
+  return NLMSASeqTable(''.join(kinds),lengths,names)
+
+def read_seq_table(pathstem,packFile=None):
+  '''read the NLMSASeqTable of the NLMSA pathstem, from its binary
+  .NLMSAseqTable if it has one, else by parsing its text .NLMSAindex'''
+  if packFile is not None:
+    if pathstem+NLMSASeqTable.suffix in packFile:
+      return seq_table_fromstring(packFile.read(pathstem+NLMSASeqTable.suffix))
+    return seq_table_fromtext(packFile.read(pathstem+'.NLMSAindex'))
+  try:
+    ifile=file(pathstem+NLMSASeqTable.suffix,'rb') # binary file
+  except IOError: # WRITTEN BY AN OLDER VERSION OF PYGR
+    try:
+      ifile=file(pathstem+'.NLMSAindex', 'rU') # text file
+    except IOError:
+      ifile=file(pathstem+'NLMSAindex', 'rU') # FOR BACKWARDS COMPATIBILITY
+    try:
+      return seq_table_fromtext(ifile.read())
+    finally:
+      ifile.close()
+  try:
+    return seq_table_fromstring(ifile.read())
+  finally:
+    ifile.close()
+
 class EmptySliceError(KeyError):
   pass
 
@@ -74,9 +242,197 @@ class EmptySlice:
   def rawIvals(self):
     return []
     
+class NLMSAIDMap(object):
+  '''read-only map between the sequence IDs of an NLMSA and their
+  (nlmsaID,nsID,offset), saved by save_id_map() as PATHSTEM.NLMSAidmap in
+  place of its seqIDdict and idDict shelves.  It is a header, fixed-width
+  records sorted by sequence ID, an open-addressing hash table of those
+  records keyed by the crc32 of their sequence ID, an index of them sorted
+  by nlmsaID, then the sequence ID strings.  The file is read via mmap, so
+  a lookup reads a few records and unpickles nothing.'''
+  suffix='.NLMSAidmap'
+  magic='NLMSAIDM'
+  version=1
+  header=struct.Struct('<8sQQQQ') # MAGIC, VERSION, N, NSLOTS, STRINGS OFFSET
+  record=struct.Struct('<qqqQQ') # nlmsaID, nsID, offset, START, LENGTH OF seqID
+  slot=struct.Struct('<q') # INDEX OF A RECORD, OR -1 IF EMPTY
+  idRecord=struct.Struct('<qQ') # nlmsaID, INDEX OF ITS RECORD
+  def __init__(self,path,base=0):
+    '''open the map saved at path, or at offset base within path if it
+    is part of a packed NLMSA'''
+    import mmap
+    ifile=file(path,'rb') # binary file
+    try:
+      self.data=mmap.mmap(ifile.fileno(),0,access=mmap.ACCESS_READ)
+    finally:
+      ifile.close()
+    try:
+      magic,version,self.n,self.nslots,strings= \
+          self.header.unpack_from(self.data,base)
+    except struct.error:
+      magic=None
+    if magic!=self.magic or version!=self.version:
+      self.data.close()
+      raise IOError('corrupted NLMSAidmap %s???' % path)
+    self.records=base+self.header.size
+    self.slots=self.records+self.n*self.record.size
+    self.byID=self.slots+self.nslots*self.slot.size
+    self.strings=base+strings
+    if self.n>0: # nlmsaIDs ARE USUALLY CONSECUTIVE: INDEX THEM DIRECTLY
+      self.firstID=self.idRecord.unpack_from(self.data,self.byID)[0]
+  def _record(self,i):
+    'return seqID,nlmsaID,nsID,offset of record i'
+    nlmsaID,nsID,offset,start,length= \
+        self.record.unpack_from(self.data,self.records+i*self.record.size)
+    start=self.strings+start
+    return self.data[start:start+length],nlmsaID,nsID,offset
+  def find_seq(self,seqID):
+    'return (nlmsaID,nsID,offset) for this sequence ID'
+    if not isinstance(seqID,str):
+      raise KeyError(seqID)
+    islot=(zlib.crc32(seqID)&0xffffffff)%self.nslots
+    while True: # LINEAR PROBING
+      i=self.slot.unpack_from(self.data,self.slots+islot*self.slot.size)[0]
+      if i<0:
+        raise KeyError(seqID)
+      t=self._record(i)
+      if t[0]==seqID:
+        return t[1:]
+      islot=(islot+1)%self.nslots
+  def find_id(self,nlmsaID):
+    'return (seqID,nsID) for this nlmsaID'
+    if self.n==0:
+      raise KeyError(nlmsaID)
+    i=nlmsaID-self.firstID
+    if 0<=i<self.n:
+      id,irecord=self.idRecord.unpack_from(self.data,
+                                           self.byID+i*self.idRecord.size)
+      if id==nlmsaID:
+        t=self._record(irecord)
+        return t[0],t[2]
+    lo=0
+    hi=self.n
+    while lo<hi: # NOT CONSECUTIVE: BINARY SEARCH
+      mid=(lo+hi)//2
+      if self.idRecord.unpack_from(self.data,
+                                   self.byID+mid*self.idRecord.size)[0] \
+                                   <nlmsaID:
+        lo=mid+1
+      else:
+        hi=mid
+    if lo<self.n:
+      id,irecord=self.idRecord.unpack_from(self.data,
+                                           self.byID+lo*self.idRecord.size)
+      if id==nlmsaID:
+        t=self._record(irecord)
+        return t[0],t[2]
+    raise KeyError(nlmsaID)
+  def __len__(self):
+    return self.n
+  def iterrecords(self):
+    'generate (seqID,nlmsaID,nsID,offset) in seqID order'
+    for i in range(self.n):
+      yield self._record(i)
+  def close(self):
+    if self.data is not None: # SHARED BY OUR TWO VIEWS, SO MAY BE CLOSED
+      self.data.close()
+      self.data=None
+
+class SeqIDMapDict(object):
+  'dict-like view of an NLMSAIDMap: seqID -> (nlmsaID,nsID,offset)'
+  def __init__(self,idMap):
+    self.idMap=idMap
+  def __getitem__(self,seqID):
+    return self.idMap.find_seq(seqID)
+  def __contains__(self,seqID):
+    try:
+      self.idMap.find_seq(seqID)
+      return True
+    except KeyError:
+      return False
+  def __len__(self):
+    return len(self.idMap)
+  def iteritems(self):
+    for t in self.idMap.iterrecords():
+      yield t[0],t[1:]
+  def __iter__(self):
+    for t in self.idMap.iterrecords():
+      yield t[0]
+  def close(self):
+    self.idMap.close()
+
+class IDMapDict(SeqIDMapDict):
+  'dict-like view of an NLMSAIDMap: str(nlmsaID) -> (seqID,nsID)'
+  def __getitem__(self,k):
+    try:
+      nlmsaID=int(k)
+    except ValueError:
+      raise KeyError(k)
+    return self.idMap.find_id(nlmsaID)
+  def __contains__(self,k):
+    try:
+      self[k]
+      return True
+    except KeyError:
+      return False
+  def iteritems(self):
+    for t in self.idMap.iterrecords():
+      yield str(t[1]),(t[0],t[2])
+  def __iter__(self):
+    for t in self.idMap.iterrecords():
+      yield str(t[1])
+
+def id_map_tostring(items):
+  '''return the NLMSAIDMap representation of the (seqID,(nlmsaID,nsID,offset))
+  items of a seqIDdict, built in one pass after sorting them'''
+  M=NLMSAIDMap
+  l=[(str(seqID),t) for seqID,t in items]
+  l.sort()
+  n=len(l)
+  nslots=1
+  while nslots<2*n: # KEEP THE HASH TABLE AT MOST HALF FULL
+    nslots=2*nslots
+  slots=[-1]*nslots
+  strings=[]
+  records=[]
+  ids=[]
+  start=0
+  for i in range(n):
+    seqID,(nlmsaID,nsID,offset)=l[i]
+    records.append(M.record.pack(nlmsaID,nsID,offset,start,len(seqID)))
+    strings.append(seqID)
+    start=start+len(seqID)
+    ids.append((nlmsaID,i))
+    islot=(zlib.crc32(seqID)&0xffffffff)%nslots
+    while slots[islot]>=0:
+      islot=(islot+1)%nslots
+    slots[islot]=i
+  ids.sort()
+  stringsOffset=M.header.size+n*(M.record.size+M.idRecord.size) \
+                 +nslots*M.slot.size
+  return ''.join([M.header.pack(M.magic,M.version,n,nslots,stringsOffset)]
+                 +records+[struct.pack('<%dq' % nslots,*slots)]
+                 +[M.idRecord.pack(nlmsaID,i) for nlmsaID,i in ids]+strings)
+
+def save_id_map(pathstem):
+  '''save the seqIDdict shelve of the NLMSA pathstem as the compact,
+  read-only PATHSTEM.NLMSAidmap'''
+  seqIDdict=classutil.open_shelve(pathstem+'.seqIDdict','r')
+  try:
+    data=id_map_tostring(seqIDdict.iteritems())
+  finally:
+    seqIDdict.close()
+  ifile=file(pathstem+NLMSAIDMap.suffix,'wb') # binary file
+  try:
+    ifile.write(data)
+  finally:
+    ifile.close()
+
+
 class NLMSASeqDict(dict):
   'index sequences by pathForward, and use list to keep reverse mapping'
-  def __init__(self,nlmsa,filename,mode,maxID=1000000,idDictClass=None):
+  def __init__(self,nlmsa,filename,mode,maxID=1000000,idDictClass=None,
+               packFile=None):
     dict.__init__(self)
     self.seqlist=NLMSASeqList(self)
     self.maxID=maxID
@@ -86,7 +442,18 @@ class NLMSASeqDict(dict):
       idDictClass = dict
     elif mode=='w': # NEW DATABASE
       mode='n'
-    if idDictClass is None: # USE PERSISTENT ID DICTIONARY STORAGE
+    elif mode=='a': # ADD TO AN EXISTING DATABASE
+      mode='w'
+    if packFile is not None and filename+NLMSAIDMap.suffix in packFile:
+      self.open_id_map(packFile.path,
+                       packFile.section(filename+NLMSAIDMap.suffix)[0])
+    elif packFile is not None: # LOAD THE DICTIONARIES SAVED IN THE PACKED FILE
+      self.seqIDdict=packFile.read_dict(filename+'.seqIDdict')
+      self.IDdict=packFile.read_dict(filename+'.idDict')
+    elif idDictClass is None and mode=='r' \
+             and os.access(filename+NLMSAIDMap.suffix,os.R_OK):
+      self.open_id_map(filename+NLMSAIDMap.suffix)
+    elif idDictClass is None: # USE PERSISTENT ID DICTIONARY STORAGE
       self.seqIDdict = classutil.open_shelve(filename+'.seqIDdict',mode)
       self.IDdict = classutil.open_shelve(filename+'.idDict',mode)
     else: # USER SUPPLIED CLASS FOR ID DICTIONARY STORAGE
@@ -127,7 +494,11 @@ class NLMSASeqDict(dict):
     try:
       nlmsaID,nsID,offset=self.seqIDdict[seqID]
     except KeyError:
-      raise KeyError('seq not found in this alignment')
+      try: # A REGULAR SEQUENCE WITH ITS OWN NLMSASequence, NOT CREATED YET
+        nsID=self.nlmsa.seqTable.ids[seq_index_name(seq)]
+      except (AttributeError,KeyError):
+        raise KeyError('seq not found in this alignment')
+      nlmsaID,offset=nsID,0
     v=nlmsaID,self.seqlist[nsID],offset
     if not hasattr(seq,'annotationType'): # DON'T CACHE ANNOTATIONS
       dict.__setitem__(self,seq.pathForward,v) # CACHE THIS RESULT
@@ -156,11 +527,21 @@ class NLMSASeqDict(dict):
       return # our storage doesn't support close(), so nothing to do
     do_close() # close both shelve objects
     self.IDdict.close()
+  def open_id_map(self,path,base=0):
+    'use the NLMSAIDMap saved at path in place of our shelves'
+    idMap=NLMSAIDMap(path,base)
+    self.seqIDdict=SeqIDMapDict(idMap)
+    self.IDdict=IDMapDict(idMap)
   def reopenReadOnly(self,mode='r'):
-    'save existing data and reopen in read-only mode'
+    '''save existing data and reopen in read-only mode, from a compact
+    NLMSAIDMap copy of our shelves'''
     self.close()
-    self.seqIDdict = classutil.open_shelve(self.filename+'.seqIDdict',mode)
-    self.IDdict = classutil.open_shelve(self.filename+'.idDict',mode)
+    if mode=='r':
+      save_id_map(self.filename)
+      self.open_id_map(self.filename+NLMSAIDMap.suffix)
+    else:
+      self.seqIDdict = classutil.open_shelve(self.filename+'.seqIDdict',mode)
+      self.IDdict = classutil.open_shelve(self.filename+'.idDict',mode)
   def getUnionSlice(self,seq):
     'get union coords for this seq interval, adding seq to index if needed'
     try:
@@ -269,9 +650,12 @@ class BuildMSASlice(object):
 
 
 
-def read_seq_dict(pathstem,trypath=None):
-  'read seqDict for NLMSA'
-  if os.access(pathstem+'.seqDictP',os.R_OK):
+def read_seq_dict(pathstem,trypath=None,packFile=None):
+  'read seqDict for NLMSA, from its NLMSAPackFile if packFile is given'
+  if packFile is not None and pathstem+'.seqDictP' in packFile:
+    from pygr import worldbase
+    return worldbase._mdb.loads(packFile.read(pathstem+'.seqDictP'))
+  elif os.access(pathstem+'.seqDictP',os.R_OK):
     from pygr import worldbase
     ifile = file(pathstem+'.seqDictP', 'rb') # pickle is binary file!
     try: # LOAD FROM worldbase-AWARE PICKLE FILE
@@ -299,6 +683,98 @@ def save_seq_dict(pathstem,seqDict):
     ofile.close()
 
 
+class NLMSAPackFile(object):
+  '''read-only access to an NLMSA packed into the single file
+  pathstem.NLMSApack by cnestedlist.binaries_to_packfile().  A packed file
+  is a header, then the contents of each file of the unpacked NLMSA, then a
+  text directory giving the name, offset and length of each.  Files are
+  looked up by their unpacked path, e.g. pathstem+'0.idb'.'''
+  headerFormat = '<8sQQQ' # MAGIC, VERSION, DIRECTORY OFFSET AND LENGTH
+  magic = 'NLMSAPCK'
+  version = 1
+  suffix = '.NLMSApack'
+  def __init__(self,pathstem):
+    self.pathstem=pathstem
+    self.path=pathstem+self.suffix
+    ifile=file(self.path,'rb') # binary file
+    try:
+      header=ifile.read(struct.calcsize(self.headerFormat))
+      try:
+        magic,version,offset,length=struct.unpack(self.headerFormat,header)
+      except struct.error:
+        magic=None
+      if magic!=self.magic:
+        raise IOError('%s is not a packed NLMSA file' % self.path)
+      if version!=self.version:
+        raise IOError('%s has unknown packed format version %d'
+                      % (self.path,version))
+      ifile.seek(offset)
+      directory=ifile.read(length)
+    finally:
+      ifile.close()
+    self.sections={}
+    for line in directory.splitlines():
+      name,offset,length=line.split('\t')
+      self.sections[name]=(int(offset),int(length))
+  def _name(self,path):
+    'get name of this file in our directory, i.e. path minus our pathstem'
+    if not path.startswith(self.pathstem):
+      raise KeyError('%s is not part of %s' % (path,self.path))
+    return path[len(self.pathstem):]
+  def __contains__(self,path):
+    try:
+      return self._name(path) in self.sections
+    except KeyError:
+      return False
+  def section(self,path):
+    'return (offset,length) of the contents of this file in the packed file'
+    try:
+      return self.sections[self._name(path)]
+    except KeyError:
+      raise KeyError('%s is not in %s' % (path,self.path))
+  def read(self,path):
+    'return the contents of this file'
+    offset,length=self.section(path)
+    ifile=file(self.path,'rb') # binary file
+    try:
+      ifile.seek(offset)
+      return ifile.read(length)
+    finally:
+      ifile.close()
+  def copy(self,path,ofile,blockSize=1048576):
+    'write the contents of this file to ofile, a block at a time'
+    offset,length=self.section(path)
+    ifile=file(self.path,'rb') # binary file
+    try:
+      ifile.seek(offset)
+      while length>0:
+        data=ifile.read(min(length,blockSize))
+        if not data:
+          raise IOError('%s is truncated' % self.path)
+        ofile.write(data)
+        length-=len(data)
+    finally:
+      ifile.close()
+  def open(self,path):
+    'return a file-like object for reading this file'
+    import StringIO
+    return StringIO.StringIO(self.read(path))
+  def read_dict(self,path):
+    'return the dictionary saved in place of a shelve file'
+    import pickle
+    return pickle.loads(self.read(path))
+
+
+def open_pack_file(pathstem):
+  '''return an NLMSAPackFile for the NLMSA pathstem if it is stored packed
+  in a single file, or None if it is stored as separate files'''
+  if os.access(pathstem+'.NLMSAindex',os.R_OK) \
+         or os.access(pathstem+'NLMSAindex',os.R_OK) \
+         or not os.access(pathstem+NLMSAPackFile.suffix,os.R_OK):
+    return None # THE UNPACKED FILES TAKE PRECEDENCE
+  return NLMSAPackFile(pathstem)
+
+
 def prune_self_mappings(src_prefix,dest_prefix,is_bidirectional):
   '''return is_bidirectional flag according to whether source and
   target are the same genome.  This handles axtNet reading, in which
@@ -309,6 +785,72 @@ def prune_self_mappings(src_prefix,dest_prefix,is_bidirectional):
   else:
     return 1
 
+def axtnet_prefixes(filename):
+  '''return the (source,target) genome prefixes given by the name of
+  an axtNet file, (chrid.)source.target.net.axt, optionally gzipped'''
+  name=os.path.basename(filename)
+  if name.endswith('.gz'):
+    name=name[:-3]
+  if name.endswith('.net.axt'):
+    t=name[:-8].split('.')[-2:]
+  elif name.endswith('.axt'):
+    t=name[:-4].split('.')[-2:]
+  else:
+    t=()
+  if len(t)!=2:
+    raise IOError('%s is not correct axtNet file name. Correct name is (chrid.)source.target.net.axt.' % filename)
+  return tuple(t)
+
+def axtnet_jobs(axtFiles,bidirectionalRule,is_bidirectional):
+  '''return a list of (filename,src_prefix,dest_prefix,is_bidirectional)
+  for reading each axtNet file.  bidirectionalRule (e.g.
+  prune_self_mappings) is called just once per (source,target) pair,
+  before any file is read, so worker processes never need to call it'''
+  rules={}
+  jobs=[]
+  for filename in axtFiles:
+    t=axtnet_prefixes(filename)
+    if bidirectionalRule is None: # JUST USE GLOBAL SETTING
+      rules[t]=is_bidirectional
+    elif t not in rules: # GET SETTING FROM USER-SUPPLIED FUNCTION
+      rules[t]=bidirectionalRule(t[0],t[1],is_bidirectional)
+    jobs.append((filename,t[0],t[1],rules[t]))
+  return jobs
+
+class AlignmentFileStream(object):
+  '''open an alignment text file for reading by the C parsers, via its
+  ifile attribute.  A .gz file is decompressed on the fly by a gzip -dc
+  subprocess, so it never has to be uncompressed to disk'''
+  def __init__(self,filename):
+    self.filename=filename
+    self.proc=None
+    if filename.endswith('.gz'):
+      if not os.access(filename,os.R_OK):
+        raise IOError('unable to open file %s' % filename)
+      import subprocess
+      try:
+        self.proc=subprocess.Popen(['gzip','-dc',filename],
+                                   stdout=subprocess.PIPE)
+      except OSError:
+        raise IOError('reading %s requires the gzip program' % filename)
+      self.ifile=self.proc.stdout
+    else:
+      try:
+        self.ifile=file(filename)
+      except IOError:
+        raise IOError('unable to open file %s' % filename)
+  def close(self):
+    '''close the file, raising IOError if it was not decompressed
+    successfully.  Call abort() instead if reading failed'''
+    self.ifile.close()
+    if self.proc is not None and self.proc.wait()!=0:
+      raise IOError('gzip -dc failed to decompress %s' % self.filename)
+  def abort(self):
+    'close the file without checking the gzip -dc exit status'
+    self.ifile.close()
+    if self.proc is not None:
+      self.proc.wait()
+
 def nlmsa_textdump_unpickler(filepath,kwargs):
   from cnestedlist import textfile_to_binaries,NLMSA
   logger.info('Saving NLMSA indexes from textdump: %s' % filepath)
@@ -337,6 +879,409 @@ class SeqCacheOwner(object):
       'keep a ref to seqs cached on our behalf'
       self.cachedSeqs[seq.id] = seq
 
+class SliceCache(object):
+  '''LRU cache of NLMSASlice query results, keyed by (nlmsa_id,start,stop).
+  None is cached for queries that found no alignment.  A query not cached
+  itself can still be answered by clipping a cached slice enclosing it.
+  Safe to share between threads querying the same NLMSA.'''
+  def __init__(self,maxSize):
+    import threading
+    self.lock=threading.Lock() # NLMSA QUERIES RUN WITHOUT THE GIL
+    self.maxSize=maxSize
+    self.byID={} # nlmsa_id -> {(start,stop):node}
+    self.keysByID={} # nlmsa_id -> SORTED LIST OF ITS (start,stop) KEYS
+    self.root=[] # CIRCULAR LIST OF [prev,next,key,value], MOST RECENT FIRST
+    self.root[:]=[self.root,self.root,None,None]
+    self.n=0
+    self.hits=self.clipHits=self.misses=0
+  def _unlink(self,node):
+    node[0][1]=node[1]
+    node[1][0]=node[0]
+  def _link(self,node):
+    'insert node at the most-recently-used end of the list'
+    root=self.root
+    node[0]=root
+    node[1]=root[1]
+    root[1][0]=node
+    root[1]=node
+  def _drop(self,node):
+    self._unlink(node)
+    id,start,stop=node[2]
+    d=self.byID[id]
+    del d[(start,stop)]
+    keys=self.keysByID[id]
+    del keys[bisect.bisect_left(keys,(start,stop))]
+    if not d:
+      del self.byID[id]
+      del self.keysByID[id]
+    self.n -= 1
+  def find(self,id,start,stop):
+    '''return (found,slice): the cached slice for exactly [start:stop], or
+    the smallest cached slice enclosing it.  slice is None if that
+    interval is known to be unaligned.'''
+    self.lock.acquire()
+    try:
+      d=self.byID.get(id,{})
+      try:
+        node=d[(start,stop)]
+        self.hits += 1
+      except KeyError:
+        node=None
+        keys=self.keysByID.get(id,())
+        i=bisect.bisect_left(keys,(start+1,)) # keys[:i] HAVE start0<=start
+        while i>0: # SMALLEST ENCLOSING INTERVAL, NEAREST start0 FIRST
+          i -= 1
+          start0,stop0=keys[i]
+          if node is not None and stop-start0>=node[2][2]-node[2][1]:
+            break # ANY FURTHER start0 CAN ONLY ENCLOSE US WITH A LONGER ONE
+          if stop<=stop0 and \
+             (node is None or stop0-start0<node[2][2]-node[2][1]):
+            node=d[(start0,stop0)]
+        if node is None:
+          self.misses += 1
+          return False,None
+        self.clipHits += 1
+      self._unlink(node) # MOVE TO MOST-RECENTLY-USED END
+      self._link(node)
+      return True,node[3]
+    finally:
+      self.lock.release()
+  def save(self,id,start,stop,slice):
+    'save the result of a query, evicting the least recently used ones'
+    if self.maxSize<=0:
+      return
+    self.lock.acquire()
+    try:
+      d=self.byID.setdefault(id,{})
+      try:
+        self._drop(d[(start,stop)])
+        d=self.byID.setdefault(id,{})
+      except KeyError:
+        pass
+      node=[None,None,(id,start,stop),slice]
+      self._link(node)
+      d[(start,stop)]=node
+      bisect.insort(self.keysByID.setdefault(id,[]),(start,stop))
+      self.n += 1
+      self._trim(self.maxSize)
+    finally:
+      self.lock.release()
+  def _trim(self,maxSize):
+    while self.n>max(maxSize,0):
+      self._drop(self.root[0]) # LEAST RECENTLY USED
+  def resize(self,maxSize):
+    'set the maximum number of cached slices, evicting as needed'
+    self.lock.acquire()
+    try:
+      self.maxSize=maxSize
+      self._trim(maxSize)
+    finally:
+      self.lock.release()
+  def clear(self):
+    self.lock.acquire()
+    try:
+      self._trim(0)
+      self.hits=self.clipHits=self.misses=0
+    finally:
+      self.lock.release()
+  def stats(self):
+    return dict(hits=self.hits,clipHits=self.clipHits,misses=self.misses,
+                nslice=self.n,maxSize=self.maxSize)
+
+def iter_slices(nlmsa,ival,windowSize):
+  '''generate (window,slice) for each successive windowSize-long piece
+  of ival that is aligned in nlmsa.  Only one window's intervals are
+  held in memory at a time, however long ival is.'''
+  if windowSize<=0:
+    raise ValueError('windowSize must be positive')
+  i=0
+  length=len(ival)
+  while i<length:
+    window=ival[i:min(i+windowSize,length)]
+    myslice=nlmsa[window]
+    if len(myslice)>0: # SOME SEQUENCE IS ALIGNED TO THIS WINDOW
+      yield window,myslice
+    i += windowSize
+
+def iter_aligned_intervals(nlmsa,ival,windowSize):
+  '''generate (ival1,ival2) aligned interval pairs for ival, querying
+  it window by window as iter_slices() does.  An aligned interval that
+  crosses window boundaries is generated once, in one piece, as soon as
+  the window where it ends has been read.  Within each window pairs are
+  ordered by ival1.'''
+  import sequence
+  seqlist=nlmsa.seqlist
+  pending={} # (target_id,target_end) -> INTERVALS THAT MAY CONTINUE
+  def aligned_pairs(l):
+    l.sort()
+    for t in l:
+      if not seqlist.is_lpo(t[2]):
+        yield (sequence.absoluteSlice(ival,t[0],t[1]),
+               nlmsa.seqInterval(t[2],t[3],t[4]))
+  for window,myslice in iter_slices(nlmsa,ival,windowSize):
+    done=[]
+    continued={}
+    for t in myslice.rawIvals(): # ORDERED BY start
+      if t[0]==window.start: # JOIN WITH ITS PIECE FROM THE LAST WINDOW?
+        l=pending.get((t[2],t[3]),())
+        if l and l[-1][1]==t[0]: # IT ENDED WHERE THIS ONE STARTS
+          p=l.pop()
+          t=(p[0],t[1],t[2],p[3],t[4])
+      if t[1]==window.stop and window.stop<ival.stop: # MAY CONTINUE...
+        continued.setdefault((t[2],t[4]),[]).append(t)
+      else:
+        done.append(t)
+    for l in pending.values(): # THESE DID NOT CONTINUE INTO THIS WINDOW
+      done += l
+    pending=continued
+    for pair in aligned_pairs(done):
+      yield pair
+  done=[]
+  for l in pending.values(): # FLUSH INTERVALS ENDING AT AN UNALIGNED WINDOW
+    done += l
+  for pair in aligned_pairs(done):
+    yield pair
+
+def scan_index(ns,start,end,chunkSize):
+  '''generate (start,end,target_id,target_start,target_end) for each
+  interval of the index of ns overlapping [start:end), in start order'''
+  import itertools
+  for chunk in ns.scan_arrays(start,end,chunkSize):
+    for t in itertools.izip(*chunk):
+      yield t
+
+def iter_lpo_segments(nlmsa,ival,ns,offset,chunkSize):
+  '''generate (start,stop,lpoID,lpoStart,lpoStop) for each segment of ival
+  mapped to an LPO, in start order, from one ordered scan of the index of
+  ns, the union holding ival's sequence at offset'''
+  if nlmsa.pairwiseMode==1: # SEQ MAPS DIRECTLY ONTO ITS LPO
+    lpoSegments=[(ival.start+offset,ival.stop+offset,ns.id-1,
+                  ival.start+offset,ival.stop+offset)]
+  else:
+    lpoSegments=scan_index(ns,ival.start+offset,ival.stop+offset,chunkSize)
+  for start,stop,lpoID,lpoStart,lpoStop in lpoSegments:
+    start -= offset # XLATE TO SEQ COORDS
+    stop -= offset
+    if start<ival.start: # CLIP TO FIT WITHIN ival
+      lpoStart += ival.start-start
+      start=ival.start
+    if stop>ival.stop:
+      lpoStop -= stop-ival.stop
+      stop=ival.stop
+    yield start,stop,lpoID,lpoStart,lpoStop
+
+def iter_segment_hits(nlmsa,segment,id,chunkSize):
+  '''generate (start,stop,target_id,target_start,target_stop) for each
+  interval aligned to segment (see iter_lpo_segments()) of sequence id,
+  in start order, from one ordered scan of the LPO'''
+  start,stop,lpoID,lpoStart,lpoStop=segment
+  seqlist=nlmsa.seqlist
+  if lpoStart<0: # ALIGNED TO THE LPO'S MINUS STRAND, WHICH IS STORED AS
+    hits=[(-t[1],-t[0],t[2],-t[4],-t[3]) # ITS PLUS STRAND, SO REVERSE
+          for t in scan_index(seqlist[lpoID],-lpoStop,-lpoStart,chunkSize)]
+    hits.sort() # BACK INTO start ORDER
+  else:
+    hits=scan_index(seqlist[lpoID],lpoStart,lpoStop,chunkSize)
+  for t in hits:
+    start2=max(t[0],lpoStart) # INTERSECTION WITH THIS SEGMENT
+    stop2=min(t[1],lpoStop)
+    istart=start+start2-lpoStart
+    if (t[2]==id and istart==t[3]+start2-t[0]) or seqlist.is_lpo(t[2]):
+      continue # SKIP ITS MAPPING TO ITSELF
+    yield (istart,start+stop2-lpoStart,t[2],t[3]+start2-t[0],t[3]+stop2-t[0])
+
+def iter_walk_pairs(nlmsa,ival,chunkSize):
+  '''generate (ival1,ival2) for every interval ival2 aligned to ival, in
+  order of ival1.start, by scanning the index of ival's sequence and then
+  each stretch of LPO it maps to, each in one ordered pass'''
+  import heapq, sequence
+  if ival.orientation<0:
+    ival= -ival
+  seq=ival.pathForward
+  id,ns,offset=nlmsa.seqs[seq]
+  # A SEGMENT'S HITS CAN ONLY FOLLOW THE NEXT SEGMENT'S IF THEY OVERLAP,
+  # E.G. A REPEAT ALIGNED TWICE, SO ONLY THOSE HITS ARE HELD BACK
+  pending=[]
+  segments=iter_lpo_segments(nlmsa,ival,ns,offset,chunkSize)
+  segment=next(segments,None)
+  while segment is not None:
+    nextSegment=next(segments,None)
+    for hit in iter_segment_hits(nlmsa,segment,id,chunkSize):
+      while pending and pending[0]<=hit:
+        t=heapq.heappop(pending)
+        yield (sequence.absoluteSlice(seq,t[0],t[1]),
+               nlmsa.seqInterval(t[2],t[3],t[4]))
+      if nextSegment is not None and hit[0]>=nextSegment[0]:
+        heapq.heappush(pending,hit)
+      else:
+        yield (sequence.absoluteSlice(seq,hit[0],hit[1]),
+               nlmsa.seqInterval(hit[2],hit[3],hit[4]))
+    segment=nextSegment
+  while pending:
+    t=heapq.heappop(pending)
+    yield (sequence.absoluteSlice(seq,t[0],t[1]),
+           nlmsa.seqInterval(t[2],t[3],t[4]))
+
+def iter_walk_windows(nlmsa,ival,windowSize,chunkSize):
+  '''group the pairs generated by iter_walk_pairs() as (window,pairs)
+  for each successive windowSize-long piece of ival where some ival1
+  starts, as iter_slices() windows it'''
+  if windowSize<=0:
+    raise ValueError('windowSize must be positive')
+  if ival.orientation<0:
+    ival= -ival
+  iwindow=None
+  pairs=[]
+  for ival1,ival2 in iter_walk_pairs(nlmsa,ival,chunkSize):
+    i=(ival1.start-ival.start)/windowSize
+    if i!=iwindow:
+      if pairs:
+        yield ival[iwindow*windowSize:min((iwindow+1)*windowSize,
+                                          len(ival))],pairs
+      iwindow=i
+      pairs=[]
+    pairs.append((ival1,ival2))
+  if pairs:
+    yield ival[iwindow*windowSize:min((iwindow+1)*windowSize,len(ival))],pairs
+
+def walk_alignment(nlmsa,ival,windowSize,chunkSize):
+  '''generate the alignment of ival in order, see NLMSA.walk()'''
+  if windowSize is None:
+    return iter_walk_pairs(nlmsa,ival,chunkSize)
+  return iter_walk_windows(nlmsa,ival,windowSize,chunkSize)
+
+def annotation_slices(annotations):
+  '''return a list of (seqKey,start,stop,annotID,seq) for each annotation
+  in annotations, sorted by sequence and then start.  An AnnotationDB is
+  read straight from its sliceDB, without creating annotation objects;
+  any other dict of annotations via their sequence attribute.'''
+  l=[]
+  try:
+    sliceDB=annotations.sliceDB
+    getSliceAttr=annotations.getSliceAttr
+    seqDB=annotations.seqDB
+  except AttributeError: # JUST A DICT OF ANNOTATION OBJECTS
+    for k,a in annotations.iteritems():
+      ival=a.sequence
+      l.append((id(ival.pathForward),ival.start,ival.stop,k,
+                ival.pathForward))
+  else:
+    seqs={}
+    for k,sliceInfo in sliceDB.iteritems():
+      seqID=getSliceAttr(sliceInfo,'id')
+      start=int(getSliceAttr(sliceInfo,'start'))
+      stop=int(getSliceAttr(sliceInfo,'stop'))
+      try:
+        if int(getSliceAttr(sliceInfo,'orientation'))<0 and start>=0:
+          start,stop=(-stop,-start) # NEGATIVE ORIENTATION COORDINATES
+      except AttributeError:
+        pass
+      try:
+        seq=seqs[seqID]
+      except KeyError:
+        seq=seqs[seqID]=seqDB[seqID]
+      l.append((seqID,start,stop,k,seq))
+  l.sort()
+  return l
+
+def iter_annotation_join(nlmsa,annotations,batchSize):
+  '''generate (annotID,ival2) for each interval ival2 aligned in nlmsa to
+  an annotation in annotations.  The annotations are sorted by sequence
+  and start, then queried batchSize at a time by nlmsa.query_batch(),
+  which resumes each query where the previous one left off.'''
+  import sequence
+  if batchSize<=0:
+    raise ValueError('batchSize must be positive')
+  aligned={} # seqKey -> WHETHER THIS SEQUENCE IS IN THE ALIGNMENT
+  seqlist=nlmsa.seqlist
+  lpo={} # nlmsa_id -> WHETHER IT IS AN LPO
+  ids=[]
+  ivals=[]
+  l=annotation_slices(annotations)
+  l.append(None) # FLUSHES THE LAST BATCH
+  for t in l:
+    if t is not None:
+      seqKey,start,stop,k,seq=t
+      try:
+        isAligned=aligned[seqKey]
+      except KeyError:
+        try:
+          nlmsa.seqs[seq]
+          isAligned=aligned[seqKey]=True
+        except KeyError: # SKIP ANNOTATIONS ON UNALIGNED SEQUENCES
+          isAligned=aligned[seqKey]=False
+      if isAligned:
+        ids.append(k)
+        ivals.append(sequence.absoluteSlice(seq,start,stop))
+      if len(ivals)<batchSize:
+        continue
+    if not ivals:
+      continue
+    iquery,starts,stops,targets,targetStarts,targetStops= \
+             nlmsa.query_batch(ivals)
+    for j in range(len(iquery)):
+      try:
+        isLPO=lpo[targets[j]]
+      except KeyError:
+        isLPO=lpo[targets[j]]=seqlist.is_lpo(targets[j])
+      if not isLPO:
+        yield ids[iquery[j]],nlmsa.seqInterval(targets[j],targetStarts[j],
+                                               targetStops[j])
+    ids=[]
+    ivals=[]
+
+class CoverageGroups(object):
+  '''assign the sequences aligned in nlmsa to the coverage groups of
+  NLMSA.coverage(by=...): by=None puts them all in one group, 'species'
+  groups them by their prefix in a PrefixUnionDict seqDict, 'seq' by
+  sequence ID, and a function f by f(seqID).  keys lists the group keys,
+  in the order their group indexes were assigned.'''
+  def __init__(self,nlmsa,by=None):
+    self.seqlist=nlmsa.seqlist
+    self.by=by
+    self.targets={} # nlmsa_id -> GROUP INDEX
+    self.index={} # GROUP KEY -> GROUP INDEX
+    self.keys=[]
+    if by is None:
+      self.keyFunc=None
+      self.keys.append(None)
+    elif by=='species':
+      try:
+        separator=nlmsa.seqDict.separator
+      except AttributeError:
+        raise ValueError("by='species' requires a PrefixUnionDict seqDict")
+      self.keyFunc=lambda seqID:seqID.split(separator,1)[0]
+    elif by=='seq':
+      self.keyFunc=lambda seqID:seqID
+    elif callable(by):
+      self.keyFunc=by
+    else:
+      raise ValueError("by must be None, 'species', 'seq' or a function")
+  def __getitem__(self,targetID):
+    'group index of the sequence whose nlmsa_id is targetID, or -1 for an LPO'
+    try:
+      return self.targets[targetID]
+    except KeyError:
+      pass
+    if self.seqlist.is_lpo(targetID):
+      i= -1
+    elif self.keyFunc is None:
+      i=0
+    else:
+      k=self.keyFunc(self.seqlist.getSeqID(targetID))
+      try:
+        i=self.index[k]
+      except KeyError:
+        i=self.index[k]=len(self.keys)
+        self.keys.append(k)
+    self.targets[targetID]=i
+    return i
+  def results(self,l):
+    '''l[i] for by=None, or else a dict of l[i] for each group, by key'''
+    if self.by is None:
+      return l[0]
+    return dict(zip(self.keys,l))
+
 def get_interval(seq,start,end,ori):
     "trivial function to get the interval seq[start:end] with requested ori"
     ival=seq[start:end]
@@ -1,6 +1,6 @@
-import unittest
+import math, os, unittest, random, struct, threading
 from testlib import testutil, PygrTestProgram
-from pygr import cnestedlist, nlmsa_utils, seqdb
+from pygr import classutil, cnestedlist, nlmsa_utils, seqdb
 
 class NestedList_Test(unittest.TestCase):
     "Basic cnestedlist class tests"
@@ -20,6 +20,79 @@ class NestedList_Test(unittest.TestCase):
         assert self.db.find_overlap_list(-11,-7) == \
                          [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
 
+    def _check_batch(self, db, starts=(0, -11, 100), ends=(10, -7, 200)):
+        iquery, start, end, target_id, target_start, target_end = \
+                db.find_overlap_batch(starts, ends)
+        hits = zip(start, end, target_id, target_start, target_end)
+        for i in range(len(starts)):
+            l = [hits[j] for j in range(len(hits)) if iquery[j] == i]
+            assert l == db.find_overlap_list(starts[i], ends[i])
+        return list(iquery)
+
+    def test_batch(self):
+        "NestedList batch query"
+        assert self._check_batch(self.db) == [0, 0, 1, 1]
+
+    def test_batch_resume(self):
+        "NestedList batch queries resuming across top-level blocks"
+        rand = random.Random(2)
+        ivals = []
+        for i in range(3000): # A LONG TOP-LEVEL LIST, WITH SOME NESTING
+            start = rand.randint(0, 100000)
+            end = start + rand.choice([1, 10, 30, 30, 100, 2000])
+            if rand.random() < 0.3:
+                ivals.append((-end, -start, 1, -end, -start))
+            else:
+                ivals.append((start, end, 2, start, end))
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        starts, ends = [], []
+        for i in range(1000): # MANY QUERIES PER BLOCK, SOME SPANNING BLOCKS
+            start = rand.randint(-1000, 101000)
+            end = start + rand.choice([1, 20, 200, 3000])
+            if rand.random() < 0.2:
+                start, end = -end, -start
+            starts.append(start)
+            ends.append(end)
+        assert len(self._check_batch(db, starts, ends)) > 1000
+        tempdir = testutil.TempDir('nlmsa-test')
+        for compress, useMmap in ((False, False), (False, True), (True, False)):
+            filename = tempdir.subfile('nlmsa%d%d' % (compress, useMmap))
+            db.write_binaries(filename, div=16, compressBlocks=compress)
+            fdb = cnestedlist.IntervalFileDB(filename, useMmap=useMmap)
+            self._check_batch(fdb, starts, ends)
+            fdb.close()
+
+    def test_batch_resume_later_block(self):
+        "NestedList batch queries on disk, each starting in a later block"
+        db = cnestedlist.IntervalDB()
+        db.save_tuples([(10 * i, 10 * i + 5, 1, i, i + 5) for i in range(100)])
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename, div=16) # BLOCKS OF [0:160), [160:320) ...
+        queries = (([800, 965], [803, 1000]), # MID-BLOCK, THEN THE LAST BLOCK
+                   ([5, 170, 500, 965], [12, 175, 540, 980]),
+                   ([155, 165], [161, 990]), # SPANS BLOCKS, THEN AN EARLIER ONE
+                   ([800, 805, 962], [801, 806, 963])) # QUERIES WITH NO HITS
+        for useMmap in (False, True):
+            fdb = cnestedlist.IntervalFileDB(filename, useMmap=useMmap)
+            for starts, ends in queries:
+                assert self._check_batch(fdb, starts, ends) == \
+                       self._check_batch(db, starts, ends)
+            fdb.close()
+        fdb = cnestedlist.IntervalFileDB(filename)
+        assert fdb.find_overlap_batch([800, 965], [803, 1000])[1].tolist() == \
+               [800, 970, 980, 990]
+        fdb.close()
+
+    def test_arrays(self):
+        "NestedList array export"
+        cols = self.db.find_overlap_arrays(0, 10)
+        assert zip(*cols) == self.db.find_overlap_list(0, 10)
+        cols = self.db.interval_arrays()
+        assert len(cols) == 5
+        assert zip(*cols) == [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+
     def test_filedb(self):
         "NestedList filedb"
         tempdir  = testutil.TempDir('nlmsa-test')
@@ -34,6 +107,283 @@ class NestedList_Test(unittest.TestCase):
         # fails on windows
         #tempdir.remove()  @CTB
 
+    def test_filedb_mmap(self):
+        "NestedList filedb, memory-mapped"
+        tempdir  = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        fdb=cnestedlist.IntervalFileDB(filename, useMmap=True)
+        assert fdb.find_overlap_list(0,10) == \
+                         [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+        assert fdb.find_overlap_list(-11,-7) == \
+                         [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+        assert self._check_batch(fdb) == [0, 0, 1, 1]
+        fdb.close()
+
+    def test_block_cache(self):
+        "NestedList filedb shared block cache"
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        maxBytes = cnestedlist.get_block_cache_stats()['maxBytes']
+        try:
+            cnestedlist.set_block_cache_size(1000000)
+            cnestedlist.clear_block_cache()
+            fdb = cnestedlist.IntervalFileDB(filename)
+            for i in range(3): # ONLY THE FIRST QUERY READS THE FILE
+                assert fdb.find_overlap_list(0,10) == \
+                       [(0, 10, 1, -110, -100), (5, 20, 2, -315, -300)]
+            stats = cnestedlist.get_block_cache_stats()
+            assert (stats['hits'], stats['misses'], stats['nblock']) == \
+                   (2, 1, 1)
+            fdb.close() # ITS BLOCKS ARE DROPPED FROM THE CACHE
+            assert cnestedlist.get_block_cache_stats()['nbytes'] == 0
+            cnestedlist.set_block_cache_size(0) # DISABLED
+            fdb = cnestedlist.IntervalFileDB(filename)
+            assert fdb.find_overlap_list(-11,-7) == \
+                   [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+            assert cnestedlist.get_block_cache_stats()['nblock'] == 0
+            fdb.close()
+            self.assertRaises(ValueError, cnestedlist.set_block_cache_size, -1)
+            assert cnestedlist.get_block_cache_stats()['maxBytes'] == 0
+        finally:
+            cnestedlist.set_block_cache_size(maxBytes)
+
+    def test_file_pool(self):
+        "NestedList filedbs sharing a few open files"
+        tempdir = testutil.TempDir('nlmsa-test')
+        maxFiles = cnestedlist.get_file_pool_stats()['maxFiles']
+        fdbs = []
+        try:
+            cnestedlist.set_max_open_files(3)
+            for i in range(10):
+                filename = tempdir.subfile('nlmsa%d' % i)
+                self.db.write_binaries(filename)
+                fdbs.append(cnestedlist.IntervalFileDB(filename))
+                assert cnestedlist.get_file_pool_stats()['nfiles'] <= 3
+            reopens = cnestedlist.get_file_pool_stats()['reopens']
+            for i in range(2): # EACH QUERY MUST REOPEN ITS DATABASE
+                for fdb in fdbs:
+                    assert fdb.find_overlap_list(-11,-7) == \
+                      [(-10, 0, 1, 100, 110), (-20, -5, 2, 300, 315)]
+            stats = cnestedlist.get_file_pool_stats()
+            assert stats['nfiles'] <= 3
+            assert stats['reopens'] - reopens == 20
+        finally:
+            for fdb in fdbs:
+                fdb.close()
+            cnestedlist.set_max_open_files(maxFiles)
+        assert cnestedlist.get_file_pool_stats()['nfiles'] == 0
+
+    def test_max_coord(self):
+        "NestedList coordinates up to maxCoord"
+        big = cnestedlist.maxCoord - 1000
+        ivals = [(big - 100, big, 1, -big, -big + 100), (0, 10, 2, 5, 15)]
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        assert db.find_overlap_list(big - 50, big - 40) == ivals[:1]
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        db.write_binaries(filename)
+        db.write_binaries(filename + 'z', compressBlocks=True)
+        for filestem in (filename, filename + 'z'):
+            fdb = cnestedlist.IntervalFileDB(filestem)
+            assert fdb.find_overlap_list(big - 50, big - 40) == ivals[:1]
+            assert fdb.find_overlap_list(-big + 40, -big + 50) == \
+                   [(-big, -big + 100, 1, big - 100, big)]
+            fdb.close()
+
+    def test_coord_size_mismatch(self):
+        "NestedList refuses files built with other coordinate size"
+        tempdir = testutil.TempDir('nlmsa-test')
+        filename = tempdir.subfile('nlmsa')
+        self.db.write_binaries(filename)
+        fields = file(filename + '.size').read().split()[:5]
+        if cnestedlist.maxCoord < 2**31: # MARK IT AS A 64-BIT DATABASE
+            fields.append('64')
+        file(filename + '.size', 'w').write(' '.join(fields) + '\n')
+        for useMmap in (False, True):
+            self.assertRaises(IOError, cnestedlist.IntervalFileDB,
+                              filename, useMmap=useMmap)
+
+class NestedList_ExternalBuild_Test(unittest.TestCase):
+    "Out-of-core nested list build must match the in-memory build"
+
+    def _write_build_file(self, filestem, ivals):
+        if cnestedlist.maxCoord < 2**31:
+            fmt = '6i'
+        else: # 64-BIT COORDINATES, PADDED TO 8-BYTE ALIGNMENT
+            fmt = 'qqiqqi4x'
+        ifile = file(filestem + '.build', 'wb')
+        for t in ivals:
+            ifile.write(struct.pack(fmt, *(t + (-1,))))
+        ifile.close()
+
+    def _random_ivals(self, n):
+        rand = random.Random(1)
+        ivals, seen = [], {}
+        while len(ivals) < n: # NESTED, MIXED-ORIENTATION INTERVALS
+            start = rand.randint(0, 50000)
+            end = start + rand.choice([1, 5, 50, 500, 5000, 40000])
+            if (start, end) in seen: # KEEP THE SORT ORDER UNAMBIGUOUS
+                continue
+            seen[(start, end)] = True
+            if rand.random() < 0.3:
+                ivals.append((-end, -start, 1, -end - 7, -start - 7))
+            else:
+                ivals.append((start, end, 2, start + 3, end + 3))
+        return ivals
+
+    def test_build_external(self):
+        "NestedList out-of-core build"
+        ivals = self._random_ivals(5000)
+        tempdir = testutil.TempDir('nlmsa-test')
+        memstem = tempdir.subfile('inmemory')
+        extstem = tempdir.subfile('external')
+        self._write_build_file(memstem, ivals)
+        self._write_build_file(extstem, ivals)
+        cnestedlist.build_nested_list_files(memstem, len(ivals))
+        cnestedlist.build_nested_list_files(extstem, len(ivals),
+                                            maxBuildMemory=24 * 300)
+        for suffix in ('.idb', '.index', '.subhead', '.size'):
+            assert file(memstem + suffix, 'rb').read() == \
+                   file(extstem + suffix, 'rb').read()
+        fdb = cnestedlist.IntervalFileDB(extstem)
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        for start, end in ((0, 10), (1000, 1200), (-30000, -29000)):
+            l = fdb.find_overlap_list(start, end)
+            l.sort()
+            l2 = db.find_overlap_list(start, end)
+            l2.sort()
+            assert l == l2
+        fdb.close()
+
+    def test_build_compressed(self):
+        "NestedList build with compressed blocks"
+        ivals = self._random_ivals(5000)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filestem = tempdir.subfile('compressed')
+        self._write_build_file(filestem, ivals)
+        cnestedlist.build_nested_list_files(filestem, len(ivals),
+                                            compressBlocks=True)
+        assert not os.path.exists(filestem + '.idb')
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        rand = random.Random(2)
+        queries = [(0, 10), (1000, 1200), (-30000, -29000)]
+        for i in range(200):
+            start = rand.randint(-60000, 60000)
+            queries.append((start, start + rand.choice([1, 10, 100, 1000])))
+        for useMmap in (False, True):
+            fdb = cnestedlist.IntervalFileDB(filestem, useMmap=useMmap)
+            for start, end in queries:
+                l = fdb.find_overlap_list(start, end)
+                l.sort()
+                l2 = db.find_overlap_list(start, end)
+                l2.sort()
+                assert l == l2
+            fdb.close()
+
+    def test_truncated_compressed(self):
+        "NestedList query of a truncated compressed file raises IOError"
+        ivals = self._random_ivals(5000)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filestem = tempdir.subfile('truncated')
+        self._write_build_file(filestem, ivals)
+        cnestedlist.build_nested_list_files(filestem, len(ivals),
+                                            compressBlocks=True)
+        data = file(filestem + '.idbz', 'rb').read()
+        file(filestem + '.idbz', 'wb').write(data[:len(data) // 2])
+        self.assertRaises(IOError, cnestedlist.IntervalFileDB, filestem,
+                          useMmap=True)
+        fdb = cnestedlist.IntervalFileDB(filestem)
+        self.assertRaises(IOError, fdb.find_overlap_list, -60000, 60000)
+        it = cnestedlist.IntervalFileDBIterator(-60000, 60000, fdb)
+        self.assertRaises(IOError, list, it)
+        fdb.close()
+
+    def test_truncated_file(self):
+        "NestedList query of a truncated file raises IOError, cached or not"
+        ivals = self._random_ivals(5000)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filestem = tempdir.subfile('truncated')
+        self._write_build_file(filestem, ivals)
+        cnestedlist.build_nested_list_files(filestem, len(ivals))
+        data = file(filestem + '.idb', 'rb').read()
+        file(filestem + '.idb', 'wb').write(data[:len(data) // 2 + 5])
+        maxBytes = cnestedlist.get_block_cache_stats()['maxBytes']
+        try:
+            for cacheSize in (maxBytes, 0):
+                cnestedlist.set_block_cache_size(cacheSize)
+                fdb = cnestedlist.IntervalFileDB(filestem)
+                self.assertRaises(IOError, fdb.find_overlap_list,
+                                  -60000, 60000)
+                fdb.close()
+        finally:
+            cnestedlist.set_block_cache_size(maxBytes)
+
+    def test_scan(self):
+        "NestedList ordered scan, reading each list once"
+        ivals = self._random_ivals(5000)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filestem = tempdir.subfile('scan')
+        self._write_build_file(filestem, ivals)
+        cnestedlist.build_nested_list_files(filestem, len(ivals))
+        self._write_build_file(filestem + 'z', ivals)
+        cnestedlist.build_nested_list_files(filestem + 'z', len(ivals),
+                                            compressBlocks=True)
+        for stem, useMmap in ((filestem, False), (filestem, True),
+                              (filestem + 'z', False)):
+            fdb = cnestedlist.IntervalFileDB(stem, useMmap=useMmap)
+            for start, end, chunkSize in ((0, None, 4096), (0, None, 7),
+                                          (1000, 1200, 3)):
+                l = []
+                for chunk in fdb.scan_arrays(start, end, chunkSize):
+                    assert len(chunk[0]) <= chunkSize
+                    l += zip(*chunk)
+                assert [t[0] for t in l] == sorted([t[0] for t in l])
+                l2 = fdb.find_overlap_list(start, end or
+                                           cnestedlist.maxCoord - 1)
+                assert sorted(l) == sorted(l2)
+            fdb.close()
+
+    def test_readahead(self):
+        "NestedList readahead of ascending blocks into the block cache"
+        ivals = self._random_ivals(5000)
+        db = cnestedlist.IntervalDB()
+        db.save_tuples(ivals)
+        tempdir = testutil.TempDir('nlmsa-test')
+        filestem = tempdir.subfile('readahead')
+        self._write_build_file(filestem, ivals)
+        cnestedlist.build_nested_list_files(filestem, len(ivals))
+        self._write_build_file(filestem + 'z', ivals)
+        cnestedlist.build_nested_list_files(filestem + 'z', len(ivals),
+                                            compressBlocks=True)
+        maxReadahead = cnestedlist.get_block_cache_stats()['maxReadahead']
+        try:
+            for stem in (filestem, filestem + 'z'):
+                misses = []
+                for readahead in (0, 16):
+                    cnestedlist.set_block_readahead(readahead)
+                    cnestedlist.clear_block_cache()
+                    fdb = cnestedlist.IntervalFileDB(stem)
+                    for start in range(0, 60000, 500): # TILED WINDOWS
+                        l = fdb.find_overlap_list(start, start + 500)
+                        l.sort()
+                        l2 = db.find_overlap_list(start, start + 500)
+                        l2.sort()
+                        assert l == l2
+                    fdb.close()
+                    stats = cnestedlist.get_block_cache_stats()
+                    misses.append(stats['misses'])
+                assert stats['maxReadahead'] == 16
+                assert stats['prefetched'] > 0
+                assert stats['prefetchHits'] > 0
+                assert misses[1] < misses[0]
+        finally:
+            cnestedlist.set_block_readahead(maxReadahead)
+
 class NLMSA_Test(unittest.TestCase):
 
     def setUp(self):
@@ -67,6 +417,19 @@ class NLMSA_Test(unittest.TestCase):
         msa = cnestedlist.NLMSA(testnlmsa, mode='w', pairwiseMode=True,
                                 bidirectional=False)
 
+def check_query_batch(n, ivals):
+    "query_batch() must agree with querying each interval separately"
+    iquery, start, stop, target_id, target_start, target_stop = \
+            n.query_batch(ivals)
+    assert list(iquery) == sorted(iquery)
+    for i, ival in enumerate(ivals):
+        l = [n.seqInterval(target_id[j], target_start[j], target_stop[j])
+             for j in range(len(iquery)) if iquery[j] == i]
+        l.sort()
+        expected = list(n[ival].keys())
+        expected.sort()
+        assert l == expected
+
 class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
     def setUp(self):
         seqdb_name = testutil.datafile('alignments.fa')
@@ -109,6 +472,21 @@ class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
 
         self._check_results(n)
 
+    def test_query_batch(self):
+        "NLMSA batch query, in memory"
+        db = self.db
+        ivals = [(('a', 0, 8, 1), ('b', 0, 8, 1),),
+                 (('a', 12, 20, 1), ('c', 0, 8, 1)),]
+        n = cnestedlist.NLMSA('test', mode='memory', pairwiseMode=True)
+        n.add_aligned_intervals(alignedIvals=ivals, srcDB=db, destDB=db,
+                                alignedIvalsAttrs=dict(id=0, start=1,
+                                stop=2, idDest=0, startDest=1,
+                                stopDest=2, ori=3, oriDest=3))
+        n.build()
+        a, b, c = db['a'], db['b'], db['c']
+        check_query_batch(n, [a, a[4:14], c[2:6], -(a[0:8])])
+        assert [len(x) for x in n.query_batch([])] == [0] * 6
+
     def test_simple_no_ori(self):
         # first set of intervals
         db = self.db
@@ -197,5 +575,567 @@ class NLMSA_BuildWithAlignedIntervals_Test(unittest.TestCase):
         n.add_aligned_intervals(alignedIvals=ivals)
         n.build()
 
+    def test_build_many(self):
+        "NLMSA in-memory build must match the on-disk build"
+        db = self.db
+        ivals = []
+        for i in range(5000): # ENOUGH TO GROW THE BUILD BUFFER SEVERAL TIMES
+            length = 1 + i % 8
+            start = (i * 7) % (38 - length)
+            ivals.append((('a', start, start + length, 1),
+                          ('bc'[i % 2], 0, length, 1)))
+        attrs = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
+                     stopDest=2, ori=3, oriDest=3)
+        pathstem = testutil.TempDir('nlmsa-memory').subfile('ondisk')
+        results = []
+        for path, mode in (('test', 'memory'), (pathstem, 'w')):
+            n = cnestedlist.NLMSA(path, mode=mode, pairwiseMode=True,
+                                  seqDict=db)
+            n.add_aligned_intervals(alignedIvals=ivals, srcDB=db,
+                                    destDB=db, alignedIvalsAttrs=attrs)
+            n.build()
+            queries = [db['a'], db['a'][3:9], db['b'], -(db['c'][2:6])]
+            l = zip(*n.query_batch(queries))
+            l.sort()
+            results.append(l)
+            n.close()
+        assert len(results[0]) > len(ivals)
+        assert results[0] == results[1]
+
+    def test_add_aligned_arrays(self):
+        "NLMSA bulk add_aligned_arrays must match add_aligned_intervals"
+        db = self.db
+        ivals = []
+        for i in range(500):
+            length = 1 + i % 8
+            start = (i * 7) % (38 - length)
+            ivals.append((('a', start, start + length, 1 - 2 * (i % 3 == 0)),
+                          ('bc'[i % 2], 0, length, 1 - 2 * (i % 5 == 0))))
+        attrs = dict(id=0, start=1, stop=2, idDest=0, startDest=1,
+                     stopDest=2, ori=3, oriDest=3)
+        columns = zip(*[src + dest for src, dest in ivals])
+        pathstem = testutil.TempDir('nlmsa-arrays').subfile('ondisk')
+        queries = [db['a'], db['a'][3:9], db['b'], -(db['c'][2:6])]
+        results = []
+        for path, mode, bulk in (('test', 'memory', False),
+                                 ('test', 'memory', True),
+                                 (pathstem, 'w', True)):
+            n = cnestedlist.NLMSA(path, mode=mode, pairwiseMode=True,
+                                  seqDict=db)
+            if bulk:
+                assert n.add_aligned_arrays(columns[0], columns[1],
+                                            columns[2], columns[4],
+                                            columns[5], columns[6],
+                                            columns[3], columns[7]) == 500
+            else:
+                n.add_aligned_intervals(alignedIvals=ivals, srcDB=db,
+                                        destDB=db, alignedIvalsAttrs=attrs)
+            n.build()
+            l = zip(*n.query_batch(queries))
+            l.sort()
+            results.append(l)
+            n.close()
+        assert len(results[0]) > len(ivals)
+        assert results[0] == results[1] == results[2]
+        n = cnestedlist.NLMSA('test', mode='memory', pairwiseMode=True,
+                              seqDict=db)
+        self.assertRaises(IndexError, n.add_aligned_arrays, ['b'], [4], [9],
+                          ['c'], [0], [5])
+        self.assertRaises(ValueError, n.add_aligned_arrays, ['b'], [0], [5],
+                          ['c', 'c'], [0], [5])
+
+class NLMSA_OnDisk_Test(unittest.TestCase):
+    "Build an NLMSA on disk, then query it from the index files"
+    buildKwargs = {}
+
+    def setUp(self):
+        self.db = seqdb.SequenceFileDB(testutil.datafile('alignments.fa'))
+        self.pathstem = testutil.TempDir('nlmsa-disk').subfile('ondisk')
+        ivals = [(('a', 0, 8, 1), ('b', 0, 8, 1),),
+                 (('a', 12, 20, 1), ('c', 0, 8, 1)),]
+        n = cnestedlist.NLMSA(self.pathstem, mode='w', pairwiseMode=True,
+                              seqDict=self.db)
+        n.add_aligned_intervals(alignedIvals=ivals, srcDB=self.db,
+                                destDB=self.db,
+                                alignedIvalsAttrs=dict(id=0, start=1,
+                                stop=2, idDest=0, startDest=1,
+                                stopDest=2, ori=3, oriDest=3))
+        n.build(verbose=False, **self.buildKwargs)
+        n.close()
+
+    def _check_results(self, n):
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        (result,) = n[a[0:8]].keys()
+        assert result == b[0:8]
+        (result,) = n[a[12:20]].keys()
+        assert result == c[0:8]
+        (result,) = n[c[2:6]].keys()
+        assert result == a[14:18]
+
+    def test_read(self):
+        "NLMSA read from disk"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        self._check_results(n)
+        n.close()
+
+    def test_read_mmap(self):
+        "NLMSA read from disk via mmap"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db, useMmap=True)
+        assert n.useMmap
+        self._check_results(n)
+        n.close()
+
+    def test_few_open_files(self):
+        "NLMSA read from disk under a tiny open file limit"
+        maxFiles = cnestedlist.get_file_pool_stats()['maxFiles']
+        try:
+            n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db,
+                                  maxOpenFiles=2)
+            assert cnestedlist.get_file_pool_stats()['maxFiles'] == 1
+            self._check_results(n)
+            self._check_results(n)
+            n.close()
+        finally:
+            cnestedlist.set_max_open_files(maxFiles)
+
+    def test_slice_arrays(self):
+        "NLMSA slice array export"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        s = n[self.db['a']]
+        assert zip(*s.rawIvalArrays()) == s.rawIvals()
+        start, end, target_id, target_start, target_end = s.seqBoundArrays()
+        assert zip(start, end)[-2:] == [(0, 8), (12, 20)]
+        assert list(target_end)[-2:] == [8, 8]
+        n.close()
+
+    def test_slice_cache(self):
+        "NLMSA slice cache"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db,
+                              sliceCacheSize=3)
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        self._check_results(n)
+        self._check_results(n) # SAME QUERIES AGAIN
+        (result,) = n[a[2:6]].keys() # CLIPPED FROM CACHED a[0:8]
+        assert result == b[2:6]
+        assert len(n[a[9:11]]) == 0 # UNALIGNED RESULTS ARE CACHED TOO
+        assert len(n[a[9:11]]) == 0
+        stats = n.getSliceCacheStats()
+        assert stats['hits'] == 4 and stats['clipHits'] == 1
+        assert stats['misses'] == 4
+        assert stats['nslice'] == 3 and stats['maxSize'] == 3
+        n.setSliceCacheSize(0)
+        self._check_results(n)
+        assert n.getSliceCacheStats()['nslice'] == 0
+        n.close()
+
+    def test_iter_slices(self):
+        "NLMSA streaming query, window by window"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        windows = [w for (w, s) in n.iterSlices(a[0:20], windowSize=3)]
+        assert windows == [a[0:3], a[3:6], a[6:9], a[12:15], a[15:18],
+                           a[18:20]] # a[9:12] IS NOT ALIGNED
+        l = list(n.iterAlignedIntervals(a[0:20], windowSize=3))
+        assert l == [(a[0:8], b[0:8]), (a[12:20], c[0:8])] # NOT SPLIT
+        l = list(n.iterAlignedIntervals(-(a[0:20]), windowSize=3))
+        assert l == [(-(a[12:20]), -(c[0:8])), (-(a[0:8]), -(b[0:8]))]
+        n.close()
+
+    def test_walk(self):
+        "NLMSA ordered walk of a whole sequence"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        assert list(n.walk(a)) == [(a[0:8], b[0:8]), (a[12:20], c[0:8])]
+        assert list(n.walk(-(a[4:14]))) == [(a[4:8], b[4:8]),
+                                            (a[12:14], c[0:2])]
+        assert list(n.walk(a, windowSize=10)) == \
+               [(a[0:10], [(a[0:8], b[0:8])]),
+                (a[10:20], [(a[12:20], c[0:8])])]
+        id, ns, offset = n.seqs[c]
+        assert list(ns.walk(c)) == [(c[0:8], a[12:20])]
+        n.close()
+
+    def test_query_batch(self):
+        "NLMSA batch query from disk"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        check_query_batch(n, [a, c[2:6], a[4:14], b, -(a[0:8])])
+        n.close()
+
+    def test_packfile(self):
+        "NLMSA packed into a single file, and unpacked again"
+        packstem = self.pathstem + 'packed'
+        path = cnestedlist.binaries_to_packfile(self.pathstem, packstem)
+        assert path == packstem + '.NLMSApack'
+        for useMmap in (False, True):
+            n = cnestedlist.NLMSA(packstem, seqDict=self.db, useMmap=useMmap)
+            assert n.packFile is not None
+            self._check_results(n)
+            n.close()
+        self.assertRaises(ValueError, cnestedlist.NLMSA, packstem, mode='a',
+                          seqDict=self.db)
+        unpackstem = self.pathstem + 'unpacked'
+        cnestedlist.packfile_to_binaries(packstem, unpackstem)
+        n = cnestedlist.NLMSA(unpackstem, seqDict=self.db)
+        assert n.packFile is None
+        self._check_results(n)
+        n.close()
+
+    def test_lazy_open(self):
+        "NLMSA creates each NLMSASequence only when first used"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        assert [ns.is_lpo for ns in n.seqlist.loaded()] == [1]
+        self._check_results(n)
+        assert len(n.seqlist.loaded()) == len(n.seqlist)
+        n.close()
+        os.remove(self.pathstem + '.NLMSAseqTable') # FALL BACK TO TEXT INDEX
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        assert len(n.seqlist.loaded()) == 1
+        self._check_results(n)
+        assert [ns.length for ns in n.seqlist] == \
+               list(n.seqTable.lengths)
+        n.close()
+
+    def test_id_map(self):
+        "NLMSA reads its sequence IDs from the compact NLMSAidmap"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        assert isinstance(n.seqs.seqIDdict, nlmsa_utils.SeqIDMapDict)
+        self._check_results(n)
+        seqIDdict = dict(n.seqs.seqIDdict.iteritems())
+        IDdict = dict(n.seqs.IDdict.iteritems())
+        n.close()
+        assert sorted(seqIDdict) == ['a', 'b', 'c']
+        for seqID, (nlmsaID, nsID, offset) in seqIDdict.items():
+            assert IDdict[str(nlmsaID)] == (seqID, nsID)
+        d = classutil.open_shelve(self.pathstem + '.seqIDdict', 'r')
+        assert dict(d.iteritems()) == seqIDdict
+        d.close()
+        os.remove(self.pathstem + '.NLMSAidmap') # FALL BACK TO THE SHELVES
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        assert not isinstance(n.seqs.seqIDdict, nlmsa_utils.SeqIDMapDict)
+        self._check_results(n)
+        n.close()
+
+    def test_threads(self):
+        "NLMSA queried from several threads at once"
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        errors = []
+        def query():
+            try:
+                for i in range(20):
+                    self._check_results(n)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=query) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        n.close()
+
+    def test_append(self):
+        "NLMSA append to delta indexes, then compact"
+        a, b, c = self.db['a'], self.db['b'], self.db['c']
+        n = cnestedlist.NLMSA(self.pathstem, mode='a', seqDict=self.db)
+        assert n.is_append
+        n.add_aligned_intervals(alignedIvals=[(('a', 24, 32, 1),
+                                               ('b', 0, 8, 1))],
+                                srcDB=self.db, destDB=self.db,
+                                alignedIvalsAttrs=dict(id=0, start=1,
+                                stop=2, idDest=0, startDest=1,
+                                stopDest=2, ori=3, oriDest=3))
+        n.build(verbose=False, **self.buildKwargs)
+        n.close()
+        def check(n):
+            self._check_results(n)
+            (result,) = n[a[26:30]].keys() # FOUND IN delta INDEX
+            assert result == b[2:6]
+            l = [(x.start, x.stop) for x in n[b[2:6]].keys()]
+            assert sorted(l) == [(2, 6), (26, 30)] # MAIN + delta INDEXES
+            check_query_batch(n, [a, b, c[2:6], a[20:30]])
+            assert list(n.walk(b)) == [(b[0:8], a[0:8]), (b[0:8], a[24:32])]
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        check(n)
+        self.assertRaises(ValueError, cnestedlist.dump_textfile,
+                          self.pathstem, self.pathstem + '.txt', False)
+        assert n.compact() > 0 # MERGE delta INTO MAIN INDEX
+        assert n.compact() == 0 # NOTHING LEFT TO MERGE
+        n.close()
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        check(n)
+        n.close()
+
+class NLMSA_OnDiskParallel_Test(NLMSA_OnDisk_Test):
+    "Same tests, building the NLMSASequence indexes in worker processes"
+    buildKwargs = dict(nprocs=2)
+
+class NLMSA_OnDiskExternalSort_Test(NLMSA_OnDisk_Test):
+    "Same tests, building the indexes out of core in a tiny memory budget"
+    buildKwargs = dict(maxBuildMemory=24)
+
+class NLMSA_OnDiskCompressed_Test(NLMSA_OnDisk_Test):
+    "Same tests, storing the indexes as compressed blocks"
+    buildKwargs = dict(compressBlocks=True)
+
+    def test_truncated(self):
+        "NLMSA query of truncated compressed indexes raises IOError"
+        dirname = os.path.dirname(self.pathstem)
+        for name in os.listdir(dirname):
+            if name.endswith('.idbz'):
+                filename = os.path.join(dirname, name)
+                data = file(filename, 'rb').read()
+                file(filename, 'wb').write(data[:len(data) // 2])
+        n = cnestedlist.NLMSA(self.pathstem, seqDict=self.db)
+        a = self.db['a']
+        self.assertRaises(IOError, lambda: n[a[0:8]].keys())
+        n.close()
+
+class NLMSA_MAF_Test(unittest.TestCase):
+    "Build an NLMSA from MAF files, in one process or several"
+    mafTexts = ("""##maf version=1
+a score=1
+s a 0 8 + 38 atggcagg
+s b 0 8 + 8 atggcagg
+
+a score=2
+s a 12 8 + 38 cagatgga
+s c 0 8 + 8 accagatg
+""", """##maf version=1
+a score=3
+s a 24 6 + 38 ata--gga
+s b 1 6 - 8 tggc-agg
+""")
+
+    def setUp(self):
+        self.db = seqdb.SequenceFileDB(testutil.datafile('alignments.fa'))
+        self.tempdir = testutil.TempDir('nlmsa-maf')
+        self.mafFiles = []
+        for i in range(len(self.mafTexts)):
+            filename = self.tempdir.subfile('%d.maf' % i)
+            file(filename, 'w').write(self.mafTexts[i])
+            self.mafFiles.append(filename)
+
+    def _build(self, name, nprocs):
+        "build with a tiny maxlen, so the blocks go to several LPOs"
+        pathstem = self.tempdir.subfile(name)
+        n = cnestedlist.NLMSA(pathstem, mode='w', seqDict=self.db,
+                              mafFiles=self.mafFiles, maxlen=12,
+                              nprocs=nprocs)
+        n.close()
+        n = cnestedlist.NLMSA(pathstem, seqDict=self.db)
+        results = []
+        for s in (self.db['a'], self.db['b'], self.db['c']):
+            results.append(sorted([(repr(s1), repr(s2))
+                                   for s1, s2, e in n[s].edges()]))
+        assert len(n.lpoList) > 1
+        n.close()
+        return pathstem, results
+
+    def test_read(self):
+        "NLMSA read from MAF files"
+        pathstem, results = self._build('serial', 1)
+        assert results[0] == [('a[0:8]', 'b[0:8]'), ('a[12:20]', 'c[0:8]'),
+                              ('a[24:27]', '-b[4:7]'), ('a[27:30]', '-b[0:3]')]
+        assert results[2] == [('c[0:8]', 'a[12:20]')]
+
+    def test_parallel(self):
+        "NLMSA read from MAF files in worker processes, then merged"
+        pathstem, results = self._build('serial', 1)
+        pathstem2, results2 = self._build('parallel', 2)
+        assert results2 == results
+        index = file(pathstem + '.NLMSAindex').read()
+        assert file(pathstem2 + '.NLMSAindex').read() == index
+        for i in range(len(index.splitlines())): # SAME INTERVALS IN EACH
+            db = cnestedlist.IntervalFileDB(pathstem + str(i))
+            db2 = cnestedlist.IntervalFileDB(pathstem2 + str(i))
+            assert db.find_overlap_list(0, cnestedlist.maxCoord - 1) == \
+                   db2.find_overlap_list(0, cnestedlist.maxCoord - 1)
+            db.close()
+            db2.close()
+        assert [f for f in os.listdir(self.tempdir.path)
+                if 'mafshard' in f] == []
+
+    def test_walk(self):
+        "NLMSA ordered walk, joining each sequence through its LPOs"
+        pathstem, results = self._build('serial', 1)
+        n = cnestedlist.NLMSA(pathstem, seqDict=self.db)
+        for i, s in enumerate((self.db['a'], self.db['b'], self.db['c'])):
+            l = [(ival1.start, repr(ival1), repr(ival2))
+                 for ival1, ival2 in n.walk(s)]
+            assert [t[0] for t in l] == sorted([t[0] for t in l])
+            assert sorted([t[1:] for t in l]) == results[i]
+        windows = [(w, len(pairs)) for w, pairs
+                   in n.walk(self.db['a'], windowSize=10)]
+        a = self.db['a']
+        assert windows == [(a[0:10], 1), (a[10:20], 1), (a[20:30], 2)]
+        n.close()
+
+    def test_column_arrays(self):
+        "NLMSA slice columns as a matrix, matching its aligned intervals"
+        pathstem, results = self._build('serial', 1)
+        n = cnestedlist.NLMSA(pathstem, seqDict=self.db)
+        a = self.db['a']
+        s = n[a[0:30]]
+        ivals, offsets, scores = s.columnArrays()
+        assert scores is None
+        nrow = len(ivals)
+        assert nrow == 4 and ivals[0] == a[0:30]
+        expected = [-1] * (30 * nrow)
+        for i in range(30): # THE QUERY ROW
+            expected[i * nrow] = i
+        for ival1, ival2 in s.matchIntervals():
+            (irow,) = [k for k in range(1, nrow) if ivals[k].id == ival2.id
+                       and ivals[k].orientation == ival2.orientation]
+            for j in range(len(ival1)):
+                expected[(ival1.start + j) * nrow + irow] = \
+                        ival2.start - ivals[irow].start + j
+        assert list(offsets) == expected
+        ivals2, letters, identity = s.columnArrays(letters=True,
+                                                   score='identity')
+        assert ivals2 == ivals and len(letters) == len(expected)
+        strings = [str(ival) for ival in ivals]
+        for k, offset in enumerate(expected):
+            if offset < 0:
+                assert letters[k] == '-'
+            else:
+                assert letters[k] == strings[k % nrow][offset]
+        entropy = s.columnArrays(score='entropy')[2]
+        for i in range(30):
+            column = letters[i * nrow:(i + 1) * nrow].replace('-', '').upper()
+            counts = [column.count(c) for c in set(column)]
+            assert abs(identity[i] - max(counts) / float(nrow)) < 1e-9
+            h = -sum([c * math.log(float(c) / len(column), 2)
+                      for c in counts]) / len(column)
+            assert abs(entropy[i] - h) < 1e-9
+        self.assertRaises(ValueError, s.columnArrays, score='bogus')
+        n.close()
+
+    def test_join_annotations(self):
+        "NLMSA bulk join of annotations, same as one query per annotation"
+        pathstem, results = self._build('serial', 1)
+        n = cnestedlist.NLMSA(pathstem, seqDict=self.db)
+        annodb = seqdb.AnnotationDB({'e1': ('a', 2, 14, 1),
+                                     'e2': ('a', 20, 30, -1),
+                                     'e3': ('b', 0, 3, 1),
+                                     'e4': ('a', 30, 38, 1)}, self.db,
+                                    sliceAttrDict=dict(id=0, start=1, stop=2,
+                                                       orientation=3))
+        expected = []
+        for k in annodb:
+            try:
+                for ival1, ival2 in n[annodb[k].sequence].matchIntervals():
+                    expected.append((k, repr(ival2)))
+            except KeyError: # e4 IS NOT ALIGNED
+                pass
+        expected.sort()
+        assert len(expected) == 6
+        annotations = dict([(k, annodb[k]) for k in annodb])
+        for d, batchSize in ((annodb, 10000), (annodb, 1), (annotations, 2)):
+            l = [(k, repr(ival2)) for k, ival2
+                 in n.joinAnnotations(d, batchSize=batchSize)]
+            assert sorted(l) == expected
+        n.close()
+
+class NLMSA_AxtNet_Test(unittest.TestCase):
+    "Build a pairwise NLMSA from axtNet files, plain or gzipped"
+    axtTexts = (('chrA.hg.mm.net.axt', """0 a 1 8 b 1 8 + 100
+atggcagg
+atggcagg
+
+1 a 13 20 c 1 8 + 50
+accagatg
+accagatg
+
+"""), ('chrA.hg.hg.net.axt', """0 a 25 30 a 1 7 - 30
+ata--gga
+tggc-agg
+
+"""))
+
+    def setUp(self):
+        self.db = seqdb.PrefixUnionDict({
+            'hg': seqdb.SequenceFileDB(testutil.datafile('alignments.fa')),
+            'mm': seqdb.SequenceFileDB(testutil.datafile('alignments.fa'))})
+        self.tempdir = testutil.TempDir('nlmsa-axtnet')
+        self.axtFiles = []
+        for name, text in self.axtTexts:
+            filename = self.tempdir.subfile(name)
+            file(filename, 'w').write(text)
+            self.axtFiles.append(filename)
+
+    def _build(self, name, axtFiles, nprocs=1):
+        pathstem = self.tempdir.subfile(name)
+        n = cnestedlist.NLMSA(pathstem, mode='w', seqDict=self.db,
+                              axtFiles=axtFiles, nprocs=nprocs)
+        n.close()
+        n = cnestedlist.NLMSA(pathstem, seqDict=self.db)
+        results = []
+        for s in ('hg.a', 'mm.b', 'mm.c'):
+            results.append(sorted([(repr(s1), repr(s2)) for s1, s2, e
+                                   in n[self.db[s]].edges()]))
+        n.close()
+        return results
+
+    def test_read(self):
+        "NLMSA read from axtNet files, bidirectional except self-mappings"
+        results = self._build('serial', self.axtFiles)
+        assert results[0] == [('a[0:8]', 'b[0:8]'), ('a[12:20]', 'c[0:8]'),
+                              ('a[24:27]', '-a[35:38]'),
+                              ('a[27:30]', '-a[31:34]')]
+        assert results[1] == [('b[0:8]', 'a[0:8]')]
+        assert results[2] == [('c[0:8]', 'a[12:20]')]
+
+    def test_gzip_parallel(self):
+        "NLMSA read from gzipped axtNet files, in worker processes"
+        results = self._build('serial', self.axtFiles)
+        gzFiles = []
+        for filename in self.axtFiles:
+            classutil.call_subprocess(['gzip', '-c', filename],
+                                      stdout=file(filename + '.gz', 'wb'))
+            gzFiles.append(filename + '.gz')
+        assert self._build('gzip', gzFiles) == results
+        assert self._build('parallel', gzFiles, 2) == results
+        assert [f for f in os.listdir(self.tempdir.path)
+                if 'axtshard' in f] == []
+
+    def test_coverage(self):
+        "NLMSA alignment depth runs, histograms and binned tracks"
+        self._build('serial', self.axtFiles)
+        n = cnestedlist.NLMSA(self.tempdir.subfile('serial'),
+                              seqDict=self.db)
+        a = self.db['hg.a']
+        runs = n.coverage(a)
+        assert runs == [(0, 8, 1), (8, 12, 0), (12, 20, 1), (20, 24, 0),
+                        (24, 30, 1), (30, 38, 0)]
+        depth = [0] * len(a) # SAME DEPTHS AS COUNTING THE SLICE INTERVALS
+        for t in n[a].rawIvals():
+            if not n.seqlist.is_lpo(t[2]):
+                for i in range(t[0], t[1]):
+                    depth[i] += 1
+        assert [d for start, stop, d in runs
+                for i in range(start, stop)] == depth
+        assert n.coverage(a, by='species') == {
+            'mm': [(0, 8, 1), (8, 12, 0), (12, 20, 1), (20, 38, 0)],
+            'hg': [(0, 24, 0), (24, 30, 1), (30, 38, 0)]}
+        assert n.coverageHistogram(a) == {0: 16, 1: 22}
+        assert n.coverageHistogram(a, by='seq')['mm.c'] == {0: 30, 1: 8}
+        start, covered, meanDepth = n.coverageTrack(a, 10)
+        assert list(start) == [0, 10, 20, 30]
+        assert list(covered) == [8, 8, 6, 0]
+        assert list(meanDepth) == [0.8, 0.8, 0.6, 0.]
+        # A GROUP FIRST SEEN IN A LATER WINDOW HAS NO COVERAGE BEFORE IT
+        tracks = n.coverageTrack(a, 10, by='species', windowSize=15)
+        assert list(tracks['hg'][1]) == [0, 0, 6, 0]
+        assert list(tracks['mm'][1]) == [8, 8, 0, 0]
+        self.assertRaises(ValueError, n.coverageTrack, a, 0)
+        n.close()
+
+    def test_bad_name(self):
+        "axtNet file names must give the source and target genomes"
+        self.assertRaises(IOError, nlmsa_utils.axtnet_prefixes, 'hg.axt')
+        assert nlmsa_utils.axtnet_prefixes('chr1.hg.mm.net.axt.gz') == \
+               ('hg', 'mm')
+
 if __name__ == '__main__':
     PygrTestProgram(verbosity=2)